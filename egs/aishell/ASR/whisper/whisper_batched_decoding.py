@@ -0,0 +1,303 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Batched decoding of whisper models for utterances of different lengths.
+
+The utterances of a batch are split into buckets of similar lengths, and the
+features of each bucket are trimmed to its longest utterance before the
+encoder, which requires the encoder forward of
+whisper_encoder_forward_monkey_patch.py. Each bucket is then decoded with a
+key/value cache in the text decoder, and an utterance is removed from the
+batch as soon as its result is known, instead of when all the utterances of
+the batch are finished.
+
+The results are the same as the ones of whisper.decode() with the same
+features and options, with or without beam search.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import whisper
+from torch import Tensor
+from whisper.decoding import DecodingTask
+
+
+def get_length_buckets(lengths: torch.Tensor, ratio: float) -> List[List[int]]:
+    """Sort the utterances by decreasing length and split them into buckets,
+    in which the shortest utterance is at least `ratio` times as long as the
+    longest one.
+
+    Args:
+      lengths:
+        A 1-D tensor with the number of frames of each utterance.
+      ratio:
+        The minimum ratio of the lengths in a bucket. 0 means a single bucket.
+    Returns:
+      Return the indexes of the utterances of each bucket.
+    """
+    buckets = []
+    for i in lengths.argsort(descending=True).tolist():
+        if buckets and lengths[i] >= ratio * lengths[buckets[-1][0]]:
+            buckets[-1].append(i)
+        else:
+            buckets.append([i])
+    return buckets
+
+
+def _select(cache: Dict[torch.nn.Module, Tensor], indexes: Tensor):
+    """Keep the rows `indexes` of all the key/value tensors of `cache`."""
+    for module in cache:
+        cache[module] = cache[module][indexes]
+
+
+def greedy_search(
+    model: whisper.model.Whisper,
+    task: DecodingTask,
+    audio_features: Tensor,
+) -> List[List[int]]:
+    """Decode greedily, removing each utterance from the batch once it
+    produces the end token.
+
+    Returns:
+      Return the tokens of each utterance, without the initial tokens and
+      the end token.
+    """
+    eot = task.tokenizer.eot
+    n_audio = audio_features.shape[0]
+    tokens = torch.tensor([task.initial_tokens] * n_audio, device=audio_features.device)
+    # index of each row of `tokens` in the batch
+    rows = torch.arange(n_audio, device=audio_features.device)
+    results: List[Optional[List[int]]] = [None] * n_audio
+
+    cache, hooks = model.install_kv_cache_hooks()
+    try:
+        for i in range(task.sample_len):
+            x = tokens if i == 0 else tokens[:, -1:]
+            logits = model.decoder(x, audio_features, kv_cache=cache)[:, -1]
+            for logit_filter in task.logit_filters:
+                logit_filter.apply(logits, tokens)
+
+            next_tokens = logits.argmax(dim=-1)
+            tokens = torch.cat([tokens, next_tokens[:, None]], dim=-1)
+
+            finished = next_tokens == eot
+            if tokens.shape[-1] > task.n_ctx:
+                finished[:] = True
+            if finished.any():
+                for r, t in zip(rows[finished].tolist(), tokens[finished].tolist()):
+                    results[r] = t[task.sample_begin :]
+                keep = (~finished).nonzero().squeeze(1)
+                if keep.numel() == 0:
+                    break
+                tokens = tokens[keep]
+                rows = rows[keep]
+                audio_features = audio_features[keep]
+                _select(cache, keep)
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    for r, t in zip(rows.tolist(), tokens.tolist()):
+        if results[r] is None:
+            results[r] = t[task.sample_begin :]
+    return [t[: t.index(eot)] if eot in t else t for t in results]
+
+
+def beam_search(
+    model: whisper.model.Whisper,
+    task: DecodingTask,
+    audio_features: Tensor,
+) -> List[List[int]]:
+    """Beam search as in whisper.decoding.BeamSearchDecoder, removing each
+    utterance from the batch once it has enough finished hypotheses.
+
+    Returns:
+      Return the tokens of the best hypothesis of each utterance, without
+      the initial tokens and the end token.
+    """
+    eot = task.tokenizer.eot
+    beam_size = task.options.beam_size
+    max_candidates = round(beam_size * (task.options.patience or 1.0))
+    device = audio_features.device
+    n_audio = audio_features.shape[0]
+
+    audio_features = audio_features.repeat_interleave(beam_size, dim=0)
+    tokens = torch.tensor([task.initial_tokens] * (n_audio * beam_size), device=device)
+    sum_logprobs = torch.zeros(n_audio * beam_size)
+    # index in the batch of each utterance still being decoded
+    audios = list(range(n_audio))
+    finished_sequences: List[Dict[Tuple[int, ...], float]] = [
+        {} for _ in range(n_audio)
+    ]
+
+    cache, hooks = model.install_kv_cache_hooks()
+    try:
+        for i in range(task.sample_len):
+            x = tokens if i == 0 else tokens[:, -1:]
+            logits = model.decoder(x, audio_features, kv_cache=cache)[:, -1]
+            for logit_filter in task.logit_filters:
+                logit_filter.apply(logits, tokens)
+
+            logprobs = F.log_softmax(logits.float(), dim=-1)
+            top_logprobs, top_tokens = logprobs.topk(beam_size + 1)
+            new_logprobs = (sum_logprobs[:, None] + top_logprobs.cpu()).tolist()
+            top_tokens = top_tokens.tolist()
+            prefixes = tokens.tolist()
+
+            next_tokens, source_indices, next_logprobs, next_audios = [], [], [], []
+            for k, a in enumerate(audios):
+                scores, sources = {}, {}
+                for j in range(beam_size):
+                    idx = k * beam_size + j
+                    for logprob, token in zip(new_logprobs[idx], top_tokens[idx]):
+                        sequence = tuple(prefixes[idx] + [token])
+                        scores[sequence] = logprob
+                        sources[sequence] = idx
+
+                finished, running = {}, []
+                for sequence in sorted(scores, key=scores.get, reverse=True):
+                    if sequence[-1] == eot:
+                        finished[sequence] = scores[sequence]
+                    else:
+                        running.append(sequence)
+                        if len(running) == beam_size:
+                            break
+
+                previously_finished = finished_sequences[a]
+                for sequence in sorted(finished, key=finished.get, reverse=True):
+                    if len(previously_finished) >= max_candidates:
+                        break
+                    previously_finished[sequence] = finished[sequence]
+
+                # The result of an utterance depends only on its finished
+                # sequences, so it is removed once they are complete.
+                if len(previously_finished) < max_candidates:
+                    next_audios.append(a)
+                    next_tokens.extend(running)
+                    source_indices.extend(sources[s] for s in running)
+                    next_logprobs.extend(scores[s] for s in running)
+
+            audios = next_audios
+            if not audios:
+                break
+            tokens = torch.tensor(next_tokens, device=device)
+            sum_logprobs = torch.tensor(next_logprobs)
+            indexes = torch.tensor(source_indices, device=device)
+            audio_features = audio_features[indexes]
+            _select(cache, indexes)
+            if tokens.shape[-1] > task.n_ctx:
+                break
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    # Same as whisper.decoding.BeamSearchDecoder.finalize()
+    preceding_tokens = tokens.tolist()
+    for k, a in enumerate(audios):
+        sequences = finished_sequences[a]
+        if len(sequences) < beam_size:
+            logprobs = sum_logprobs[k * beam_size : (k + 1) * beam_size]
+            for j in list(np.argsort(logprobs))[::-1]:
+                sequence = preceding_tokens[k * beam_size + j] + [eot]
+                sequences[tuple(sequence)] = logprobs[j].item()
+                if len(sequences) >= beam_size:
+                    break
+
+    hyps = [
+        [list(s[task.sample_begin : s.index(eot, task.sample_begin)]) for s in seqs]
+        for seqs in finished_sequences
+    ]
+    scores = [list(seqs.values()) for seqs in finished_sequences]
+    selected = task.sequence_ranker.rank(hyps, scores)
+    return [h[i] for h, i in zip(hyps, selected)]
+
+
+@torch.no_grad()
+def batched_decode(
+    model: whisper.model.Whisper,
+    mel: Tensor,
+    options: whisper.DecodingOptions,
+) -> List[str]:
+    """Decode a batch of features with a key/value cache in the text decoder,
+    removing the utterances whose results are known from the batch.
+
+    Args:
+      model:
+        The whisper model.
+      mel:
+        The features, of shape (batch_size, n_mels, T).
+      options:
+        The decoding options. Only deterministic decoding, i.e., with a
+        temperature of 0, and a given language are supported.
+    Returns:
+      Return the text of each utterance.
+    """
+    assert options.temperature == 0, "Sampling is not supported"
+    assert options.language is not None, "Language detection is not supported"
+    task = DecodingTask(model, options)
+
+    if options.fp16:
+        mel = mel.half()
+    audio_features = model.encoder(mel)
+
+    if options.beam_size is not None and options.beam_size > 1:
+        hyps = beam_search(model, task, audio_features)
+    else:
+        # Beam search with a beam size of 1 is the same as greedy search
+        hyps = greedy_search(model, task, audio_features)
+    return [task.tokenizer.decode(hyp).strip() for hyp in hyps]
+
+
+def bucketed_decode(
+    model: whisper.model.Whisper,
+    feature: Tensor,
+    options: whisper.DecodingOptions,
+    feature_lens: Optional[Tensor] = None,
+    bucket_ratio: float = 0.5,
+) -> List[str]:
+    """Split a batch into buckets of utterances of similar lengths, and decode
+    each bucket with :func:`batched_decode`.
+
+    Args:
+      model:
+        The whisper model. Its encoder must accept inputs shorter than 30s if
+        `feature_lens` is given, see whisper_encoder_forward_monkey_patch.py.
+      feature:
+        The padded features, of shape (batch_size, n_mels, T).
+      options:
+        The decoding options.
+      feature_lens:
+        The number of frames of each utterance. If given, the features of each
+        bucket are trimmed to its longest utterance. If None, the whole batch
+        is decoded at once with all its frames.
+      bucket_ratio:
+        See :func:`get_length_buckets`.
+    Returns:
+      Return the text of each utterance.
+    """
+    if feature_lens is None:
+        return batched_decode(model, feature, options)
+
+    hyps = [None] * feature.shape[0]
+    for indexes in get_length_buckets(feature_lens, bucket_ratio):
+        max_len = int(feature_lens[indexes].max())
+        bucket_hyps = batched_decode(model, feature[indexes, :, :max_len], options)
+        for i, hyp in zip(indexes, bucket_hyps):
+            hyps[i] = hyp
+    return hyps
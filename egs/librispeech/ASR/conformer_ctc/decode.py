@@ -18,6 +18,7 @@
 
 import argparse
 import logging
+import time
 from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -32,6 +33,8 @@ from conformer import Conformer
 from icefall.bpe_graph_compiler import BpeCtcTrainingGraphCompiler
 from icefall.checkpoint import load_checkpoint
 from icefall.decode import (
+    SpeculativeDecodingStats,
+    ctc_greedy_search,
     get_lattice,
     nbest_decoding,
     nbest_oracle,
@@ -40,6 +43,7 @@ from icefall.decode import (
     rescore_with_n_best_list,
     rescore_with_rnn_lm,
     rescore_with_whole_lattice,
+    speculative_greedy_search,
 )
 from icefall.env import get_env_info
 from icefall.lexicon import Lexicon
@@ -102,6 +106,13 @@ def get_parser():
             - (7) nbest-oracle. Its WER is the lower bound of any n-best
               rescoring method can achieve. Useful for debugging n-best
               rescoring method.
+            - (8) attention-decoder-greedy-search. Use greedy search of the
+              attention decoder, one token at a time.
+            - (9) attention-decoder-speculative-greedy-search. Use the result
+              of CTC greedy search as a draft, verify it with a single forward
+              of the attention decoder, and continue greedy search of the
+              attention decoder from the first rejected token. It gives the
+              same result as (8) with fewer decoder steps.
         """,
     )
 
@@ -308,6 +319,40 @@ def decode_one_batch(
     nnet_output, memory, memory_key_padding_mask = model(feature, supervisions)
     # nnet_output is (N, T, C)
 
+    if params.method in (
+        "attention-decoder-greedy-search",
+        "attention-decoder-speculative-greedy-search",
+    ):
+        encoder_out_lens = (~memory_key_padding_mask).sum(dim=1)
+        if params.method == "attention-decoder-greedy-search":
+            draft_token_ids = [[] for _ in range(nnet_output.size(0))]
+        else:
+            draft_token_ids = ctc_greedy_search(nnet_output, encoder_out_lens)
+
+        def decoder_logits(indexes, ys_in_pad, ys_in_lens):
+            return model.decoder_logits(
+                memory=memory[:, indexes],
+                memory_key_padding_mask=memory_key_padding_mask[indexes],
+                ys_in_pad=ys_in_pad,
+                eos_id=eos_id,
+            )
+
+        token_ids = speculative_greedy_search(
+            decoder_logits=decoder_logits,
+            draft_token_ids=draft_token_ids,
+            max_lens=encoder_out_lens.tolist(),
+            sos_id=sos_id,
+            eos_id=eos_id,
+            device=device,
+            stats=params.speculative_decoding_stats,
+        )
+        # hyps is a list of str, e.g., ['xxx yyy zzz', ...]
+        hyps = bpe_model.decode(token_ids)
+
+        # hyps is a list of list of str, e.g., [['xxx', 'yyy', 'zzz'], ... ]
+        hyps = [s.split() for s in hyps]
+        return {params.method: hyps}
+
     supervision_segments = torch.stack(
         (
             supervisions["sequence_idx"],
@@ -654,7 +699,11 @@ def main():
     params.sos_id = sos_id
     params.eos_id = eos_id
 
-    if params.method == "ctc-decoding":
+    if params.method in (
+        "ctc-decoding",
+        "attention-decoder-greedy-search",
+        "attention-decoder-speculative-greedy-search",
+    ):
         HLG = None
         H = k2.ctc_topo(
             max_token=max_token_id,
@@ -789,6 +838,8 @@ def main():
     test_dl = [test_clean_dl, test_other_dl]
 
     for test_set, test_dl in zip(test_sets, test_dl):
+        params.speculative_decoding_stats = SpeculativeDecodingStats()
+        start_time = time.time()
         results_dict = decode_dataset(
             dl=test_dl,
             params=params,
@@ -802,6 +853,14 @@ def main():
             sos_id=sos_id,
             eos_id=eos_id,
         )
+        if params.method in (
+            "attention-decoder-greedy-search",
+            "attention-decoder-speculative-greedy-search",
+        ):
+            logging.info(
+                f"{test_set}: {params.speculative_decoding_stats}, "
+                f"decoding time: {time.time() - start_time:.2f}s"
+            )
 
         save_results(params=params, test_set_name=test_set, results_dict=results_dict)
 
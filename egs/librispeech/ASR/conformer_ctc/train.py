@@ -53,6 +53,7 @@ from icefall.checkpoint import load_checkpoint
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
+from icefall.graph_cache import TrainingGraphCache
 from icefall.graph_compiler import CtcTrainingGraphCompiler
 from icefall.lexicon import Lexicon
 from icefall.utils import (
@@ -159,6 +160,24 @@ def get_parser():
         help="The seed for random generators intended for reproducibility",
     )
 
+    parser.add_argument(
+        "--graph-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the training graphs of this number of
+        utterances in memory, so they are not compiled again in later
+        epochs. See icefall/graph_cache.py""",
+    )
+
+    parser.add_argument(
+        "--graph-cache-dir",
+        type=str,
+        default=None,
+        help="""If not None and --graph-cache-size is positive, also save
+        the training graphs to this directory. Use a different directory
+        for each lang dir""",
+    )
+
     return parser
 
 
@@ -555,6 +574,8 @@ def train_one_epoch(
                 f"batch {batch_idx}, loss[{loss_info}], "
                 f"tot_loss[{tot_loss}], batch size: {batch_size}"
             )
+            if graph_compiler.cache is not None:
+                logging.info(f"Graph cache: {graph_compiler.cache}")
 
         if batch_idx % params.log_interval == 0:
             if tb_writer is not None:
@@ -655,6 +676,11 @@ def run(rank, world_size, args):
             f"'lang_bpe' or 'lang_phone' in its name): {params.lang_dir}"
         )
 
+    if params.graph_cache_size > 0:
+        graph_compiler.cache = TrainingGraphCache(
+            max_size=params.graph_cache_size, cache_dir=params.graph_cache_dir
+        )
+
     logging.info("About to create model")
     model = Conformer(
         num_features=params.feature_dim,
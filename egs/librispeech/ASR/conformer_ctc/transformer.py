@@ -379,6 +379,48 @@ class Transformer(nn.Module):
 
         return nll
 
+    def decoder_logits(
+        self,
+        memory: torch.Tensor,
+        memory_key_padding_mask: torch.Tensor,
+        ys_in_pad: torch.Tensor,
+        eos_id: int,
+    ) -> torch.Tensor:
+        """
+        Args:
+          memory:
+            It's the output of the encoder with shape (T, N, C)
+          memory_key_padding_mask:
+            The padding mask from the encoder.
+          ys_in_pad:
+            The token IDs of shape (N, S), starting with the SOS and padded
+            with the EOS.
+          eos_id:
+            The token ID for EOS.
+        Returns:
+            A 3-D tensor of shape (N, S, num_classes) with the logits of the
+            decoder, e.g., for greedy search.
+        """
+        device = memory.device
+        tgt_mask = generate_square_subsequent_mask(ys_in_pad.shape[-1]).to(device)
+
+        tgt_key_padding_mask = decoder_padding_mask(ys_in_pad, ignore_id=eos_id)
+        # The first column contains sos_id, which is the same as eos_id
+        tgt_key_padding_mask[:, 0] = False
+
+        tgt = self.decoder_embed(ys_in_pad)  # (N, S) -> (N, S, C)
+        tgt = self.decoder_pos(tgt)
+        tgt = tgt.permute(1, 0, 2)  # (N, S, C) -> (S, N, C)
+        pred_pad = self.decoder(
+            tgt=tgt,
+            memory=memory,
+            tgt_mask=tgt_mask,
+            tgt_key_padding_mask=tgt_key_padding_mask,
+            memory_key_padding_mask=memory_key_padding_mask,
+        )  # (S, N, C)
+        pred_pad = pred_pad.permute(1, 0, 2)  # (S, N, C) -> (N, S, C)
+        return self.decoder_output_layer(pred_pad)
+
 
 class TransformerEncoderLayer(nn.Module):
     """
@@ -38,7 +38,12 @@ from torch.nn.utils import clip_grad_norm_
 from torch.utils.tensorboard import SummaryWriter
 from transformer import Noam
 
-from icefall.ali import convert_alignments_to_tensor, load_alignments, lookup_alignments
+from icefall.ali import (
+    convert_alignments_to_tensor,
+    is_alignment_store,
+    load_alignments,
+    lookup_alignments,
+)
 from icefall.checkpoint import load_checkpoint
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.dist import cleanup_dist, setup_dist
@@ -99,6 +104,9 @@ def get_parser():
         two files, train-960.pt and valid.pt, which
         contain framewise alignment information for
         the training set and validation set.
+        If it contains two directories train-960 and valid
+        converted by ./local/convert_alignments.py, they are
+        used instead.
         """,
     )
 
@@ -750,16 +758,20 @@ def run(rank, world_size, args):
         optimizer.load_state_dict(checkpoints["optimizer"])
 
     train_960_ali_filename = Path(params.ali_dir) / "train-960.pt"
-    if (
-        params.batch_idx_train < params.use_ali_until
-        and train_960_ali_filename.is_file()
+    valid_ali_filename = Path(params.ali_dir) / "valid.pt"
+    if is_alignment_store(Path(params.ali_dir) / "train-960"):
+        # See ./local/convert_alignments.py
+        train_960_ali_filename = Path(params.ali_dir) / "train-960"
+        valid_ali_filename = Path(params.ali_dir) / "valid"
+
+    if params.batch_idx_train < params.use_ali_until and (
+        train_960_ali_filename.exists()
     ):
         logging.info("Use pre-computed alignments")
         subsampling_factor, train_ali = load_alignments(train_960_ali_filename)
         assert subsampling_factor == params.subsampling_factor
         assert len(train_ali) == 843723, f"{len(train_ali)} vs 843723"
 
-        valid_ali_filename = Path(params.ali_dir) / "valid.pt"
         subsampling_factor, valid_ali = load_alignments(valid_ali_filename)
         assert subsampling_factor == params.subsampling_factor
 
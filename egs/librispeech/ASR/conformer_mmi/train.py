@@ -38,10 +38,16 @@ from torch.nn.utils import clip_grad_norm_
 from torch.utils.tensorboard import SummaryWriter
 from transformer import Noam
 
-from icefall.ali import convert_alignments_to_tensor, load_alignments, lookup_alignments
+from icefall.ali import (
+    convert_alignments_to_tensor,
+    is_alignment_store,
+    load_alignments,
+    lookup_alignments,
+)
 from icefall.checkpoint import load_checkpoint
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.dist import cleanup_dist, setup_dist
+from icefall.graph_cache import TrainingGraphCache
 from icefall.lexicon import Lexicon
 from icefall.mmi import LFMMILoss
 from icefall.mmi_graph_compiler import MmiTrainingGraphCompiler
@@ -99,6 +105,9 @@ def get_parser():
         two files, train-960.pt and valid.pt, which
         contain framewise alignment information for
         the training set and validation set.
+        If it contains two directories train-960 and valid
+        converted by ./local/convert_alignments.py, they are
+        used instead.
         """,
     )
 
@@ -129,6 +138,24 @@ def get_parser():
         help="The seed for random generators intended for reproducibility",
     )
 
+    parser.add_argument(
+        "--graph-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the training graphs of this number of
+        utterances in memory, so they are not compiled again in later
+        epochs. See icefall/graph_cache.py""",
+    )
+
+    parser.add_argument(
+        "--graph-cache-dir",
+        type=str,
+        default=None,
+        help="""If not None and --graph-cache-size is positive, also save
+        the training graphs to this directory. Use a different directory
+        for each lang dir""",
+    )
+
     parser.add_argument(
         "--use-pruned-intersect",
         type=str2bool,
@@ -590,6 +617,8 @@ def train_one_epoch(
                 f"total avg loss: {tot_avg_loss:.4f}, "
                 f"batch size: {batch_size}"
             )
+            if graph_compiler.cache is not None:
+                logging.info(f"Graph cache: {graph_compiler.cache}")
 
             if tb_writer is not None:
                 tb_writer.add_scalar(
@@ -716,6 +745,10 @@ def run(rank, world_size, args):
         sos_id=1,
         eos_id=1,
     )
+    if params.graph_cache_size > 0:
+        graph_compiler.cache = TrainingGraphCache(
+            max_size=params.graph_cache_size, cache_dir=params.graph_cache_dir
+        )
 
     logging.info("About to create model")
     if params.att_rate == 0:
@@ -750,16 +783,20 @@ def run(rank, world_size, args):
         optimizer.load_state_dict(checkpoints["optimizer"])
 
     train_960_ali_filename = Path(params.ali_dir) / "train-960.pt"
-    if (
-        params.batch_idx_train < params.use_ali_until
-        and train_960_ali_filename.is_file()
+    valid_ali_filename = Path(params.ali_dir) / "valid.pt"
+    if is_alignment_store(Path(params.ali_dir) / "train-960"):
+        # See ./local/convert_alignments.py
+        train_960_ali_filename = Path(params.ali_dir) / "train-960"
+        valid_ali_filename = Path(params.ali_dir) / "valid"
+
+    if params.batch_idx_train < params.use_ali_until and (
+        train_960_ali_filename.exists()
     ):
         logging.info("Use pre-computed alignments")
         subsampling_factor, train_ali = load_alignments(train_960_ali_filename)
         assert subsampling_factor == params.subsampling_factor
         assert len(train_ali) == 843723, f"{len(train_ali)} vs 843723"
 
-        valid_ali_filename = Path(params.ali_dir) / "valid.pt"
         subsampling_factor, valid_ali = load_alignments(valid_ali_filename)
         assert subsampling_factor == params.subsampling_factor
 
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the training dataloader throughput of
+PrecomputedFeatures (random reads from lilcom archives) with
+sequentially read shards (see icefall/dataset/shar.py)
+on randomly generated features.
+
+Usage:
+
+    ./local/benchmark_shar.py --work-dir /tmp/shar-bench --num-cuts 20000
+
+Use a --work-dir on the file system you want to benchmark, e.g.,
+a network file system.
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from lhotse import CutSet, Features, LilcomChunkyWriter, SupervisionSegment
+from lhotse.cut import MonoCut
+from lhotse.dataset import DynamicBucketingSampler, K2SpeechRecognitionDataset
+from lhotse.dataset.dataloading import make_worker_init_fn
+
+from icefall.dataset.shar import SharIterableDataset, export_to_shar, load_shar_cuts
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        default=Path("shar-benchmark"),
+        help="Directory for the generated features and shards.",
+    )
+
+    parser.add_argument(
+        "--num-cuts",
+        type=int,
+        default=5000,
+        help="Number of cuts to generate.",
+    )
+
+    parser.add_argument(
+        "--num-archives",
+        type=int,
+        default=8,
+        help="Number of lilcom archives for the generated features.",
+    )
+
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=500,
+        help="Number of cuts per shard.",
+    )
+
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=600,
+        help="Maximum duration of a batch in seconds.",
+    )
+
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=2,
+        help="Number of dataloader workers.",
+    )
+
+    return parser.parse_args()
+
+
+def generate_cuts(work_dir: Path, num_cuts: int, num_archives: int) -> CutSet:
+    rng = np.random.default_rng(0)
+    feats_dir = work_dir / "feats"
+    feats_dir.mkdir(parents=True, exist_ok=True)
+
+    writers = [
+        LilcomChunkyWriter(feats_dir / f"feats-{i}.lca") for i in range(num_archives)
+    ]
+    cuts = []
+    for i in range(num_cuts):
+        num_frames = int(rng.integers(100, 2000))
+        duration = num_frames / 100
+        feats = rng.standard_normal((num_frames, 80), dtype=np.float32)
+        writer = writers[i % num_archives]
+        cut_id = f"cut-{i:07d}"
+        features = Features(
+            type="fbank",
+            num_frames=num_frames,
+            num_features=80,
+            frame_shift=0.01,
+            sampling_rate=16000,
+            start=0,
+            duration=duration,
+            storage_type=writer.name,
+            storage_path=str(writer.storage_path),
+            storage_key=writer.write(cut_id, feats),
+            recording_id=cut_id,
+            channels=0,
+        )
+        supervision = SupervisionSegment(
+            id=cut_id,
+            recording_id=cut_id,
+            start=0,
+            duration=duration,
+            text=" ".join(["HELLO"] * int(duration * 2)),
+        )
+        cuts.append(
+            MonoCut(
+                id=cut_id,
+                start=0,
+                duration=duration,
+                channel=0,
+                features=features,
+                supervisions=[supervision],
+            )
+        )
+    for w in writers:
+        w.close()
+
+    cuts = CutSet.from_cuts(cuts)
+    cuts.to_file(work_dir / "cuts.jsonl.gz")
+    return cuts
+
+
+def benchmark(dl: torch.utils.data.DataLoader, name: str) -> None:
+    num_cuts = 0
+    num_frames = 0
+    start = time.time()
+    for batch in dl:
+        num_cuts += batch["inputs"].size(0)
+        num_frames += batch["supervisions"]["num_frames"].sum().item()
+    elapsed = time.time() - start
+    logging.info(
+        f"{name}: {num_cuts} cuts in {elapsed:.2f}s, "
+        f"{num_cuts / elapsed:.1f} cuts/s, {num_frames / elapsed:.0f} frames/s"
+    )
+
+
+def main():
+    args = get_args()
+    logging.info(vars(args))
+
+    cuts_path = args.work_dir / "cuts.jsonl.gz"
+    shar_dir = args.work_dir / "shar"
+    if not cuts_path.is_file():
+        logging.info("Generating features")
+        generate_cuts(args.work_dir, args.num_cuts, args.num_archives)
+    if not (shar_dir / "index.json").is_file():
+        logging.info("Exporting shards")
+        export_to_shar(
+            CutSet.from_file(cuts_path),
+            output_dir=shar_dir,
+            shard_size=args.shard_size,
+        )
+
+    dataset = K2SpeechRecognitionDataset()
+
+    sampler = DynamicBucketingSampler(
+        CutSet.from_file(cuts_path),
+        max_duration=args.max_duration,
+        shuffle=True,
+        num_buckets=10,
+    )
+    dl = torch.utils.data.DataLoader(
+        dataset,
+        sampler=sampler,
+        batch_size=None,
+        num_workers=args.num_workers,
+    )
+    benchmark(dl, "PrecomputedFeatures (random reads)")
+
+    sampler = DynamicBucketingSampler(
+        load_shar_cuts(shar_dir, shuffle_buffer_size=1000),
+        max_duration=args.max_duration,
+        shuffle=True,
+        num_buckets=10,
+        world_size=1,
+        rank=0,
+    )
+    dl = torch.utils.data.DataLoader(
+        SharIterableDataset(dataset=dataset, sampler=sampler),
+        batch_size=None,
+        num_workers=args.num_workers,
+        worker_init_fn=make_worker_init_fn(rank=0, world_size=1),
+    )
+    benchmark(dl, "Shar (sequential reads)")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
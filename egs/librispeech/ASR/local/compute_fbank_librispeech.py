@@ -21,11 +21,12 @@ This file computes fbank features of the LibriSpeech dataset.
 It looks for manifests in the directory data/manifests.
 
 The generated fbank features are saved in data/fbank.
+If the script is interrupted, run it again to compute only the
+remaining features.
 """
 
 import argparse
 import logging
-import os
 from pathlib import Path
 from typing import Optional
 
@@ -35,6 +36,7 @@ from filter_cuts import filter_cuts
 from lhotse import CutSet, Fbank, FbankConfig, LilcomChunkyWriter
 from lhotse.recipes.utils import read_manifests_if_cached
 
+from icefall.feature_extraction import compute_features_resumable
 from icefall.utils import get_executor, str2bool
 
 # Torch's multithreaded behavior needs to be disabled or
@@ -68,6 +70,21 @@ def get_args():
         help="""Perturb speed with factor 0.9 and 1.1 on train subset.""",
     )
 
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=None,
+        help="""Number of worker processes. Defaults to the number of CPUs.""",
+    )
+
+    parser.add_argument(
+        "--unit-size",
+        type=int,
+        default=1000,
+        help="""Number of cuts in a work unit. Units that are done are
+        skipped if the script is run again after a crash.""",
+    )
+
     return parser.parse_args()
 
 
@@ -75,10 +92,11 @@ def compute_fbank_librispeech(
     bpe_model: Optional[str] = None,
     dataset: Optional[str] = None,
     perturb_speed: Optional[bool] = True,
+    num_workers: Optional[int] = None,
+    unit_size: int = 1000,
 ):
     src_dir = Path("data/manifests")
     output_dir = Path("data/fbank")
-    num_jobs = min(15, os.cpu_count())
     num_mel_bins = 80
 
     if bpe_model:
@@ -140,15 +158,16 @@ def compute_fbank_librispeech(
                         + cut_set.perturb_speed(0.9)
                         + cut_set.perturb_speed(1.1)
                     )
-            cut_set = cut_set.compute_and_store_features(
+            compute_features_resumable(
+                cut_set,
                 extractor=extractor,
-                storage_path=f"{output_dir}/{prefix}_feats_{partition}",
-                # when an executor is specified, make more partitions
-                num_jobs=num_jobs if ex is None else 80,
-                executor=ex,
+                storage_dir=f"{output_dir}/{prefix}_feats_{partition}",
+                output_cuts=output_dir / cuts_filename,
+                unit_size=unit_size,
+                num_workers=num_workers,
+                executor=ex.get_executor() if ex is not None else None,
                 storage_type=LilcomChunkyWriter,
             )
-            cut_set.to_file(output_dir / cuts_filename)
 
 
 if __name__ == "__main__":
@@ -161,4 +180,6 @@ if __name__ == "__main__":
         bpe_model=args.bpe_model,
         dataset=args.dataset,
         perturb_speed=args.perturb_speed,
+        num_workers=args.num_workers,
+        unit_size=args.unit_size,
     )
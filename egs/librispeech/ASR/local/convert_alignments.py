@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file converts alignments saved by `icefall.ali.save_alignments`,
+i.e., a pickled dict, into a memory-mapped alignment store.
+See `icefall/ali.py` for the format.
+
+Usage:
+
+  ./local/convert_alignments.py \\
+    --in-file data/ali_500/train-960.pt \\
+    --out-dir data/ali_500/train-960
+
+conformer_mmi/train.py uses data/ali_500/train-960 and data/ali_500/valid
+instead of the .pt files if they exist.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from icefall.ali import convert_alignments, is_alignment_store
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--in-file",
+        type=str,
+        required=True,
+        help="Alignments saved by icefall.ali.save_alignments",
+    )
+
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        required=True,
+        help="Output directory",
+    )
+
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default=None,
+        choices=["int16", "int32"],
+        help="If not given, use int16 if all labels fit into it",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    out_dir = Path(args.out_dir)
+    if is_alignment_store(out_dir):
+        logging.warning(f"{out_dir} exists - skipping")
+        return
+
+    convert_alignments(args.in_file, out_dir, dtype=args.dtype)
+    logging.info(f"Saved to {out_dir}")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
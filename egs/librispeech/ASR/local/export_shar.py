@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script packs the precomputed features and supervisions of a CutSet
+into large shards (Lhotse Shar format) that are read sequentially
+during training. See icefall/dataset/shar.py
+
+Usage:
+
+    ./local/export_shar.py \
+      --in-cuts data/fbank/librispeech_cuts_train-all-shuf.jsonl.gz \
+      --out-dir data/shar/train-all-shuf \
+      --shard-size 2000 \
+      --num-jobs 8
+
+Then train with
+
+    ./zipformer/train.py --shar-dir data/shar/train-all-shuf ...
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from lhotse import load_manifest_lazy
+
+from icefall.dataset.shar import export_to_shar
+from icefall.utils import str2bool
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--in-cuts",
+        type=Path,
+        required=True,
+        help="Input cuts with precomputed features.",
+    )
+
+    parser.add_argument(
+        "--out-dir",
+        type=Path,
+        required=True,
+        help="Output directory for the shards.",
+    )
+
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=1000,
+        help="""Number of cuts per shard. There should be at least
+        world_size * num_workers shards for training.""",
+    )
+
+    parser.add_argument(
+        "--feature-format",
+        type=str,
+        default="lilcom",
+        choices=["lilcom", "numpy"],
+        help="How to compress features in the shards.",
+    )
+
+    parser.add_argument(
+        "--shuffle",
+        type=str2bool,
+        default=False,
+        help="""Shuffle the cuts before sharding. It loads the manifest
+        into memory. Not needed if the input is already shuffled,
+        e.g., librispeech_cuts_train-all-shuf.jsonl.gz""",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Seed for --shuffle.",
+    )
+
+    parser.add_argument(
+        "--num-jobs",
+        type=int,
+        default=1,
+        help="Number of processes for the export.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    logging.info(vars(args))
+
+    cuts = load_manifest_lazy(args.in_cuts)
+    if args.shuffle:
+        import random
+
+        logging.info("Shuffling cuts")
+        cuts = cuts.to_eager().shuffle(rng=random.Random(args.seed))
+
+    index = export_to_shar(
+        cuts,
+        output_dir=args.out_dir,
+        shard_size=args.shard_size,
+        feature_format=args.feature_format,
+        num_jobs=args.num_jobs,
+        verbose=True,
+    )
+    logging.info(
+        f"Saved {index['num_cuts']} cuts ({index['duration'] / 3600:.2f} hours) "
+        f"in {index['num_shards']} shards to {args.out_dir}"
+    )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file converts LM training data generated by
+./local/prepare_lm_training_data.py or ./local/sort_lm_training_data.py
+into a directory containing
+
+    - tokens.npy, the BPE tokens of all sentences, concatenated
+    - offsets.npy, the start of each sentence in tokens.npy
+
+Both files are memory-mapped during training, so the corpus is not loaded
+into the memory of every dataloader worker and DDP rank. Pass the
+directory to --lm-data of rnn_lm/train.py or transformer_lm/train.py.
+
+Usage:
+
+  ./local/pack_lm_training_data.py \\
+    --in-lm-data data/lm_training_bpe_500/sorted_lm_data.pt \\
+    --out-dir data/lm_training_bpe_500/packed_lm_data
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from icefall.rnn_lm.dataset import convert_lm_data, is_packed_lm_data
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--in-lm-data",
+        type=str,
+        help="Input LM training data, e.g., data/bpe_500/sorted_lm_data.pt",
+    )
+
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        help="Output directory, e.g., data/bpe_500/packed_lm_data",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    in_lm_data = Path(args.in_lm_data)
+    out_dir = Path(args.out_dir)
+    assert in_lm_data.is_file(), f"{in_lm_data}"
+    if is_packed_lm_data(out_dir):
+        logging.warning(f"{out_dir} exists - skipping")
+        return
+
+    convert_lm_data(in_lm_data, out_dir)
+    logging.info(f"Saved to {out_dir}")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
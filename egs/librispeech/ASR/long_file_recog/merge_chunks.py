@@ -27,17 +27,12 @@ from pathlib import Path
 from typing import List
 
 import sentencepiece as spm
-from lhotse import (
-    CutSet,
-    MonoCut,
-    SupervisionSegment,
-    SupervisionSet,
-    load_manifest,
-    load_manifest_lazy,
-)
+from lhotse import CutSet, MonoCut, SupervisionSegment, load_manifest_lazy
 from lhotse.cut import Cut
 from lhotse.serialization import SequentialJsonlWriter
 
+from icefall.manifest_index import IndexedManifest
+
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -75,7 +70,7 @@ def get_parser():
 
 def merge_chunks(
     cuts_chunk: CutSet,
-    supervisions: SupervisionSet,
+    supervisions: IndexedManifest,
     cuts_writer: SequentialJsonlWriter,
     sp: spm.SentencePieceProcessor,
     extra: float,
@@ -86,7 +81,8 @@ def merge_chunks(
       cuts_chunk:
         The chunk-wise cuts opened in a lazy mode.
       supervisions:
-        The supervision manifest containing text file path, opened in a lazy mode.
+        The supervision manifest containing text file path, indexed by id,
+        so that it is not loaded into memory.
       cuts_writer:
         Writer to save the cuts with recognition results.
       sp:
@@ -216,8 +212,9 @@ def main():
             logging.info(f"{manifest_out} already exists - skipping.")
             continue
 
-        supervisions = load_manifest(
-            manifest_out_dir / f"librilight_supervisions_{subset}.jsonl.gz"
+        supervisions = IndexedManifest(
+            manifest_out_dir / f"librilight_supervisions_{subset}.jsonl.gz",
+            convert_gzip=True,
         )  # We will use the text path from supervisions
 
         cuts_chunk = load_manifest_lazy(
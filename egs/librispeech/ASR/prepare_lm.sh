@@ -262,3 +262,19 @@ if [ $stage -le 8 ] && [ $stop_stage -ge 8 ]; then
       --out-statistics $out_dir/statistics-test.txt
   done
 fi
+
+if [ $stage -le 9 ] && [ $stop_stage -ge 9 ]; then
+  log "Stage 9: Pack NNLM training data"
+  # Convert the sorted LM training data into flat token arrays that
+  # are memory-mapped during training. Pass the output directories to
+  # --lm-data and --lm-data-valid of rnn_lm/train.py to use them.
+
+  for vocab_size in ${vocab_sizes[@]}; do
+    out_dir=data/lm_training_bpe_${vocab_size}
+    for part in "" -valid -test; do
+      ./local/pack_lm_training_data.py \
+        --in-lm-data $out_dir/sorted_lm_data${part}.pt \
+        --out-dir $out_dir/packed_lm_data${part}
+    done
+  done
+fi
@@ -34,6 +34,7 @@ from lhotse.dataset import (  # noqa F401 for PrecomputedFeatures
     SimpleCutSampler,
     SpecAugment,
 )
+from lhotse.dataset.dataloading import make_worker_init_fn
 from lhotse.dataset.input_strategies import (  # noqa F401 For AudioSamples
     AudioSamples,
     OnTheFlyFeatures,
@@ -41,6 +42,14 @@ from lhotse.dataset.input_strategies import (  # noqa F401 For AudioSamples
 from lhotse.utils import fix_random_seed
 from torch.utils.data import DataLoader
 
+from icefall.dataset.sampling import CostBucketingSampler, CostConstraint
+from icefall.dataset.shar import (
+    SharIterableDataset,
+    check_num_shards,
+    get_num_batches_per_epoch,
+    load_shar_cuts,
+)
+from icefall.dist import get_rank, get_world_size
 from icefall.utils import str2bool
 
 
@@ -109,6 +118,52 @@ class LibriSpeechAsrDataModule:
             help="Maximum pooled recordings duration (seconds) in a "
             "single batch. You can reduce it if it causes CUDA OOM.",
         )
+        group.add_argument(
+            "--quadratic-duration",
+            type=float,
+            default=None,
+            help="If set, the effective duration of a cut in DynamicBucketingSampler "
+            "is duration + duration**2 / quadratic_duration, so that batches of "
+            "long cuts are smaller. Useful for models with self-attention.",
+        )
+        group.add_argument(
+            "--max-cost",
+            type=float,
+            default=None,
+            help="""If set, the batches of the training DynamicBucketingSampler
+            are limited by a cost instead of --max-duration. The cost of a cut
+            is a * T + b * T**2 + c * U, where T is its duration in seconds
+            and U the number of tokens in its transcript; a batch costs
+            num_cuts * (cost of its longest cut).
+            See icefall/dataset/sampling.py""",
+        )
+        group.add_argument(
+            "--cost-duration-scale",
+            type=float,
+            default=1.0,
+            help="Used only when --max-cost is set. `a` in the cost function.",
+        )
+        group.add_argument(
+            "--cost-quadratic-scale",
+            type=float,
+            default=0.0,
+            help="Used only when --max-cost is set. `b` in the cost function. "
+            "For example, 1/30 doubles the cost of a cut of 30 seconds.",
+        )
+        group.add_argument(
+            "--cost-token-scale",
+            type=float,
+            default=0.0,
+            help="Used only when --max-cost is set. `c` in the cost function.",
+        )
+        group.add_argument(
+            "--cost-token-unit",
+            type=str,
+            default="word",
+            choices=["word", "char"],
+            help="Used only when --max-cost is set. The unit of U in the "
+            "cost function.",
+        )
         group.add_argument(
             "--bucketing-sampler",
             type=str2bool,
@@ -215,6 +270,37 @@ class LibriSpeechAsrDataModule:
             help="AudioSamples or PrecomputedFeatures",
         )
 
+        group.add_argument(
+            "--shar-dir",
+            type=Path,
+            default=None,
+            help="""If set, read the training cuts and their features
+            sequentially from the shards in this directory instead of
+            reading features at random offsets of the feature archives.
+            Use ./local/export_shar.py to create it.
+            See icefall/dataset/shar.py""",
+        )
+
+        group.add_argument(
+            "--shar-shuffle-buffer-size",
+            type=int,
+            default=10000,
+            help="Used only when --shar-dir is set. Size of the in-memory "
+            "buffer used to shuffle the cuts read from the shards.",
+        )
+
+        group.add_argument(
+            "--shar-num-batches-per-epoch",
+            type=int,
+            default=0,
+            help="""Used only when --shar-dir is set. If positive, the shards
+            are read repeatedly and every epoch has exactly this number of
+            batches on each rank. If 0, it is used only with DDP and
+            estimated so that an epoch reads the data about once. With DDP,
+            all ranks need the same number of batches, otherwise the
+            training hangs at the end of the epoch.""",
+        )
+
     def train_dataloaders(
         self,
         cuts_train: CutSet,
@@ -304,16 +390,45 @@ class LibriSpeechAsrDataModule:
                 return_cuts=self.args.return_cuts,
             )
 
-        if self.args.bucketing_sampler:
+        if self.args.shar_dir is not None:
+            # The cuts are already split over DDP ranks and dataloader
+            # workers by the shar reader. See icefall/dataset/shar.py
+            sampler_kwargs = dict(world_size=1, rank=0)
+        else:
+            sampler_kwargs = dict()
+
+        if self.args.bucketing_sampler and self.args.max_cost is not None:
+            logging.info("Using CostBucketingSampler.")
+            constraint = CostConstraint(
+                max_cost=self.args.max_cost,
+                duration_scale=self.args.cost_duration_scale,
+                quadratic_scale=self.args.cost_quadratic_scale,
+                token_scale=self.args.cost_token_scale,
+                token_unit=self.args.cost_token_unit,
+            )
+            logging.info(f"Cost constraint: {constraint}")
+            train_sampler = CostBucketingSampler(
+                cuts_train,
+                constraint=constraint,
+                shuffle=self.args.shuffle,
+                num_buckets=self.args.num_buckets,
+                buffer_size=self.args.num_buckets * 2000,
+                shuffle_buffer_size=self.args.num_buckets * 5000,
+                drop_last=self.args.drop_last,
+                **sampler_kwargs,
+            )
+        elif self.args.bucketing_sampler:
             logging.info("Using DynamicBucketingSampler.")
             train_sampler = DynamicBucketingSampler(
                 cuts_train,
                 max_duration=self.args.max_duration,
+                quadratic_duration=self.args.quadratic_duration,
                 shuffle=self.args.shuffle,
                 num_buckets=self.args.num_buckets,
                 buffer_size=self.args.num_buckets * 2000,
                 shuffle_buffer_size=self.args.num_buckets * 5000,
                 drop_last=self.args.drop_last,
+                **sampler_kwargs,
             )
         else:
             logging.info("Using SimpleCutSampler.")
@@ -321,16 +436,44 @@ class LibriSpeechAsrDataModule:
                 cuts_train,
                 max_duration=self.args.max_duration,
                 shuffle=self.args.shuffle,
+                **sampler_kwargs,
             )
         logging.info("About to create train dataloader")
 
+        # 'seed' is derived from the current random state, which will have
+        # previously been set in the main process.
+        seed = torch.randint(0, 100000, ()).item()
+
+        if self.args.shar_dir is not None:
+            if sampler_state_dict is not None:
+                logging.warning(
+                    "The sampler state dict is ignored with --shar-dir "
+                    "since the sampler lives in the dataloader workers."
+                )
+            check_num_shards(
+                self.args.shar_dir,
+                world_size=get_world_size(),
+                num_workers=self.args.num_workers,
+            )
+            train_dl = DataLoader(
+                SharIterableDataset(
+                    dataset=train,
+                    sampler=train_sampler,
+                    num_batches=self.shar_num_batches_per_epoch() or None,
+                ),
+                batch_size=None,
+                num_workers=self.args.num_workers,
+                persistent_workers=False,
+                worker_init_fn=make_worker_init_fn(
+                    rank=get_rank(), world_size=get_world_size(), seed=seed
+                ),
+            )
+            return train_dl
+
         if sampler_state_dict is not None:
             logging.info("Loading sampler state dict")
             train_sampler.load_state_dict(sampler_state_dict)
 
-        # 'seed' is derived from the current random state, which will have
-        # previously been set in the main process.
-        seed = torch.randint(0, 100000, ()).item()
         worker_init_fn = _SeedWorkers(seed)
 
         train_dl = DataLoader(
@@ -403,6 +546,31 @@ class LibriSpeechAsrDataModule:
         )
         return test_dl
 
+    def shar_num_batches_per_epoch(self) -> int:
+        """Return the number of batches per epoch with --shar-dir, or 0 if
+        an epoch is a single pass over the shards."""
+        if self.args.shar_num_batches_per_epoch > 0:
+            return self.args.shar_num_batches_per_epoch
+        if get_world_size() == 1:
+            return 0
+        return get_num_batches_per_epoch(
+            self.args.shar_dir,
+            world_size=get_world_size(),
+            max_duration=self.args.max_duration,
+        )
+
+    @lru_cache()
+    def train_shar_cuts(self) -> CutSet:
+        logging.info(f"About to get train cuts from {self.args.shar_dir}")
+        num_batches = self.shar_num_batches_per_epoch()
+        if num_batches > 0:
+            logging.info(f"Using {num_batches} batches per epoch")
+        return load_shar_cuts(
+            self.args.shar_dir,
+            shuffle_buffer_size=self.args.shar_shuffle_buffer_size,
+            repeat=num_batches > 0,
+        )
+
     @lru_cache()
     def train_clean_5_cuts(self) -> CutSet:
         logging.info("mini_librispeech: About to get train-clean-5 cuts")
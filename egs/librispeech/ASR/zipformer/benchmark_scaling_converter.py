@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script checks that the encoder converted by convert_for_inference() in
+scaling_converter.py gives the same outputs as the original one, and compares
+their latency. It uses random weights unless --checkpoint is given.
+
+Usage:
+
+(1) Non-streaming model
+
+    ./zipformer/benchmark_scaling_converter.py
+
+(2) Streaming model, for which the streaming encoder is also compared
+
+    ./zipformer/benchmark_scaling_converter.py \
+        --causal 1 \
+        --chunk-size 16 \
+        --left-context-frames 128
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable, List, Tuple
+
+import torch
+from scaling_converter import convert_for_inference
+from torch import Tensor, nn
+from train import add_model_arguments, get_encoder_embed, get_encoder_model, get_params
+
+from icefall.utils import make_pad_mask
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="If not empty, the checkpoint to load the encoder from, "
+        "e.g., zipformer/exp/epoch-30.pt",
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of utterances per batch.",
+    )
+
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        default=1000,
+        help="Number of feature frames of each utterance.",
+    )
+
+    parser.add_argument(
+        "--num-iters",
+        type=int,
+        default=10,
+        help="Number of times each encoder is run for the timing.",
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="Number of threads of PyTorch.",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+class Encoder(nn.Module):
+    """A wrapper for encoder_embed and encoder."""
+
+    def __init__(self, encoder_embed: nn.Module, encoder: nn.Module) -> None:
+        super().__init__()
+        self.encoder_embed = encoder_embed
+        self.encoder = encoder
+
+    def forward(self, feature: Tensor, feature_lens: Tensor) -> Tuple[Tensor, Tensor]:
+        x, x_lens = self.encoder_embed(feature, feature_lens)
+        src_key_padding_mask = make_pad_mask(x_lens)
+        x = x.permute(1, 0, 2)  # (N, T, C) -> (T, N, C)
+        encoder_out, encoder_out_lens = self.encoder(x, x_lens, src_key_padding_mask)
+        return encoder_out.permute(1, 0, 2), encoder_out_lens
+
+    def get_init_states(self, batch_size: int) -> List[Tensor]:
+        """See get_init_states() in streaming_decode.py"""
+        states = self.encoder.get_init_states(batch_size)
+        states.append(self.encoder_embed.get_init_states(batch_size))
+        states.append(torch.zeros(batch_size, dtype=torch.int32))
+        return states
+
+    def streaming_forward(
+        self,
+        feature: Tensor,
+        feature_lens: Tensor,
+        states: List[Tensor],
+        left_context_len: int,
+    ) -> Tuple[Tensor, List[Tensor]]:
+        """See streaming_forward() in streaming_decode.py"""
+        x, x_lens, new_cached_embed_left_pad = self.encoder_embed.streaming_forward(
+            x=feature,
+            x_lens=feature_lens,
+            cached_left_pad=states[-2],
+        )
+        src_key_padding_mask = make_pad_mask(x_lens)
+
+        processed_mask = torch.arange(left_context_len).expand(
+            x.size(0), left_context_len
+        )
+        processed_lens = states[-1]
+        processed_mask = (processed_lens.unsqueeze(1) <= processed_mask).flip(1)
+        src_key_padding_mask = torch.cat([processed_mask, src_key_padding_mask], dim=1)
+
+        x = x.permute(1, 0, 2)  # (N, T, C) -> (T, N, C)
+        encoder_out, _, new_states = self.encoder.streaming_forward(
+            x=x,
+            x_lens=x_lens,
+            states=states[:-2],
+            src_key_padding_mask=src_key_padding_mask,
+        )
+        new_states += [new_cached_embed_left_pad, processed_lens + x_lens]
+        return encoder_out.permute(1, 0, 2), new_states
+
+
+def decode_streaming(
+    model: Encoder, feature: Tensor, chunk_size: int, left_context_len: int
+) -> List[Tensor]:
+    """Run the streaming encoder chunk by chunk on `feature`, of shape
+    (N, T, C), and return the output of each chunk."""
+    # See decode_one_chunk() in streaming_decode.py
+    pad_length = 7 + 2 * 3
+    batch_size = feature.size(0)
+    states = model.get_init_states(batch_size)
+    outputs = []
+    for start in range(0, feature.size(1) - pad_length, chunk_size * 2):
+        chunk = feature[:, start : start + chunk_size * 2 + pad_length]
+        if chunk.size(1) < chunk_size * 2 + pad_length:
+            break
+        chunk_lens = torch.full((batch_size,), chunk.size(1))
+        encoder_out, states = model.streaming_forward(
+            chunk, chunk_lens, states, left_context_len
+        )
+        outputs.append(encoder_out)
+    return outputs
+
+
+def timeit(f: Callable, num_iters: int) -> float:
+    """Return the average time of f() in seconds, after one warm-up call."""
+    f()
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        f()
+    return (time.perf_counter() - start) / num_iters
+
+
+@torch.no_grad()
+def main():
+    args = get_parser().parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    params = get_params()
+    params.update(vars(args))
+    logging.info(params)
+
+    torch.manual_seed(0)
+    model = Encoder(get_encoder_embed(params), get_encoder_model(params))
+    if params.checkpoint:
+        state_dict = torch.load(params.checkpoint, map_location="cpu")["model"]
+        state_dict = {
+            k: v
+            for k, v in state_dict.items()
+            if k.startswith(("encoder.", "encoder_embed."))
+        }
+        model.load_state_dict(state_dict)
+    model.eval()
+
+    # The baseline is the model as used by decode.py and streaming_decode.py
+    baseline = model
+    optimized = convert_for_inference(model)
+
+    B, T = params.batch_size, params.num_frames
+    feature = torch.randn(B, T, params.feature_dim)
+    feature_lens = torch.full((B,), T, dtype=torch.int64)
+
+    out, out_lens = baseline(feature, feature_lens)
+    opt_out, opt_out_lens = optimized(feature, feature_lens)
+    assert torch.equal(out_lens, opt_out_lens), (out_lens, opt_out_lens)
+    logging.info(
+        f"Offline: max abs difference {(out - opt_out).abs().max():.3g}, "
+        f"max abs output {out.abs().max():.3g}"
+    )
+
+    t = timeit(lambda: baseline(feature, feature_lens), params.num_iters)
+    opt_t = timeit(lambda: optimized(feature, feature_lens), params.num_iters)
+    logging.info(
+        f"Offline: {B} x {T} frames, {t * 1000:.1f} ms -> {opt_t * 1000:.1f} ms, "
+        f"speedup {t / opt_t:.2f}"
+    )
+
+    if not params.causal:
+        return
+
+    assert "," not in params.chunk_size, "chunk_size should be one value"
+    assert (
+        "," not in params.left_context_frames
+    ), "left_context_frames should be one value"
+    chunk_size = int(params.chunk_size)
+    left_context_len = int(params.left_context_frames)
+
+    outputs = decode_streaming(baseline, feature, chunk_size, left_context_len)
+    opt_outputs = decode_streaming(optimized, feature, chunk_size, left_context_len)
+    out = torch.cat(outputs, dim=1)
+    opt_out = torch.cat(opt_outputs, dim=1)
+    logging.info(
+        f"Streaming: max abs difference {(out - opt_out).abs().max():.3g}, "
+        f"max abs output {out.abs().max():.3g}"
+    )
+
+    num_chunks = len(outputs)
+    t = timeit(
+        lambda: decode_streaming(baseline, feature, chunk_size, left_context_len),
+        params.num_iters,
+    )
+    opt_t = timeit(
+        lambda: decode_streaming(optimized, feature, chunk_size, left_context_len),
+        params.num_iters,
+    )
+    logging.info(
+        f"Streaming: chunk size {chunk_size}, left context {left_context_len}, "
+        f"{t / num_chunks * 1000:.2f} ms -> {opt_t / num_chunks * 1000:.2f} ms "
+        f"per chunk, speedup {t / opt_t:.2f}"
+    )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
@@ -105,6 +105,26 @@ Usage:
     --nbest-scale 1.0 \
     --lm-dir data/lm \
     --decoding-method attention-decoder-rescoring-with-ngram
+
+(9) attention-decoder-greedy-search
+./zipformer/ctc_decode.py \
+    --epoch 30 \
+    --avg 15 \
+    --exp-dir ./zipformer/exp \
+    --use-ctc 1 \
+    --use-attention-decoder 1 \
+    --max-duration 100 \
+    --decoding-method attention-decoder-greedy-search
+
+(10) attention-decoder-speculative-greedy-search
+./zipformer/ctc_decode.py \
+    --epoch 30 \
+    --avg 15 \
+    --exp-dir ./zipformer/exp \
+    --use-ctc 1 \
+    --use-attention-decoder 1 \
+    --max-duration 100 \
+    --decoding-method attention-decoder-speculative-greedy-search
 """
 
 
@@ -112,6 +132,7 @@ import argparse
 import logging
 import math
 import os
+import time
 from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -132,6 +153,8 @@ from icefall.checkpoint import (
 )
 from icefall.context_graph import ContextGraph, ContextState
 from icefall.decode import (
+    SpeculativeDecodingStats,
+    attention_decoder_speculative_greedy_search,
     ctc_greedy_search,
     ctc_prefix_beam_search,
     ctc_prefix_beam_search_attention_decoder_rescoring,
@@ -268,6 +291,13 @@ def get_parser():
           the given beam, rescore them with the attention decoder.
         - (12) ctc-prefix-beam-search-shallow-fussion. Use NNLM shallow fussion during
           beam search, LODR and hotwords are also supported in this decoding method.
+        - (13) attention-decoder-greedy-search. Use greedy search of the attention
+          decoder, one token at a time.
+        - (14) attention-decoder-speculative-greedy-search. Use the result of CTC
+          greedy search as a draft, verify it with a single forward of the
+          attention decoder, and continue greedy search of the attention decoder
+          from the first rejected token. It gives the same result as (13) with
+          fewer decoder steps.
         """,
     )
 
@@ -511,6 +541,28 @@ def decode_one_batch(
             ans[a_scale_str] = hyps
         return ans
 
+    if params.decoding_method in (
+        "attention-decoder-greedy-search",
+        "attention-decoder-speculative-greedy-search",
+    ):
+        if params.decoding_method == "attention-decoder-greedy-search":
+            draft_token_ids = [[] for _ in range(encoder_out.size(0))]
+        else:
+            draft_token_ids = ctc_greedy_search(ctc_output, encoder_out_lens)
+        token_ids = attention_decoder_speculative_greedy_search(
+            attention_decoder=model.attention_decoder,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+            draft_token_ids=draft_token_ids,
+            stats=params.speculative_decoding_stats,
+        )
+        # hyps is a list of str, e.g., ['xxx yyy zzz', ...]
+        hyps = bpe_model.decode(token_ids)
+        # hyps is a list of list of str, e.g., [['xxx', 'yyy', 'zzz'], ... ]
+        hyps = [s.split() for s in hyps]
+        key = params.decoding_method
+        return {key: hyps}
+
     if params.decoding_method == "ctc-prefix-beam-search-shallow-fussion":
         token_ids = ctc_prefix_beam_search_shallow_fussion(
             ctc_output=ctc_output,
@@ -870,6 +922,8 @@ def main():
         "nbest-oracle",
         "attention-decoder-rescoring-no-ngram",
         "attention-decoder-rescoring-with-ngram",
+        "attention-decoder-greedy-search",
+        "attention-decoder-speculative-greedy-search",
     )
     params.res_dir = params.exp_dir / params.decoding_method
 
@@ -929,6 +983,8 @@ def main():
         "ctc-prefix-beam-search-attention-decoder-rescoring",
         "ctc-prefix-beam-search-shallow-fussion",
         "attention-decoder-rescoring-no-ngram",
+        "attention-decoder-greedy-search",
+        "attention-decoder-speculative-greedy-search",
     ]:
         HLG = None
         H = None
@@ -1151,6 +1207,8 @@ def main():
     test_dl = [test_clean_dl, test_other_dl]
 
     for test_set, test_dl in zip(test_sets, test_dl):
+        params.speculative_decoding_stats = SpeculativeDecodingStats()
+        start_time = time.time()
         results_dict = decode_dataset(
             dl=test_dl,
             params=params,
@@ -1164,6 +1222,14 @@ def main():
             LODR_lm=LODR_lm,
             context_graph=context_graph,
         )
+        if params.decoding_method in (
+            "attention-decoder-greedy-search",
+            "attention-decoder-speculative-greedy-search",
+        ):
+            logging.info(
+                f"{test_set}: {params.speculative_decoding_stats}, "
+                f"decoding time: {time.time() - start_time:.2f}s"
+            )
 
         save_asr_output(
             params=params,
@@ -91,6 +91,16 @@ Usage:
     --beam 20.0 \
     --max-contexts 8 \
     --max-states 64
+
+(8) greedy search of the attention decoder, with the result of greedy search
+    as the draft
+./zipformer/decode.py \
+    --epoch 28 \
+    --avg 15 \
+    --exp-dir ./zipformer/exp \
+    --use-attention-decoder 1 \
+    --max-duration 600 \
+    --decoding-method attention_decoder_speculative_greedy_search
 """
 
 
@@ -98,6 +108,7 @@ import argparse
 import logging
 import math
 import os
+import time
 from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -131,6 +142,11 @@ from icefall.checkpoint import (
     find_checkpoints,
     load_checkpoint,
 )
+from icefall.decode import (
+    SpeculativeDecodingStats,
+    attention_decoder_speculative_greedy_search,
+)
+from icefall.error_stats import ErrorStats
 from icefall.lexicon import Lexicon
 from icefall.utils import (
     AttributeDict,
@@ -221,8 +237,13 @@ def get_parser():
           - fast_beam_search_nbest
           - fast_beam_search_nbest_oracle
           - fast_beam_search_nbest_LG
+          - attention_decoder_speculative_greedy_search
         If you use fast_beam_search_nbest_LG, you have to specify
         `--lang-dir`, which should contain `LG.pt`.
+        attention_decoder_speculative_greedy_search needs a model trained
+        with --use-attention-decoder 1. It uses the result of greedy_search
+        as a draft for greedy search of the attention decoder, see
+        attention_decoder_speculative_greedy_search() in icefall/decode.py.
         """,
     )
 
@@ -378,6 +399,14 @@ def get_parser():
         help="""Skip scoring, but still save the ASR output (for eval sets).""",
     )
 
+    parser.add_argument(
+        "--num-scoring-jobs",
+        type=int,
+        default=1,
+        help="""Number of processes used to compute the WER of each test set.
+        It does not change the results.""",
+    )
+
     add_model_arguments(parser)
 
     return parser
@@ -519,6 +548,21 @@ def decode_one_batch(
         )
         for hyp in sp.decode(hyp_tokens):
             hyps.append(hyp.split())
+    elif params.decoding_method == "attention_decoder_speculative_greedy_search":
+        draft_token_ids = greedy_search_batch(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+        )
+        hyp_tokens = attention_decoder_speculative_greedy_search(
+            attention_decoder=model.attention_decoder,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+            draft_token_ids=draft_token_ids,
+            stats=params.speculative_decoding_stats,
+        )
+        for hyp in sp.decode(hyp_tokens):
+            hyps.append(hyp.split())
     elif params.decoding_method == "modified_beam_search":
         hyp_tokens = modified_beam_search(
             model=model,
@@ -684,6 +728,8 @@ def decode_dataset(
         log_interval = 20
 
     results = defaultdict(list)
+    # The WER of the batches decoded so far, logged with the progress
+    running_stats = defaultdict(lambda: ErrorStats(keep_details=False))
     for batch_idx, batch in enumerate(dl):
         texts = batch["supervisions"]["text"]
         cut_ids = [cut.id for cut in batch["supervisions"]["cut"]]
@@ -709,6 +755,8 @@ def decode_dataset(
                 this_batch.append((cut_id, ref_words, hyp_words))
 
             results[name].extend(this_batch)
+            if not params.skip_scoring:
+                running_stats[name].update(this_batch)
 
         num_cuts += len(texts)
 
@@ -716,6 +764,8 @@ def decode_dataset(
             batch_str = f"{batch_idx}/{num_batches}"
 
             logging.info(f"batch {batch_str}, cuts processed until now is {num_cuts}")
+            for name, stats in running_stats.items():
+                logging.info(f"{name}: running {stats}")
     return results
 
 
@@ -752,7 +802,11 @@ def save_wer_results(
         errs_filename = params.res_dir / f"errs-{test_set_name}-{params.suffix}.txt"
         with open(errs_filename, "w", encoding="utf8") as fd:
             wer = write_error_stats(
-                fd, f"{test_set_name}-{key}", results, enable_log=True
+                fd,
+                f"{test_set_name}-{key}",
+                results,
+                enable_log=True,
+                num_jobs=params.num_scoring_jobs,
             )
             test_set_wers[key] = wer
 
@@ -801,6 +855,7 @@ def main():
         "modified_beam_search_lm_shallow_fusion",
         "modified_beam_search_lm_rescore",
         "modified_beam_search_lm_rescore_LODR",
+        "attention_decoder_speculative_greedy_search",
     )
     params.res_dir = params.exp_dir / params.decoding_method
 
@@ -871,6 +926,7 @@ def main():
     # <blk> and <unk> are defined in local/train_bpe_model.py
     params.blank_id = sp.piece_to_id("<blk>")
     params.unk_id = sp.piece_to_id("<unk>")
+    params.sos_id = params.eos_id = sp.piece_to_id("<sos/eos>")
     params.vocab_size = sp.get_piece_size()
 
     logging.info(params)
@@ -1052,6 +1108,8 @@ def main():
     test_dl = [test_clean_dl, test_other_dl]
 
     for test_set, test_dl in zip(test_sets, test_dl):
+        params.speculative_decoding_stats = SpeculativeDecodingStats()
+        start_time = time.time()
         results_dict = decode_dataset(
             dl=test_dl,
             params=params,
@@ -1064,6 +1122,11 @@ def main():
             ngram_lm=ngram_lm,
             ngram_lm_scale=ngram_lm_scale,
         )
+        if params.decoding_method == "attention_decoder_speculative_greedy_search":
+            logging.info(
+                f"{test_set}: {params.speculative_decoding_stats}, "
+                f"decoding time: {time.time() - start_time:.2f}s"
+            )
 
         save_asr_output(
             params=params,
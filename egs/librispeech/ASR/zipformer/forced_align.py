@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script computes word and token alignments of a CutSet with an
+exported zipformer model and writes the aligned cuts to a jsonl manifest.
+
+Export the model with:
+
+./zipformer/export.py \
+  --exp-dir ./zipformer/exp \
+  --use-ctc 1 \
+  --tokens data/lang_bpe_500/tokens.txt \
+  --epoch 30 \
+  --avg 9 \
+  --jit 1
+
+Usage:
+
+./zipformer/forced_align.py \
+  --model-filename ./zipformer/exp/jit_script.pt \
+  --bpe-model data/lang_bpe_500/bpe.model \
+  --method ctc \
+  --num-workers 16 \
+  data/fbank/librispeech_cuts_train-clean-100.jsonl.gz \
+  data/ali/librispeech_cuts_train-clean-100.jsonl
+
+Use `--method transducer` for a model trained without CTC. If the script
+is interrupted, run it again with the same arguments to align the rest.
+
+The alignments are in `supervision.alignment["word"]` and
+`supervision.alignment["token"]` of the output cuts.
+"""
+
+import argparse
+import logging
+from functools import partial
+
+import sentencepiece as spm
+import torch
+from lhotse import CutSet
+
+from icefall.forced_alignment import (
+    CtcForcedAligner,
+    ForcedAligner,
+    TransducerForcedAligner,
+    align_cuts,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--model-filename",
+        type=str,
+        required=True,
+        help="Path to the torchscript model jit_script.pt",
+    )
+
+    parser.add_argument(
+        "--bpe-model",
+        type=str,
+        default="data/lang_bpe_500/bpe.model",
+        help="Path to the BPE model",
+    )
+
+    parser.add_argument(
+        "--method",
+        type=str,
+        default="ctc",
+        choices=["ctc", "transducer"],
+        help="Which output of the model is used for the alignment",
+    )
+
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=600.0,
+        help="Maximum total duration in seconds of a batch",
+    )
+
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=4,
+        help="Number of worker processes. 0 to align in the main process",
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="Number of torch threads in each worker",
+    )
+
+    parser.add_argument(
+        "--frame-shift",
+        type=float,
+        default=0.04,
+        help="Frame shift in seconds of the encoder output",
+    )
+
+    parser.add_argument(
+        "cuts",
+        type=str,
+        help="The input CutSet",
+    )
+
+    parser.add_argument(
+        "output",
+        type=str,
+        help="The output jsonl manifest",
+    )
+
+    return parser
+
+
+def make_aligner(
+    model_filename: str,
+    bpe_model: str,
+    method: str,
+    frame_shift: float,
+) -> ForcedAligner:
+    model = torch.jit.load(model_filename, map_location="cpu")
+    model.eval()
+
+    sp = spm.SentencePieceProcessor()
+    sp.load(bpe_model)
+
+    if method == "ctc":
+        aligner_cls = partial(CtcForcedAligner, blank_id=sp.piece_to_id("<blk>"))
+    else:
+        aligner_cls = TransducerForcedAligner
+
+    return aligner_cls(
+        model,
+        encode_words=lambda words: sp.encode(words, out_type=int),
+        token_symbols=sp.id_to_piece,
+        frame_shift=frame_shift,
+    )
+
+
+@torch.no_grad()
+def main():
+    args = get_parser().parse_args()
+    logging.info(vars(args))
+
+    cuts = CutSet.from_file(args.cuts)
+    align_cuts(
+        cuts,
+        make_aligner=partial(
+            make_aligner,
+            model_filename=args.model_filename,
+            bpe_model=args.bpe_model,
+            method=args.method,
+            frame_shift=args.frame_shift,
+        ),
+        output=args.output,
+        max_duration=args.max_duration,
+        num_workers=args.num_workers,
+        num_threads=args.num_threads,
+    )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
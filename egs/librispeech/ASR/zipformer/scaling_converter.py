@@ -20,24 +20,215 @@ This file replaces various modules in a model.
 Specifically, ActivationBalancer is replaced with an identity operator;
 Whiten is also replaced with an identity operator;
 BasicNorm is replaced by a module with `exp` removed.
+
+convert_for_inference() additionally removes from the graph the computations
+that depend only on the parameters, for inference with PyTorch on CPU.
 """
 
 import copy
-from typing import List
+from typing import Dict, List, Optional
 
 import torch
 import torch.nn as nn
 from scaling import (
+    ActivationDropoutAndLinear,
     Balancer,
+    BiasNorm,
+    ChunkCausalDepthwiseConv1d,
+    Dropout2,
     Dropout3,
     ScaleGrad,
+    ScheduledFloat,
     SwooshL,
     SwooshLOnnx,
     SwooshR,
     SwooshROnnx,
     Whiten,
 )
-from zipformer import CompactRelPositionalEncoding
+from zipformer import (
+    BypassModule,
+    CompactRelPositionalEncoding,
+    ConvolutionModule,
+    FeedforwardModule,
+    Zipformer2,
+    Zipformer2Encoder,
+    Zipformer2EncoderLayer,
+)
+
+
+class BiasNormInference(nn.Module):
+    """BiasNorm with its output scale, exp(log_scale), precomputed.
+
+    Args:
+      norm:
+        The BiasNorm to be converted.
+      scale:
+        The scale of the output. Defaults to the one of `norm`; it is 1.0 if
+        the scale is folded into the next module.
+    """
+
+    def __init__(self, norm: BiasNorm, scale: Optional[float] = None):
+        super().__init__()
+        self.num_channels = norm.num_channels
+        self.channel_dim = norm.channel_dim
+        self.register_buffer("bias", norm.bias.detach().clone())
+        if scale is None:
+            scale = norm.log_scale.exp().item()
+        self.scale = scale
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        channel_dim = self.channel_dim
+        if channel_dim < 0:
+            channel_dim += x.ndim
+        bias = self.bias
+        for _ in range(channel_dim + 1, x.ndim):
+            bias = bias.unsqueeze(-1)
+        scales = torch.mean((x - bias) ** 2, dim=channel_dim, keepdim=True).rsqrt()
+        if self.scale != 1.0:
+            scales = scales * self.scale
+        return x * scales
+
+
+class ActivationAndLinearInference(nn.Module):
+    """ActivationDropoutAndLinear for inference.
+
+    SwooshL(x) and SwooshR(x) are softplus(x - offset) - 0.08 * x - c, with
+    an offset of 4 and 1 respectively. With y = x - offset, this is
+    softplus(y) - 0.08 * y - (0.08 * offset + c), and the constant is folded
+    into the bias of the linear layer.
+
+    Args:
+      m:
+        The ActivationDropoutAndLinear to be converted.
+      offset_folded:
+        True if the offset has been subtracted from the bias of the previous
+        module, i.e., if the input is y instead of x.
+    """
+
+    def __init__(self, m: ActivationDropoutAndLinear, offset_folded: bool = False):
+        super().__init__()
+        if m.activation == "SwooshL":
+            offset, c = 4.0, 0.035
+        else:
+            assert m.activation == "SwooshR", m.activation
+            offset, c = 1.0, 0.313261687
+        weight = m.weight.detach()
+        bias = torch.zeros_like(weight[:, 0]) if m.bias is None else m.bias.detach()
+        self.register_buffer("weight", weight.clone())
+        self.register_buffer("bias", bias - (0.08 * offset + c) * weight.sum(dim=1))
+        self.offset = 0.0 if offset_folded else offset
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # The input of ConvolutionModule.out_proj is permuted, and linear()
+        # is much slower with such inputs.
+        x = x.contiguous()
+        if self.offset != 0.0:
+            x = x - self.offset
+        x = torch.add(nn.functional.softplus(x), x, alpha=-0.08)
+        return nn.functional.linear(x, self.weight, self.bias)
+
+
+class BypassInference(nn.Module):
+    """BypassModule computed as src_orig * (1 - s) + src * (s * src_scale),
+    with both scales precomputed, where s is the bypass scale.
+
+    Args:
+      bypass:
+        The BypassModule to be converted.
+      src_scale:
+        The scale of the BiasNorm before it, if it is folded into this module.
+    """
+
+    def __init__(self, bypass: BypassModule, src_scale: float = 1.0):
+        super().__init__()
+        scale = bypass.bypass_scale.detach()
+        self.register_buffer("orig_scale", 1.0 - scale)
+        self.register_buffer("scale", scale * src_scale)
+
+    def forward(self, src_orig: torch.Tensor, src: torch.Tensor) -> torch.Tensor:
+        return torch.addcmul(src_orig * self.orig_scale, src, self.scale)
+
+
+class PositionalProjection(nn.Module):
+    """Replaces `linear_pos` of RelPositionMultiheadAttentionWeights. The
+    positional embeddings given to it are slices of the table of a
+    CompactRelPositionalEncoding, so the whole table is projected once and
+    the rows of the slice are returned. The table is projected again when
+    it is replaced. Other inputs are projected by `linear_pos`.
+
+    Args:
+      linear_pos:
+        The projection of the positional embeddings. It is applied to each
+        embedding independently.
+      encoder_pos:
+        The CompactRelPositionalEncoding whose table `pe`, of shape
+        (2 * max_len - 1, pos_dim), is a buffer, so that model.to() converts
+        it together with `projected_pe`. See precompute_positional_encodings().
+    """
+
+    def __init__(self, linear_pos: nn.Module, encoder_pos: nn.Module):
+        super().__init__()
+        self.linear_pos = linear_pos
+        # It has no parameters or persistent buffers, so sharing it with the
+        # encoder does not change the state dict.
+        self.encoder_pos = encoder_pos
+        self.register_buffer("projected_pe", None, persistent=False)
+        self.project_pe()
+
+    def project_pe(self) -> None:
+        """Project the current table of `encoder_pos`. It is called again
+        when the table is replaced, e.g., by extend_pe() for inputs longer
+        than the table, or by model.to()."""
+        pe = self.encoder_pos.pe
+        with torch.no_grad():
+            self.projected_pe = self.linear_pos(pe)
+        # A reference, not a data pointer, so that the memory of the table
+        # cannot be reused by another one.
+        self.projected_from = pe
+
+    def forward(self, pos_emb: torch.Tensor) -> torch.Tensor:
+        pe = self.encoder_pos.pe
+        if pe is not self.projected_from:
+            self.project_pe()
+        row_bytes = pe.stride(0) * pe.element_size()
+        offset = pos_emb.data_ptr() - pe.data_ptr()
+        start = offset // row_bytes
+        if (
+            pos_emb.ndim == 3
+            and pos_emb.size(0) == 1
+            and pos_emb.shape[2:] == pe.shape[1:]
+            and pos_emb.stride(1) == pe.stride(0)
+            and pos_emb.dtype == pe.dtype
+            and pos_emb.device == self.projected_pe.device
+            and offset % row_bytes == 0
+            and 0 <= start
+            and start + pos_emb.size(1) <= self.projected_pe.size(0)
+        ):
+            return self.projected_pe[start : start + pos_emb.size(1)].unsqueeze(0)
+        return self.linear_pos(pos_emb)
+
+
+class ChunkCausalDepthwiseConv1dInference(ChunkCausalDepthwiseConv1d):
+    """ChunkCausalDepthwiseConv1d that computes the scale of the chunkwise
+    convolution once for each chunk size."""
+
+    def __init__(self, conv: ChunkCausalDepthwiseConv1d):
+        super().__init__(
+            channels=conv.causal_conv.in_channels,
+            kernel_size=conv.kernel_size,
+            bias=conv.chunkwise_conv.bias is not None,
+        )
+        self.load_state_dict(conv.state_dict())
+        self.to(conv.chunkwise_conv_scale)
+        self.chunk_scales: Dict[int, torch.Tensor] = {}
+
+    def _get_chunk_scale(self, chunk_size: int):
+        scale = self.chunk_scales.get(chunk_size)
+        if scale is None:
+            with torch.no_grad():
+                scale = super()._get_chunk_scale(chunk_size)
+            self.chunk_scales[chunk_size] = scale
+        return scale
 
 
 # Copied from https://pytorch.org/docs/1.9.0/_modules/torch/nn/modules/module.html#Module.get_submodule  # noqa
@@ -58,6 +249,16 @@ def get_submodule(model, target):
     return mod
 
 
+def set_submodules(model: nn.Module, d: Dict[str, nn.Module]):
+    """Replace the submodules of `model` named by the keys of `d`."""
+    for k, v in d.items():
+        if "." in k:
+            parent, child = k.rsplit(".", maxsplit=1)
+            setattr(get_submodule(model, parent), child, v)
+        else:
+            setattr(model, k, v)
+
+
 def convert_scaled_to_non_scaled(
     model: nn.Module,
     inplace: bool = False,
@@ -95,11 +296,175 @@ def convert_scaled_to_non_scaled(
             # to replace torch.jit.trace()
             d[name] = torch.jit.script(m)
 
-    for k, v in d.items():
-        if "." in k:
-            parent, child = k.rsplit(".", maxsplit=1)
-            setattr(get_submodule(model, parent), child, v)
+    set_submodules(model, d)
+
+    return model
+
+
+def freeze_scheduled_floats(model: nn.Module):
+    """Replace every ScheduledFloat of `model` with its value at inference
+    time, i.e., its default value."""
+    for m in list(model.modules()):
+        for name, child in list(m.named_children()):
+            if isinstance(child, ScheduledFloat):
+                delattr(m, name)
+                setattr(m, name, float(child.default))
+
+
+def fold_bias_norm_and_bypass(model: nn.Module):
+    """Replace BiasNorm with BiasNormInference and BypassModule with
+    BypassInference. In Zipformer2EncoderLayer, the output of `norm` is used
+    only by `bypass`, so the scale of `norm` is folded into `bypass`.
+    """
+    d = {}
+    for name, m in model.named_modules():
+        prefix = name + "." if name else ""
+        if (
+            isinstance(m, Zipformer2EncoderLayer)
+            and isinstance(m.norm, BiasNorm)
+            and isinstance(m.bypass, BypassModule)
+        ):
+            d[prefix + "norm"] = BiasNormInference(m.norm, scale=1.0)
+            d[prefix + "bypass"] = BypassInference(
+                m.bypass, src_scale=m.norm.log_scale.exp().item()
+            )
+    for name, m in model.named_modules():
+        if name in d:
+            continue
+        if isinstance(m, BiasNorm):
+            d[name] = BiasNormInference(m)
+        elif isinstance(m, BypassModule):
+            d[name] = BypassInference(m)
+
+    set_submodules(model, d)
+
+
+def fold_activations(model: nn.Module):
+    """Replace ActivationDropoutAndLinear with ActivationAndLinearInference.
+    In FeedforwardModule and ConvolutionModule, the input of `out_proj` is an
+    affine function of the output of a module with a bias, so the offset of
+    the activation is folded into that bias.
+    """
+    d = {}
+    for name, m in model.named_modules():
+        prefix = name + "." if name else ""
+        if not isinstance(
+            getattr(m, "out_proj", None), ActivationDropoutAndLinear
+        ) or not isinstance(m, (FeedforwardModule, ConvolutionModule)):
+            continue
+        if isinstance(m, FeedforwardModule):
+            # in_proj -> hidden_balancer -> out_proj
+            prev = m.in_proj
+        elif isinstance(m.depthwise_conv, ChunkCausalDepthwiseConv1d):
+            # depthwise_conv -> balancer2 -> whiten -> out_proj, and the
+            # output of depthwise_conv is the sum of the outputs of
+            # chunkwise_conv and causal_conv.
+            prev = m.depthwise_conv.causal_conv
         else:
-            setattr(model, k, v)
+            prev = m.depthwise_conv
+        if not isinstance(prev, (nn.Linear, nn.Conv1d)) or prev.bias is None:
+            continue
+        out_proj = ActivationAndLinearInference(m.out_proj, offset_folded=True)
+        with torch.no_grad():
+            if m.out_proj.activation == "SwooshL":
+                prev.bias -= 4.0
+            else:
+                prev.bias -= 1.0
+        d[prefix + "out_proj"] = out_proj
+
+    for name, m in model.named_modules():
+        if name not in d and isinstance(m, ActivationDropoutAndLinear):
+            d[name] = ActivationAndLinearInference(m)
+
+    set_submodules(model, d)
+
+
+def precompute_positional_encodings(model: nn.Module, max_len: int = 1000):
+    """Compute the tables of the CompactRelPositionalEncoding of each
+    Zipformer2Encoder for inputs of up to `max_len` frames (including the
+    left context), and their projection by each encoder layer.
+
+    The tables also cover the chunk sizes and left contexts of the
+    Zipformer2 models in `model`.
+    """
+    for m in model.modules():
+        if isinstance(m, Zipformer2):
+            max_len = max(max_len, max(m.chunk_size) + max(m.left_context_frames))
+
+    # The tables are computed with the dtype and on the device of the model,
+    # like the inputs of CompactRelPositionalEncoding.forward().
+    p = next(model.parameters())
+    x = torch.zeros((), dtype=p.dtype, device=p.device).expand(max_len)
+
+    for m in model.modules():
+        if not isinstance(m, Zipformer2Encoder):
+            continue
+        encoder_pos = m.encoder_pos
+        assert isinstance(encoder_pos, CompactRelPositionalEncoding), type(encoder_pos)
+        encoder_pos.dropout = nn.Identity()
+        encoder_pos.extend_pe(x)
+        # Make `pe` a buffer, so that model.to() converts it
+        pe = encoder_pos.pe
+        del encoder_pos.pe
+        encoder_pos.register_buffer("pe", pe, persistent=False)
+        for layer in m.layers:
+            attn = layer.self_attn_weights
+            attn.linear_pos = PositionalProjection(attn.linear_pos, encoder_pos)
+
+
+def convert_for_inference(
+    model: nn.Module,
+    inplace: bool = False,
+    max_len: int = 1000,
+) -> nn.Module:
+    """Convert a model for inference with PyTorch, e.g., on CPU. In addition
+    to convert_scaled_to_non_scaled(), it:
+
+      - replaces ScheduledFloat with constants and Dropout2 with an identity
+        operator;
+      - precomputes the scales of BiasNorm and BypassModule, and folds the
+        scale of the last BiasNorm of each encoder layer into its bypass;
+      - computes SwooshL and SwooshR before the linear layers with 2
+        operators instead of 10, folding their constants into the biases of
+        the adjacent modules, see fold_activations();
+      - precomputes the positional encodings and their projections, see
+        precompute_positional_encodings();
+      - computes the chunk scales of ChunkCausalDepthwiseConv1d once per
+        chunk size.
+
+    The converted model gives the same outputs as the input model in eval mode,
+    up to rounding errors, with forward() and streaming_forward(). It can
+    neither be trained nor exported, and its state dict differs from the
+    one of the input model. It can be moved to another device or dtype with
+    `.to()` before or after the conversion.
+
+    Args:
+      model:
+        The model to be converted.
+      inplace:
+        If True, the input model is modified inplace.
+        If False, the input model is copied and we modify the copied version.
+      max_len:
+        See precompute_positional_encodings().
+    Return:
+      Return the converted model, in eval mode.
+    """
+    model = convert_scaled_to_non_scaled(model, inplace=inplace)
+    model.eval()
+
+    freeze_scheduled_floats(model)
+    fold_bias_norm_and_bypass(model)
+    fold_activations(model)
+    precompute_positional_encodings(model, max_len=max_len)
+
+    d = {}
+    for name, m in model.named_modules():
+        if isinstance(m, Dropout2):
+            d[name] = nn.Identity()
+        elif isinstance(m, ChunkCausalDepthwiseConv1d) and not isinstance(
+            m, ChunkCausalDepthwiseConv1dInference
+        ):
+            d[name] = ChunkCausalDepthwiseConv1dInference(m)
+    set_submodules(model, d)
 
     return model
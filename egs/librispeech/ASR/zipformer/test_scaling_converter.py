@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import torch
+from scaling_converter import PositionalProjection, convert_for_inference
+from zipformer import Zipformer2
+
+
+def get_model(causal: bool) -> Zipformer2:
+    model = Zipformer2(
+        encoder_dim=(64, 96),
+        encoder_unmasked_dim=(48, 64),
+        num_heads=(4, 4),
+        causal=causal,
+        chunk_size=(4,) if causal else (-1,),
+        left_context_frames=(64,),
+    )
+    # So that the parameters that are folded are not at their initial values
+    with torch.no_grad():
+        for name, p in model.named_parameters():
+            if name.endswith(("bias", "log_scale", "bypass_scale")):
+                p.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+@torch.no_grad()
+def test_convert_for_inference():
+    for causal in (False, True):
+        model = get_model(causal)
+        converted = convert_for_inference(model)
+
+        batch_size, seq_len = 3, 40
+        x = torch.randn(seq_len, batch_size, 64)
+        x_lens = torch.tensor([40, 30, 17])
+        src_key_padding_mask = torch.arange(seq_len) >= x_lens.unsqueeze(1)
+
+        y, y_lens = model(x, x_lens, src_key_padding_mask)
+        y2, y2_lens = converted(x, x_lens, src_key_padding_mask)
+        assert torch.equal(y_lens, y2_lens)
+        assert torch.allclose(y, y2, atol=1e-4), (y - y2).abs().max()
+
+
+@torch.no_grad()
+def test_convert_for_inference_streaming():
+    model = get_model(causal=True)
+    converted = convert_for_inference(model)
+
+    batch_size, chunk_size, left_context_len = 2, 8, 64
+    states = model.get_init_states(batch_size)
+    states2 = converted.get_init_states(batch_size)
+    for i in range(10):
+        x = torch.randn(chunk_size, batch_size, 64)
+        x_lens = torch.full((batch_size,), chunk_size)
+        src_key_padding_mask = torch.zeros(
+            batch_size, left_context_len + chunk_size, dtype=torch.bool
+        )
+        # The left context of the first chunks is padding
+        src_key_padding_mask[:, : max(0, left_context_len - i * chunk_size)] = True
+
+        y, _, states = model.streaming_forward(x, x_lens, states, src_key_padding_mask)
+        y2, _, states2 = converted.streaming_forward(
+            x, x_lens, states2, src_key_padding_mask
+        )
+        assert torch.allclose(y, y2, atol=1e-4), (y - y2).abs().max()
+
+
+@torch.no_grad()
+def test_convert_for_inference_dtype():
+    x = torch.randn(40, 2, 64, dtype=torch.float64)
+    x_lens = torch.tensor([40, 25])
+    src_key_padding_mask = torch.arange(40) >= x_lens.unsqueeze(1)
+
+    model = get_model(causal=False).double()
+    y, _ = model(x, x_lens, src_key_padding_mask)
+
+    # Converted in float64, or converted first and then cast
+    for converted in (
+        convert_for_inference(model),
+        convert_for_inference(model.float()).double(),
+    ):
+        num_projections = 0
+
+        def count(*args):
+            nonlocal num_projections
+            num_projections += 1
+
+        y2, _ = converted(x, x_lens, src_key_padding_mask)
+        assert y2.dtype == torch.float64
+        assert torch.allclose(y, y2, atol=1e-4), (y - y2).abs().max()
+
+        # The tables replaced by model.to() are projected again once, and
+        # then the projected tables are used instead of linear_pos
+        for m in converted.modules():
+            if isinstance(m, PositionalProjection):
+                m.linear_pos.register_forward_hook(count)
+
+        y2, _ = converted(x, x_lens, src_key_padding_mask)
+        assert torch.allclose(y, y2, atol=1e-4), (y - y2).abs().max()
+        assert num_projections == 0, num_projections
+
+
+@torch.no_grad()
+def test_convert_for_inference_long_input():
+    model = get_model(causal=False)
+    converted = convert_for_inference(model)
+
+    # The first input is longer than the tables for 1000 frames of the
+    # encoders with a frame rate of 1/2, so they are extended
+    for seq_len in (2200, 40):
+        x = torch.randn(seq_len, 2, 64)
+        x_lens = torch.tensor([seq_len, seq_len // 2])
+        src_key_padding_mask = torch.arange(seq_len) >= x_lens.unsqueeze(1)
+
+        y, _ = model(x, x_lens, src_key_padding_mask)
+        y2, _ = converted(x, x_lens, src_key_padding_mask)
+        assert torch.allclose(y, y2, atol=1e-4), (y - y2).abs().max()
+
+
+def main():
+    test_convert_for_inference()
+    test_convert_for_inference_streaming()
+    test_convert_for_inference_dtype()
+    test_convert_for_inference_long_input()
+
+
+if __name__ == "__main__":
+    torch.manual_seed(20250101)
+    main()
@@ -70,6 +70,7 @@ from asr_datamodule import LibriSpeechAsrDataModule
 from attention_decoder import AttentionDecoderModel
 from decoder import Decoder
 from joiner import Joiner
+from lhotse import CutSet
 from lhotse.cut import Cut
 from lhotse.dataset import SpecAugment
 from lhotse.dataset.sampling.base import CutSampler
@@ -91,6 +92,8 @@ from icefall.checkpoint import (
     save_checkpoint_with_global_batch_idx,
     update_averaged_model,
 )
+from icefall.dataset.shar import is_iterable_dataloader
+from icefall.dataset.spec_augment import BatchedSpecAugment
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
 from icefall.err import raise_grad_scale_is_too_small_error
@@ -491,6 +494,43 @@ def get_parser():
         help="Accumulate stats on activations, print them and exit.",
     )
 
+    parser.add_argument(
+        "--continuous-diagnostics",
+        type=str2bool,
+        default=False,
+        help="""Accumulate cheap stats on the activations and gradients of a
+        subset of modules in a fraction of the batches during the whole
+        training, and write them to tensorboard every
+        --diagnostics-flush-interval batches. To print the full diagnostics
+        of --print-diagnostics for a few batches during training, create
+        the file exp-dir/full-diagnostics.
+        """,
+    )
+
+    parser.add_argument(
+        "--diagnostics-sample-prob",
+        type=float,
+        default=0.02,
+        help="Used only when --continuous-diagnostics is True. "
+        "The fraction of batches that are analyzed.",
+    )
+
+    parser.add_argument(
+        "--diagnostics-module-fraction",
+        type=float,
+        default=0.25,
+        help="Used only when --continuous-diagnostics is True. "
+        "The fraction of modules that are analyzed.",
+    )
+
+    parser.add_argument(
+        "--diagnostics-flush-interval",
+        type=int,
+        default=1000,
+        help="Used only when --continuous-diagnostics is True. "
+        "Write the diagnostics every this number of batches.",
+    )
+
     parser.add_argument(
         "--inf-check",
         type=str2bool,
@@ -549,6 +589,44 @@ def get_parser():
         help="Whether to use bf16 in AMP.",
     )
 
+    parser.add_argument(
+        "--auto-tune-max-duration",
+        type=str2bool,
+        default=False,
+        help="""If True, run a few forward/backward probes on synthetic batches
+        before training to find the largest --max-duration that fits into
+        memory. The value given by --max-duration is ignored.
+        See icefall/max_duration_tuner.py
+        """,
+    )
+
+    parser.add_argument(
+        "--auto-tune-memory-budget",
+        type=float,
+        default=0.0,
+        help="""Memory budget in GB used by --auto-tune-max-duration.
+        If 0, use the total memory of the GPU, or the available RAM for CPU.
+        """,
+    )
+
+    parser.add_argument(
+        "--auto-tune-safety-margin",
+        type=float,
+        default=0.1,
+        help="Fraction of the memory budget that --auto-tune-max-duration "
+        "keeps free.",
+    )
+
+    parser.add_argument(
+        "--auto-tune-per-bucket",
+        type=str2bool,
+        default=False,
+        help="""Used only when --auto-tune-max-duration is True. If True, also
+        tune --quadratic-duration so that buckets with shorter cuts
+        use larger batches.
+        """,
+    )
+
     add_model_arguments(parser)
 
     return parser
@@ -745,7 +823,9 @@ def get_spec_augment(params: AttributeDict) -> SpecAugment:
         f"num_frame_masks: {num_frame_masks}, "
         f"max_frames_mask_fraction: {max_frames_mask_fraction}"
     )
-    spec_augment = SpecAugment(
+    # Masks all sequences of a batch at once, which matters for cr-ctc,
+    # where the batch is augmented twice
+    spec_augment = BatchedSpecAugment(
         time_warp_factor=0,  # Do time warping in model.py
         num_frame_masks=num_frame_masks,  # default: 10
         features_mask_size=27,
@@ -822,6 +902,16 @@ def load_checkpoint_if_available(
     return saved_params
 
 
+def get_train_sampler(train_dl: torch.utils.data.DataLoader) -> Optional[CutSampler]:
+    """Return the sampler of the training dataloader, whose state is saved
+    in checkpoints. Return None with --shar-dir, in which case the sampler
+    lives in the dataloader workers and its state cannot be saved.
+    """
+    if is_iterable_dataloader(train_dl):
+        return None
+    return train_dl.sampler
+
+
 def save_checkpoint(
     params: AttributeDict,
     model: Union[nn.Module, DDP],
@@ -1040,6 +1130,7 @@ def train_one_epoch(
     tb_writer: Optional[SummaryWriter] = None,
     world_size: int = 1,
     rank: int = 0,
+    continuous_diagnostic: Optional[diagnostics.ContinuousDiagnostic] = None,
 ) -> None:
     """Train the model for one epoch.
 
@@ -1073,6 +1164,8 @@ def train_one_epoch(
       rank:
         The rank of the node in DDP training. If no DDP is used, it should
         be set to 0.
+      continuous_diagnostic:
+        If not None, it is used with --continuous-diagnostics.
     """
     model.train()
 
@@ -1088,7 +1181,7 @@ def train_one_epoch(
             params=params,
             optimizer=optimizer,
             scheduler=scheduler,
-            sampler=train_dl.sampler,
+            sampler=get_train_sampler(train_dl),
             scaler=scaler,
             rank=0,
         )
@@ -1100,6 +1193,11 @@ def train_one_epoch(
         params.batch_idx_train += 1
         batch_size = len(batch["supervisions"]["text"])
 
+        if continuous_diagnostic is not None:
+            continuous_diagnostic.start_batch(
+                grad_scale=scaler._scale if params.use_autocast else None
+            )
+
         try:
             with torch.cuda.amp.autocast(
                 enabled=params.use_autocast, dtype=params.dtype
@@ -1118,6 +1216,8 @@ def train_one_epoch(
             # NOTE: We use reduction==sum and loss is computed over utterances
             # in the batch and there is no normalization to it so far.
             scaler.scale(loss).backward()
+            if continuous_diagnostic is not None:
+                continuous_diagnostic.end_batch()
             scheduler.step_batch(params.batch_idx_train)
 
             scaler.step(optimizer)
@@ -1132,6 +1232,16 @@ def train_one_epoch(
         if params.print_diagnostics and batch_idx == 5:
             return
 
+        if (
+            continuous_diagnostic is not None
+            and params.batch_idx_train % params.diagnostics_flush_interval == 0
+        ):
+            continuous_diagnostic.flush(tb_writer, params.batch_idx_train)
+            request_file = params.exp_dir / "full-diagnostics"
+            if rank == 0 and request_file.is_file():
+                request_file.unlink()
+                continuous_diagnostic.request_full_diagnostics()
+
         if (
             rank == 0
             and params.batch_idx_train > 0
@@ -1155,7 +1265,7 @@ def train_one_epoch(
                 params=params,
                 optimizer=optimizer,
                 scheduler=scheduler,
-                sampler=train_dl.sampler,
+                sampler=get_train_sampler(train_dl),
                 scaler=scaler,
                 rank=rank,
             )
@@ -1238,6 +1348,22 @@ def train_one_epoch(
                     tb_writer, "train/valid_", params.batch_idx_train
                 )
 
+            # Only available with --max-cost
+            cost_stats = getattr(train_dl.sampler, "cost_stats", None)
+            if cost_stats is not None:
+                logging.info(f"Batch cost statistics: {cost_stats}")
+                if tb_writer is not None:
+                    mean, std, max_cost = cost_stats.summary()
+                    tb_writer.add_scalar(
+                        "train/batch_cost_mean", mean, params.batch_idx_train
+                    )
+                    tb_writer.add_scalar(
+                        "train/batch_cost_std", std, params.batch_idx_train
+                    )
+                    tb_writer.add_scalar(
+                        "train/batch_cost_max", max_cost, params.batch_idx_train
+                    )
+
     loss_value = tot_loss["loss"] / tot_loss["frames"]
     params.train_loss = loss_value
     if params.train_loss < params.best_train_loss:
@@ -1366,12 +1492,24 @@ def run(rank, world_size, args):
         )  # allow 4 megabytes per sub-module
         diagnostic = diagnostics.attach_diagnostics(model, opts)
 
+    continuous_diagnostic = None
+    if params.continuous_diagnostics and not params.print_diagnostics:
+        opts = diagnostics.ContinuousDiagnosticOptions(
+            sample_prob=params.diagnostics_sample_prob,
+            module_fraction=params.diagnostics_module_fraction,
+            seed=params.seed + rank,
+        )
+        continuous_diagnostic = diagnostics.attach_continuous_diagnostics(model, opts)
+
     if params.inf_check:
         register_inf_check_hooks(model)
 
     librispeech = LibriSpeechAsrDataModule(args)
 
-    if params.full_libri:
+    if params.shar_dir is not None:
+        # See ./local/export_shar.py
+        train_cuts = librispeech.train_shar_cuts()
+    elif params.full_libri:
         train_cuts = librispeech.train_all_shuf_cuts()
 
         # previously we used the following code to load all training cuts,
@@ -1435,11 +1573,31 @@ def run(rank, world_size, args):
         train_cuts, sampler_state_dict=sampler_state_dict
     )
 
+    if params.auto_tune_max_duration:
+        if sampler_state_dict is not None:
+            logging.info(
+                "Skip --auto-tune-max-duration since the sampler state "
+                "is restored from a checkpoint"
+            )
+        else:
+            auto_tune_max_duration(
+                model=model,
+                train_dl=train_dl,
+                train_cuts=train_cuts,
+                sp=sp,
+                params=params,
+                spec_augment=spec_augment,
+                world_size=world_size,
+            )
+            args.max_duration = params.max_duration
+            args.quadratic_duration = params.quadratic_duration
+            train_dl = librispeech.train_dataloaders(train_cuts)
+
     valid_cuts = librispeech.dev_clean_cuts()
     valid_cuts += librispeech.dev_other_cuts()
     valid_dl = librispeech.valid_dataloaders(valid_cuts)
 
-    if not params.print_diagnostics:
+    if not params.print_diagnostics and not is_iterable_dataloader(train_dl):
         scan_pessimistic_batches_for_oom(
             model=model,
             train_dl=train_dl,
@@ -1457,7 +1615,11 @@ def run(rank, world_size, args):
     for epoch in range(params.start_epoch, params.num_epochs + 1):
         scheduler.step_epoch(epoch - 1)
         fix_random_seed(params.seed + epoch - 1)
-        train_dl.sampler.set_epoch(epoch - 1)
+        if is_iterable_dataloader(train_dl):
+            # It also reshuffles the shards with --shar-dir
+            train_dl.dataset.set_epoch(epoch - 1)
+        else:
+            train_dl.sampler.set_epoch(epoch - 1)
 
         if tb_writer is not None:
             tb_writer.add_scalar("train/epoch", epoch, params.batch_idx_train)
@@ -1478,6 +1640,7 @@ def run(rank, world_size, args):
             tb_writer=tb_writer,
             world_size=world_size,
             rank=rank,
+            continuous_diagnostic=continuous_diagnostic,
         )
 
         if params.print_diagnostics:
@@ -1490,7 +1653,7 @@ def run(rank, world_size, args):
             model_avg=model_avg,
             optimizer=optimizer,
             scheduler=scheduler,
-            sampler=train_dl.sampler,
+            sampler=get_train_sampler(train_dl),
             scaler=scaler,
             rank=rank,
         )
@@ -1580,6 +1743,107 @@ def scan_pessimistic_batches_for_oom(
         )
 
 
+def auto_tune_max_duration(
+    model: Union[nn.Module, DDP],
+    train_dl: torch.utils.data.DataLoader,
+    train_cuts: CutSet,
+    sp: spm.SentencePieceProcessor,
+    params: AttributeDict,
+    spec_augment: Optional[SpecAugment] = None,
+    world_size: int = 1,
+    max_cut_duration: float = 20.0,
+) -> None:
+    """Find the largest max_duration that fits into memory and save it
+    to `params.max_duration` (and `params.quadratic_duration`).
+
+    Args:
+      max_cut_duration:
+        Duration of the longest training cut. It has to match the
+        filter in :func:`run`.
+    """
+    from icefall.max_duration_tuner import (
+        get_bucket_durations,
+        make_synthetic_asr_batch,
+        select_max_duration,
+        tune_max_duration,
+    )
+
+    # Probe the underlying module so that ranks that run out of memory
+    # at different probes do not get stuck in a gradient all-reduce.
+    if isinstance(model, DDP):
+        model = model.module
+    device = next(model.parameters()).device
+
+    num_tokens = 0
+    duration = 0.0
+    for c in train_cuts.subset(first=1000):
+        num_tokens += len(sp.encode(c.supervisions[0].text))
+        duration += c.duration
+    tokens_per_second = num_tokens / max(duration, 1.0)
+
+    def make_batch(batch_size: int, num_frames: int, num_tokens: int) -> dict:
+        # ids 0, 1 and 2 are <blk>, <sos/eos> and <unk>
+        texts = [
+            sp.decode(torch.randint(3, params.vocab_size, (num_tokens,)).tolist())
+            for _ in range(batch_size)
+        ]
+        return make_synthetic_asr_batch(
+            batch_size=batch_size,
+            num_frames=num_frames,
+            texts=texts,
+            feature_dim=params.feature_dim,
+        )
+
+    def step_fn(batch: dict) -> None:
+        with torch.cuda.amp.autocast(enabled=params.use_autocast, dtype=params.dtype):
+            loss, _ = compute_loss(
+                params=params,
+                model=model,
+                sp=sp,
+                batch=batch,
+                is_training=True,
+                spec_augment=spec_augment,
+            )
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    logging.info("Auto-tuning max_duration")
+    result = tune_max_duration(
+        step_fn=step_fn,
+        make_batch=make_batch,
+        bucket_durations=get_bucket_durations(
+            getattr(train_dl.dataset, "sampler", train_dl.sampler), max_cut_duration
+        ),
+        device=device,
+        memory_budget=int(params.auto_tune_memory_budget * 1e9) or None,
+        safety_margin=params.auto_tune_safety_margin,
+        tokens_per_second=tokens_per_second,
+        per_bucket=params.auto_tune_per_bucket,
+    )
+    logging.info(f"Auto-tuning result:\n{result}")
+
+    max_duration = result.max_duration
+    quadratic_duration = result.quadratic_duration
+    if world_size > 1:
+        # All ranks must use the same settings, and max_duration and
+        # quadratic_duration are fitted together. So fit them again, on all
+        # ranks, to the smallest safe max_duration of each bucket over the
+        # ranks, with the longest upper bound of each bucket.
+        d = torch.tensor(result.bucket_durations, device=device)
+        torch.distributed.all_reduce(d, op=torch.distributed.ReduceOp.MAX)
+        m = torch.tensor(result.bucket_max_durations, device=device)
+        torch.distributed.all_reduce(m, op=torch.distributed.ReduceOp.MIN)
+        max_duration, quadratic_duration = select_max_duration(
+            d.tolist(), m.tolist(), per_bucket=params.auto_tune_per_bucket
+        )
+
+    logging.info(
+        f"Using max_duration={max_duration}, quadratic_duration={quadratic_duration}"
+    )
+    params.max_duration = max_duration
+    params.quadratic_duration = quadratic_duration
+
+
 def main():
     parser = get_parser()
     LibriSpeechAsrDataModule.add_arguments(parser)
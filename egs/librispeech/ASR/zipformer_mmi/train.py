@@ -80,6 +80,7 @@ from icefall.checkpoint import (
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
 from icefall.err import raise_grad_scale_is_too_small_error
+from icefall.graph_cache import TrainingGraphCache
 from icefall.hooks import register_inf_check_hooks
 from icefall.lexicon import Lexicon, UniqLexicon
 from icefall.mmi import LFMMILoss
@@ -264,6 +265,24 @@ def get_parser():
         help="The seed for random generators intended for reproducibility",
     )
 
+    parser.add_argument(
+        "--graph-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the training graphs of this number of
+        utterances in memory, so they are not compiled again in later
+        epochs. See icefall/graph_cache.py""",
+    )
+
+    parser.add_argument(
+        "--graph-cache-dir",
+        type=str,
+        default=None,
+        help="""If not None and --graph-cache-size is positive, also save
+        the training graphs to this directory. Use a different directory
+        for each lang dir""",
+    )
+
     parser.add_argument(
         "--use-pruned-intersect",
         type=str2bool,
@@ -830,6 +849,11 @@ def train_one_epoch(
                 f"lr: {cur_lr:.2e}, "
                 + (f"grad_scale: {scaler._scale.item()}" if params.use_fp16 else "")
             )
+            if mmi_graph_compiler.cache is not None:
+                logging.info(
+                    f"Graph cache: ctc: {ctc_graph_compiler.cache}, "
+                    f"mmi: {mmi_graph_compiler.cache}"
+                )
 
             if tb_writer is not None:
                 tb_writer.add_scalar(
@@ -928,6 +952,16 @@ def run(rank, world_size, args):
         sos_id=1,
         eos_id=1,
     )
+    if params.graph_cache_size > 0:
+        cache_dir = params.graph_cache_dir
+        for name, graph_compiler in [
+            ("ctc", ctc_graph_compiler),
+            ("mmi", mmi_graph_compiler),
+        ]:
+            graph_compiler.cache = TrainingGraphCache(
+                max_size=params.graph_cache_size,
+                cache_dir=Path(cache_dir) / name if cache_dir else None,
+            )
 
     logging.info(params)
 
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script compresses audio to an ECDC file, or decompresses an ECDC file
+to audio, chunk by chunk, so that the memory does not depend on the length
+of the audio and the bitstream can be sent as it is produced.
+
+The file has the ECDC header of binary.py, followed by packets, one per
+chunk of codes. Each packet starts with its number of frames and its number
+of bytes. The codes of a packet are coded either with a fixed number of bits
+per code, or with the arithmetic coder of quantization/ac.py and an adaptive
+model of the frequencies of the codes of each quantizer, which is updated
+identically by the encoder and the decoder. A packet with 0 frames ends the
+stream and contains the number of samples of the audio.
+
+Usage:
+
+    ./encodec/compress.py \
+        --epoch 300 \
+        --exp-dir ./encodec/exp \
+        --target-bw 6 \
+        input.wav output.ecdc
+
+    ./encodec/compress.py \
+        --epoch 300 \
+        --exp-dir ./encodec/exp \
+        output.ecdc decoded.wav
+"""
+
+import argparse
+import io
+import logging
+import math
+import struct
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Optional, Tuple
+
+import soundfile as sf
+import torch
+import torchaudio
+from binary import (
+    BitPacker,
+    BitUnpacker,
+    _read_exactly,
+    read_ecdc_header,
+    write_ecdc_header,
+)
+from quantization.ac import (
+    ArithmeticCoder,
+    ArithmeticDecoder,
+    build_stable_quantized_cdf,
+)
+from torch import nn
+from train import get_model, get_params
+
+from icefall.checkpoint import load_checkpoint
+from icefall.utils import str2bool
+
+# Number of frames and number of bytes of a packet
+_packet_header_struct = struct.Struct("!II")
+_audio_length_struct = struct.Struct("!Q")
+
+
+class AdaptiveCodeModel:
+    """Probabilities of the codes of each quantizer, estimated from the counts
+    of the codes seen so far. The counts are halved when their sum reaches
+    `max_total`, so that the model adapts to recent statistics.
+
+    Args:
+      n_q:
+        Number of quantizers.
+      bins:
+        Codebook size.
+      total_range_bits:
+        See :class:`quantization.ac.ArithmeticCoder`.
+      max_total:
+        Maximum sum of the counts of a quantizer.
+    """
+
+    def __init__(
+        self,
+        n_q: int,
+        bins: int,
+        total_range_bits: int = 24,
+        max_total: int = 2**16,
+    ):
+        self.counts = torch.ones(n_q, bins, dtype=torch.int64)
+        self.total_range_bits = total_range_bits
+        self.max_total = max_total
+
+    def quantized_cdfs(self) -> torch.Tensor:
+        """Return the quantized CDFs of all the quantizers, of shape
+        (n_q, bins)."""
+        pdf = self.counts.double() / self.counts.sum(dim=1, keepdim=True)
+        return build_stable_quantized_cdf(
+            pdf, self.total_range_bits, roundoff=1e-8, check=False
+        )
+
+    def update(self, codes: torch.Tensor):
+        """Update the counts with the codes of one frame, of shape (n_q,)."""
+        self.counts[torch.arange(self.counts.shape[0]), codes] += 1
+        full = self.counts.sum(dim=1) >= self.max_total
+        if full.any():
+            self.counts[full] = (self.counts[full] + 1) // 2
+
+
+def encode_codes(
+    codes: torch.Tensor, bins: int, model: Optional[AdaptiveCodeModel]
+) -> bytes:
+    """Encode the codes of one chunk, of shape (n_q, T_frames), frame by
+    frame. Use arithmetic coding with `model` if it is not None."""
+    buf = io.BytesIO()
+    if model is not None:
+        coder = ArithmeticCoder(buf, model.total_range_bits)
+        # The codes of a frame are coded with CDFs that depend only on
+        # the previous frames, so they can be pushed at once.
+        for frame in codes.t():
+            coder.push_batch(frame, model.quantized_cdfs())
+            model.update(frame)
+        coder.flush()
+    else:
+        packer = BitPacker(math.ceil(math.log2(bins)), buf)
+        for code in codes.t().reshape(-1).tolist():
+            packer.push(code)
+        packer.flush()
+    return buf.getvalue()
+
+
+def decode_codes(
+    payload: bytes,
+    num_frames: int,
+    n_q: int,
+    bins: int,
+    model: Optional[AdaptiveCodeModel],
+) -> torch.Tensor:
+    """Decode codes encoded by :func:`encode_codes`. Return a tensor of shape
+    (n_q, num_frames)."""
+    buf = io.BytesIO(payload)
+    codes = []
+    if model is not None:
+        decoder = ArithmeticDecoder(buf, model.total_range_bits)
+        for _ in range(num_frames):
+            frame = decoder.pull_batch(model.quantized_cdfs())
+            if frame is None:
+                raise EOFError("The packet is truncated.")
+            model.update(torch.tensor(frame))
+            codes.extend(frame)
+    else:
+        unpacker = BitUnpacker(math.ceil(math.log2(bins)), buf)
+        for _ in range(num_frames * n_q):
+            code = unpacker.pull()
+            if code is None:
+                raise EOFError("The packet is truncated.")
+            codes.append(code)
+    return torch.tensor(codes).view(num_frames, n_q).t()
+
+
+def write_packet(fo: IO[bytes], num_frames: int, payload: bytes):
+    fo.write(_packet_header_struct.pack(num_frames, len(payload)))
+    fo.write(payload)
+    fo.flush()
+
+
+def read_packet(fo: IO[bytes]) -> Tuple[int, bytes]:
+    """Return the number of frames and the payload of the next packet."""
+    num_frames, num_bytes = _packet_header_struct.unpack(
+        _read_exactly(fo, _packet_header_struct.size)
+    )
+    return num_frames, _read_exactly(fo, num_bytes)
+
+
+def compress_stream(
+    model: nn.Module,
+    chunks: Iterable[torch.Tensor],
+    fo: IO[bytes],
+    target_bw: Optional[float] = None,
+    use_ac: bool = True,
+):
+    """Compress audio chunk by chunk and write it to `fo`.
+
+    Args:
+      model:
+        The Encodec model.
+      chunks:
+        Consecutive chunks of the audio, each of shape (1, T_chunk).
+      fo:
+        The file to write to. A packet is written for each chunk as soon as
+        its codes are computed.
+      target_bw:
+        Target bandwidth. Defaults to the largest one of the model.
+      use_ac:
+        Whether to use arithmetic coding.
+    """
+    if target_bw is None:
+        target_bw = model.target_bandwidths[-1]
+    n_q = model.quantizer.get_num_quantizers_for_bandwidth(model.frame_rate, target_bw)
+    bins = model.quantizer.bins
+    write_ecdc_header(
+        fo,
+        {
+            "m": "encodec",
+            "sr": model.sampling_rate,
+            "nc": n_q,
+            "bins": bins,
+            "ac": use_ac,
+        },
+    )
+    code_model = AdaptiveCodeModel(n_q, bins) if use_ac else None
+
+    length = 0
+
+    def count(chunks):
+        nonlocal length
+        for x in chunks:
+            assert x.ndim == 2 and x.shape[0] == 1, x.shape
+            length += x.shape[-1]
+            yield x.unsqueeze(0)
+
+    for codes in model.encode_streaming(count(chunks), target_bw):
+        codes = codes[:, 0].cpu()
+        write_packet(fo, codes.shape[1], encode_codes(codes, bins, code_model))
+
+    write_packet(fo, 0, _audio_length_struct.pack(length))
+
+
+def decompress_stream(model: nn.Module, fo: IO[bytes]) -> Iterator[torch.Tensor]:
+    """Read audio compressed by :func:`compress_stream` from `fo`, packet by
+    packet, and yield it chunk by chunk, each of shape (1, T_chunk)."""
+    metadata = read_ecdc_header(fo)
+    assert metadata["m"] == "encodec", metadata
+    assert metadata["sr"] == model.sampling_rate, (metadata, model.sampling_rate)
+    n_q = metadata["nc"]
+    bins = metadata["bins"]
+    code_model = AdaptiveCodeModel(n_q, bins) if metadata["ac"] else None
+    device = next(model.parameters()).device
+
+    length = None
+
+    def read_codes():
+        nonlocal length
+        while True:
+            num_frames, payload = read_packet(fo)
+            if num_frames == 0:
+                (length,) = _audio_length_struct.unpack(payload)
+                return
+            codes = decode_codes(payload, num_frames, n_q, bins, code_model)
+            yield codes.unsqueeze(1).to(device)
+
+    # The audio is padded to a whole number of frames, and its length is at
+    # the end of the stream, so the last frame of audio is held back.
+    hop_length = int(model.hop_length)
+    num_samples = 0
+    pending = None
+    for x in model.decode_streaming(read_codes()):
+        x = x[0] if pending is None else torch.cat([pending, x[0]], dim=-1)
+        if x.shape[-1] > hop_length:
+            num_samples += x.shape[-1] - hop_length
+            yield x[:, :-hop_length]
+        pending = x[:, -hop_length:]
+
+    assert num_samples <= length, (num_samples, length)
+    if length > num_samples:
+        yield pending[:, : length - num_samples]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--epoch",
+        type=int,
+        default=1000,
+        help="""It specifies the checkpoint to use.
+        Note: Epoch counts from 1.
+        """,
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=str,
+        default="encodec/exp",
+        help="The experiment dir",
+    )
+
+    parser.add_argument(
+        "--target-bw",
+        type=float,
+        default=6,
+        help="The target bandwidth for compression",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=float,
+        default=1.0,
+        help="Duration in seconds of the chunks of audio read at a time.",
+    )
+
+    parser.add_argument(
+        "--use-ac",
+        type=str2bool,
+        default=True,
+        help="Whether to use arithmetic coding, or codes of a fixed length.",
+    )
+
+    parser.add_argument(
+        "input",
+        type=Path,
+        help="Input audio file, or .ecdc file to decompress.",
+    )
+
+    parser.add_argument(
+        "output",
+        type=Path,
+        help="Output .ecdc file, or audio file if the input is a .ecdc file.",
+    )
+
+    return parser
+
+
+@torch.no_grad()
+def main():
+    args = get_parser().parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+
+    model = get_model(params)
+    load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+    model.eval()
+
+    chunk_size = int(args.chunk_size * model.sampling_rate)
+    if args.input.suffix == ".ecdc":
+        with open(args.input, "rb") as fi, sf.SoundFile(
+            args.output, "w", samplerate=model.sampling_rate, channels=1
+        ) as fo:
+            for x in decompress_stream(model, fi):
+                fo.write(x[0].numpy())
+    else:
+        info = torchaudio.info(str(args.input))
+        assert info.sample_rate == model.sampling_rate, (
+            f"The sampling rate of {args.input} is {info.sample_rate}, "
+            f"please resample it to {model.sampling_rate}"
+        )
+
+        def read_chunks():
+            for offset in range(0, info.num_frames, chunk_size):
+                x, _ = torchaudio.load(
+                    str(args.input), frame_offset=offset, num_frames=chunk_size
+                )
+                yield x[:1]
+
+        with open(args.output, "wb") as fo:
+            compress_stream(
+                model, read_chunks(), fo, args.target_bw, use_ac=args.use_ac
+            )
+    logging.info(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
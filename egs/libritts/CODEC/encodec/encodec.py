@@ -17,7 +17,7 @@
 
 import math
 import random
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
 
 import numpy as np
 import torch
@@ -357,3 +357,60 @@ class Encodec(nn.Module):
         codes = self.encode(x, target_bw, st)
         x_hat = self.decode(codes)
         return codes, x_hat
+
+    def encode_streaming(
+        self,
+        chunks: Iterable[torch.Tensor],
+        target_bw: Optional[float] = None,
+        st: Optional[int] = None,
+    ) -> Iterator[torch.Tensor]:
+        """Encode audio chunk by chunk, with the same result as :meth:`encode`
+        on the whole audio, up to rounding errors.
+
+        Args:
+            chunks (Iterable[Tensor]): Consecutive chunks of the audio, each
+                of shape (B, 1, T_chunk), of any length.
+            target_bw (Optional[float]): Target bandwidth.
+            st (Optional[int]): Index of the first quantizer to use.
+
+        Returns:
+            Yield codes of shape (n_q, B, T_frames) as soon as the encoder
+            has enough input to compute them. The encoder of a non-causal
+            model has a look-ahead of a few frames.
+        """
+        bw = self.target_bandwidths[-1] if target_bw is None else target_bw
+        st = st or 0
+        with self.encoder.streaming():
+            for x in chunks:
+                e = self.encoder(x)
+                if e.shape[-1] > 0:
+                    yield self.quantizer.encode(e, self.frame_rate, bw, st)
+            e = self.encoder.flush()
+            if e.shape[-1] > 0:
+                yield self.quantizer.encode(e, self.frame_rate, bw, st)
+
+    def decode_streaming(self, codes: Iterable[torch.Tensor]) -> Iterator[torch.Tensor]:
+        """Decode codes chunk by chunk, with the same result as :meth:`decode`
+        on all the codes, up to rounding errors.
+
+        Args:
+            codes (Iterable[Tensor]): Consecutive chunks of codes, each of
+                shape (n_q, B, T_frames).
+
+        Returns:
+            Yield chunks of audio of shape (B, 1, T_chunk).
+        """
+        with self.decoder.streaming():
+            for c in codes:
+                x_hat = self.decoder(self.quantizer.decode(c))
+                if x_hat.shape[-1] > 0:
+                    yield x_hat
+            yield self.decoder.flush()
+
+    def inference_streaming(self, x, chunk_size: int, target_bw=None, st=None):
+        """Same as :meth:`inference`, but the audio is encoded and decoded in
+        chunks of `chunk_size` samples."""
+        chunks = x.unsqueeze(1).split(chunk_size, dim=-1)
+        codes = list(self.encode_streaming(chunks, target_bw, st))
+        x_hat = torch.cat(list(self.decode_streaming(codes)), dim=-1)
+        return torch.cat(codes, dim=-1), x_hat
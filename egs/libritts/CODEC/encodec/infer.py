@@ -23,6 +23,15 @@ Usage:
     --epoch 300 \
     --exp-dir ./codec/exp \
     --max-duration 500
+
+To encode and decode in chunks of 0.1 s as in streaming, which gives the
+same results:
+
+./codec/infer.py \
+    --epoch 300 \
+    --exp-dir ./codec/exp \
+    --max-duration 500 \
+    --chunk-size 2400
 """
 
 
@@ -75,6 +84,14 @@ def get_parser():
         help="The target bandwidth for the generator",
     )
 
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="""If positive, encode and decode the audio chunk by chunk, with
+        chunks of this number of samples, as in streaming.""",
+    )
+
     return parser
 
 
@@ -187,9 +204,16 @@ def infer_dataset(
             audio_lens = batch["audio_lens"].tolist()
             cut_ids = [cut.id for cut in batch["cut"]]
 
-            codes, audio_hats = model.inference(
-                audios.to(device), target_bw=params.target_bw
-            )
+            if params.chunk_size > 0:
+                codes, audio_hats = model.inference_streaming(
+                    audios.to(device),
+                    chunk_size=params.chunk_size,
+                    target_bw=params.target_bw,
+                )
+            else:
+                codes, audio_hats = model.inference(
+                    audios.to(device), target_bw=params.target_bw
+                )
             audio_hats = audio_hats.squeeze(1).cpu()
 
             for cut_id, audio, audio_hat, audio_len in zip(
@@ -17,4 +17,5 @@ from .conv import (
 )
 from .lstm import SLSTM
 from .seanet import SEANetDecoder, SEANetEncoder
+from .streaming import StreamingModule, flush_module
 from .transformer import StreamingTransformerEncoder
@@ -6,13 +6,15 @@
 """Convolutional layers wrappers and utilities."""
 import logging
 import math
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
+import torch
 from torch import Tensor, nn
 from torch.nn import functional as F
 from torch.nn.utils import spectral_norm, weight_norm
 
 from .norm import ConvLayerNorm
+from .streaming import StreamingModule
 
 CONV_NORMALIZATIONS = frozenset(
     [
@@ -61,7 +63,12 @@ def get_extra_padding_for_conv1d(
     x: Tensor, kernel_size: int, stride: int, padding_total: int = 0
 ) -> int:
     """See `pad_for_conv1d`."""
-    length = x.shape[-1]
+    return _get_extra_padding(x.shape[-1], kernel_size, stride, padding_total)
+
+
+def _get_extra_padding(
+    length: int, kernel_size: int, stride: int, padding_total: int = 0
+) -> int:
     n_frames = (length - kernel_size + padding_total) / stride + 1
     ideal_length = (math.ceil(n_frames) - 1) * stride + (kernel_size - padding_total)
     return ideal_length - length
@@ -213,9 +220,14 @@ class NormConvTranspose2d(nn.Module):
         return x
 
 
-class SConv1d(nn.Module):
+class SConv1d(StreamingModule):
     """Conv1d with some builtin handling of asymmetric or causal padding
     and normalization.
+
+    In streaming mode (see :class:`StreamingModule`), the input frames that
+    are not yet fully used are cached, and the padding on the right is only
+    added by `flush()`, so the output is the same as without streaming. The
+    look-ahead is the right padding, which is 0 for causal convolutions.
     """
 
     def __init__(
@@ -254,7 +266,20 @@ class SConv1d(nn.Module):
         self.causal = causal
         self.pad_mode = pad_mode
 
+    def _get_paddings(self) -> Tuple[int, int]:
+        kernel_size = self.conv.conv.kernel_size[0]
+        stride = self.conv.conv.stride[0]
+        dilation = self.conv.conv.dilation[0]
+        padding_total = (kernel_size - 1) * dilation - (stride - 1)
+        if self.causal:
+            return padding_total, 0
+        # Asymmetric padding required for odd strides
+        padding_right = padding_total // 2
+        return padding_total - padding_right, padding_right
+
     def forward(self, x):
+        if self._is_streaming:
+            return self._forward_streaming(x)
         B, C, T = x.shape
         kernel_size = self.conv.conv.kernel_size[0]
         stride = self.conv.conv.stride[0]
@@ -275,10 +300,88 @@ class SConv1d(nn.Module):
             )
         return self.conv(x)
 
+    def _conv_frames(self, x: Tensor) -> Tensor:
+        """Apply the convolution to all the complete windows of the padded
+        input `x`, and keep the input of the next windows in the state."""
+        state = self._streaming_state
+        kernel_size = self.conv.conv.kernel_size[0]
+        stride = self.conv.conv.stride[0]
+        dilation = self.conv.conv.dilation[0]
+        effective_kernel_size = (kernel_size - 1) * dilation + 1
+
+        num_frames = 0
+        if x.shape[-1] >= effective_kernel_size:
+            num_frames = (x.shape[-1] - effective_kernel_size) // stride + 1
+        state["buffer"] = x[..., num_frames * stride :]
+        if num_frames == 0:
+            return x.new_zeros(x.shape[0], self.conv.conv.out_channels, 0)
+        end = (num_frames - 1) * stride + effective_kernel_size
+        return self.conv(x[..., :end])
+
+    def _forward_streaming(self, x: Tensor) -> Tensor:
+        assert self.conv.norm_type != "time_group_norm", "Not streamable"
+        state = self._streaming_state
+        padding_left, padding_right = self._get_paddings()
+        stride = self.conv.conv.stride[0]
+
+        state["length"] = state.get("length", 0) + x.shape[-1]
+        # The last frames, to compute the padding on the right by flush().
+        # The extra padding is less than the stride.
+        tail = x if "tail" not in state else torch.cat([state["tail"], x], dim=-1)
+        state["tail"] = tail[..., -(padding_right + stride) :]
+
+        if "buffer" in state:
+            x = torch.cat([state["buffer"], x], dim=-1)
+        if not state.get("started", False):
+            # Wait until pad1d() would not need to handle a small input, even
+            # for the padding on the right
+            if x.shape[-1] <= max(padding_left, padding_right + stride - 1):
+                state["buffer"] = x
+                return x.new_zeros(x.shape[0], self.conv.conv.out_channels, 0)
+            x = pad1d(x, (padding_left, 0), mode=self.pad_mode)
+            state["started"] = True
+        return self._conv_frames(x)
+
+    def flush(self, x: Optional[Tensor] = None) -> Tensor:
+        state = self._streaming_state
+        if x is not None:
+            y = self._forward_streaming(x)
+        else:
+            y = state["buffer"].new_zeros(
+                state["buffer"].shape[0], self.conv.conv.out_channels, 0
+            )
 
-class SConvTranspose1d(nn.Module):
+        if not state.get("started", False):
+            # The whole input is in the buffer
+            self._is_streaming = False
+            y = self.forward(state["buffer"])
+            self._is_streaming = True
+        else:
+            kernel_size = self.conv.conv.kernel_size[0]
+            stride = self.conv.conv.stride[0]
+            dilation = self.conv.conv.dilation[0]
+            padding_total = (kernel_size - 1) * dilation - (stride - 1)
+            _, padding_right = self._get_paddings()
+            padding_right += _get_extra_padding(
+                state["length"], kernel_size, stride, padding_total
+            )
+            buffer = state["buffer"]
+            if padding_right > 0:
+                padding = pad1d(state["tail"], (0, padding_right), mode=self.pad_mode)
+                buffer = torch.cat([buffer, padding[..., -padding_right:]], dim=-1)
+            y = torch.cat([y, self._conv_frames(buffer)], dim=-1)
+        self._streaming_state = {}
+        return y
+
+
+class SConvTranspose1d(StreamingModule):
     """ConvTranspose1d with some builtin handling of asymmetric or causal padding
     and normalization.
+
+    In streaming mode (see :class:`StreamingModule`), the outputs that still
+    get contributions from the next input frames are cached and overlap-added
+    with the output of the next chunk, so the output is the same as without
+    streaming.
     """
 
     def __init__(
@@ -309,7 +412,62 @@ class SConvTranspose1d(nn.Module):
         ), "`trim_right_ratio` != 1.0 only makes sense for causal convolutions"
         assert self.trim_right_ratio >= 0.0 and self.trim_right_ratio <= 1.0
 
+    def _get_paddings(self) -> Tuple[int, int]:
+        kernel_size = self.convtr.convtr.kernel_size[0]
+        stride = self.convtr.convtr.stride[0]
+        padding_total = kernel_size - stride
+        if self.causal:
+            padding_right = math.ceil(padding_total * self.trim_right_ratio)
+        else:
+            padding_right = padding_total // 2
+        return padding_total - padding_right, padding_right
+
+    def _emit(self, y: Tensor) -> Tensor:
+        """Trim the padding on the left from the first outputs and normalize."""
+        state = self._streaming_state
+        to_trim = state.get("to_trim", self._get_paddings()[0])
+        state["to_trim"] = max(0, to_trim - y.shape[-1])
+        return self.convtr.norm(y[..., to_trim:])
+
+    def _forward_streaming(self, x: Tensor) -> Tensor:
+        assert self.convtr.norm_type != "time_group_norm", "Not streamable"
+        state = self._streaming_state
+        stride = self.convtr.convtr.stride[0]
+        bias = self.convtr.convtr.bias
+        if x.shape[-1] == 0:
+            return x.new_zeros(x.shape[0], self.convtr.convtr.out_channels, 0)
+
+        # The normalization is applied after the overlap-add
+        y = self.convtr.convtr(x)
+        if "tail" in state:
+            tail = state["tail"]
+            y = torch.cat(
+                [y[..., : tail.shape[-1]] + tail, y[..., tail.shape[-1] :]], -1
+            )
+
+        # The last kernel_size - stride outputs get contributions from the next
+        # frames. The bias is added again to the next output.
+        num_samples = x.shape[-1] * stride
+        state["tail"] = y[..., num_samples:]
+        if bias is not None:
+            state["tail"] = state["tail"] - bias.view(-1, 1)
+        return self._emit(y[..., :num_samples])
+
+    def flush(self, x: Optional[Tensor] = None) -> Tensor:
+        state = self._streaming_state
+        y = self._forward_streaming(x) if x is not None else None
+        tail = state["tail"]
+        bias = self.convtr.convtr.bias
+        if bias is not None:
+            tail = tail + bias.view(-1, 1)
+        _, padding_right = self._get_paddings()
+        tail = self._emit(tail[..., : tail.shape[-1] - padding_right])
+        self._streaming_state = {}
+        return tail if y is None else torch.cat([y, tail], dim=-1)
+
     def forward(self, x):
+        if self._is_streaming:
+            return self._forward_streaming(x)
         kernel_size = self.convtr.convtr.kernel_size[0]
         stride = self.convtr.convtr.stride[0]
         padding_total = kernel_size - stride
@@ -4,13 +4,18 @@
 # This source code is licensed under the license found in the
 # LICENSE file at https://github.com/facebookresearch/encodec/blob/main/LICENSE
 """LSTM layers module."""
-from torch import nn
+from typing import Optional
 
+from torch import Tensor, nn
 
-class SLSTM(nn.Module):
+from .streaming import StreamingModule
+
+
+class SLSTM(StreamingModule):
     """
     LSTM without worrying about the hidden state, nor the layout of the data.
     Expects input as convolutional layout.
+    In streaming mode, the hidden state is kept between chunks.
     """
 
     def __init__(self, dimension: int, num_layers: int = 2, skip: bool = True):
@@ -19,9 +24,21 @@ class SLSTM(nn.Module):
         self.lstm = nn.LSTM(dimension, dimension, num_layers)
 
     def forward(self, x):
+        if self._is_streaming and x.shape[-1] == 0:
+            return x
         x = x.permute(2, 0, 1)
-        y, _ = self.lstm(x)
+        if self._is_streaming:
+            y, self._streaming_state["hx"] = self.lstm(
+                x, self._streaming_state.get("hx")
+            )
+        else:
+            y, _ = self.lstm(x)
         if self.skip:
             y = y + x
         y = y.permute(1, 2, 0)
         return y
+
+    def flush(self, x: Optional[Tensor] = None) -> Tensor:
+        y = self.forward(x)
+        self._streaming_state = {}
+        return y
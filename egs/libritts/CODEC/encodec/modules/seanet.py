@@ -8,11 +8,13 @@
 from typing import Any, Dict, List, Optional
 
 import numpy as np
+import torch
 import torch.nn as nn
 from modules import SLSTM, SConv1d, SConvTranspose1d
+from modules.streaming import StreamingModule, flush_module
 
 
-class SEANetResnetBlock(nn.Module):
+class SEANetResnetBlock(StreamingModule):
     """Residual block from SEANet model.
     Args:
         dim (int): Dimension of the input/output
@@ -81,11 +83,32 @@ class SEANetResnetBlock(nn.Module):
             )
 
     def forward(self, x):
+        if self._is_streaming:
+            return self._add(self.shortcut(x), self.block(x))
         return self.shortcut(x) + self.block(x)
 
+    def _add(self, shortcut: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        # In streaming mode, the branches may have different look-aheads,
+        # so the outputs of one branch wait for those of the other one.
+        state = self._streaming_state
+        if "shortcut" in state:
+            shortcut = torch.cat([state["shortcut"], shortcut], dim=-1)
+            y = torch.cat([state["y"], y], dim=-1)
+        num_frames = min(shortcut.shape[-1], y.shape[-1])
+        state["shortcut"] = shortcut[..., num_frames:]
+        state["y"] = y[..., num_frames:]
+        return shortcut[..., :num_frames] + y[..., :num_frames]
 
-class SEANetEncoder(nn.Module):
+    def flush(self, x: Optional[torch.Tensor] = None) -> torch.Tensor:
+        y = self._add(flush_module(self.shortcut, x), flush_module(self.block, x))
+        assert self._streaming_state["y"].shape[-1] == 0
+        self._streaming_state = {}
+        return y
+
+
+class SEANetEncoder(StreamingModule):
     """SEANet encoder.
+    It supports streaming, see :class:`modules.StreamingModule`.
     Args:
         channels (int): Audio channels.
         dimension (int): Intermediate representation dimension.
@@ -210,9 +233,13 @@ class SEANetEncoder(nn.Module):
     def forward(self, x):
         return self.model(x)
 
+    def flush(self, x: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return flush_module(self.model, x)
 
-class SEANetDecoder(nn.Module):
+
+class SEANetDecoder(StreamingModule):
     """SEANet decoder.
+    It supports streaming, see :class:`modules.StreamingModule`.
     Args:
         channels (int): Audio channels.
         dimension (int): Intermediate representation dimension.
@@ -349,6 +376,9 @@ class SEANetDecoder(nn.Module):
         y = self.model(z)
         return y
 
+    def flush(self, z: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return flush_module(self.model, z)
+
 
 def test():
     import torch
@@ -0,0 +1,76 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Base class of the modules that can process a stream chunk by chunk."""
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from torch import Tensor, nn
+
+
+class StreamingModule(nn.Module):
+    """A module that can process its input chunk by chunk, keeping a state
+    between calls, with the same result as processing the whole input at once.
+
+    In streaming mode, i.e., inside `with module.streaming():`, `forward()`
+    takes the next chunk of the input along the last (time) dimension and
+    returns the output that can be computed from the input seen so far, which
+    may be shorter than the chunk for modules with a look-ahead. At the end
+    of the stream, `flush()` returns the rest of the output. The states of all
+    the streaming submodules are reset when leaving the context.
+
+    Subclasses keep their state in `self._streaming_state`, and implement
+    `flush()`, where `x` is the last part of the input, possibly empty,
+    e.g., the remaining output of the previous module.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._streaming_state: Dict[str, Any] = {}
+        self._is_streaming = False
+
+    def _set_streaming(self, streaming: bool):
+        for module in self.modules():
+            if isinstance(module, StreamingModule):
+                module._is_streaming = streaming
+                module._streaming_state = {}
+
+    @contextmanager
+    def streaming(self):
+        """Enable streaming mode in this module and its submodules."""
+        self._set_streaming(True)
+        try:
+            yield
+        finally:
+            self._set_streaming(False)
+
+    def reset_streaming(self):
+        """Reset the states, e.g., to start a new stream."""
+        self._set_streaming(self._is_streaming)
+
+    def flush(self, x: Optional[Tensor] = None) -> Tensor:
+        raise NotImplementedError
+
+
+def flush_module(module: nn.Module, x: Optional[Tensor] = None) -> Tensor:
+    """Flush `module`, which may be a streaming module, a stateless module,
+    or a `nn.Sequential` of them, and return the rest of its output."""
+    if isinstance(module, StreamingModule):
+        return module.flush(x)
+    if isinstance(module, nn.Sequential):
+        for layer in module:
+            x = flush_module(layer, x)
+        return x
+    return module(x)
@@ -7,13 +7,12 @@
 import io
 import math
 import random
-from typing import IO, Any, List, Optional
+from typing import IO, List, Optional, Union
 
 import torch
+from binary import BitPacker, BitUnpacker
 from torch import Tensor
 
-from ..binary import BitPacker, BitUnpacker
-
 
 def build_stable_quantized_cdf(
     pdf: Tensor,
@@ -27,7 +26,8 @@ def build_stable_quantized_cdf(
     to the PDF.
 
     Args:
-        pdf (Tensor): probability distribution, shape should be `[N]`.
+        pdf (Tensor): probability distribution, shape should be `[N]`, or `[..., N]`
+            to build the CDFs of several distributions at once.
         total_range_bits (int): see `ArithmeticCoder`, the typical range we expect
             during the coding process is `[0, 2 ** total_range_bits - 1]`.
         roundoff (float): will round the pdf up to that level to remove difference coming
@@ -42,7 +42,7 @@ def build_stable_quantized_cdf(
         pdf = (pdf / roundoff).floor() * roundoff
     # interpolate with uniform distribution to achieve desired minimum probability.
     total_range = 2**total_range_bits
-    cardinality = len(pdf)
+    cardinality = pdf.shape[-1]
     alpha = min_range * cardinality / total_range
     assert alpha <= 1, "you must reduce min_range"
     ranges = (((1 - alpha) * total_range) * pdf).floor().long()
@@ -51,10 +51,10 @@ def build_stable_quantized_cdf(
     if min_range < 2:
         raise ValueError("min_range must be at least 2.")
     if check:
-        assert quantized_cdf[-1] <= 2**total_range_bits, quantized_cdf[-1]
-        if (
-            (quantized_cdf[1:] - quantized_cdf[:-1]) < min_range
-        ).any() or quantized_cdf[0] < min_range:
+        assert (quantized_cdf[..., -1] <= 2**total_range_bits).all(), quantized_cdf
+        if ((quantized_cdf[..., 1:] - quantized_cdf[..., :-1]) < min_range).any() or (
+            quantized_cdf[..., 0] < min_range
+        ).any():
             raise ValueError("You must increase your total_range_bits.")
     return quantized_cdf
 
@@ -106,8 +106,6 @@ class ArithmeticCoder:
         self.low: int = 0
         self.high: int = 0
         self.max_bit: int = -1
-        self._dbg: List[Any] = []
-        self._dbg2: List[Any] = []
 
     @property
     def delta(self) -> int:
@@ -120,18 +118,15 @@ class ArithmeticCoder:
         # by powers of 2, and we can flush them out to the bit stream.
         assert self.high >= self.low, (self.low, self.high)
         assert self.high < 2 ** (self.max_bit + 1)
-        while self.max_bit >= 0:
-            b1 = self.low >> self.max_bit
-            b2 = self.high >> self.max_bit
-            if b1 == b2:
-                self.low -= b1 << self.max_bit
-                self.high -= b1 << self.max_bit
-                assert self.high >= self.low, (self.high, self.low, self.max_bit)
-                assert self.low >= 0
-                self.max_bit -= 1
-                self.packer.push(b1)
-            else:
-                break
+        # The common prefix is made of the bits above the highest bit
+        # that differs between self.low and self.high.
+        num_bits = (self.low ^ self.high).bit_length()
+        for i in range(self.max_bit, num_bits - 1, -1):
+            self.packer.push((self.low >> i) & 1)
+        mask = (1 << num_bits) - 1
+        self.low &= mask
+        self.high &= mask
+        self.max_bit = num_bits - 1
 
     def push(self, symbol: int, quantized_cdf: Tensor):
         """Push the given symbol on the stream, flushing out bits
@@ -142,13 +137,35 @@ class ArithmeticCoder:
             quantized_cdf (Tensor): use `build_stable_quantized_cdf`
                 to build this from your pdf estimate.
         """
+        range_low = 0 if symbol == 0 else quantized_cdf[symbol - 1].item()
+        range_high = quantized_cdf[symbol].item() - 1
+        self._push_range(range_low, range_high)
+
+    def push_batch(self, symbols: Tensor, quantized_cdfs: Tensor):
+        """Push the given symbols on the stream, in order. This gives the same
+        stream as pushing them one by one, but looks up all the ranges at once,
+        which is much faster than `push` for many symbols.
+
+        Args:
+            symbols (Tensor): symbols to encode, shape should be `[B]`.
+            quantized_cdfs (Tensor): the quantized CDF of each symbol, shape
+                should be `[B, N]`.
+        """
+        symbols = symbols.to(device=quantized_cdfs.device, dtype=torch.int64)
+        range_highs = quantized_cdfs.gather(1, symbols.unsqueeze(1)).squeeze(1)
+        range_lows = quantized_cdfs.gather(
+            1, (symbols - 1).clamp(min=0).unsqueeze(1)
+        ).squeeze(1)
+        range_lows = range_lows.masked_fill(symbols == 0, 0)
+        for range_low, range_high in zip(range_lows.tolist(), range_highs.tolist()):
+            self._push_range(range_low, range_high - 1)
+
+    def _push_range(self, range_low: int, range_high: int):
         while self.delta < 2**self.total_range_bits:
             self.low *= 2
             self.high = self.high * 2 + 1
             self.max_bit += 1
 
-        range_low = 0 if symbol == 0 else quantized_cdf[symbol - 1].item()
-        range_high = quantized_cdf[symbol].item() - 1
         effective_low = int(
             math.ceil(range_low * (self.delta / (2**self.total_range_bits)))
         )
@@ -164,13 +181,10 @@ class ArithmeticCoder:
             range_low,
             range_high,
         )
-        self._dbg.append((self.low, self.high))
-        self._dbg2.append((self.low, self.high))
-        outs = self._flush_common_prefix()
+        self._flush_common_prefix()
         assert self.low <= self.high
         assert self.max_bit >= -1
         assert self.max_bit <= 61, self.max_bit
-        return outs
 
     def flush(self):
         """Flush the remaining information to the stream."""
@@ -204,10 +218,6 @@ class ArithmeticDecoder:
         self.current: int = 0
         self.max_bit: int = -1
         self.unpacker = BitUnpacker(bits=1, fo=fo)  # we pull single bits at a time.
-        # Following is for debugging
-        self._dbg: List[Any] = []
-        self._dbg2: List[Any] = []
-        self._last: Any = None
 
     @property
     def delta(self) -> int:
@@ -216,25 +226,20 @@ class ArithmeticDecoder:
     def _flush_common_prefix(self):
         # Given the current range [L, H], if both have a common prefix,
         # we know we can remove it from our representation to avoid handling large numbers.
-        while self.max_bit >= 0:
-            b1 = self.low >> self.max_bit
-            b2 = self.high >> self.max_bit
-            if b1 == b2:
-                self.low -= b1 << self.max_bit
-                self.high -= b1 << self.max_bit
-                self.current -= b1 << self.max_bit
-                assert self.high >= self.low
-                assert self.low >= 0
-                self.max_bit -= 1
-            else:
-                break
-
-    def pull(self, quantized_cdf: Tensor) -> Optional[int]:
+        # The current value lies in [L, H], so it shares the same prefix.
+        num_bits = (self.low ^ self.high).bit_length()
+        mask = (1 << num_bits) - 1
+        self.low &= mask
+        self.high &= mask
+        self.current &= mask
+        self.max_bit = num_bits - 1
+
+    def pull(self, quantized_cdf: Union[Tensor, List[int]]) -> Optional[int]:
         """Pull a symbol, reading as many bits from the stream as required.
         This returns `None` when the stream has been exhausted.
 
         Args:
-            quantized_cdf (Tensor): use `build_stable_quantized_cdf`
+            quantized_cdf (Tensor or list of int): use `build_stable_quantized_cdf`
                 to build this from your pdf estimate. This must be **exatly**
                 the same cdf as the one used at encoding time.
         """
@@ -247,36 +252,46 @@ class ArithmeticDecoder:
             self.current = self.current * 2 + bit
             self.max_bit += 1
 
-        def bin_search(low_idx: int, high_idx: int):
-            # Binary search is not just for coding interviews :)
+        if isinstance(quantized_cdf, Tensor):
+            quantized_cdf = quantized_cdf.tolist()
+
+        # Binary search is not just for coding interviews :)
+        scale = self.delta / (2**self.total_range_bits)
+        low_idx, high_idx = 0, len(quantized_cdf) - 1
+        while True:
             if high_idx < low_idx:
                 raise RuntimeError("Binary search failed")
             mid = (low_idx + high_idx) // 2
-            range_low = quantized_cdf[mid - 1].item() if mid > 0 else 0
-            range_high = quantized_cdf[mid].item() - 1
-            effective_low = int(
-                math.ceil(range_low * (self.delta / (2**self.total_range_bits)))
-            )
-            effective_high = int(
-                math.floor(range_high * (self.delta / (2**self.total_range_bits)))
-            )
-            low = effective_low + self.low
-            high = effective_high + self.low
-            if self.current >= low:
-                if self.current <= high:
-                    return (mid, low, high, self.current)
-                else:
-                    return bin_search(mid + 1, high_idx)
+            range_low = quantized_cdf[mid - 1] if mid > 0 else 0
+            range_high = quantized_cdf[mid] - 1
+            low = int(math.ceil(range_low * scale)) + self.low
+            high = int(math.floor(range_high * scale)) + self.low
+            if self.current < low:
+                high_idx = mid - 1
+            elif self.current > high:
+                low_idx = mid + 1
             else:
-                return bin_search(low_idx, mid - 1)
+                break
 
-        self._last = (self.low, self.high, self.current, self.max_bit)
-        sym, self.low, self.high, self.current = bin_search(0, len(quantized_cdf) - 1)
-        self._dbg.append((self.low, self.high, self.current))
+        self.low, self.high = low, high
         self._flush_common_prefix()
-        self._dbg2.append((self.low, self.high, self.current))
+        return mid
+
+    def pull_batch(self, quantized_cdfs: Tensor) -> Optional[List[int]]:
+        """Pull as many symbols as there are CDFs, see `pull`. This returns
+        `None` when the stream has been exhausted.
 
-        return sym
+        Args:
+            quantized_cdfs (Tensor): the quantized CDF of each symbol, shape
+                should be `[B, N]`.
+        """
+        symbols = []
+        for quantized_cdf in quantized_cdfs.tolist():
+            symbol = self.pull(quantized_cdf)
+            if symbol is None:
+                return None
+            symbols.append(symbol)
+        return symbols
 
 
 def test():
@@ -306,6 +321,19 @@ def test():
             assert decoded_symbol == symbol, idx
         assert decoder.pull(torch.zeros(1)) is None
 
+        # The batched versions must give the same stream.
+        q_cdfs = build_stable_quantized_cdf(torch.stack(pdfs), encoder.total_range_bits)
+        batch_fo = io.BytesIO()
+        encoder = ArithmeticCoder(batch_fo)
+        encoder.push_batch(torch.tensor(symbols), q_cdfs)
+        encoder.flush()
+        assert batch_fo.getvalue() == fo.getvalue()
+
+        batch_fo.seek(0)
+        decoder = ArithmeticDecoder(batch_fo)
+        assert decoder.pull_batch(q_cdfs) == symbols
+        assert decoder.pull_batch(torch.zeros(1, 1)) is None
+
 
 if __name__ == "__main__":
     test()
@@ -92,6 +92,33 @@ def kmeans(samples, num_clusters: int, num_iters: int = 10):
     return means, bins
 
 
+@torch.no_grad()
+def rvq_search(x: torch.Tensor, embed: torch.Tensor, embed_sq: torch.Tensor):
+    """Residual vector quantization of `x` with the stacked codebooks `embed`,
+    for inference. The distances are computed with a single matmul per
+    quantizer, and the residual is updated in place in a preallocated buffer.
+
+    Args:
+        x (Tensor): Vectors to quantize, of shape (N, D).
+        embed (Tensor): Codebooks of the quantizers, of shape (n_q, K, D).
+        embed_sq (Tensor): Squared norms of the codewords, of shape (n_q, K).
+    Returns:
+        Tensor: Codes of shape (n_q, N).
+    """
+    n_q, codebook_size, _ = embed.shape
+    residual = x.clone()
+    quantized = torch.empty_like(residual)
+    dist = x.new_empty(x.shape[0], codebook_size)
+    codes = torch.empty(n_q, x.shape[0], dtype=torch.int64, device=x.device)
+    for q in range(n_q):
+        # |x - e|^2 without |x|^2, which does not change the argmin
+        torch.addmm(embed_sq[q], residual, embed[q].t(), alpha=-2, out=dist)
+        torch.argmin(dist, dim=-1, out=codes[q])
+        torch.index_select(embed[q], 0, codes[q], out=quantized)
+        residual.sub_(quantized)
+    return codes
+
+
 class EuclideanCodebook(nn.Module):
     """Codebook with Euclidean distance.
     Args:
@@ -332,6 +359,29 @@ class ResidualVectorQuantization(nn.Module):
         self.layers = nn.ModuleList(
             [VectorQuantization(**kwargs) for _ in range(num_quantizers)]
         )
+        # Stacked codebooks and their squared norms for inference,
+        # see `_get_codebooks`.
+        self._codebooks = None
+
+    def train(self, mode: bool = True):
+        # The codebooks are updated in place during training
+        self._codebooks = None
+        return super().train(mode)
+
+    def _get_codebooks(self):
+        """Return the codebooks of all the quantizers stacked, of shape
+        (num_quantizers, K, D), and their squared norms, of shape
+        (num_quantizers, K), or None if the quantizers project their input,
+        which is not supported by `rvq_search`."""
+        if not isinstance(self.layers[0].project_in, nn.Identity):
+            return None
+        embeds = [layer.codebook for layer in self.layers]
+        # Loading a state dict updates the codebooks in place
+        key = [(e.data_ptr(), e._version, e.device, e.dtype) for e in embeds]
+        if self._codebooks is None or self._codebooks[0] != key:
+            embed = torch.stack(embeds)
+            self._codebooks = (key, embed, embed.pow(2).sum(-1))
+        return self._codebooks[1:]
 
     def forward(self, x, n_q: Optional[int] = None):
         quantized_out = 0.0
@@ -356,10 +406,21 @@ class ResidualVectorQuantization(nn.Module):
     def encode(
         self, x: torch.Tensor, n_q: Optional[int] = None, st: Optional[int] = None
     ) -> torch.Tensor:
-        residual = x
-        all_indices = []
         n_q = n_q or len(self.layers)
         st = st or 0
+        codebooks = None if self.training else self._get_codebooks()
+        if codebooks is not None:
+            embed, embed_sq = codebooks
+            batch_size, dim, num_frames = x.shape
+            codes = rvq_search(
+                x.transpose(1, 2).reshape(-1, dim),
+                embed[st:n_q],
+                embed_sq[st:n_q],
+            )
+            return codes.view(-1, batch_size, num_frames)
+
+        residual = x
+        all_indices = []
         for layer in self.layers[st:n_q]:
             indices = layer.encode(residual)
             quantized = layer.decode(indices)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import torch
+from quantization import ResidualVectorQuantizer
+from quantization.ac import test as test_arithmetic_coder
+
+
+def test_rvq_search():
+    torch.manual_seed(0)
+    quantizer = ResidualVectorQuantizer(
+        dimension=32, n_q=8, bins=256, kmeans_init=False
+    )
+    x = torch.randn(3, 32, 100)
+    for n_q, st in [(8, None), (4, None), (6, 2)]:
+        # In training mode, the quantizers are run one by one.
+        quantizer.train()
+        expected = quantizer.vq.encode(x, n_q=n_q, st=st)
+        quantizer.eval()
+        codes = quantizer.vq.encode(x, n_q=n_q, st=st)
+        assert torch.equal(codes, expected), (n_q, st)
+
+    # The cached codebooks must follow the loaded ones.
+    state_dict = quantizer.state_dict()
+    for key in state_dict:
+        if key.endswith("embed"):
+            state_dict[key] = state_dict[key].flip(0)
+    quantizer.load_state_dict(state_dict)
+    codes = quantizer.vq.encode(x)
+    quantizer.train()
+    assert torch.equal(codes, quantizer.vq.encode(x))
+
+
+def main():
+    with torch.no_grad():
+        test_rvq_search()
+        test_arithmetic_coder()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+
+import torch
+from compress import compress_stream, decompress_stream
+from encodec import Encodec
+from modules.seanet import SEANetDecoder, SEANetEncoder
+from quantization import ResidualVectorQuantizer
+
+
+def get_model() -> Encodec:
+    encoder = SEANetEncoder(n_filters=4, dimension=16, ratios=[4, 2])
+    decoder = SEANetDecoder(n_filters=4, dimension=16, ratios=[4, 2])
+    quantizer = ResidualVectorQuantizer(dimension=16, n_q=4, bins=64, kmeans_init=False)
+    return Encodec(
+        sampling_rate=8000,
+        target_bandwidths=[1.5, 3.0],
+        params={},
+        encoder=encoder,
+        quantizer=quantizer,
+        decoder=decoder,
+        multi_scale_discriminator=None,
+    ).eval()
+
+
+def test_seanet_streaming():
+    torch.manual_seed(0)
+    for causal in [False, True]:
+        encoder = SEANetEncoder(n_filters=4, dimension=16, causal=causal).eval()
+        decoder = SEANetDecoder(n_filters=4, dimension=16, causal=causal).eval()
+        for num_samples in [40, 333, 4001]:
+            x = torch.randn(2, 1, num_samples)
+            e = encoder(x)
+            y = decoder(e)
+            for chunk_size in [1, 7, 320, 5000]:
+                if chunk_size * 1000 < num_samples:
+                    continue
+                with encoder.streaming():
+                    chunks = [
+                        encoder(x[..., i : i + chunk_size])
+                        for i in range(0, num_samples, chunk_size)
+                    ]
+                    chunks.append(encoder.flush())
+                assert torch.allclose(torch.cat(chunks, dim=-1), e, atol=1e-5)
+
+                with decoder.streaming():
+                    chunks = [
+                        decoder(e[..., i : i + chunk_size])
+                        for i in range(0, e.shape[-1], chunk_size)
+                    ]
+                    chunks.append(decoder.flush())
+                assert torch.allclose(torch.cat(chunks, dim=-1), y, atol=1e-5)
+
+
+def test_compress_stream():
+    torch.manual_seed(0)
+    model = get_model()
+    x = torch.randn(1, 5003)
+    codes, y = model.inference(x)
+    streaming_codes, streaming_y = model.inference_streaming(x, chunk_size=1000)
+    assert torch.equal(streaming_codes, codes)
+    assert torch.allclose(streaming_y, y, atol=1e-5)
+
+    for use_ac in [True, False]:
+        fo = io.BytesIO()
+        compress_stream(model, x.split(1000, dim=-1), fo, use_ac=use_ac)
+        fo.seek(0)
+        decoded = torch.cat(list(decompress_stream(model, fo)), dim=-1)
+        assert decoded.shape == x.shape, decoded.shape
+        assert torch.allclose(decoded, y[0, :, : x.shape[-1]], atol=1e-5)
+
+
+def main():
+    with torch.no_grad():
+        test_seanet_streaming()
+        test_compress_stream()
+
+
+if __name__ == "__main__":
+    main()
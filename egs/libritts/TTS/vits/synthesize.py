@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script synthesizes the utterances of a text file, e.g., to generate
+synthetic data for ASR. Each line of the file is
+
+    utt_id speaker text
+
+where speaker is the key of a speaker embedding in --speaker-embeds-scp,
+e.g., the x-vectors computed for training, and the audio is saved to
+<output-dir>/<utt_id>.wav. The utterances are batched by their predicted
+durations; see synthesis.py.
+
+Usage:
+./vits/synthesize.py \
+    --epoch 1000 \
+    --exp-dir ./vits/exp \
+    --input-file texts.txt \
+    --output-dir ./vits/exp/synthesized \
+    --max-frames 10000
+
+On CPU, splitting the utterances across processes is usually faster than
+using many threads in one process, e.g., with 16 cores:
+
+./vits/synthesize.py \
+    --epoch 1000 \
+    --exp-dir ./vits/exp \
+    --input-file texts.txt \
+    --output-dir ./vits/exp/synthesized \
+    --num-processes 8 \
+    --num-threads 2
+"""
+
+
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import torch
+from lhotse.features.io import KaldiReader
+from synthesis import add_synthesis_arguments, read_utterances, run_synthesis
+from tokenizer import Tokenizer
+from train import get_model, get_params
+
+from icefall.checkpoint import load_checkpoint
+from icefall.utils import AttributeDict, setup_logger
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--epoch",
+        type=int,
+        default=1000,
+        help="""It specifies the checkpoint to use for decoding.
+        Note: Epoch counts from 1.
+        """,
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=str,
+        default="vits/exp",
+        help="The experiment dir",
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        default="data/tokens.txt",
+        help="""Path to vocabulary.""",
+    )
+
+    parser.add_argument(
+        "--speaker-embeds-scp",
+        type=str,
+        default="exp/xvector_nnet_1a/xvectors_train_clean_460/feats.scp",
+        help="Path to the feats.scp file of the speaker embeddings.",
+    )
+
+    add_synthesis_arguments(parser)
+
+    return parser
+
+
+def setup(params: AttributeDict, device: torch.device):
+    tokenizer = Tokenizer(params.tokens)
+    params.blank_id = tokenizer.pad_id
+    params.vocab_size = tokenizer.vocab_size
+
+    model = get_model(params)
+    load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+
+    speaker_map = KaldiReader(params.speaker_embeds_scp)
+
+    def speaker_inputs(
+        speakers: List[str], device: torch.device
+    ) -> Dict[str, torch.Tensor]:
+        spembs = torch.Tensor(np.array([speaker_map.read(s) for s in speakers]))
+        return {"spembs": spembs.squeeze(1).to(device)}
+
+    return model, tokenizer, speaker_inputs
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    args.exp_dir = Path(args.exp_dir)
+
+    params = get_params()
+    params.update(vars(args))
+
+    setup_logger(f"{params.output_dir}/log/log-synthesize")
+    logging.info("Synthesis started")
+    logging.info(params)
+
+    utterances = read_utterances(params.input_file, with_speaker=True)
+    logging.info(f"Number of utterances: {len(utterances)}")
+
+    run_synthesis(params, utterances, setup)
+
+    logging.info(f"Wav files are saved to {params.output_dir}")
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
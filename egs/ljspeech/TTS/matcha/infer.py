@@ -5,7 +5,9 @@ import argparse
 import datetime as dt
 import json
 import logging
+import math
 from pathlib import Path
+from typing import Iterator, Optional
 
 import soundfile as sf
 import torch
@@ -13,6 +15,7 @@ import torch.nn as nn
 from hifigan.config import v1, v2, v3
 from hifigan.denoiser import Denoiser
 from hifigan.models import Generator as HiFiGAN
+from streaming import stream_synthesis
 from tokenizer import Tokenizer
 from train import get_model, get_params
 from tts_datamodule import LJSpeechTtsDataModule
@@ -87,6 +90,40 @@ def get_parser():
         help="The sampling rate of the generated speech (default: 22050 for LJSpeech)",
     )
 
+    parser.add_argument(
+        "--n-timesteps",
+        type=int,
+        default=2,
+        help="Number of steps of the ODE solver.",
+    )
+
+    parser.add_argument(
+        "--solver",
+        type=str,
+        default=None,
+        choices=["euler", "midpoint", "heun", "adaptive"],
+        help="""The ODE solver. midpoint and heun use 2 function evaluations
+        per step. adaptive chooses the step sizes, starting with
+        1 / n-timesteps. Defaults to the solver the model was trained with.""",
+    )
+
+    parser.add_argument(
+        "--sway-sampling-coef",
+        type=float,
+        default=None,
+        help="""If given, warp the time steps of the ODE solver with sway
+        sampling. Negative values, e.g., -1, use smaller steps at the start.""",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="""If positive, run the vocoder on chunks of this many mel frames
+        when synthesizing a single text, and log the latency to the first
+        chunk. Used only with --input-text.""",
+    )
+
     return parser
 
 
@@ -118,6 +155,34 @@ def to_waveform(
     return audio.squeeze()
 
 
+def to_waveform_streaming(
+    mel: torch.Tensor,
+    vocoder: nn.Module,
+    denoiser: nn.Module,
+    chunk_size: int = 64,
+    context_size: int = 24,
+    crossfade_size: int = 4,
+) -> Iterator[torch.Tensor]:
+    """Like :func:`to_waveform`, but yield the waveform in chunks of
+    `chunk_size` mel frames, see :func:`streaming.stream_synthesis`.
+    The default context covers the receptive field of the HiFiGAN
+    vocoder and of the STFT of the denoiser."""
+
+    def decode(mel: torch.Tensor) -> torch.Tensor:
+        audio = vocoder(mel).clamp(-1, 1)
+        return denoiser(audio.squeeze(0), strength=0.00025)
+
+    for audio in stream_synthesis(
+        decode,
+        mel,
+        hop_length=math.prod(vocoder.h.upsample_rates),
+        chunk_size=chunk_size,
+        context_size=context_size,
+        crossfade_size=crossfade_size,
+    ):
+        yield audio.cpu()
+
+
 def process_text(text: str, tokenizer: Tokenizer, device: str = "cpu") -> dict:
     x = tokenizer.texts_to_token_ids([text], add_sos=True, add_eos=True)
     x = torch.tensor(x, dtype=torch.long, device=device)
@@ -134,6 +199,8 @@ def synthesize(
     temperature: float,
     device: str = "cpu",
     spks=None,
+    solver: Optional[str] = None,
+    sway_sampling_coef: Optional[float] = None,
 ) -> dict:
     text_processed = process_text(text=text, tokenizer=tokenizer, device=device)
     start_t = dt.datetime.now()
@@ -144,6 +211,8 @@ def synthesize(
         temperature=temperature,
         spks=spks,
         length_scale=length_scale,
+        solver=solver,
+        sway_sampling_coef=sway_sampling_coef,
     )
     # merge everything to one dict
     output.update({"start_t": start_t, **text_processed})
@@ -199,6 +268,8 @@ def infer_dataset(
                 length_scale=params.length_scale,
                 temperature=params.temperature,
                 device=device,
+                solver=params.solver,
+                sway_sampling_coef=params.sway_sampling_coef,
             )
             output["waveform"] = to_waveform(output["mel"], vocoder, denoiser)
 
@@ -260,9 +331,6 @@ def main():
         params.model_args.data_statistics.mel_mean = stats["fbank_mean"]
         params.model_args.data_statistics.mel_std = stats["fbank_std"]
 
-    # Number of ODE Solver steps
-    params.n_timesteps = 2
-
     # Changes to the speaking rate
     params.length_scale = 1.0
 
@@ -303,8 +371,21 @@ def main():
             length_scale=params.length_scale,
             temperature=params.temperature,
             device=device,
+            solver=params.solver,
+            sway_sampling_coef=params.sway_sampling_coef,
         )
-        output["waveform"] = to_waveform(output["mel"], vocoder, denoiser)
+        if params.chunk_size > 0:
+            chunks = []
+            for audio in to_waveform_streaming(
+                output["mel"], vocoder, denoiser, chunk_size=params.chunk_size
+            ):
+                if not chunks:
+                    elapsed = (dt.datetime.now() - output["start_t"]).total_seconds()
+                    logging.info(f"First audio chunk after {elapsed:.3f} s")
+                chunks.append(audio)
+            output["waveform"] = torch.cat(chunks)
+        else:
+            output["waveform"] = to_waveform(output["mel"], vocoder, denoiser)
 
         sf.write(
             file=params.output_wav,
@@ -26,7 +26,19 @@ class BASECFM(torch.nn.Module, ABC):
         self.estimator = None
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None):
+    def forward(
+        self,
+        mu,
+        mask,
+        n_timesteps,
+        temperature=1.0,
+        spks=None,
+        cond=None,
+        solver=None,
+        sway_sampling_coef=None,
+        rtol=1e-2,
+        atol=1e-3,
+    ):
         """Forward diffusion
 
         Args:
@@ -34,11 +46,19 @@ class BASECFM(torch.nn.Module, ABC):
                 shape: (batch_size, n_feats, mel_timesteps)
             mask (torch.Tensor): output_mask
                 shape: (batch_size, 1, mel_timesteps)
-            n_timesteps (int): number of diffusion steps
+            n_timesteps (int): number of diffusion steps. For the adaptive
+                solver, it only sets the size of the first step.
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver (str, optional): one of "euler", "midpoint", "heun" and
+                "adaptive". Defaults to the solver of `cfm_params`.
+            sway_sampling_coef (float, optional): if not None, the time steps
+                are warped by t + s * (cos(pi / 2 * t) - 1 + t), which gives
+                smaller steps near t = 0 for s < 0. Defaults to None.
+            rtol (float, optional): relative tolerance of the adaptive solver.
+            atol (float, optional): absolute tolerance of the adaptive solver.
 
         Returns:
             sample: generated mel-spectrogram
@@ -46,9 +66,31 @@ class BASECFM(torch.nn.Module, ABC):
         """
         z = torch.randn_like(mu) * temperature
         t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        return self.solve_euler(
-            z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond
-        )
+        if sway_sampling_coef is not None:
+            t_span = t_span + sway_sampling_coef * (
+                torch.cos(torch.pi / 2 * t_span) - 1 + t_span
+            )
+
+        solver = solver or self.solver
+        if solver == "adaptive":
+            return self.solve_adaptive(
+                z,
+                t_span=t_span,
+                mu=mu,
+                mask=mask,
+                spks=spks,
+                cond=cond,
+                rtol=rtol,
+                atol=atol,
+            )
+        solve = {
+            "euler": self.solve_euler,
+            "midpoint": self.solve_midpoint,
+            "heun": self.solve_heun,
+        }
+        if solver not in solve:
+            raise ValueError(f"Unsupported solver: {solver}")
+        return solve[solver](z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond)
 
     def solve_euler(self, x, t_span, mu, mask, spks, cond):
         """
@@ -82,6 +124,101 @@ class BASECFM(torch.nn.Module, ABC):
 
         return sol[-1]
 
+    def solve_midpoint(self, x, t_span, mu, mask, spks, cond):
+        """
+        Fixed step midpoint solver for ODEs, 2 function evaluations per step.
+        See :func:`solve_euler` for the arguments.
+        """
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            x_mid = x + dt / 2 * self.estimator(x, mask, mu, t, spks, cond)
+            x = x + dt * self.estimator(x_mid, mask, mu, t + dt / 2, spks, cond)
+
+        return x
+
+    def solve_heun(self, x, t_span, mu, mask, spks, cond):
+        """
+        Fixed step Heun (trapezoidal) solver for ODEs, 2 function evaluations
+        per step. See :func:`solve_euler` for the arguments.
+        """
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            k1 = self.estimator(x, mask, mu, t, spks, cond)
+            k2 = self.estimator(x + dt * k1, mask, mu, t + dt, spks, cond)
+            x = x + dt / 2 * (k1 + k2)
+
+        return x
+
+    def solve_adaptive(
+        self,
+        x,
+        t_span,
+        mu,
+        mask,
+        spks,
+        cond,
+        rtol,
+        atol,
+        max_num_steps=1000,
+        min_dt=1e-6,
+    ):
+        """
+        Adaptive Bogacki-Shampine 3(2) solver for ODEs. The step size is
+        chosen so that the estimated local error is within `atol + rtol * |x|`.
+        Accepted steps need 3 function evaluations, since the last one is
+        reused by the next step.
+
+        Args:
+            x, mu, mask, spks, cond: see :func:`solve_euler`
+            t_span (torch.Tensor): only its first step sets the initial step size.
+            rtol (float): relative tolerance.
+            atol (float): absolute tolerance.
+            max_num_steps (int, optional): maximum number of steps, including
+                the rejected ones. Defaults to 1000.
+            min_dt (float, optional): smallest allowed step size. Defaults to 1e-6.
+
+        Raises:
+            RuntimeError: if the step size falls below `min_dt` or the solver
+                takes more than `max_num_steps` steps, e.g., because the local
+                error is NaN or inf.
+        """
+        t = 0.0
+        dt = (t_span[1] - t_span[0]).item()
+        k1 = self.estimator(x, mask, mu, t_span[0], spks, cond)
+        num_steps = 0
+        while t < 1.0:
+            if num_steps >= max_num_steps:
+                raise RuntimeError(
+                    f"The adaptive solver reached t={t} after {num_steps} steps, "
+                    f"the maximum number of steps"
+                )
+            if dt < min_dt:
+                raise RuntimeError(
+                    f"The step size {dt} of the adaptive solver is smaller than "
+                    f"{min_dt} at t={t}"
+                )
+            num_steps += 1
+            # t + (1 - t) might be rounded to a value below 1
+            last_step = dt >= 1.0 - t
+            dt = min(dt, 1.0 - t)
+            t_ = torch.tensor(t, dtype=t_span.dtype, device=t_span.device)
+            k2 = self.estimator(x + dt / 2 * k1, mask, mu, t_ + dt / 2, spks, cond)
+            k3 = self.estimator(
+                x + 3 * dt / 4 * k2, mask, mu, t_ + 3 * dt / 4, spks, cond
+            )
+            x_new = x + dt * (2 * k1 + 3 * k2 + 4 * k3) / 9
+            k4 = self.estimator(x_new, mask, mu, t_ + dt, spks, cond)
+
+            # difference with the second order solution
+            err = dt * (-5 * k1 / 72 + k2 / 12 + k3 / 9 - k4 / 8)
+            scale = atol + rtol * torch.maximum(x.abs(), x_new.abs())
+            err = (err / scale).pow(2).mean().sqrt().item()
+            if err <= 1.0:
+                t, x, k1 = 1.0 if last_step else t + dt, x_new, k4
+            dt = dt * min(5.0, max(0.2, 0.9 * max(err, 1e-10) ** (-1 / 3)))
+
+        return x
+
     def compute_loss(self, x1, mask, mu, spks=None, cond=None):
         """Computes diffusion loss
 
@@ -74,7 +74,15 @@ class MatchaTTS(torch.nn.Module):  # 🍵
 
     @torch.inference_mode()
     def synthesise(
-        self, x, x_lengths, n_timesteps, temperature=1.0, spks=None, length_scale=1.0
+        self,
+        x,
+        x_lengths,
+        n_timesteps,
+        temperature=1.0,
+        spks=None,
+        length_scale=1.0,
+        solver=None,
+        sway_sampling_coef=None,
     ):
         """
         Generates mel-spectrogram from text. Returns:
@@ -93,6 +101,10 @@ class MatchaTTS(torch.nn.Module):  # 🍵
                 shape: (batch_size,)
             length_scale (float, optional): controls speech pace.
                 Increase value to slow down generated speech and vice versa.
+            solver (str, optional): ODE solver of the decoder, see
+                :func:`BASECFM.forward`. Defaults to the solver of `cfm_params`.
+            sway_sampling_coef (float, optional): warps the time steps of the
+                ODE solver, see :func:`BASECFM.forward`.
 
         Returns:
             dict: {
@@ -136,7 +148,15 @@ class MatchaTTS(torch.nn.Module):  # 🍵
         encoder_outputs = mu_y[:, :, :y_max_length]
 
         # Generate sample tracing the probability flow
-        decoder_outputs = self.decoder(mu_y, y_mask, n_timesteps, temperature, spks)
+        decoder_outputs = self.decoder(
+            mu_y,
+            y_mask,
+            n_timesteps,
+            temperature,
+            spks,
+            solver=solver,
+            sway_sampling_coef=sway_sampling_coef,
+        )
         decoder_outputs = decoder_outputs[:, :, :y_max_length]
 
         t = (dt.datetime.now() - t).total_seconds()
@@ -0,0 +1 @@
+../vits/streaming.py
\ No newline at end of file
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the latency to the first audio and the real-time
+factor (RTF) of VITS.inference_streaming() with those of VITS.inference(),
+and reports the largest difference between the two waveforms for the same
+random seed.
+
+A randomly initialized model is used, since the speed does not depend on
+the weights. The number of frames depends on the predicted durations, so
+the RTF is computed from the length of the generated audio.
+
+Usage:
+
+    ./vits/benchmark_streaming.py --model-type high --text-len 200
+"""
+
+import argparse
+import logging
+import time
+
+import torch
+from vits import VITS
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--model-type",
+        type=str,
+        default="high",
+        help="Model type, one of: low, medium, high.",
+    )
+
+    parser.add_argument(
+        "--text-len",
+        type=int,
+        default=200,
+        help="Number of input tokens.",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=64,
+        help="Number of frames synthesized at a time.",
+    )
+
+    parser.add_argument(
+        "--first-chunk-size",
+        type=int,
+        default=16,
+        help="Number of frames of the first chunk.",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=16,
+        help="Number of context frames on each side of a chunk.",
+    )
+
+    parser.add_argument(
+        "--crossfade-size",
+        type=int,
+        default=4,
+        help="Number of frames by which consecutive chunks overlap.",
+    )
+
+    parser.add_argument(
+        "--num-runs",
+        type=int,
+        default=3,
+        help="Number of utterances to synthesize with each method.",
+    )
+
+    return parser.parse_args()
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def synthesize(model, text, seed):
+    torch.manual_seed(seed)
+    synchronize()
+    start = time.time()
+    wav, _, _ = model.inference(text)
+    synchronize()
+    elapsed = time.time() - start
+    return wav, elapsed, elapsed
+
+
+def synthesize_streaming(model, text, seed, args):
+    torch.manual_seed(seed)
+    synchronize()
+    start = time.time()
+    first_chunk_time = None
+    chunks = []
+    for chunk in model.inference_streaming(
+        text,
+        chunk_size=args.chunk_size,
+        context_size=args.context_size,
+        crossfade_size=args.crossfade_size,
+        first_chunk_size=args.first_chunk_size,
+    ):
+        if first_chunk_time is None:
+            synchronize()
+            first_chunk_time = time.time() - start
+        chunks.append(chunk)
+    synchronize()
+    return torch.cat(chunks), first_chunk_time, time.time() - start
+
+
+@torch.inference_mode()
+def main():
+    args = get_args()
+    logging.info(vars(args))
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    torch.manual_seed(0)
+    vocab_size = 100
+    model = VITS(vocab_size=vocab_size, model_type=args.model_type)
+    model.to(device)
+    model.eval()
+    sampling_rate = model.sampling_rate
+
+    text = torch.randint(1, vocab_size, (args.text_len,), device=device)
+
+    # Warm up
+    synthesize(model, text, 0)
+
+    first_chunk_time = {"full": 0.0, "streaming": 0.0}
+    elapsed = {"full": 0.0, "streaming": 0.0}
+    duration = 0.0
+    for seed in range(args.num_runs):
+        wav, first, total = synthesize(model, text, seed)
+        first_chunk_time["full"] += first
+        elapsed["full"] += total
+
+        streamed, first, total = synthesize_streaming(model, text, seed, args)
+        first_chunk_time["streaming"] += first
+        elapsed["streaming"] += total
+
+        duration += wav.numel() / sampling_rate
+        diff = (wav - streamed).abs().max().item()
+        logging.info(
+            f"seed {seed}: {wav.numel() / sampling_rate:.2f} s of audio, "
+            f"max abs difference of the waveforms: {diff:.3g}"
+        )
+
+    for name in ["full", "streaming"]:
+        logging.info(
+            f"{name}: first audio after "
+            f"{first_chunk_time[name] / args.num_runs:.3f} s, "
+            f"RTF {elapsed[name] / duration:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -11,7 +11,7 @@ This code is based on https://github.com/jaywalnut310/vits.
 
 
 import math
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -20,6 +20,7 @@ from duration_predictor import StochasticDurationPredictor
 from hifigan import HiFiGANGenerator
 from posterior_encoder import PosteriorEncoder
 from residual_coupling import ResidualAffineCouplingBlock
+from streaming import stream_synthesis
 from text_encoder import TextEncoder
 from utils import get_random_segments
 
@@ -400,32 +401,9 @@ class VITSGenerator(torch.nn.Module):
             Tensor: Duration tensor (B, T_text).
 
         """
-        # encoder
-        x, m_p, logs_p, x_mask = self.text_encoder(text, text_lengths)
-        x_mask = x_mask.to(x.dtype)
-        g = None
-        if self.spks is not None:
-            # (B, global_channels, 1)
-            g = self.global_emb(sids.view(-1)).unsqueeze(-1)
-        if self.spk_embed_dim is not None:
-            # (B, global_channels, 1)
-            if spembs.ndim == 2:
-                g_ = self.spemb_proj(F.normalize(spembs)).unsqueeze(-1)
-            elif spembs.ndim == 1:
-                g_ = self.spemb_proj(F.normalize(spembs.unsqueeze(0))).unsqueeze(-1)
-            else:
-                raise ValueError("spembs should be 1D or 2D (batch mode) tensor.")
-            if g is None:
-                g = g_
-            else:
-                g = g + g_
-        if self.langs is not None:
-            # (B, global_channels, 1)
-            g_ = self.lang_emb(lids.view(-1)).unsqueeze(-1)
-            if g is None:
-                g = g_
-            else:
-                g = g + g_
+        x, m_p, logs_p, x_mask, g = self._encode_text(
+            text, text_lengths, sids=sids, spembs=spembs, lids=lids
+        )
 
         if use_teacher_forcing:
             # forward posterior encoder
@@ -472,42 +450,244 @@ class VITSGenerator(torch.nn.Module):
             # forward decoder with random segments
             wav = self.decoder(z * y_mask, g=g)
         else:
-            # duration
-            if dur is None:
-                logw = self.duration_predictor(
-                    x,
-                    x_mask,
-                    g=g,
-                    inverse=True,
-                    noise_scale=noise_scale_dur,
-                )
-                w = torch.exp(logw) * x_mask * alpha
-                dur = torch.ceil(w)
-            y_lengths = torch.clamp_min(torch.sum(dur, [1, 2]), 1).long()
-            y_mask = (~make_pad_mask(y_lengths)).unsqueeze(1).to(text.device)
-            y_mask = y_mask.to(x.dtype)
-            attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
-            attn = self._generate_path(dur, attn_mask)
-
-            # expand the length to match with the feature sequence
-            # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
-            m_p = torch.matmul(
-                attn.squeeze(1),
-                m_p.transpose(1, 2),
-            ).transpose(1, 2)
-            # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
-            logs_p = torch.matmul(
-                attn.squeeze(1),
-                logs_p.transpose(1, 2),
-            ).transpose(1, 2)
-
-            # decoder
-            z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+            z_p, y_mask, attn, dur = self._sample_latent(
+                x,
+                m_p,
+                logs_p,
+                x_mask,
+                g=g,
+                dur=dur,
+                noise_scale=noise_scale,
+                noise_scale_dur=noise_scale_dur,
+                alpha=alpha,
+            )
             z = self.flow(z_p, y_mask, g=g, inverse=True)
             wav = self.decoder((z * y_mask)[:, :, :max_len], g=g)
 
         return wav.squeeze(1), attn.squeeze(1), dur.squeeze(1)
 
+    def _encode_text(
+        self,
+        text: torch.Tensor,
+        text_lengths: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        spembs: Optional[torch.Tensor] = None,
+        lids: Optional[torch.Tensor] = None,
+    ) -> Tuple[
+        torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor]
+    ]:
+        """Run the text encoder and compute the global conditioning.
+
+        Returns:
+            Tensor: Text encoder hidden states (B, H, T_text).
+            Tensor: Prior mean (B, H, T_text).
+            Tensor: Prior log scale (B, H, T_text).
+            Tensor: Text mask (B, 1, T_text).
+            Optional[Tensor]: Global conditioning (B, global_channels, 1).
+
+        """
+        # encoder
+        x, m_p, logs_p, x_mask = self.text_encoder(text, text_lengths)
+        x_mask = x_mask.to(x.dtype)
+        g = None
+        if self.spks is not None:
+            # (B, global_channels, 1)
+            g = self.global_emb(sids.view(-1)).unsqueeze(-1)
+        if self.spk_embed_dim is not None:
+            # (B, global_channels, 1)
+            if spembs.ndim == 2:
+                g_ = self.spemb_proj(F.normalize(spembs)).unsqueeze(-1)
+            elif spembs.ndim == 1:
+                g_ = self.spemb_proj(F.normalize(spembs.unsqueeze(0))).unsqueeze(-1)
+            else:
+                raise ValueError("spembs should be 1D or 2D (batch mode) tensor.")
+            if g is None:
+                g = g_
+            else:
+                g = g + g_
+        if self.langs is not None:
+            # (B, global_channels, 1)
+            g_ = self.lang_emb(lids.view(-1)).unsqueeze(-1)
+            if g is None:
+                g = g_
+            else:
+                g = g + g_
+
+        return x, m_p, logs_p, x_mask, g
+
+    def _predict_durations(
+        self,
+        x: torch.Tensor,
+        x_mask: torch.Tensor,
+        g: Optional[torch.Tensor] = None,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+    ) -> torch.Tensor:
+        """Predict the durations from the text encoder hidden states.
+
+        Returns:
+            Tensor: Duration tensor (B, 1, T_text).
+
+        """
+        logw = self.duration_predictor(
+            x,
+            x_mask,
+            g=g,
+            inverse=True,
+            noise_scale=noise_scale_dur,
+        )
+        w = torch.exp(logw) * x_mask * alpha
+        return torch.ceil(w)
+
+    def predict_durations(
+        self,
+        text: torch.Tensor,
+        text_lengths: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        spembs: Optional[torch.Tensor] = None,
+        lids: Optional[torch.Tensor] = None,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+    ) -> torch.Tensor:
+        """Predict the durations only, i.e., run the text encoder and the
+        duration predictor, which are much cheaper than the flow and the
+        decoder. The result can be passed as `dur` to :meth:`inference`.
+
+        Args:
+            text (Tensor): Input text index tensor (B, T_text,).
+            text_lengths (Tensor): Text length tensor (B,).
+            sids (Optional[Tensor]): Speaker index tensor (B,) or (B, 1).
+            spembs (Optional[Tensor]): Speaker embedding tensor (B, spk_embed_dim).
+            lids (Optional[Tensor]): Language index tensor (B,) or (B, 1).
+            noise_scale_dur (float): Noise scale value for duration predictor.
+            alpha (float): Alpha parameter to control the speed of generated speech.
+
+        Returns:
+            Tensor: Duration tensor (B, 1, T_text), zero for padded tokens.
+
+        """
+        x, _, _, x_mask, g = self._encode_text(text, text_lengths, sids, spembs, lids)
+        return self._predict_durations(x, x_mask, g, noise_scale_dur, alpha)
+
+    def _sample_latent(
+        self,
+        x: torch.Tensor,
+        m_p: torch.Tensor,
+        logs_p: torch.Tensor,
+        x_mask: torch.Tensor,
+        g: Optional[torch.Tensor] = None,
+        dur: Optional[torch.Tensor] = None,
+        noise_scale: float = 0.667,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Predict the durations and sample the latent of the flow output.
+
+        Returns:
+            Tensor: Latent z_p to be passed to the inverse flow (B, H, T_feats).
+            Tensor: Feature mask (B, 1, T_feats).
+            Tensor: Monotonic attention weight tensor (B, 1, T_feats, T_text).
+            Tensor: Duration tensor (B, 1, T_text).
+
+        """
+        # duration
+        if dur is None:
+            dur = self._predict_durations(x, x_mask, g, noise_scale_dur, alpha)
+        y_lengths = torch.clamp_min(torch.sum(dur, [1, 2]), 1).long()
+        y_mask = (~make_pad_mask(y_lengths)).unsqueeze(1).to(x.device)
+        y_mask = y_mask.to(x.dtype)
+        attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
+        attn = self._generate_path(dur, attn_mask)
+
+        # expand the length to match with the feature sequence
+        # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
+        m_p = torch.matmul(
+            attn.squeeze(1),
+            m_p.transpose(1, 2),
+        ).transpose(1, 2)
+        # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
+        logs_p = torch.matmul(
+            attn.squeeze(1),
+            logs_p.transpose(1, 2),
+        ).transpose(1, 2)
+
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        return z_p, y_mask, attn, dur
+
+    def inference_streaming(
+        self,
+        text: torch.Tensor,
+        text_lengths: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        spembs: Optional[torch.Tensor] = None,
+        lids: Optional[torch.Tensor] = None,
+        dur: Optional[torch.Tensor] = None,
+        noise_scale: float = 0.667,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+        chunk_size: int = 64,
+        context_size: int = 16,
+        crossfade_size: int = 4,
+        first_chunk_size: Optional[int] = None,
+    ) -> Iterator[torch.Tensor]:
+        """Run inference, yielding the waveform chunk by chunk.
+
+        The text encoder, the duration predictor and the inverse flow are run
+        once, then the decoder is run on chunks of the latent with
+        :func:`streaming.stream_synthesis`, so that the first audio is
+        available long before the whole utterance is synthesized.
+
+        Args:
+            text (Tensor): Input text index tensor (1, T_text,).
+            text_lengths (Tensor): Text length tensor (1,).
+            sids (Optional[Tensor]): Speaker index tensor (1,) or (1, 1).
+            spembs (Optional[Tensor]): Speaker embedding tensor (1, spk_embed_dim).
+            lids (Optional[Tensor]): Language index tensor (1,) or (1, 1).
+            dur (Optional[Tensor]): Ground-truth duration (1, 1, T_text,).
+            noise_scale (float): Noise scale parameter for flow.
+            noise_scale_dur (float): Noise scale parameter for duration predictor.
+            alpha (float): Alpha parameter to control the speed of generated speech.
+            chunk_size (int): Number of frames synthesized at a time.
+            context_size (int): Number of context frames on each side of a chunk.
+                The default covers the receptive field of the decoder, so the
+                output equals that of inference().
+            crossfade_size (int): Number of frames by which chunks overlap.
+            first_chunk_size (Optional[int]): Number of frames of the first chunk.
+
+        Returns:
+            Iterator[Tensor]: Waveform chunks (T_chunk,).
+
+        """
+        assert text.size(0) == 1, "Only batch size 1 is supported"
+        x, m_p, logs_p, x_mask, g = self._encode_text(
+            text, text_lengths, sids=sids, spembs=spembs, lids=lids
+        )
+        z_p, y_mask, _, _ = self._sample_latent(
+            x,
+            m_p,
+            logs_p,
+            x_mask,
+            g=g,
+            dur=dur,
+            noise_scale=noise_scale,
+            noise_scale_dur=noise_scale_dur,
+            alpha=alpha,
+        )
+
+        # The flow is cheap compared to the decoder, so it is run on the
+        # whole utterance and only the decoder needs context frames.
+        z = self.flow(z_p, y_mask, g=g, inverse=True)
+
+        yield from stream_synthesis(
+            lambda z: self.decoder(z, g=g),
+            z,
+            hop_length=self.upsample_factor,
+            chunk_size=chunk_size,
+            context_size=context_size,
+            crossfade_size=crossfade_size,
+            first_chunk_size=first_chunk_size,
+        )
+
     def _generate_path(self, dur: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
         """Generate path a.k.a. monotonic attention.
 
@@ -0,0 +1,111 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Chunked synthesis of a waveform from frame-level features.
+
+The HiFiGAN decoder of VITS and the HiFiGAN vocoder of Matcha are
+convolutional, so the samples of a frame depend only on the
+input frames within their receptive field. :func:`stream_synthesis` runs
+such a network over chunks of the input, each padded with `context_size`
+frames of real input on both sides, and yields the audio of each chunk as
+soon as it is computed, so that playback can start after the first chunk
+instead of after the whole utterance.
+
+If `context_size` covers the receptive field, the streamed audio is the
+same as that of a single pass, up to rounding errors. Otherwise, the
+chunks are overlapped by `crossfade_size` frames and linearly crossfaded
+to hide the discontinuities at the boundaries.
+"""
+
+from typing import Callable, Iterator, Optional
+
+import torch
+
+
+def stream_synthesis(
+    decode: Callable[[torch.Tensor], torch.Tensor],
+    x: torch.Tensor,
+    hop_length: int,
+    chunk_size: int = 64,
+    context_size: int = 16,
+    crossfade_size: int = 4,
+    first_chunk_size: Optional[int] = None,
+) -> Iterator[torch.Tensor]:
+    """Synthesize a waveform chunk by chunk.
+
+    Args:
+      decode:
+        A function mapping a tensor of shape (1, C, t) to the audio of the
+        t frames, of shape (1, t * hop_length) or (1, 1, t * hop_length).
+      x:
+        The input of `decode` for the whole utterance, of shape (1, C, T).
+      hop_length:
+        Number of samples per frame.
+      chunk_size:
+        Number of frames synthesized at a time.
+      context_size:
+        Number of frames on each side of a chunk passed to `decode` to
+        cover its receptive field. They are not part of the output.
+      crossfade_size:
+        Number of frames by which consecutive chunks overlap. It must not
+        be larger than `chunk_size` or `first_chunk_size`.
+      first_chunk_size:
+        Number of frames of the first chunk. Defaults to `chunk_size`. A
+        smaller value reduces the latency to the first audio.
+    Returns:
+      Yield 1-D tensors of audio; together they have T * hop_length samples.
+    """
+    assert x.ndim == 3 and x.size(0) == 1, x.shape
+    if first_chunk_size is None:
+        first_chunk_size = chunk_size
+    assert 0 <= crossfade_size <= min(chunk_size, first_chunk_size), (
+        crossfade_size,
+        chunk_size,
+        first_chunk_size,
+    )
+    num_frames = x.size(2)
+    fade = crossfade_size * hop_length
+    fade_in = torch.arange(1, fade + 1, device=x.device, dtype=x.dtype) / (fade + 1)
+
+    # The last `crossfade_size` frames of the previous chunk
+    tail = None
+    start = 0
+    end = min(first_chunk_size, num_frames)
+    while start < num_frames:
+        # Frames [out_start, end) are synthesized; the first `crossfade_size`
+        # of them overlap with `tail`.
+        out_start = start if tail is None else start - crossfade_size
+        win_start = max(0, out_start - context_size)
+        win_end = min(num_frames, end + context_size)
+        audio = decode(x[:, :, win_start:win_end]).reshape(-1)
+        audio = audio[(out_start - win_start) * hop_length :]
+        audio = audio[: (end - out_start) * hop_length]
+
+        if tail is not None:
+            head = audio[:fade] * fade_in + tail * fade_in.flip(0)
+            audio = torch.cat([head, audio[fade:]])
+
+        if end < num_frames and fade > 0:
+            tail = audio[-fade:]
+            audio = audio[:-fade]
+        elif end < num_frames:
+            tail = audio[:0]
+
+        yield audio
+
+        start = end
+        end = min(start + chunk_size, num_frames)
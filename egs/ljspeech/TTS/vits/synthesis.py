@@ -0,0 +1,453 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline synthesis of many utterances with VITS, e.g., to generate
+synthetic data for ASR.
+
+The flow and the decoder of VITS run on the padded number of frames of a
+batch, so the cost of a batch is its size times the number of frames of its
+longest utterance, and batches of utterances of random lengths waste most
+of the compute on padding. Here,
+
+  (1) the durations of all utterances are predicted first, with the text
+      encoder and the duration predictor only, which are cheap compared to
+      the flow and the decoder,
+  (2) the utterances are sorted by their number of frames and grouped into
+      batches of at most `max_frames` padded frames, so all batches have
+      about the same cost,
+  (3) the batches are synthesized with the predicted durations, and the
+      audio is written by a pool of threads, with a bounded number of
+      pending files so that the memory does not grow if writing is slower
+      than synthesis, and
+  (4) optionally, the utterances are split across several processes, each
+      with its own copy of the model and its own threads, which is faster
+      on CPU than a single process with many threads.
+
+The recipes provide a `setup` function returning the model, the tokenizer
+and a function mapping speakers to the inputs of the model for speaker
+conditioning; see ./synthesize.py.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torchaudio
+from torch.nn.utils.rnn import pad_sequence
+
+from icefall.utils import AttributeDict, setup_logger
+
+# Maps the speakers of a batch to keyword arguments of
+# VITS.inference_batch(), e.g., {"sids": ...}
+SpeakerInputs = Callable[[List[Optional[str]], torch.device], Dict[str, torch.Tensor]]
+
+
+@dataclass
+class Utterance:
+    id: str
+    text: str
+    speaker: Optional[str] = None
+
+
+def add_synthesis_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--input-file",
+        type=str,
+        required=True,
+        help="""A text file with one utterance per line, formatted as
+        "utt_id text", or "utt_id speaker text" for multi-speaker models.
+        """,
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        required=True,
+        help="""The audio of each utterance is saved to
+        <output-dir>/<utt_id>.wav. Utterances whose file exists are skipped,
+        so an interrupted run can be resumed.
+        """,
+    )
+
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        default=10000,
+        help="""Maximum number of padded frames of a batch, i.e., batch size
+        times the number of frames of its longest utterance.
+        Reduce it if you run out of memory.
+        """,
+    )
+
+    parser.add_argument(
+        "--num-writers",
+        type=int,
+        default=4,
+        help="Number of threads writing audio files.",
+    )
+
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=256,
+        help="""Maximum number of audio files waiting to be written.
+        Synthesis is blocked when it is reached.
+        """,
+    )
+
+    parser.add_argument(
+        "--num-processes",
+        type=int,
+        default=1,
+        help="""Number of processes to split the utterances across. Each process
+        loads the model. With CUDA, process i uses GPU i %% num_gpus.
+        """,
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="If given, the number of threads of torch in each process.",
+    )
+
+    parser.add_argument(
+        "--noise-scale",
+        type=float,
+        default=0.667,
+        help="Noise scale of the flow.",
+    )
+
+    parser.add_argument(
+        "--noise-scale-dur",
+        type=float,
+        default=0.8,
+        help="Noise scale of the duration predictor.",
+    )
+
+    parser.add_argument(
+        "--length-scale",
+        type=float,
+        default=1.0,
+        help="Scale of the predicted durations. Larger values give slower speech.",
+    )
+
+
+def read_utterances(filename: str, with_speaker: bool = False) -> List[Utterance]:
+    """Read utterances from a text file with lines "utt_id text", or
+    "utt_id speaker text" if `with_speaker` is True."""
+    utterances = []
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            fields = line.strip().split(maxsplit=2 if with_speaker else 1)
+            if len(fields) == 0:
+                continue
+            if len(fields) != (3 if with_speaker else 2):
+                logging.warning(f"Skip invalid line: {line.strip()}")
+                continue
+            if with_speaker:
+                utterances.append(Utterance(fields[0], fields[2], fields[1]))
+            else:
+                utterances.append(Utterance(fields[0], fields[1]))
+    return utterances
+
+
+def make_batches(lengths: List[int], max_frames: int) -> List[List[int]]:
+    """Group sequences into batches whose size times the length of their
+    longest sequence is at most `max_frames`. Sequences are sorted by
+    decreasing length, so that each batch has sequences of similar lengths,
+    and the first batch is the largest one; a sequence longer than
+    `max_frames` is put in a batch of its own.
+
+    Args:
+      lengths:
+        The lengths of the sequences.
+      max_frames:
+        The maximum cost of a batch.
+    Returns:
+      Return the indexes of the sequences in each batch.
+    """
+    indexes = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    for i in indexes:
+        # The first sequence of a batch is the longest one
+        if len(batch) > 0 and (len(batch) + 1) * lengths[batch[0]] > max_frames:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+class AudioWriter:
+    """Write audio files from a pool of threads.
+
+    :meth:`write` blocks if `max_pending` files are waiting to be written.
+    Each file is first written to a temporary file that is then renamed, so
+    that an interrupted run leaves no truncated files. The first error of a
+    writer thread is raised by :meth:`close`.
+    """
+
+    def __init__(
+        self, sampling_rate: int, num_workers: int = 4, max_pending: int = 256
+    ):
+        self.sampling_rate = sampling_rate
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+    def _save(self, filename: Path, audio: torch.Tensor):
+        tmp_filename = filename.with_suffix(".tmp.wav")
+        torchaudio.save(str(tmp_filename), audio, sample_rate=self.sampling_rate)
+        os.replace(tmp_filename, filename)
+
+    def _done(self, future):
+        self.pending.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def write(self, filename: Path, audio: torch.Tensor):
+        """Write `audio` of shape (1, num_samples) to `filename`."""
+        if len(self.errors) > 0:
+            raise self.errors[0]
+        self.pending.acquire()
+        future = self.executor.submit(self._save, filename, audio)
+        future.add_done_callback(self._done)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    def __enter__(self) -> "AudioWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _pad(token_ids: List[List[int]], pad_id: int, device: torch.device):
+    tokens = pad_sequence(
+        [torch.tensor(t, dtype=torch.int64) for t in token_ids],
+        batch_first=True,
+        padding_value=pad_id,
+    )
+    tokens_lens = torch.tensor([len(t) for t in token_ids], dtype=torch.int64)
+    return tokens.to(device), tokens_lens.to(device)
+
+
+@torch.no_grad()
+def synthesize(
+    model: nn.Module,
+    utterances: List[Utterance],
+    token_ids: List[List[int]],
+    params: AttributeDict,
+    pad_id: int,
+    speaker_inputs: Optional[SpeakerInputs] = None,
+) -> float:
+    """Synthesize `utterances` in batches of similar lengths and write the
+    audio to `params.output_dir`.
+
+    Args:
+      model:
+        The VITS model.
+      utterances:
+        The utterances to synthesize.
+      token_ids:
+        The token IDs of each utterance.
+      params:
+        It contains the options of :func:`add_synthesis_arguments`, and
+        `sampling_rate`.
+      pad_id:
+        The padding token ID.
+      speaker_inputs:
+        Maps the speakers of a batch to the speaker conditioning of the
+        model. None for single-speaker models.
+    Returns:
+      Return the duration of the synthesized audio in seconds.
+    """
+    device = next(model.parameters()).device
+    output_dir = Path(params.output_dir)
+    hop_length = model.generator.upsample_factor
+
+    def get_speaker_inputs(batch: List[int]) -> Dict[str, torch.Tensor]:
+        if speaker_inputs is None:
+            return {}
+        return speaker_inputs([utterances[i].speaker for i in batch], device)
+
+    # (1) Predict the durations, in batches of similar numbers of tokens.
+    # There are fewer tokens than frames, so the same budget is safe.
+    durations = [None] * len(utterances)
+    for batch in make_batches([len(t) for t in token_ids], params.max_frames):
+        tokens, tokens_lens = _pad([token_ids[i] for i in batch], pad_id, device)
+        dur = model.generator.predict_durations(
+            text=tokens,
+            text_lengths=tokens_lens,
+            noise_scale_dur=params.noise_scale_dur,
+            alpha=params.length_scale,
+            **get_speaker_inputs(batch),
+        ).squeeze(1)
+        for j, i in enumerate(batch):
+            durations[i] = dur[j, : len(token_ids[i])]
+
+    # (2) Group the utterances by their number of frames
+    num_frames = [max(int(d.sum().item()), 1) for d in durations]
+    batches = make_batches(num_frames, params.max_frames)
+    padded_frames = sum(len(b) * num_frames[b[0]] for b in batches)
+    logging.info(
+        f"{len(utterances)} utterances, {sum(num_frames)} frames, "
+        f"{len(batches)} batches, "
+        f"padding {1 - sum(num_frames) / padded_frames:.2%} of the frames"
+    )
+
+    # (3) Synthesize and write
+    num_samples = 0
+    start = time.time()
+    with AudioWriter(
+        params.sampling_rate,
+        num_workers=params.num_writers,
+        max_pending=params.max_pending,
+    ) as writer:
+        for batch_idx, batch in enumerate(batches):
+            tokens, tokens_lens = _pad([token_ids[i] for i in batch], pad_id, device)
+            dur = pad_sequence([durations[i] for i in batch], batch_first=True)
+            audio, _, _ = model.inference_batch(
+                text=tokens,
+                text_lengths=tokens_lens,
+                durations=dur,
+                noise_scale=params.noise_scale,
+                **get_speaker_inputs(batch),
+            )
+            audio = audio.cpu()
+            for j, i in enumerate(batch):
+                length = num_frames[i] * hop_length
+                writer.write(
+                    output_dir / f"{utterances[i].id}.wav",
+                    audio[j : j + 1, :length].clone(),
+                )
+                num_samples += length
+
+            if batch_idx % 20 == 0:
+                elapsed = time.time() - start
+                seconds = num_samples / params.sampling_rate
+                logging.info(
+                    f"batch {batch_idx}/{len(batches)}, "
+                    f"{seconds:.1f} s of audio in {elapsed:.1f} s"
+                )
+
+    return num_samples / params.sampling_rate
+
+
+def _worker(
+    rank: int,
+    world_size: int,
+    params: AttributeDict,
+    utterances: List[Utterance],
+    setup: Callable[[AttributeDict, torch.device], Tuple],
+):
+    if world_size > 1:
+        setup_logger(f"{params.output_dir}/log/log-synthesize-{rank}")
+    if params.num_threads is not None:
+        torch.set_num_threads(params.num_threads)
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", rank % torch.cuda.device_count())
+
+    # The utterances are sorted by length, so each process gets a similar share
+    utterances = utterances[rank::world_size]
+    if len(utterances) == 0:
+        return
+
+    model, tokenizer, speaker_inputs = setup(params, device)
+    model.to(device)
+    model.eval()
+
+    token_ids = tokenizer.texts_to_token_ids(
+        [u.text for u in utterances],
+        intersperse_blank=True,
+        add_sos=True,
+        add_eos=True,
+    )
+
+    start = time.time()
+    seconds = synthesize(
+        model,
+        utterances,
+        token_ids,
+        params,
+        pad_id=tokenizer.pad_id,
+        speaker_inputs=speaker_inputs,
+    )
+    elapsed = time.time() - start
+    logging.info(
+        f"Process {rank}: {seconds:.1f} s of audio in {elapsed:.1f} s, "
+        f"RTF {elapsed / max(seconds, 1e-6):.4f}"
+    )
+
+
+def run_synthesis(
+    params: AttributeDict,
+    utterances: List[Utterance],
+    setup: Callable[[AttributeDict, torch.device], Tuple],
+):
+    """Synthesize `utterances` in `params.num_processes` processes.
+
+    Args:
+      params:
+        It contains the options of :func:`add_synthesis_arguments` and
+        those needed by `setup`.
+      utterances:
+        The utterances to synthesize.
+      setup:
+        Called in each process with `params` and the device to use. It
+        returns the model, the tokenizer and the :data:`SpeakerInputs` of
+        the model, or None for single-speaker models. With more than one
+        process, it must be a module level function so that it can be
+        pickled.
+    """
+    output_dir = Path(params.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    num_utterances = len(utterances)
+    utterances = [u for u in utterances if not (output_dir / f"{u.id}.wav").is_file()]
+    if len(utterances) < num_utterances:
+        logging.info(
+            f"Skip {num_utterances - len(utterances)} utterances "
+            f"that are already synthesized"
+        )
+    utterances = sorted(utterances, key=lambda u: len(u.text), reverse=True)
+
+    if params.num_processes > 1:
+        mp.spawn(
+            _worker,
+            args=(params.num_processes, params, utterances, setup),
+            nprocs=params.num_processes,
+            join=True,
+        )
+    else:
+        _worker(0, 1, params, utterances, setup)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import torch
+import torch.nn as nn
+from streaming import stream_synthesis
+from vits import VITS
+
+
+def get_decoder(hop_length: int) -> nn.Module:
+    # The receptive field is 3 + 1 frames on each side
+    return nn.Sequential(
+        nn.Conv1d(8, 16, kernel_size=7, padding=3),
+        nn.ConvTranspose1d(
+            16,
+            1,
+            kernel_size=2 * hop_length,
+            stride=hop_length,
+            padding=hop_length // 2,
+        ),
+    )
+
+
+def test_stream_synthesis():
+    torch.manual_seed(0)
+    hop_length = 4
+    decoder = get_decoder(hop_length)
+    x = torch.randn(1, 8, 50)
+    with torch.no_grad():
+        expected = decoder(x).reshape(-1)
+        for chunk_size, first_chunk_size, crossfade_size in [
+            (10, None, 0),
+            (10, 3, 2),
+            (7, 7, 7),
+            (64, None, 4),
+        ]:
+            chunks = list(
+                stream_synthesis(
+                    decoder,
+                    x,
+                    hop_length=hop_length,
+                    chunk_size=chunk_size,
+                    context_size=5,
+                    crossfade_size=crossfade_size,
+                    first_chunk_size=first_chunk_size,
+                )
+            )
+            if first_chunk_size is not None:
+                assert (
+                    chunks[0].numel()
+                    == (first_chunk_size - crossfade_size) * hop_length
+                )
+            assert torch.allclose(torch.cat(chunks), expected, atol=1e-6)
+
+        # Without enough context, chunks are crossfaded
+        audio = torch.cat(
+            list(
+                stream_synthesis(
+                    decoder,
+                    x,
+                    hop_length=hop_length,
+                    chunk_size=10,
+                    context_size=1,
+                    crossfade_size=2,
+                )
+            )
+        )
+        assert audio.shape == expected.shape
+        assert (audio - expected).abs().max() < expected.abs().max()
+
+
+def get_tiny_vits(vocab_size: int) -> VITS:
+    generator_params = {
+        "hidden_channels": 16,
+        "spks": None,
+        "langs": None,
+        "spk_embed_dim": None,
+        "global_channels": -1,
+        "segment_size": 32,
+        "text_encoder_attention_heads": 2,
+        "text_encoder_ffn_expand": 2,
+        "text_encoder_cnn_module_kernel": 5,
+        "text_encoder_blocks": 1,
+        "text_encoder_dropout_rate": 0.1,
+        "decoder_kernel_size": 7,
+        "decoder_channels": 32,
+        "decoder_upsample_scales": [4, 4],
+        "decoder_upsample_kernel_sizes": [8, 8],
+        "decoder_resblock_kernel_sizes": [3, 5],
+        "decoder_resblock_dilations": [[1, 3], [1, 3]],
+        "use_weight_norm_in_decoder": True,
+        "posterior_encoder_kernel_size": 5,
+        "posterior_encoder_layers": 2,
+        "posterior_encoder_stacks": 1,
+        "posterior_encoder_base_dilation": 1,
+        "posterior_encoder_dropout_rate": 0.0,
+        "use_weight_norm_in_posterior_encoder": True,
+        "flow_flows": 2,
+        "flow_kernel_size": 5,
+        "flow_base_dilation": 1,
+        "flow_layers": 2,
+        "flow_dropout_rate": 0.0,
+        "use_weight_norm_in_flow": True,
+        "use_only_mean_in_flow": True,
+        "stochastic_duration_predictor_kernel_size": 3,
+        "stochastic_duration_predictor_dropout_rate": 0.5,
+        "stochastic_duration_predictor_flows": 2,
+        "stochastic_duration_predictor_dds_conv_layers": 2,
+    }
+    return VITS(
+        vocab_size=vocab_size,
+        feature_dim=33,
+        generator_params=generator_params,
+    ).eval()
+
+
+def test_vits_inference_streaming():
+    torch.manual_seed(0)
+    model = get_tiny_vits(vocab_size=20)
+    hop_length = 16
+    text = torch.randint(1, 20, (30,))
+
+    with torch.no_grad():
+        for seed in range(2):
+            # The same random noise for the durations and the latent
+            torch.manual_seed(seed)
+            wav, _, dur = model.inference(text)
+            num_frames = int(dur.sum())
+            assert wav.numel() == num_frames * hop_length
+
+            torch.manual_seed(seed)
+            chunks = list(
+                model.inference_streaming(
+                    text, chunk_size=num_frames, context_size=0, crossfade_size=0
+                )
+            )
+            assert len(chunks) == 1
+            assert torch.allclose(chunks[0], wav, atol=1e-6)
+
+            # The receptive field of the decoder is shorter than the context
+            torch.manual_seed(seed)
+            streamed = torch.cat(
+                list(
+                    model.inference_streaming(
+                        text,
+                        chunk_size=8,
+                        context_size=16,
+                        crossfade_size=2,
+                        first_chunk_size=4,
+                    )
+                )
+            )
+            assert streamed.shape == wav.shape
+            assert torch.allclose(streamed, wav, atol=1e-5), (
+                (streamed - wav).abs().max()
+            )
+
+            # Without enough context, the chunks differ near their borders
+            # but stay close thanks to the crossfade
+            torch.manual_seed(seed)
+            streamed = torch.cat(
+                list(
+                    model.inference_streaming(
+                        text, chunk_size=8, context_size=1, crossfade_size=2
+                    )
+                )
+            )
+            assert streamed.shape == wav.shape
+            assert not torch.allclose(streamed, wav, atol=1e-5)
+            assert (streamed - wav).abs().max() < 0.5 * wav.abs().max()
+
+
+def main():
+    test_stream_synthesis()
+    test_vits_inference_streaming()
+
+
+if __name__ == "__main__":
+    main()
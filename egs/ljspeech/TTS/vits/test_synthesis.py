@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import tempfile
+from pathlib import Path
+
+import torch
+import torchaudio
+from synthesis import AudioWriter, make_batches
+
+
+def test_make_batches():
+    lengths = [5, 1, 9, 3, 3, 12]
+    batches = make_batches(lengths, max_frames=10)
+    assert batches == [[5], [2], [0, 3], [4, 1]], batches
+
+    for max_frames in [1, 10, 20, 100]:
+        batches = make_batches(lengths, max_frames)
+        assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+        for b in batches:
+            cost = len(b) * max(lengths[i] for i in b)
+            assert len(b) == 1 or cost <= max_frames, (b, max_frames)
+
+
+def test_audio_writer():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audios = [torch.rand(1, 100 * (i + 1)) - 0.5 for i in range(10)]
+        with AudioWriter(16000, num_workers=2, max_pending=3) as writer:
+            for i, audio in enumerate(audios):
+                writer.write(Path(tmp_dir) / f"{i}.wav", audio)
+
+        assert sorted(p.name for p in Path(tmp_dir).iterdir()) == sorted(
+            f"{i}.wav" for i in range(10)
+        )
+        for i, audio in enumerate(audios):
+            saved, sampling_rate = torchaudio.load(f"{tmp_dir}/{i}.wav")
+            assert sampling_rate == 16000
+            assert torch.allclose(saved, audio, atol=1e-4)
+
+        # Errors of the writer threads are raised
+        writer = AudioWriter(16000)
+        writer.write(Path(tmp_dir) / "missing" / "0.wav", audios[0])
+        try:
+            writer.close()
+        except Exception:
+            pass
+        else:
+            assert False, "No error is raised"
+
+
+def main():
+    test_make_batches()
+    test_audio_writer()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@
 """VITS module for GAN-TTS task."""
 
 import copy
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -617,6 +617,69 @@ class VITS(nn.Module):
             )
         return wav.view(-1), att_w[0], dur[0]
 
+    def inference_streaming(
+        self,
+        text: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        spembs: Optional[torch.Tensor] = None,
+        lids: Optional[torch.Tensor] = None,
+        durations: Optional[torch.Tensor] = None,
+        noise_scale: float = 0.667,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+        chunk_size: int = 64,
+        context_size: int = 16,
+        crossfade_size: int = 4,
+        first_chunk_size: Optional[int] = None,
+    ) -> Iterator[torch.Tensor]:
+        """Run inference for single sample, yielding the waveform chunk by chunk.
+
+        Args:
+            text (Tensor): Input text index tensor (T_text,).
+            sids (Tensor): Speaker index tensor (1,).
+            spembs (Optional[Tensor]): Speaker embedding tensor (spk_embed_dim,).
+            lids (Tensor): Language index tensor (1,).
+            durations (Tensor): Ground-truth duration tensor (T_text,).
+            noise_scale (float): Noise scale value for flow.
+            noise_scale_dur (float): Noise scale value for duration predictor.
+            alpha (float): Alpha parameter to control the speed of generated speech.
+            chunk_size (int): Number of frames synthesized at a time.
+            context_size (int): Number of context frames on each side of a chunk.
+            crossfade_size (int): Number of frames by which chunks overlap.
+            first_chunk_size (Optional[int]): Number of frames of the first chunk.
+
+        Returns:
+            Iterator[Tensor]: Generated waveform chunks (T_chunk,).
+        """
+        text = text[None]
+        text_lengths = torch.tensor(
+            [text.size(1)],
+            dtype=torch.long,
+            device=text.device,
+        )
+        if sids is not None:
+            sids = sids.view(1)
+        if lids is not None:
+            lids = lids.view(1)
+        if durations is not None:
+            durations = durations.view(1, 1, -1)
+
+        return self.generator.inference_streaming(
+            text=text,
+            text_lengths=text_lengths,
+            sids=sids,
+            spembs=spembs,
+            lids=lids,
+            dur=durations,
+            noise_scale=noise_scale,
+            noise_scale_dur=noise_scale_dur,
+            alpha=alpha,
+            chunk_size=chunk_size,
+            context_size=context_size,
+            crossfade_size=crossfade_size,
+            first_chunk_size=first_chunk_size,
+        )
+
     def inference_batch(
         self,
         text: torch.Tensor,
@@ -639,6 +702,8 @@ class VITS(nn.Module):
             sids (Tensor): Speaker index tensor (B,).
             spembs (Optional[Tensor]): Speaker embedding tensor (B, spk_embed_dim).
             lids (Tensor): Language index tensor (B,).
+            durations (Optional[Tensor]): Duration tensor (B, T_text), e.g.,
+                from generator.predict_durations(). If None, predict them.
             noise_scale (float): Noise scale value for flow.
             noise_scale_dur (float): Noise scale value for duration predictor.
             alpha (float): Alpha parameter to control the speed of generated speech.
@@ -649,6 +714,9 @@ class VITS(nn.Module):
             * att_w (Tensor): Monotonic attention weight tensor (B, T_feats, T_text).
             * duration (Tensor): Predicted duration tensor (B, T_text).
         """
+        if durations is not None:
+            durations = durations.view(durations.size(0), 1, -1)
+
         # inference
         wav, att_w, dur = self.generator.inference(
             text=text,
@@ -656,6 +724,7 @@ class VITS(nn.Module):
             sids=sids,
             spembs=spembs,
             lids=lids,
+            dur=durations,
             noise_scale=noise_scale,
             noise_scale_dur=noise_scale_dur,
             alpha=alpha,
@@ -0,0 +1 @@
+../../../aishell/ASR/whisper/whisper_batched_decoding.py
\ No newline at end of file
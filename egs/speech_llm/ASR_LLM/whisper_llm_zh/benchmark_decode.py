@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the throughput of SPEECH_LLM.decode(), which calls
+llm.generate(), and SPEECH_LLM.decode_cached(), which reuses the key/value
+states of the prompt prefix and removes finished utterances from the batch,
+and checks that both give the same tokens. It also reports the throughput of
+decode_cached() when only the valid speech frames are given to the LLM.
+
+A tiny randomly initialized whisper encoder and Qwen2 LLM are used, so it
+needs neither checkpoints nor a tokenizer.
+
+Usage:
+
+    ./whisper_llm_zh/benchmark_decode.py --batch-size 16 --num-batches 5
+"""
+
+import argparse
+import logging
+import time
+from typing import List
+
+import torch
+import whisper
+from model import SPEECH_LLM, EncoderProjector
+from transformers import Qwen2Config, Qwen2ForCausalLM
+from whisper_encoder_forward_monkey_patch import replace_whisper_encoder_forward
+
+# Token IDs of the tiny LLM
+PAD_ID = 0
+BOS_ID = 1
+EOS_ID = 2
+SPEECH_ID = 3
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--llm-dim",
+        type=int,
+        default=256,
+        help="Hidden size of the LLM.",
+    )
+
+    parser.add_argument(
+        "--llm-layers",
+        type=int,
+        default=4,
+        help="Number of layers of the LLM.",
+    )
+
+    parser.add_argument(
+        "--encoder-dim",
+        type=int,
+        default=256,
+        help="Dimension of the whisper encoder.",
+    )
+
+    parser.add_argument(
+        "--encoder-layers",
+        type=int,
+        default=4,
+        help="Number of layers of the whisper encoder.",
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="Number of utterances per batch.",
+    )
+
+    parser.add_argument(
+        "--num-batches",
+        type=int,
+        default=5,
+        help="Number of batches to decode with each method.",
+    )
+
+    parser.add_argument(
+        "--min-frames",
+        type=int,
+        default=200,
+        help="Minimum number of feature frames of an utterance.",
+    )
+
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        default=1000,
+        help="Maximum number of feature frames of an utterance.",
+    )
+
+    parser.add_argument(
+        "--max-new-tokens",
+        type=int,
+        default=50,
+        help="Maximum number of generated tokens per utterance.",
+    )
+
+    return parser.parse_args()
+
+
+def get_model(args) -> SPEECH_LLM:
+    replace_whisper_encoder_forward()
+    encoder = whisper.model.AudioEncoder(
+        n_mels=80,
+        n_ctx=1500,
+        n_state=args.encoder_dim,
+        n_head=4,
+        n_layer=args.encoder_layers,
+    )
+    config = Qwen2Config(
+        vocab_size=1000,
+        hidden_size=args.llm_dim,
+        intermediate_size=args.llm_dim * 4,
+        num_hidden_layers=args.llm_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        pad_token_id=PAD_ID,
+        bos_token_id=BOS_ID,
+        eos_token_id=EOS_ID,
+    )
+    config.default_speech_token_id = SPEECH_ID
+    llm = Qwen2ForCausalLM(config)
+    encoder_projector = EncoderProjector(args.encoder_dim, args.llm_dim, 8)
+    return SPEECH_LLM(encoder, llm, encoder_projector)
+
+
+def strip(tokens: List[int]) -> List[int]:
+    """Remove the end token and the padding after it."""
+    return tokens[: tokens.index(EOS_ID)] if EOS_ID in tokens else tokens
+
+
+def timed(f, *args, **kwargs):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    result = f(*args, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return result, time.time() - start
+
+
+@torch.no_grad()
+def main():
+    args = get_args()
+    logging.info(vars(args))
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    torch.manual_seed(0)
+    model = get_model(args)
+    model.to(device)
+    model.eval()
+
+    # "<|im_start|>user\n<speech>请转写音频为文字<|im_end|>\n<|im_start|>assistant\n"
+    prompt_ids = [BOS_ID, 10, 11, SPEECH_ID] + list(range(20, 30)) + [EOS_ID, 11]
+    prompt_ids += [BOS_ID, 12, 11]
+
+    methods = ["generate", "cached", "cached-valid-frames"]
+    elapsed = {m: 0.0 for m in methods}
+    num_tokens = {m: 0 for m in methods}
+    for i in range(args.num_batches):
+        feature_lens = torch.randint(
+            args.min_frames, args.max_frames + 1, (args.batch_size,), device=device
+        )
+        fbank = torch.randn(args.batch_size, 80, feature_lens.max(), device=device)
+        fbank.masked_fill_(
+            torch.arange(fbank.shape[-1], device=device) >= feature_lens[:, None, None],
+            0,
+        )
+        input_ids = torch.tensor([prompt_ids] * args.batch_size, device=device)
+
+        generated_ids, t = timed(
+            model.decode,
+            fbank,
+            input_ids,
+            input_ids.ne(PAD_ID),
+            max_new_tokens=args.max_new_tokens,
+        )
+        results = {"generate": [strip(ids) for ids in generated_ids.tolist()]}
+        elapsed["generate"] += t
+
+        results["cached"], t = timed(
+            model.decode_cached,
+            fbank,
+            prompt_ids,
+            max_new_tokens=args.max_new_tokens,
+        )
+        elapsed["cached"] += t
+
+        results["cached-valid-frames"], t = timed(
+            model.decode_cached,
+            fbank,
+            prompt_ids,
+            feature_lens=feature_lens,
+            max_new_tokens=args.max_new_tokens,
+        )
+        elapsed["cached-valid-frames"] += t
+
+        for m in methods:
+            num_tokens[m] += sum(len(ids) for ids in results[m])
+        same = results["generate"] == results["cached"]
+        lens = [len(ids) for ids in results["cached"]]
+        logging.info(
+            f"batch {i}: {min(lens)} to {max(lens)} tokens per utterance, "
+            f"same tokens with generate() and decode_cached(): {same}"
+        )
+
+    num_utterances = args.num_batches * args.batch_size
+    for m in methods:
+        logging.info(
+            f"{m}: {num_utterances / elapsed[m]:.2f} utterances/s, "
+            f"{num_tokens[m] / elapsed[m]:.1f} tokens/s"
+        )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -44,6 +44,13 @@ python3 ./whisper_llm_zh/decode.py \
   --manifest-dir data/fbank \
   --use-flash-attn True \
   --use-lora True --dataset aishell
+
+# By default, the utterances of a batch are split into buckets of similar
+# lengths, and each bucket is decoded greedily with SPEECH_LLM.decode_cached(),
+# which reuses the key/value states of the prompt before the speech and stops
+# decoding each utterance at its end. Use --use-prefix-cache False to decode
+# with llm.generate() instead, and --use-valid-frames True to give only the
+# speech features of the valid frames of each utterance to the LLM.
 """
 
 import argparse
@@ -218,6 +225,37 @@ def get_parser():
         help="replace whisper encoder forward method to remove input length restriction",
     )
 
+    parser.add_argument(
+        "--use-prefix-cache",
+        type=str2bool,
+        default=True,
+        help="""If True, decode greedily with SPEECH_LLM.decode_cached(), which
+        computes the prompt tokens before the speech only once and removes
+        finished utterances from the batch. If False, use llm.generate().
+        """,
+    )
+
+    parser.add_argument(
+        "--use-valid-frames",
+        type=str2bool,
+        default=False,
+        help="""If True, only the speech features of the valid frames of each
+        utterance are given to the LLM, instead of all the padded ones.
+        Used only with --use-prefix-cache True.
+        """,
+    )
+
+    parser.add_argument(
+        "--bucket-ratio",
+        type=float,
+        default=0.5,
+        help="""The utterances of a batch are sorted by length and decoded in
+        buckets, in which the shortest utterance is at least this ratio of the
+        longest one, so that short utterances are not padded to long ones.
+        0 means a single bucket. Used only with --use-prefix-cache True.
+        """,
+    )
+
     parser.add_argument(
         "--dataset",
         type=str,
@@ -239,6 +277,28 @@ def get_params() -> AttributeDict:
     return params
 
 
+def get_length_buckets(lengths: torch.Tensor, ratio: float) -> List[List[int]]:
+    """Sort the utterances by decreasing length and split them into buckets,
+    in which the shortest utterance is at least `ratio` times as long as the
+    longest one.
+
+    Args:
+      lengths:
+        A 1-D tensor with the number of frames of each utterance.
+      ratio:
+        The minimum ratio of the lengths in a bucket. 0 means a single bucket.
+    Returns:
+      Return the indexes of the utterances of each bucket.
+    """
+    buckets = []
+    for i in lengths.argsort(descending=True).tolist():
+        if buckets and lengths[i] >= ratio * lengths[buckets[-1][0]]:
+            buckets[-1].append(i)
+        else:
+            buckets.append([i])
+    return buckets
+
+
 def decode_one_batch(
     params: AttributeDict,
     model: nn.Module,
@@ -329,11 +389,31 @@ def decode_one_batch(
         ]
     ] * len(feature)
 
-    input_ids, attention_mask = preprocess(messages, tokenizer, max_len=128)
+    if params.use_prefix_cache:
+        # The prompt is the same for all the utterances
+        input_ids, _ = preprocess(messages[:1], tokenizer, max_len=128)
+        prompt_ids = input_ids[0].tolist()
+        feature_lens = supervisions["num_frames"].to(device)
+
+        generated_ids = [None] * len(feature)
+        for indexes in get_length_buckets(feature_lens, params.bucket_ratio):
+            bucket_feature = feature[indexes]
+            bucket_lens = feature_lens[indexes]
+            if params.remove_whisper_encoder_input_length_restriction:
+                bucket_feature = bucket_feature[..., : bucket_lens.max()]
+            results = model.decode_cached(
+                bucket_feature,
+                prompt_ids,
+                feature_lens=bucket_lens if params.use_valid_frames else None,
+            )
+            for i, ids in zip(indexes, results):
+                generated_ids[i] = ids
+    else:
+        input_ids, attention_mask = preprocess(messages, tokenizer, max_len=128)
 
-    generated_ids = model.decode(
-        feature, input_ids.to(device, dtype=torch.long), attention_mask.to(device)
-    )
+        generated_ids = model.decode(
+            feature, input_ids.to(device, dtype=torch.long), attention_mask.to(device)
+        )
     hyps = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
 
     return {"beam-search": hyps}
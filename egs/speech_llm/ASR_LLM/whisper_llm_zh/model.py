@@ -1,5 +1,8 @@
+from typing import List, Optional, Tuple
+
 import torch
 from torch import nn
+from transformers import DynamicCache
 from transformers.trainer_pt_utils import LabelSmoother
 
 IGNORE_TOKEN_ID = LabelSmoother.ignore_index
@@ -63,6 +66,13 @@ class SPEECH_LLM(nn.Module):
         self.encoder = encoder
         self.llm = llm
         self.encoder_projector = encoder_projector
+        # The prompt tokens before the speech and their key/value states,
+        # see `get_prefix_cache`
+        self._prefix_cache = None
+
+    def train(self, mode: bool = True):
+        self._prefix_cache = None
+        return super().train(mode)
 
     def _merge_input_ids_with_speech_features(
         self, speech_features, inputs_embeds, input_ids, attention_mask, labels=None
@@ -237,8 +247,8 @@ class SPEECH_LLM(nn.Module):
 
         encoder_outs = self.encoder(fbank)
         speech_features = self.encoder_projector(encoder_outs)
-        speech_features = speech_features.to(torch.float16)
         inputs_embeds = self.llm.get_input_embeddings()(input_ids)
+        speech_features = speech_features.to(inputs_embeds.dtype)
         (
             inputs_embeds,
             attention_mask,
@@ -264,6 +274,161 @@ class SPEECH_LLM(nn.Module):
 
         return generated_ids
 
+    def encode_speech(
+        self, fbank: torch.Tensor, feature_lens: Optional[torch.Tensor] = None
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Args:
+            fbank (:obj:`torch.Tensor`): The features, of shape (N, C, T).
+            feature_lens (:obj:`torch.Tensor`, `optional`): The number of valid frames of each utterance.
+        Returns:
+            :obj:`Tuple(torch.Tensor)`: The speech features, of shape (N, T', llm_dim), and the number of them
+            that depend on valid frames, or None if `feature_lens` is None.
+        """
+        encoder_outs = self.encoder(fbank)
+        speech_features = self.encoder_projector(encoder_outs)
+        if feature_lens is None:
+            return speech_features, None
+        # The whisper encoder subsamples by 2
+        encoder_lens = (feature_lens + 1) // 2
+        rate = self.encoder_projector.downsample_rate
+        speech_lens = ((encoder_lens + rate - 1) // rate).clamp(
+            max=speech_features.shape[1]
+        )
+        return speech_features, speech_lens
+
+    @torch.no_grad()
+    def get_prefix_cache(self, prefix_ids: List[int]) -> Tuple[Tuple[torch.Tensor]]:
+        """
+        Return the key/value states of the prompt tokens before the speech, which are the same for all the
+        utterances. They are computed once and reused until the prompt changes.
+        Args:
+            prefix_ids (:obj:`List[int]`): The prompt tokens before the speech.
+        Returns:
+            :obj:`Tuple`: The key/value states in the legacy format, with a batch size of 1.
+        """
+        if self._prefix_cache is None or self._prefix_cache[0] != prefix_ids:
+            device = self.llm.get_input_embeddings().weight.device
+            outputs = self.llm(
+                input_ids=torch.tensor([prefix_ids], device=device),
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            )
+            self._prefix_cache = (
+                list(prefix_ids),
+                outputs.past_key_values.to_legacy_cache(),
+            )
+        return self._prefix_cache[1]
+
+    @torch.no_grad()
+    def decode_cached(
+        self,
+        fbank: torch.Tensor,
+        prompt_ids: List[int],
+        feature_lens: Optional[torch.Tensor] = None,
+        max_new_tokens: int = 200,
+    ) -> List[List[int]]:
+        """
+        Greedy decoding, which gives the same results as :meth:`decode` with the default arguments, but:
+
+            - the key/value states of the prompt tokens before the speech are computed once and reused,
+              see :meth:`get_prefix_cache`;
+            - if `feature_lens` is given, only the speech features of the valid frames of each utterance
+              are given to the LLM, instead of all the padded ones;
+            - an utterance is removed from the batch as soon as its end is generated.
+
+        Args:
+            fbank (:obj:`torch.Tensor`): The features, of shape (N, C, T).
+            prompt_ids (:obj:`List[int]`): The prompt tokens, which contain one speech token and are the
+                same for all the utterances.
+            feature_lens (:obj:`torch.Tensor`, `optional`): The number of valid frames of each utterance.
+            max_new_tokens (:obj:`int`): The maximum number of generated tokens per utterance.
+        Returns:
+            :obj:`List[List[int]]`: The generated tokens of each utterance, without the end token.
+        """
+        config = self.llm.config
+        index = prompt_ids.index(config.default_speech_token_id)
+        prefix_ids, suffix_ids = prompt_ids[:index], prompt_ids[index + 1 :]
+
+        embed_tokens = self.llm.get_input_embeddings()
+        device = embed_tokens.weight.device
+        speech_features, speech_lens = self.encode_speech(fbank, feature_lens)
+        speech_features = speech_features.to(embed_tokens.weight.dtype)
+        batch_size, speech_len, _ = speech_features.shape
+        if speech_lens is None:
+            speech_lens = torch.full((batch_size,), speech_len, device=device)
+        speech_lens = speech_lens.to(device)
+
+        # The speech features and the prompt tokens after them, with the padding between the prefix and
+        # the speech, so that the last position of all the utterances is the same.
+        suffix_embeds = embed_tokens(torch.tensor(suffix_ids, device=device))
+        lens = speech_lens + len(suffix_ids)
+        max_len = speech_len + len(suffix_ids)
+        positions = torch.arange(max_len, device=device)
+        valid = positions >= (max_len - lens).unsqueeze(1)
+        speech_mask = valid & (positions < (max_len - len(suffix_ids)))
+        inputs_embeds = speech_features.new_zeros(
+            batch_size, max_len, speech_features.shape[-1]
+        )
+        # Within each utterance, the valid speech features are the first ones
+        speech_valid = torch.arange(speech_len, device=device) < speech_lens.unsqueeze(
+            1
+        )
+        inputs_embeds[speech_mask] = speech_features[speech_valid]
+        inputs_embeds[:, max_len - len(suffix_ids) :] = suffix_embeds
+
+        prefix_len = len(prefix_ids)
+        attention_mask = torch.cat(
+            [valid.new_ones(batch_size, prefix_len), valid], dim=1
+        ).long()
+        position_ids = (attention_mask.cumsum(-1) - 1).masked_fill_(
+            attention_mask == 0, 1
+        )[:, prefix_len:]
+
+        past_key_values = DynamicCache.from_legacy_cache(
+            tuple(
+                tuple(t.expand(batch_size, -1, -1, -1) for t in layer)
+                for layer in self.get_prefix_cache(prefix_ids)
+            )
+        )
+
+        results = [[] for _ in range(batch_size)]
+        # Indexes of the utterances still being decoded
+        active = torch.arange(batch_size, device=device)
+        next_positions = position_ids[:, -1] + 1
+        for step in range(max_new_tokens):
+            outputs = self.llm(
+                inputs_embeds=inputs_embeds,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            tokens = outputs.logits[:, -1].argmax(dim=-1)
+
+            finished = tokens == config.eos_token_id
+            for i, token in zip(active.tolist(), tokens.tolist()):
+                if token != config.eos_token_id:
+                    results[i].append(token)
+            if finished.all() or step + 1 == max_new_tokens:
+                break
+            if finished.any():
+                keep = (~finished).nonzero().squeeze(1)
+                active, tokens = active[keep], tokens[keep]
+                attention_mask = attention_mask[keep]
+                next_positions = next_positions[keep]
+                past_key_values.reorder_cache(keep)
+
+            inputs_embeds = embed_tokens(tokens.unsqueeze(1))
+            attention_mask = torch.cat(
+                [attention_mask, attention_mask.new_ones(len(active), 1)], dim=1
+            )
+            position_ids = next_positions.unsqueeze(1)
+            next_positions = next_positions + 1
+
+        return results
+
 
 def compute_accuracy(pad_outputs, pad_targets, ignore_label):
     """Calculate accuracy.
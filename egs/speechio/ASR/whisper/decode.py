@@ -40,6 +40,12 @@ python3 ./whisper/decode.py \
   --remove-whisper-encoder-input-length-restriction False \
   --beam-size 1 --max-duration 50
 
+# By default, the utterances of a batch are split into buckets of similar
+# lengths. The features of each bucket are trimmed to its longest utterance
+# when --remove-whisper-encoder-input-length-restriction is True, and each
+# bucket is decoded with a key/value cache in the text decoder, removing the
+# utterances whose results are known from the batch. Use
+# --use-bucketed-decoding False to decode each batch with model.decode().
 """
 
 import argparse
@@ -58,6 +64,7 @@ from lhotse.cut import Cut
 from multi_dataset import MultiDataset
 from tn.chinese.normalizer import Normalizer
 from whisper.normalizers import BasicTextNormalizer
+from whisper_batched_decoding import bucketed_decode
 from whisper_decoder_forward_monkey_patch import replace_whisper_decoder_forward
 from whisper_encoder_forward_monkey_patch import replace_whisper_encoder_forward
 from zhconv import convert
@@ -228,6 +235,27 @@ def get_parser():
         help="replace whisper encoder forward method to remove input length restriction",
     )
 
+    parser.add_argument(
+        "--use-bucketed-decoding",
+        type=str2bool,
+        default=True,
+        help="""If True, decode the utterances of a batch in buckets of similar
+        lengths, removing the finished utterances from the batch, see
+        whisper_batched_decoding.py. If False, use model.decode().
+        """,
+    )
+
+    parser.add_argument(
+        "--bucket-ratio",
+        type=float,
+        default=0.5,
+        help="""The utterances of a batch are sorted by length and decoded in
+        buckets, in which the shortest utterance is at least this ratio of the
+        longest one. 0 means a single bucket.
+        Used only with --use-bucketed-decoding True.
+        """,
+    )
+
     parser.add_argument(
         "--use-distill-whisper",
         type=str2bool,
@@ -289,8 +317,20 @@ def decode_one_batch(
     supervisions = batch["supervisions"]
     feature_len = supervisions["num_frames"]
     feature_len = feature_len.to(device, dtype=dtype)
-    results = model.decode(feature, params.decoding_options)
-    hyps = [result.text for result in results]
+    if params.use_bucketed_decoding:
+        feature_lens = None
+        if params.remove_whisper_encoder_input_length_restriction:
+            feature_lens = supervisions["num_frames"].to(device)
+        hyps = bucketed_decode(
+            model,
+            feature,
+            params.decoding_options,
+            feature_lens=feature_lens,
+            bucket_ratio=params.bucket_ratio,
+        )
+    else:
+        results = model.decode(feature, params.decoding_options)
+        hyps = [result.text for result in results]
 
     hyps = remove_punctuation(hyps)
     hyps = to_simple(hyps)
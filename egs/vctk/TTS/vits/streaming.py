@@ -0,0 +1 @@
+../../../ljspeech/TTS/vits/streaming.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../ljspeech/TTS/vits/synthesis.py
\ No newline at end of file
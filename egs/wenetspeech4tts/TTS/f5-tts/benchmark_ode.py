@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script sweeps the ODE solvers and the number of steps of CFM.sample()
+and reports, for each setting, the number of function evaluations (NFE),
+i.e., of forward passes of the DiT (the conditional and unconditional
+passes of classifier-free guidance are done in one pass), the real-time
+factor (RTF) and the mel distance to a reference solution.
+
+The reference is computed with --ref-method and --ref-steps from the same
+noise, so the mel distance (mean absolute difference of the log mel
+spectrograms of the generated frames) measures the error of the solver.
+Without --model-path, a randomly initialized model is used, which is
+enough to compare the speed; for the quality, use a trained model.
+
+Usage:
+
+    ./f5-tts/benchmark_ode.py \
+        --model-path $model_path \
+        --decoder-dim 768 --nhead 12 --num-decoder-layers 18 \
+        --methods euler,midpoint --nfe-list 4,8,16,32 \
+        --adaptive-methods bosh3 --tolerances 0.1,0.01
+"""
+
+import argparse
+import logging
+import time
+
+import torch
+from model.cfm import ADAPTIVE_METHODS
+from train import add_model_arguments, get_model, load_F5_TTS_pretrained_checkpoint
+
+from icefall.checkpoint import load_checkpoint
+from icefall.utils import str2bool
+
+# As in infer.py
+SAMPLING_RATE = 24_000
+HOP_LENGTH = 256
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        default="f5-tts/vocab.txt",
+        help="Path to the unique text tokens file",
+    )
+
+    parser.add_argument(
+        "--model-path",
+        type=str,
+        default=None,
+        help="The checkpoint to use. If None, use a randomly initialized model.",
+    )
+
+    parser.add_argument(
+        "--use-cosyvoice-semantic-token",
+        type=str2bool,
+        default=False,
+        help="Whether to use cosyvoice semantic token to replace text token.",
+    )
+
+    parser.add_argument(
+        "--prompt-frames",
+        type=int,
+        default=250,
+        help="Number of mel frames of the audio prompt.",
+    )
+
+    parser.add_argument(
+        "--gen-frames",
+        type=int,
+        default=500,
+        help="Number of mel frames to generate.",
+    )
+
+    parser.add_argument(
+        "--text-len",
+        type=int,
+        default=100,
+        help="Number of text tokens, including the text of the prompt.",
+    )
+
+    parser.add_argument(
+        "--cfg-strength",
+        type=float,
+        default=2.0,
+        help="Strength of classifier-free guidance. 0 disables it.",
+    )
+
+    parser.add_argument("-ss", "--swaysampling", default=-1, type=float)
+
+    parser.add_argument(
+        "--methods",
+        type=str,
+        default="euler,midpoint",
+        help="Comma separated fixed step solvers of torchdiffeq.",
+    )
+
+    parser.add_argument(
+        "--nfe-list",
+        type=str,
+        default="4,8,16,32",
+        help="Comma separated numbers of steps for the fixed step solvers.",
+    )
+
+    parser.add_argument(
+        "--adaptive-methods",
+        type=str,
+        default="bosh3",
+        help="Comma separated adaptive solvers of torchdiffeq.",
+    )
+
+    parser.add_argument(
+        "--tolerances",
+        type=str,
+        default="0.1,0.01",
+        help="""Comma separated relative tolerances for the adaptive solvers.
+        The absolute tolerance is a tenth of it.""",
+    )
+
+    parser.add_argument(
+        "--ref-method",
+        type=str,
+        default="rk4",
+        help="The solver of the reference solution.",
+    )
+
+    parser.add_argument(
+        "--ref-steps",
+        type=int,
+        default=64,
+        help="Number of steps of the reference solution.",
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="If given, the number of threads used by torch on CPU.",
+    )
+
+    add_model_arguments(parser)
+    return parser.parse_args()
+
+
+class CountCalls:
+    def __init__(self, module: torch.nn.Module):
+        self.num_calls = 0
+        module.register_forward_pre_hook(self)
+
+    def __call__(self, module, args):
+        self.num_calls += 1
+
+
+def synthesize(model, inputs, steps, args, odeint_kwargs):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    out, _ = model.sample(
+        steps=steps,
+        cfg_strength=args.cfg_strength,
+        sway_sampling_coef=args.swaysampling,
+        seed=0,
+        odeint_kwargs=odeint_kwargs,
+        **inputs,
+    )
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return out[:, args.prompt_frames :], time.time() - start
+
+
+@torch.inference_mode()
+def main():
+    args = get_parser()
+    logging.info(vars(args))
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    torch.manual_seed(0)
+    model = get_model(args).eval()
+    if args.model_path is not None:
+        checkpoint = torch.load(args.model_path, map_location="cpu")
+        if "ema_model_state_dict" in checkpoint or "model_state_dict" in checkpoint:
+            model = load_F5_TTS_pretrained_checkpoint(model, args.model_path)
+        else:
+            load_checkpoint(args.model_path, model=model)
+    model.to(device)
+    counter = CountCalls(model.transformer)
+
+    vocab_size = model.transformer.text_embed.text_embed.num_embeddings - 1
+    inputs = dict(
+        cond=torch.randn(1, args.prompt_frames, model.num_channels, device=device),
+        text=torch.randint(0, vocab_size, (1, args.text_len), device=device),
+        duration=args.prompt_frames + args.gen_frames,
+        lens=torch.tensor([args.prompt_frames], device=device),
+    )
+    audio_seconds = args.gen_frames * HOP_LENGTH / SAMPLING_RATE
+
+    # Also serves as a warm up
+    ref, _ = synthesize(
+        model, inputs, args.ref_steps, args, dict(method=args.ref_method)
+    )
+
+    settings = []
+    for method in args.methods.split(","):
+        for steps in args.nfe_list.split(","):
+            settings.append(
+                (f"{method}, {steps} steps", int(steps), dict(method=method))
+            )
+    for method in filter(None, args.adaptive_methods.split(",")):
+        assert method in ADAPTIVE_METHODS, method
+        for rtol in args.tolerances.split(","):
+            odeint_kwargs = dict(method=method, rtol=float(rtol), atol=float(rtol) / 10)
+            settings.append((f"{method}, rtol {rtol}", 1, odeint_kwargs))
+
+    for name, steps, odeint_kwargs in settings:
+        counter.num_calls = 0
+        out, elapsed = synthesize(model, inputs, steps, args, odeint_kwargs)
+        mel_distance = (out - ref).abs().mean().item()
+        logging.info(
+            f"{name}: NFE {counter.num_calls}, RTF {elapsed / audio_seconds:.3f}, "
+            f"mel distance {mel_distance:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
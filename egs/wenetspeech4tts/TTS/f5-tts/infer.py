@@ -15,6 +15,9 @@ python3 f5-tts/generate_averaged_model.py \
 # command for text token input
 accelerate launch f5-tts/infer.py --nfe 16 --model-path $model_path --manifest-file $manifest --output-dir $output_dir --decoder-dim 768 --nhead 12 --num-decoder-layers 18
 
+# the same, with batches of up to 20000 mel frames
+accelerate launch f5-tts/infer.py --nfe 16 --model-path $model_path --manifest-file $manifest --output-dir $output_dir --decoder-dim 768 --nhead 12 --num-decoder-layers 18 --infer-batch-size 20000
+
 # command for cosyvoice semantic token input
 split=test_zh # seed_tts_eval test_zh
 accelerate launch f5-tts/infer.py --nfe 16 --model-path $model_path --split-name $split --output-dir $output_dir --decoder-dim 768 --nhead 12 --num-decoder-layers 18 --use-cosyvoice-semantic-token True
@@ -35,7 +38,7 @@ import torch.nn.functional as F
 import torchaudio
 from accelerate import Accelerator
 from bigvganinference import BigVGANInference
-from model.cfm import CFM
+from model.cfm import ADAPTIVE_METHODS, CFM
 from model.dit import DiT
 from model.modules import MelSpec
 from model.utils import convert_char_to_pinyin
@@ -101,6 +104,39 @@ def get_parser():
 
     parser.add_argument("-ss", "--swaysampling", default=-1, type=float)
 
+    parser.add_argument(
+        "--ode-method",
+        type=str,
+        default="euler",
+        help="""The solver of torchdiffeq for the neural ODE, e.g., euler,
+        midpoint, heun2, rk4, or one of the adaptive solvers bosh3, dopri5
+        and adaptive_heun, for which --nfe and --swaysampling are ignored.
+        midpoint and heun2 evaluate the model twice per step.""",
+    )
+
+    parser.add_argument(
+        "--ode-rtol",
+        type=float,
+        default=1e-2,
+        help="Relative tolerance of the adaptive ODE solvers.",
+    )
+
+    parser.add_argument(
+        "--ode-atol",
+        type=float,
+        default=1e-3,
+        help="Absolute tolerance of the adaptive ODE solvers.",
+    )
+
+    parser.add_argument(
+        "--infer-batch-size",
+        type=int,
+        default=1,
+        help="""Maximum number of mel frames (including the prompts) of a
+        batch. Utterances of similar lengths are put in the same batch.
+        The default value 1 synthesizes one utterance at a time.""",
+    )
+
     parser.add_argument(
         "--interpolate-token",
         type=str2bool,
@@ -707,7 +743,7 @@ def main():
                 mel_spec_type="bigvgan",
                 target_rms=0.1,
                 use_truth_duration=False,
-                infer_batch_size=1,
+                infer_batch_size=args.infer_batch_size,
             )
         else:
             prompts_all = get_inference_prompt_cosy_voice(
@@ -720,7 +756,7 @@ def main():
                 mel_spec_type="bigvgan",
                 target_rms=0.1,
                 use_truth_duration=False,
-                infer_batch_size=1,
+                infer_batch_size=args.infer_batch_size,
                 interpolate_token=args.interpolate_token,
             )
     else:
@@ -740,7 +776,7 @@ def main():
             mel_spec_type="bigvgan",
             target_rms=0.1,
             use_truth_duration=False,
-            infer_batch_size=1,
+            infer_batch_size=args.infer_batch_size,
             interpolate_token=args.interpolate_token,
         )
 
@@ -759,6 +795,10 @@ def main():
             model=model,
         )
 
+    odeint_kwargs = dict(method=args.ode_method)
+    if args.ode_method in ADAPTIVE_METHODS:
+        odeint_kwargs.update(rtol=args.ode_rtol, atol=args.ode_atol)
+
     os.makedirs(args.output_dir, exist_ok=True)
 
     accelerator.wait_for_everyone()
@@ -800,6 +840,7 @@ def main():
                     sway_sampling_coef=args.swaysampling,
                     no_ref_audio=False,
                     seed=args.seed,
+                    odeint_kwargs=odeint_kwargs,
                 )
                 for i, gen in enumerate(generated):
                     gen = gen[ref_mel_lens[i] : total_mel_lens[i], :].unsqueeze(0)
@@ -27,6 +27,10 @@ from torch import nn
 from torch.nn.utils.rnn import pad_sequence
 from torchdiffeq import odeint
 
+# Solvers of torchdiffeq that choose the step sizes themselves, given the
+# tolerances `rtol` and `atol`
+ADAPTIVE_METHODS = ("adaptive_heun", "bosh3", "dopri5", "dopri8", "fehlberg2")
+
 
 class CFM(nn.Module):
     def __init__(
@@ -95,8 +99,16 @@ class CFM(nn.Module):
         duplicate_test=False,
         t_inter=0.1,
         edit_mask=None,
+        odeint_kwargs: dict | None = None,
     ):
+        """
+        `odeint_kwargs`, if given, override the `odeint_kwargs` of the
+        constructor, e.g., dict(method="midpoint") or, for one of the
+        ADAPTIVE_METHODS, dict(method="bosh3", rtol=1e-2, atol=1e-3), in
+        which case `steps` and `sway_sampling_coef` are ignored.
+        """
         self.eval()
+        odeint_kwargs = {**self.odeint_kwargs, **(odeint_kwargs or {})}
         # raw wave
 
         if cond.ndim == 2:
@@ -170,28 +182,31 @@ class CFM(nn.Module):
             # at each step, conditioning is fixed
             # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
 
-            # predict flow
-            pred = self.transformer(
-                x=x,
-                cond=step_cond,
-                text=text,
-                time=t,
-                mask=mask,
-                drop_audio_cond=False,
-                drop_text=False,
-            )
             if cfg_strength < 1e-5:
-                return pred
+                return self.transformer(
+                    x=x,
+                    cond=step_cond,
+                    text=text,
+                    time=t,
+                    mask=mask,
+                    drop_audio_cond=False,
+                    drop_text=False,
+                    cache=True,
+                )
 
-            null_pred = self.transformer(
+            # predict flow, with and without conditions in one batch
+            pred_cfg = self.transformer(
                 x=x,
                 cond=step_cond,
                 text=text,
                 time=t,
                 mask=mask,
-                drop_audio_cond=True,
-                drop_text=True,
+                drop_audio_cond=False,
+                drop_text=False,
+                cfg_infer=True,
+                cache=True,
             )
+            pred, null_pred = torch.chunk(pred_cfg, 2, dim=0)
             return pred + (pred - null_pred) * cfg_strength
 
         # noise input
@@ -216,13 +231,19 @@ class CFM(nn.Module):
             y0 = (1 - t_start) * y0 + t_start * test_cond
             steps = int(steps * (1 - t_start))
 
-        t = torch.linspace(
-            t_start, 1, steps + 1, device=self.device, dtype=step_cond.dtype
-        )
-        if sway_sampling_coef is not None:
-            t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
+        if odeint_kwargs.get("method") in ADAPTIVE_METHODS:
+            t = torch.tensor([t_start, 1], device=self.device, dtype=step_cond.dtype)
+        else:
+            t = torch.linspace(
+                t_start, 1, steps + 1, device=self.device, dtype=step_cond.dtype
+            )
+            if sway_sampling_coef is not None:
+                t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+        # The text embeddings are cached in fn() during the integration
+        self.transformer.clear_cache()
+        trajectory = odeint(fn, y0, t, **odeint_kwargs)
+        self.transformer.clear_cache()
 
         sampled = trajectory[-1]
         out = sampled
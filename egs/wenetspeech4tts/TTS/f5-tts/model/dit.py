@@ -161,6 +161,10 @@ class DiT(nn.Module):
 
         self.checkpoint_activations = checkpoint_activations
 
+        # Text embeddings cached across the steps of the ODE solver,
+        # see get_input_embed()
+        self.text_cond, self.text_uncond = None, None
+
     def ckpt_wrapper(self, module):
         # https://github.com/chuanyangjin/fast-DiT/blob/main/models.py
         def ckpt_forward(*inputs):
@@ -169,6 +173,39 @@ class DiT(nn.Module):
 
         return ckpt_forward
 
+    def get_input_embed(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"],  # noqa: F722
+        text: int["b nt"],  # noqa: F722
+        drop_audio_cond: bool = False,
+        drop_text: bool = False,
+        cache: bool = False,
+    ):
+        """Mix the noised audio, the masked cond audio and the text embedding.
+
+        The text embedding does not depend on the time step, so with
+        `cache=True` it is computed only once per value of `drop_text`
+        and reused until clear_cache() is called.
+        """
+        seq_len = x.shape[1]
+        if cache:
+            if drop_text:
+                if self.text_uncond is None:
+                    self.text_uncond = self.text_embed(text, seq_len, drop_text=True)
+                text_embed = self.text_uncond
+            else:
+                if self.text_cond is None:
+                    self.text_cond = self.text_embed(text, seq_len, drop_text=False)
+                text_embed = self.text_cond
+        else:
+            text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
+
+        return self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+
+    def clear_cache(self):
+        self.text_cond, self.text_uncond = None, None
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
@@ -178,6 +215,8 @@ class DiT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
+        cfg_infer: bool = False,  # pack cond & uncond forward
+        cache: bool = False,  # reuse the text embeddings, see get_input_embed()
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
@@ -185,8 +224,27 @@ class DiT(nn.Module):
 
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
         t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+        if cfg_infer:
+            # The conditional and unconditional passes of classifier-free
+            # guidance are run as one batch: b n d -> 2b n d
+            x_cond = self.get_input_embed(
+                x, cond, text, drop_audio_cond=False, drop_text=False, cache=cache
+            )
+            x_uncond = self.get_input_embed(
+                x, cond, text, drop_audio_cond=True, drop_text=True, cache=cache
+            )
+            x = torch.cat((x_cond, x_uncond), dim=0)
+            t = torch.cat((t, t), dim=0)
+            mask = torch.cat((mask, mask), dim=0) if mask is not None else None
+        else:
+            x = self.get_input_embed(
+                x,
+                cond,
+                text,
+                drop_audio_cond=drop_audio_cond,
+                drop_text=drop_text,
+                cache=cache,
+            )
 
         rope = self.rotary_embed.forward_from_seq_len(seq_len)
 
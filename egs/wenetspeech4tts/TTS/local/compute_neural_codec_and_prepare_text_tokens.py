@@ -44,6 +44,7 @@ from phonemizer.backend.espeak.language_switch import LanguageSwitch
 from phonemizer.backend.espeak.words_mismatch import WordMismatch
 from phonemizer.punctuation import Punctuation
 from phonemizer.separator import Separator
+from torch import nn
 from tqdm.auto import tqdm
 
 from icefall.utils import get_executor
@@ -307,6 +308,28 @@ def remove_encodec_weight_norm(model):
             remove_weight_norm(decoder._modules[key].conv.conv)
 
 
+@torch.no_grad()
+def rvq_search(x: torch.Tensor, embed: torch.Tensor, embed_sq: torch.Tensor):
+    """Residual vector quantization of `x`, of shape (N, D), with the stacked
+    codebooks `embed`, of shape (n_q, K, D), whose squared norms are `embed_sq`,
+    of shape (n_q, K). It gives the same codes, of shape (n_q, N), as the
+    quantizer of EnCodec, with one matmul per quantizer and no allocation
+    in the loop.
+    """
+    n_q, codebook_size, _ = embed.shape
+    residual = x.clone()
+    quantized = torch.empty_like(residual)
+    dist = x.new_empty(x.shape[0], codebook_size)
+    codes = torch.empty(n_q, x.shape[0], dtype=torch.int64, device=x.device)
+    for q in range(n_q):
+        # |x - e|^2 without |x|^2, which does not change the argmin
+        torch.addmm(embed_sq[q], residual, embed[q].t(), alpha=-2, out=dist)
+        torch.argmin(dist, dim=-1, out=codes[q])
+        torch.index_select(embed[q], 0, codes[q], out=quantized)
+        residual.sub_(quantized)
+    return codes
+
+
 class AudioTokenizer:
     """EnCodec audio."""
 
@@ -330,12 +353,37 @@ class AudioTokenizer:
         self.sample_rate = model.sample_rate
         self.channels = model.channels
 
+        # The 24 kHz model encodes the whole audio at once without
+        # normalization, so we can run its encoder and replace its
+        # quantizer with rvq_search, using precomputed codebook norms.
+        n_q = model.quantizer.get_num_quantizers_for_bandwidth(
+            model.frame_rate, model.bandwidth
+        )
+        self.codebooks = None
+        if model.segment is None and not model.normalize:
+            layers = model.quantizer.vq.layers[:n_q]
+            assert all(isinstance(layer.project_in, nn.Identity) for layer in layers)
+            self.codebooks = torch.stack(
+                [layer._codebook.embed for layer in layers]
+            ).to(device)
+            self.codebook_norms = self.codebooks.pow(2).sum(-1)
+
     @property
     def device(self):
         return self._device
 
     def encode(self, wav: torch.Tensor) -> torch.Tensor:
-        return self.codec.encode(wav.to(self.device))
+        if self.codebooks is None:
+            return self.codec.encode(wav.to(self.device))
+
+        emb = self.codec.encoder(wav.to(self.device))  # [B, D, T]
+        batch_size, dim, num_frames = emb.shape
+        codes = rvq_search(
+            emb.transpose(1, 2).reshape(-1, dim), self.codebooks, self.codebook_norms
+        )
+        codes = codes.view(-1, batch_size, num_frames).transpose(0, 1)
+        # The same format as EncodecModel.encode: a list of (codes, scale)
+        return [(codes, None)]
 
     def decode(self, frames: torch.Tensor) -> torch.Tensor:
         return self.codec.decode(frames)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the speed of the AR decoder of VALL-E with and
+without the key/value cache (see `use_kv_cache` in VALLE.inference()), and
+checks that both give the same codes for the same random seed.
+
+A randomly initialized model is used, since the speed does not depend on
+the weights; only the number of generated tokens does, so the speed is
+reported in AR tokens per second.
+
+Usage:
+
+    ./valle/benchmark_inference.py --num-decoder-layers 12 --text-len 50
+"""
+
+import argparse
+import logging
+import time
+
+import torch
+from valle import NUM_AUDIO_TOKENS, NUM_TEXT_TOKENS, VALLE
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--decoder-dim",
+        type=int,
+        default=1024,
+        help="Embedding dimension in the decoder model.",
+    )
+
+    parser.add_argument(
+        "--nhead",
+        type=int,
+        default=16,
+        help="Number of attention heads in the Decoder layers.",
+    )
+
+    parser.add_argument(
+        "--num-decoder-layers",
+        type=int,
+        default=12,
+        help="Number of Decoder layers.",
+    )
+
+    parser.add_argument(
+        "--text-len",
+        type=int,
+        default=50,
+        help="Number of text tokens, including the text of the prompt.",
+    )
+
+    parser.add_argument(
+        "--prompt-len",
+        type=int,
+        default=225,
+        help="Number of frames of the audio prompt (75 frames per second).",
+    )
+
+    parser.add_argument(
+        "--num-runs",
+        type=int,
+        default=3,
+        help="Number of utterances to synthesize with each method.",
+    )
+
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=-100,
+        help="Whether AR Decoder do top_k(if > 0) sampling.",
+    )
+
+    return parser.parse_args()
+
+
+def synthesize(model, x, x_lens, y, seed, top_k, use_kv_cache):
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    codes = model.inference(
+        x,
+        x_lens,
+        y,
+        enroll_x_lens=None,
+        top_k=top_k,
+        use_kv_cache=use_kv_cache,
+    )
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return codes, time.time() - start
+
+
+@torch.no_grad()
+def main():
+    args = get_args()
+    logging.info(vars(args))
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    torch.manual_seed(0)
+    # Only the AR decoder is benchmarked
+    model = VALLE(
+        args.decoder_dim,
+        args.nhead,
+        args.num_decoder_layers,
+        num_quantizers=1,
+    )
+    model.to(device)
+    model.eval()
+
+    x = torch.randint(0, NUM_TEXT_TOKENS, (1, args.text_len), device=device)
+    x_lens = torch.tensor([args.text_len], device=device)
+    y = torch.randint(0, NUM_AUDIO_TOKENS, (1, args.prompt_len, 1), device=device)
+
+    # Warm up
+    synthesize(model, x, x_lens, y, 0, args.top_k, use_kv_cache=True)
+
+    num_tokens = {True: 0, False: 0}
+    elapsed = {True: 0.0, False: 0.0}
+    for seed in range(args.num_runs):
+        results = {}
+        for use_kv_cache in [False, True]:
+            codes, t = synthesize(model, x, x_lens, y, seed, args.top_k, use_kv_cache)
+            results[use_kv_cache] = codes
+            num_tokens[use_kv_cache] += codes.shape[1]
+            elapsed[use_kv_cache] += t
+        same = torch.equal(results[False], results[True])
+        logging.info(
+            f"seed {seed}: {results[True].shape[1]} tokens, "
+            f"same codes with and without cache: {same}"
+        )
+
+    for use_kv_cache in [False, True]:
+        name = "with kv cache" if use_kv_cache else "without kv cache"
+        logging.info(
+            f"{name}: {num_tokens[use_kv_cache] / elapsed[use_kv_cache]:.1f} "
+            f"tokens/s"
+        )
+    logging.info(f"speedup: {elapsed[False] / elapsed[True]:.2f}x")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
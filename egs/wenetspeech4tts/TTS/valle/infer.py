@@ -29,6 +29,12 @@ Usage example:
             --checkpoint ${exp_dir}/epoch-${epoch}-avg-${avg}.pt \
             --text-extractor pypinyin_initials_finals --top-p ${top_p}
 
+    # Synthesize the utterances of a file in batches of 16
+    python3 valle/infer.py --output-dir demos_epoch_${epoch}_avg_${avg} \
+            --checkpoint ${exp_dir}/epoch-${epoch}-avg-${avg}.pt \
+            --text ./aishell3.txt --batch-size 16 \
+            --text-extractor pypinyin_initials_finals
+
 """
 import argparse
 import logging
@@ -125,6 +131,15 @@ def get_args():
         help="Whether AR Decoder do valle-2 repetition-aware sampling. https://arxiv.org/pdf/2406.05370",
     )
 
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="""Number of utterances synthesized together when --text is a
+        file. The utterances are sorted by their expected output length
+        before batching.""",
+    )
+
     return parser.parse_args()
 
 
@@ -204,42 +219,61 @@ def main():
 
     if os.path.isfile(args.text):  # for demos
         # https://github.com/lifeiteng/lifeiteng.github.com/blob/main/valle/prepare.py
+        utterances = []
         with open(args.text) as f:
             for line in f:
                 fields = line.strip().split("  ")
                 fields = [item for item in fields if item]
                 assert len(fields) == 4
                 prompt_text, prompt_audio, text, audio_path = fields
-                logging.info(f"synthesize text: {text}")
-                text_tokens, text_tokens_lens = text_collater(
-                    [
-                        tokenize_text(
-                            text_tokenizer, text=f"{prompt_text} {text}".strip()
-                        )
-                    ]
+                text_tokens = tokenize_text(
+                    text_tokenizer, text=f"{prompt_text} {text}".strip()
                 )
-                _, enroll_x_lens = text_collater(
-                    [tokenize_text(text_tokenizer, text=f"{prompt_text}".strip())]
+                prompt_tokens = tokenize_text(
+                    text_tokenizer, text=f"{prompt_text}".strip()
                 )
-
                 audio_prompts = tokenize_audio(audio_tokenizer, prompt_audio)
-                audio_prompts = audio_prompts[0][0].transpose(2, 1).to(device)
-
-                # synthesis
-                encoded_frames = model.inference(
-                    text_tokens.to(device),
-                    text_tokens_lens.to(device),
-                    audio_prompts,
-                    enroll_x_lens=enroll_x_lens,
-                    top_k=args.top_k,
-                    temperature=args.temperature,
-                    top_p=args.top_p,
-                    ras=args.repetition_aware_sampling,
+                audio_prompts = audio_prompts[0][0].transpose(2, 1)
+                utterances.append(
+                    (text, audio_path, text_tokens, prompt_tokens, audio_prompts)
                 )
 
-                samples = audio_tokenizer.decode(
-                    [(encoded_frames.transpose(2, 1), None)]
-                )
+        # Group utterances of similar output lengths, assuming that the
+        # speaking rate is the same as in the prompt
+        def expected_len(utt):
+            _, _, text_tokens, prompt_tokens, audio_prompts = utt
+            return audio_prompts.shape[1] * len(text_tokens) / len(prompt_tokens)
+
+        utterances.sort(key=expected_len)
+
+        for i in range(0, len(utterances), args.batch_size):
+            batch = utterances[i : i + args.batch_size]
+            for text, *_ in batch:
+                logging.info(f"synthesize text: {text}")
+            text_tokens, text_tokens_lens = text_collater([u[2] for u in batch])
+            _, enroll_x_lens = text_collater([u[3] for u in batch])
+
+            audio_prompts = [u[4][0] for u in batch]
+            audio_prompts_lens = torch.tensor([a.shape[0] for a in audio_prompts])
+            audio_prompts = torch.nn.utils.rnn.pad_sequence(
+                audio_prompts, batch_first=True
+            )
+
+            # synthesis
+            encoded_frames = model.batch_inference(
+                text_tokens.to(device),
+                text_tokens_lens.to(device),
+                audio_prompts.to(device),
+                audio_prompts_lens.to(device),
+                enroll_x_lens=enroll_x_lens,
+                top_k=args.top_k,
+                temperature=args.temperature,
+                top_p=args.top_p,
+                ras=args.repetition_aware_sampling,
+            )
+
+            for (_, audio_path, *_), frames in zip(batch, encoded_frames):
+                samples = audio_tokenizer.decode([(frames.transpose(2, 1), None)])
                 # store
                 # save audio path into args.output_dir + audio_path
                 audio_path = f"{args.output_dir}/{audio_path}"
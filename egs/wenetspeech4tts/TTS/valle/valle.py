@@ -128,10 +128,30 @@ class SinePositionalEmbedding(nn.Module):
         pe = pe.unsqueeze(0)
         self.pe = pe.to(device=x.device, dtype=x.dtype).detach()
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        self.extend_pe(x)
+    def forward(
+        self, x: torch.Tensor, offset: Union[int, torch.Tensor] = 0
+    ) -> torch.Tensor:
+        """
+        Args:
+          x:
+            A tensor of shape (N, T, D).
+          offset:
+            The position of the first frame of `x`, used when a sequence
+            is processed incrementally. A tensor of shape (N,) gives the
+            offset of each sequence.
+        """
+        if isinstance(offset, int):
+            end = offset + x.size(1)
+            self.extend_pe(x if offset == 0 else x.new_empty(1, end))
+            pe = self.pe[:, offset:end]
+        else:
+            positions = offset.unsqueeze(1) + torch.arange(
+                x.size(1), device=offset.device
+            )
+            self.extend_pe(x.new_empty(1, int(positions.max()) + 1))
+            pe = self.pe[0, positions]
         output = x.unsqueeze(-1) if x.ndim == 2 else x
-        output = output * self.x_scale + self.alpha * self.pe[:, : x.size(1)]
+        output = output * self.x_scale + self.alpha * pe
         return self.dropout(output)
 
 
@@ -552,6 +572,83 @@ class MultiheadAttention(Module):
         else:
             return attn_output, attn_output_weights
 
+    def streaming_forward(
+        self,
+        x: Tensor,
+        cached_key: Optional[Tensor],
+        cached_val: Optional[Tensor],
+        cache_len: int,
+        attn_mask: Optional[Tensor] = None,
+    ) -> Tuple[Tensor, Tensor, Tensor]:
+        """Self-attention for incremental decoding: the new frames `x`
+        attend to the `cache_len` cached frames and to themselves. Only
+        for inference, i.e., dropout is not applied.
+
+        Args:
+          x:
+            A tensor of shape (N, L, E). Only batch_first is supported.
+          cached_key:
+            The keys of the previous frames, of shape (N, num_heads,
+            capacity, head_dim), where only the first `cache_len` frames are
+            valid. None if there are no previous frames.
+          cached_val:
+            The values of the previous frames, with the same shape as
+            `cached_key`.
+          cache_len:
+            Number of valid frames in the cache.
+          attn_mask:
+            A boolean mask of shape (L, cache_len + L), or (N, L,
+            cache_len + L) for a different mask per sequence, where True
+            means that the position is not allowed to attend, as in
+            forward(). None to attend to all frames.
+        Returns:
+          Return a tuple containing:
+            - the attention output, of shape (N, L, E)
+            - the updated cached_key
+            - the updated cached_val
+          The cache buffers are updated in place and reallocated with a
+          larger capacity when needed.
+        """
+        assert self.batch_first, "Only batch_first is supported"
+        assert self._qkv_same_embed_dim
+        assert self.bias_k is None and not self.add_zero_attn
+
+        N, L, _ = x.shape
+        q, k, v = F.linear(x, self.in_proj_weight, self.in_proj_bias).chunk(3, dim=-1)
+        q, k, v = [
+            t.view(N, L, self.num_heads, self.head_dim).transpose(1, 2)
+            for t in (q, k, v)
+        ]
+
+        end = cache_len + L
+        if cached_key is None or cached_key.size(2) < end:
+            # Grow geometrically, so that appending one frame per step
+            # copies the cache only O(log(T)) times.
+            capacity = max(2 * end, 256)
+            new_key = k.new_empty(N, self.num_heads, capacity, self.head_dim)
+            new_val = v.new_empty(N, self.num_heads, capacity, self.head_dim)
+            if cache_len > 0:
+                new_key[:, :, :cache_len] = cached_key[:, :, :cache_len]
+                new_val[:, :, :cache_len] = cached_val[:, :, :cache_len]
+            cached_key, cached_val = new_key, new_val
+
+        cached_key[:, :, cache_len:end] = k
+        cached_val[:, :, cache_len:end] = v
+
+        if attn_mask is not None:
+            # scaled_dot_product_attention() uses True for allowed positions
+            attn_mask = ~attn_mask
+            if attn_mask.ndim == 3:
+                attn_mask = attn_mask.unsqueeze(1)
+        attn_output = F.scaled_dot_product_attention(
+            q,
+            cached_key[:, :, :end],
+            cached_val[:, :, :end],
+            attn_mask=attn_mask,
+        )
+        attn_output = attn_output.transpose(1, 2).reshape(N, L, self.embed_dim)
+        return self.out_proj(attn_output), cached_key, cached_val
+
 
 class LayerNorm(nn.Module):
     __constants__ = ["normalized_shape", "eps", "elementwise_affine"]
@@ -780,6 +877,37 @@ class TransformerEncoderLayer(nn.Module):
             return (x, stage_embedding)
         return x
 
+    def streaming_forward(
+        self,
+        x: Tensor,
+        cached_key: Optional[Tensor],
+        cached_val: Optional[Tensor],
+        cache_len: int,
+        attn_mask: Optional[Tensor] = None,
+    ) -> Tuple[Tensor, Tensor, Tensor]:
+        """Like forward(), but the self-attention of the new frames `x`
+        also covers the `cache_len` cached frames. See
+        MultiheadAttention.streaming_forward() for the arguments.
+        Adaptive layer norm (i.e., a tuple `src`) is not supported.
+
+        Returns:
+          Return the output of shape (N, L, E) and the updated caches.
+        """
+        if self.norm_first:
+            attn_output, cached_key, cached_val = self.self_attn.streaming_forward(
+                self.norm1(x), cached_key, cached_val, cache_len, attn_mask
+            )
+            x = x + self.dropout1(attn_output)
+            x = x + self._ff_block(self.norm2(x))
+        else:
+            attn_output, cached_key, cached_val = self.self_attn.streaming_forward(
+                x, cached_key, cached_val, cache_len, attn_mask
+            )
+            x = self.norm1(x + self.dropout1(attn_output))
+            x = self.norm2(x + self._ff_block(x))
+
+        return x, cached_key, cached_val
+
     # self-attention block
     def _sa_block(
         self,
@@ -874,6 +1002,43 @@ class TransformerEncoder(nn.Module):
 
         return output
 
+    def streaming_forward(
+        self,
+        src: Tensor,
+        states: Optional[List[Tuple[Tensor, Tensor]]],
+        cache_len: int,
+        mask: Optional[Tensor] = None,
+    ) -> Tuple[Tensor, List[Tuple[Tensor, Tensor]]]:
+        r"""Pass the new frames `src` through the encoder layers, attending
+        also to the `cache_len` frames processed by previous calls.
+
+        Args:
+            src: the new frames, of shape (N, L, E) (required).
+            states: the key/value caches of each layer returned by the
+                previous call, or None for the first call.
+            cache_len: the number of frames processed by previous calls.
+            mask: the mask of shape (L, cache_len + L) or (N, L,
+                cache_len + L) for the new frames (optional).
+
+        Returns:
+            Return the output and the updated states.
+        """
+        if states is None:
+            states = [(None, None)] * self.num_layers
+
+        new_states = []
+        output = src
+        for mod, (cached_key, cached_val) in zip(self.layers, states):
+            output, cached_key, cached_val = mod.streaming_forward(
+                output, cached_key, cached_val, cache_len, attn_mask=mask
+            )
+            new_states.append((cached_key, cached_val))
+
+        if self.norm is not None:
+            output = self.norm(output)
+
+        return output, new_states
+
 
 def _get_clones(module, N):
     return nn.ModuleList([copy.deepcopy(module) for i in range(N)])
@@ -1389,6 +1554,72 @@ class VALLE(nn.Module):
 
         return ((x, codes), total_loss, metrics)
 
+    def _ar_step(
+        self,
+        x: torch.Tensor,
+        y: torch.Tensor,
+        cache: Optional[Dict[str, Any]] = None,
+    ) -> torch.Tensor:
+        """Return the logits of the AR decoder for the token following `y`.
+
+        Args:
+          x:
+            The text embeddings with positions, of shape (1, S, D).
+          y:
+            The audio tokens so far, of shape (1, T).
+          cache:
+            If None, the whole sequence [x, y] is processed. Otherwise,
+            only the tokens of `y` that are not in the cache yet; the
+            cache is updated in place. Pass an empty dict at the first step.
+        Returns:
+          Return a tensor of shape (1, NUM_AUDIO_TOKENS + 1).
+        """
+        x_len = x.shape[1]
+        y_len = y.shape[1]
+
+        if cache:
+            # Only the new tokens, which attend to all cached frames
+            num_tokens = cache["num_tokens"]
+            y_emb = self.ar_audio_embedding(y[:, num_tokens:])
+            y_emb = self.ar_audio_prenet(y_emb)
+            y_pos = self.ar_audio_position(y_emb, offset=num_tokens)
+            xy_dec, cache["states"] = self.ar_decoder.streaming_forward(
+                y_pos, cache["states"], cache_len=x_len + num_tokens
+            )
+            cache["num_tokens"] = y_len
+            return self.ar_predict_layer(xy_dec[:, -1])
+
+        y_emb = self.ar_audio_embedding(y)
+        y_emb = self.ar_audio_prenet(y_emb)
+        y_pos = self.ar_audio_position(y_emb)
+        xy_pos = torch.concat([x, y_pos], dim=1)
+
+        # The text attends only to itself and the audio is causal
+        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
+        x_attn_mask_pad = F.pad(
+            x_attn_mask,
+            (0, y_len),
+            value=True,
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = torch.concat([x_attn_mask_pad, y_attn_mask], dim=0).to(y.device)
+
+        if cache is None:
+            xy_dec, _ = self.ar_decoder(
+                (xy_pos, None),
+                mask=xy_attn_mask,
+            )
+        else:
+            xy_dec, cache["states"] = self.ar_decoder.streaming_forward(
+                xy_pos, states=None, cache_len=0, mask=xy_attn_mask
+            )
+            cache["num_tokens"] = y_len
+        return self.ar_predict_layer(xy_dec[:, -1])
+
     def inference(
         self,
         x: torch.Tensor,
@@ -1399,6 +1630,7 @@ class VALLE(nn.Module):
         temperature: float = 1.0,
         top_p: float = 1.0,
         ras: bool = False,
+        use_kv_cache: bool = True,
     ) -> torch.Tensor:
         """
         Args:
@@ -1415,6 +1647,10 @@ class VALLE(nn.Module):
             The value used to module the next token probabilities. Must be strictly positive. Default to 1.0.
           ras: (`optional`) bool
             Whether to use repetition-aware sampling. Default to False.
+          use_kv_cache: (`optional`) bool
+            Whether the AR decoder caches the keys and values of the
+            previous steps. If False, each step recomputes the whole
+            sequence, which is only useful for benchmarking. Default to True.
         Returns:
           Return the predicted audio code matrix.
         """
@@ -1436,40 +1672,16 @@ class VALLE(nn.Module):
         prefix_len = y.shape[1]
 
         # AR Decoder
-        # TODO: Managing decoder steps avoid repetitive computation
         y = prompts[..., 0]
         if self.ar_audio_prepend_bos:
             y = F.pad(y, (1, 0), value=NUM_AUDIO_TOKENS + 1)
 
-        x_len = x_lens.max()
-        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
+        # With use_kv_cache, the text and the prompt are processed once and
+        # each step processes only the last sampled token.
+        cache = {} if use_kv_cache else None
 
         while True:
-            y_emb = self.ar_audio_embedding(y)
-            y_emb = self.ar_audio_prenet(y_emb)
-            y_pos = self.ar_audio_position(y_emb)
-            xy_pos = torch.concat([x, y_pos], dim=1)
-
-            y_len = y.shape[1]
-            x_attn_mask_pad = F.pad(
-                x_attn_mask,
-                (0, y_len),
-                value=True,
-            )
-            y_attn_mask = F.pad(
-                torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
-                (x_len, 0),
-                value=False,
-            )
-            xy_attn_mask = torch.concat([x_attn_mask_pad, y_attn_mask], dim=0).to(
-                y.device
-            )
-
-            xy_dec, _ = self.ar_decoder(
-                (xy_pos, None),
-                mask=xy_attn_mask,
-            )
-            logits = self.ar_predict_layer(xy_dec[:, -1])
+            logits = self._ar_step(x, y, cache)
             samples = topk_sampling(
                 logits,
                 top_k=top_k,
@@ -1564,6 +1776,248 @@ class VALLE(nn.Module):
         assert len(codes) == self.num_quantizers
         return torch.stack(codes, dim=-1)
 
+    def batch_inference(
+        self,
+        x: torch.Tensor,
+        x_lens: torch.Tensor,
+        y: torch.Tensor,
+        y_lens: torch.Tensor,
+        enroll_x_lens: Optional[torch.Tensor] = None,
+        top_k: int = -100,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        ras: bool = False,
+    ) -> List[torch.Tensor]:
+        """Like inference(), for a batch of utterances with different text
+        and prompt lengths.
+
+        The AR decoder uses key/value caches, and the utterances that
+        reached EOS are removed from the batch. The NAR decoders process
+        the whole batch with a padding mask. It is faster to batch
+        utterances of similar output lengths.
+
+        Args:
+          x:
+            A 2-D tensor of shape (N, S), padded.
+          x_lens:
+            A 1-D tensor of shape (N,). It contains the number of tokens in
+            `x` before padding.
+          y:
+            The prompts, a 3-D tensor of shape (N, T, num_quantizers),
+            padded.
+          y_lens:
+            A 1-D tensor of shape (N,). It contains the number of frames of
+            each prompt.
+          enroll_x_lens:
+            A 1-D tensor of shape (N,) with the number of tokens of the
+            prompt text in `x`. Used only if prefix_mode is 2 or 4.
+          top_k, temperature, top_p, ras:
+            See inference().
+        Returns:
+          Return a list of N tensors. The i-th tensor has shape
+          (1, T_i, num_quantizers) and contains the predicted audio codes of
+          the i-th utterance, as returned by inference().
+        """
+        assert x.ndim == 2, x.shape
+        assert y.ndim == 3, y.shape
+        assert x.shape[0] == y.shape[0] == x_lens.shape[0] == y_lens.shape[0]
+        assert torch.all(x_lens > 0)
+
+        device = x.device
+        batch_size = x.shape[0]
+        x_lens = x_lens.to(device)
+        y_lens = y_lens.to(device)
+        bos = int(self.ar_audio_prepend_bos)
+
+        text = x
+        x = self.ar_text_embedding(text)
+        x = self.ar_text_prenet(x)
+        x = self.ar_text_position(x)
+
+        prompts = y
+        y = prompts[..., 0]
+        if self.ar_audio_prepend_bos:
+            y = F.pad(y, (1, 0), value=NUM_AUDIO_TOKENS + 1)
+
+        # AR Decoder. The first step processes the text and the prompts,
+        # with the same attention mask as inference() plus padding.
+        x_len = x.shape[1]
+        y_len = y.shape[1]
+        ar_y_lens = y_lens + bos
+        y_emb = self.ar_audio_embedding(y)
+        y_emb = self.ar_audio_prenet(y_emb)
+        y_pos = self.ar_audio_position(y_emb)
+        xy_pos = torch.concat([x, y_pos], dim=1)
+
+        xy_attn_mask = torch.zeros(
+            (x_len + y_len, x_len + y_len), dtype=torch.bool, device=device
+        )
+        xy_attn_mask[:x_len, x_len:] = True
+        xy_attn_mask[x_len:, x_len:] = torch.triu(
+            torch.ones(y_len, y_len, dtype=torch.bool, device=device), diagonal=1
+        )
+        # True for padding
+        key_padding_mask = torch.concat(
+            [make_pad_mask(x_lens, x_len), make_pad_mask(ar_y_lens, y_len)], dim=1
+        ).to(device)
+        xy_attn_mask = xy_attn_mask.unsqueeze(0) | key_padding_mask.unsqueeze(1)
+
+        xy_dec, states = self.ar_decoder.streaming_forward(
+            xy_pos, states=None, cache_len=0, mask=xy_attn_mask
+        )
+        last = xy_dec[torch.arange(batch_size, device=device), x_len + ar_y_lens - 1]
+        cache_len = x_len + y_len
+
+        # Index of the remaining utterances in the batch
+        active = torch.arange(batch_size, device=device)
+        # Position of the next token in the audio of each utterance
+        positions = ar_y_lens.clone()
+        max_new_tokens = x_lens * 16 + 1 - bos
+        ar_codes = torch.zeros(
+            (batch_size, int(max_new_tokens.max()) + 1),
+            dtype=torch.int64,
+            device=device,
+        )
+        num_new_tokens = torch.zeros(batch_size, dtype=torch.int64, device=device)
+
+        # The last 10 tokens of each utterance, for repetition aware sampling
+        window_size = 10
+        indexes = ar_y_lens.unsqueeze(1) + torch.arange(-window_size, 0, device=device)
+        preceding_tokens = y.gather(1, indexes.clamp(min=0))
+        preceding_tokens.masked_fill_(indexes < 0, -1)
+
+        while True:
+            logits = self.ar_predict_layer(last)
+            samples = topk_sampling(
+                logits,
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_aware_sampling=ras,
+                preceding_tokens=preceding_tokens,
+            )
+
+            finished = (
+                (torch.argmax(logits, dim=-1) == NUM_AUDIO_TOKENS)
+                | (samples[:, 0] == NUM_AUDIO_TOKENS)
+                | (num_new_tokens[active] + bos > x_lens[active] * 16)
+            )
+            if finished.any():
+                if not bos and (num_new_tokens[active][finished] == 0).any():
+                    raise SyntaxError("well trained model shouldn't reach here.")
+                if finished.all():
+                    break
+                # Drop the finished utterances from the batch
+                keep = (~finished).nonzero(as_tuple=True)[0]
+                active = active[keep]
+                samples = samples[keep]
+                positions = positions[keep]
+                preceding_tokens = preceding_tokens[keep]
+                key_padding_mask = key_padding_mask[keep]
+                states = [(k[keep], v[keep]) for k, v in states]
+
+            ar_codes[active, num_new_tokens[active]] = samples[:, 0]
+            num_new_tokens[active] += 1
+            preceding_tokens = torch.concat([preceding_tokens[:, 1:], samples], dim=1)
+
+            y_emb = self.ar_audio_embedding(samples)
+            y_emb = self.ar_audio_prenet(y_emb)
+            y_pos = self.ar_audio_position(y_emb, offset=positions)
+            # The new token attends to all frames except the padding
+            mask = F.pad(key_padding_mask, (0, cache_len + 1 - y_len - x_len))
+            xy_dec, states = self.ar_decoder.streaming_forward(
+                y_pos, states, cache_len, mask=mask.unsqueeze(1)
+            )
+            last = xy_dec[:, -1]
+            cache_len += 1
+            positions += 1
+
+        num_new_tokens = num_new_tokens.tolist()
+        if self.num_quantizers == 1:
+            return [
+                ar_codes[i, : num_new_tokens[i]].view(1, -1, 1)
+                for i in range(batch_size)
+            ]
+
+        # Non-AR Decoders. The audio of each utterance is its prompt
+        # followed by the generated frames.
+        new_lens = torch.tensor(num_new_tokens, device=device)
+        audio_lens = y_lens + new_lens
+        audio_len = int(audio_lens.max())
+        t = torch.arange(audio_len, device=device).unsqueeze(0)
+        prompt_mask = t < y_lens.unsqueeze(1)
+        new_mask = (t >= y_lens.unsqueeze(1)) & (t < audio_lens.unsqueeze(1))
+        new_index = (t - y_lens.unsqueeze(1)).clamp(0, ar_codes.shape[1] - 1)
+
+        prompts = F.pad(prompts, (0, 0, 0, audio_len - prompts.shape[1]))
+        prompts = prompts.masked_fill(~prompt_mask.unsqueeze(-1), 0)
+        codes = [ar_codes.gather(1, new_index).masked_fill(~new_mask, 0)]
+
+        y_emb = self.nar_audio_embeddings[0](
+            torch.where(prompt_mask, prompts[..., 0], codes[0])
+        )
+        prompt_mask = prompt_mask.unsqueeze(-1)
+        new_mask = new_mask.unsqueeze(-1)
+
+        text_lens = x_lens
+        if self.prefix_mode in [2, 4]:  # Exclude enrolled_phonemes
+            # SOS + Synthesis Text + EOS
+            text = [
+                torch.concat([text[i, :1], text[i, enroll_x_lens[i] - 1 : x_lens[i]]])
+                for i in range(batch_size)
+            ]
+            text_lens = torch.tensor([len(tokens) for tokens in text], device=device)
+            text = nn.utils.rnn.pad_sequence(text, batch_first=True)
+
+        x = self.nar_text_embedding(text)
+        x = self.nar_text_prenet(x)
+        x = self.nar_text_position(x)
+        text_len = x.shape[1]
+
+        xy_padding_mask = torch.concat(
+            [
+                make_pad_mask(text_lens, text_len).to(device),
+                make_pad_mask(audio_lens, audio_len).to(device),
+            ],
+            dim=1,
+        )
+
+        if self.prefix_mode != 0:
+            for j in range(1, self.num_quantizers):
+                y_emb += self.nar_audio_embeddings[j](prompts[..., j]) * prompt_mask
+
+        for i, (predict_layer, embedding_layer) in enumerate(
+            zip(
+                self.nar_predict_layers,
+                self.nar_audio_embeddings[1:],
+            )
+        ):
+            y_pos = self.nar_audio_prenet(y_emb)
+            y_pos = self.nar_audio_position(y_pos)
+            xy_pos = torch.concat([x, y_pos], dim=1)
+
+            xy_dec, _ = self.nar_decoder(
+                (xy_pos, self.nar_stage_embeddings[i].weight),
+                src_key_padding_mask=xy_padding_mask,
+            )
+            logits = predict_layer(xy_dec[:, text_len:])
+
+            samples = torch.argmax(logits, dim=-1).masked_fill(~new_mask[..., 0], 0)
+            codes.append(samples)
+
+            if i < self.num_quantizers - 2:
+                if self.prefix_mode == 0:
+                    y_emb += embedding_layer(prompts[..., i + 1]) * prompt_mask
+                y_emb += embedding_layer(samples) * new_mask
+
+        codes = torch.stack(codes, dim=-1)
+        assert codes.shape[-1] == self.num_quantizers
+        y_lens = y_lens.tolist()
+        return [
+            codes[i : i + 1, y_lens[i] : y_lens[i] + num_new_tokens[i]]
+            for i in range(batch_size)
+        ]
+
     def visualize(
         self,
         predicts: Tuple[torch.Tensor],
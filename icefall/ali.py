@@ -14,8 +14,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, List, Tuple
+"""
+Framewise alignments can be saved in two formats:
 
+  (1) A single file written by :func:`save_alignments`, which pickles a
+      dict mapping cut IDs to lists of ints. The whole dict is loaded into
+      every process that uses it.
+
+  (2) A directory written by :class:`AlignmentWriter` and
+      :func:`finalize_alignment_store`, and read by :class:`AlignmentStore`::
+
+        ali_dir/meta.json
+        ali_dir/ali.00000.bin      # flat alignments of shard 0
+        ali_dir/index.00000.npz    # cut IDs and offsets of shard 0
+        ali_dir/ali.00001.bin
+        ali_dir/index.00001.npz
+        ...
+        ali_dir/index_ids.npy      # sorted cut IDs of all shards
+        ali_dir/index_shard.npy
+        ali_dir/index_offset.npy
+        ali_dir/index_length.npy
+
+      The alignments and the index are memory-mapped, so the page cache
+      is shared by all dataloader workers and DDP ranks, and looking up
+      an alignment does not copy it. Each shard can be written by a
+      separate job; :func:`finalize_alignment_store` merges their indexes.
+
+:func:`load_alignments` accepts both formats. Use
+:func:`convert_alignments` to convert (1) to (2).
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
 import torch
 from torch.nn.utils.rnn import pad_sequence
 
@@ -45,20 +79,29 @@ def save_alignments(
     torch.save(ali_dict, filename)
 
 
-def load_alignments(filename: str) -> Tuple[int, Dict[str, List[int]]]:
+def load_alignments(
+    filename: str,
+) -> Tuple[int, Union[Dict[str, List[int]], "AlignmentStore"]]:
     """Load alignments from a file.
 
     Args:
       filename:
         Path to the file containing alignment information.
         The file should be saved by :func:`save_alignments`.
+        It can also be a directory written by :class:`AlignmentWriter`.
     Returns:
       Return a tuple containing:
         - subsampling_factor: The subsampling_factor used to compute
           the alignments.
         - alignments: A dict containing utterances and their corresponding
-          framewise alignment, after subsampling.
+          framewise alignment, after subsampling. If `filename` is a
+          directory, it is an :class:`AlignmentStore`, which can be
+          used like a read-only dict.
     """
+    if is_alignment_store(filename):
+        store = AlignmentStore(filename)
+        return store.subsampling_factor, store
+
     ali_dict = torch.load(filename)
     subsampling_factor = ali_dict["subsampling_factor"]
     alignments = ali_dict["alignments"]
@@ -66,8 +109,9 @@ def load_alignments(filename: str) -> Tuple[int, Dict[str, List[int]]]:
 
 
 def convert_alignments_to_tensor(
-    alignments: Dict[str, List[int]], device: torch.device
-) -> Dict[str, torch.Tensor]:
+    alignments: Union[Dict[str, List[int]], "AlignmentStore"],
+    device: torch.device,
+) -> Union[Dict[str, torch.Tensor], "AlignmentStore"]:
     """Convert alignments from list of int to a 1-D torch.Tensor.
 
     Args:
@@ -80,7 +124,12 @@ def convert_alignments_to_tensor(
       Return a dict using 1-D torch.Tensor to store the alignments.
       The dtype of the tensor are `torch.int64`. We choose `torch.int64`
       because `torch.nn.functional.one_hot` requires that.
+      An :class:`AlignmentStore` is returned as it is, since
+      :func:`lookup_alignments` converts its alignments on the fly.
     """
+    if isinstance(alignments, AlignmentStore):
+        return alignments
+
     ans = {}
     for utt_id, ali in alignments.items():
         ali = torch.tensor(ali, dtype=torch.int64, device=device)
@@ -90,7 +139,7 @@ def convert_alignments_to_tensor(
 
 def lookup_alignments(
     cut_ids: List[str],
-    alignments: Dict[str, torch.Tensor],
+    alignments: Union[Dict[str, torch.Tensor], "AlignmentStore"],
     num_classes: int,
     log_score: float = -10,
 ) -> torch.Tensor:
@@ -122,7 +171,7 @@ def lookup_alignments(
         A list of utterance IDs.
       alignments:
         A dict containing alignments. The keys are utterance IDs and the values
-        are framewise alignments.
+        are framewise alignments. It can also be an :class:`AlignmentStore`.
       num_classes:
         The max token ID + 1 that appears in the alignments.
       log_score:
@@ -132,7 +181,10 @@ def lookup_alignments(
       Return a 3-D torch.float32 tensor of shape (N, T, C).
     """
     # We assume all utterances have their alignments.
-    ali = [alignments[cut_id] for cut_id in cut_ids]
+    if isinstance(alignments, AlignmentStore):
+        ali = [alignments.get_tensor(cut_id) for cut_id in cut_ids]
+    else:
+        ali = [alignments[cut_id] for cut_id in cut_ids]
     padded_ali = pad_sequence(ali, batch_first=True, padding_value=0)
     padded_one_hot = torch.nn.functional.one_hot(
         padded_ali,
@@ -140,3 +192,285 @@ def lookup_alignments(
     )
     mask = (1 - padded_one_hot) * float(log_score)
     return mask
+
+
+def _check_dtype(dtype: str) -> np.dtype:
+    assert dtype in ("int16", "int32"), dtype
+    return np.dtype(dtype)
+
+
+class AlignmentWriter(object):
+    def __init__(
+        self,
+        out_dir: Union[str, Path],
+        subsampling_factor: int,
+        shard: int = 0,
+        dtype: str = "int32",
+    ):
+        """Write alignments of a shard of an :class:`AlignmentStore`.
+
+        Parallel jobs should use different shard IDs. After all jobs are
+        done, call :func:`finalize_alignment_store`. A shard is complete
+        only after :meth:`close` is called; an incomplete shard can simply
+        be rewritten.
+
+        Usage::
+
+            with AlignmentWriter(out_dir, subsampling_factor=4, shard=3) as w:
+                for cut_id, ali in ...:
+                    w.write(cut_id, ali)
+
+        Args:
+          out_dir:
+            The output directory. It is shared by all shards.
+          subsampling_factor:
+            The subsampling factor of the model.
+          shard:
+            ID of this shard.
+          dtype:
+            "int16" or "int32". Use "int16" if all labels are less
+            than 32768.
+        """
+        assert shard >= 0, shard
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.subsampling_factor = subsampling_factor
+        self.shard = shard
+        self.dtype = _check_dtype(dtype)
+
+        self.cut_ids: List[str] = []
+        self.offsets: List[int] = [0]
+        self.f = open(self.out_dir / f"ali.{shard:05d}.bin", "wb")
+
+    def write(
+        self, cut_id: str, alignment: Union[List[int], np.ndarray, torch.Tensor]
+    ) -> None:
+        if isinstance(alignment, torch.Tensor):
+            alignment = alignment.cpu().numpy()
+        alignment = np.asarray(alignment)
+        assert alignment.ndim == 1, alignment.shape
+        if alignment.size > 0:
+            info = np.iinfo(self.dtype)
+            assert info.min <= alignment.min() and alignment.max() <= info.max, (
+                cut_id,
+                self.dtype,
+            )
+        self.f.write(alignment.astype(self.dtype).tobytes())
+        self.cut_ids.append(cut_id)
+        self.offsets.append(self.offsets[-1] + alignment.size)
+
+    def close(self) -> None:
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        np.savez(
+            self.out_dir / f"index.{self.shard:05d}.npz",
+            cut_ids=np.array([c.encode("utf-8") for c in self.cut_ids], dtype="S"),
+            offsets=np.array(self.offsets, dtype=np.int64),
+            subsampling_factor=self.subsampling_factor,
+            dtype=str(self.dtype),
+        )
+
+    def __enter__(self) -> "AlignmentWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        elif self.f is not None:
+            # Don't write the index, so the shard is treated as incomplete
+            self.f.close()
+            self.f = None
+
+
+def finalize_alignment_store(out_dir: Union[str, Path]) -> None:
+    """Merge the indexes of all shards written by :class:`AlignmentWriter`
+    in `out_dir` into a single index sorted by cut ID.
+
+    Shards without index, i.e., whose writer was not closed, are ignored
+    with a warning.
+    """
+    out_dir = Path(out_dir)
+    shards = []
+    for filename in sorted(out_dir.glob("ali.*.bin")):
+        shard = int(filename.name.split(".")[1])
+        if not (out_dir / f"index.{shard:05d}.npz").is_file():
+            logging.warning(f"Skipping incomplete shard {filename}")
+            continue
+        shards.append(shard)
+    assert len(shards) > 0, f"No shards found in {out_dir}"
+
+    cut_ids, shard_ids, offsets, lengths = [], [], [], []
+    subsampling_factor = None
+    dtype = None
+    for i, shard in enumerate(shards):
+        index = np.load(out_dir / f"index.{shard:05d}.npz")
+        if subsampling_factor is None:
+            subsampling_factor = int(index["subsampling_factor"])
+            dtype = str(index["dtype"])
+        assert subsampling_factor == int(index["subsampling_factor"]), shard
+        assert dtype == str(index["dtype"]), shard
+
+        cut_ids.append(index["cut_ids"])
+        shard_ids.append(np.full(index["cut_ids"].size, i, dtype=np.int32))
+        offsets.append(index["offsets"][:-1])
+        lengths.append(np.diff(index["offsets"]).astype(np.int32))
+
+    cut_ids = np.concatenate(cut_ids)
+    order = np.argsort(cut_ids, kind="stable")
+    cut_ids = cut_ids[order]
+    duplicates = cut_ids[1:][cut_ids[1:] == cut_ids[:-1]]
+    assert duplicates.size == 0, f"Duplicate cut IDs, e.g., {duplicates[0]}"
+
+    np.save(out_dir / "index_ids.npy", cut_ids)
+    np.save(out_dir / "index_shard.npy", np.concatenate(shard_ids)[order])
+    np.save(out_dir / "index_offset.npy", np.concatenate(offsets)[order])
+    np.save(out_dir / "index_length.npy", np.concatenate(lengths)[order])
+
+    meta = {
+        "subsampling_factor": subsampling_factor,
+        "dtype": dtype,
+        "num_cuts": int(cut_ids.size),
+        "shards": [f"ali.{shard:05d}.bin" for shard in shards],
+    }
+    with open(out_dir / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def is_alignment_store(filename: Union[str, Path]) -> bool:
+    """Return True if `filename` is a directory finalized by
+    :func:`finalize_alignment_store`."""
+    return (Path(filename) / "meta.json").is_file()
+
+
+class AlignmentStore(object):
+    def __init__(self, dirname: Union[str, Path]):
+        """A read-only, memory-mapped dict-like view of the alignments
+        in a directory finalized by :func:`finalize_alignment_store`.
+
+        `store[cut_id]` returns a 1-D numpy array that refers to the
+        memory-mapped file, i.e., it is not copied.
+
+        It can be pickled, e.g., to dataloader workers, without copying
+        the alignments; each process re-opens the memory maps.
+        """
+        self.dirname = Path(dirname)
+        with open(self.dirname / "meta.json") as f:
+            self.meta = json.load(f)
+        self.subsampling_factor = self.meta["subsampling_factor"]
+        self.dtype = _check_dtype(self.meta["dtype"])
+        self._index = None
+        self._shards = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_index"] = None
+        state["_shards"] = None
+        return state
+
+    @property
+    def index(self) -> Dict[str, np.ndarray]:
+        if self._index is None:
+            self._index = {
+                name: np.load(self.dirname / f"index_{name}.npy", mmap_mode="r")
+                for name in ("ids", "shard", "offset", "length")
+            }
+        return self._index
+
+    @property
+    def shards(self) -> List[np.ndarray]:
+        if self._shards is None:
+            self._shards = [
+                np.memmap(self.dirname / name, dtype=self.dtype, mode="r")
+                if (self.dirname / name).stat().st_size > 0
+                else np.zeros(0, dtype=self.dtype)
+                for name in self.meta["shards"]
+            ]
+        return self._shards
+
+    def _find(self, cut_id: str) -> Optional[int]:
+        ids = self.index["ids"]
+        key = cut_id.encode("utf-8")
+        i = int(np.searchsorted(ids, key))
+        if i < ids.size and ids[i] == key:
+            return i
+        return None
+
+    def __len__(self) -> int:
+        return self.meta["num_cuts"]
+
+    def __contains__(self, cut_id: str) -> bool:
+        return self._find(cut_id) is not None
+
+    def __getitem__(self, cut_id: str) -> np.ndarray:
+        i = self._find(cut_id)
+        if i is None:
+            raise KeyError(cut_id)
+        index = self.index
+        offset = int(index["offset"][i])
+        length = int(index["length"][i])
+        return self.shards[index["shard"][i]][offset : offset + length]
+
+    def get(self, cut_id: str, default=None) -> Optional[np.ndarray]:
+        if cut_id not in self:
+            return default
+        return self[cut_id]
+
+    def get_tensor(self, cut_id: str) -> torch.Tensor:
+        """Return the alignment of `cut_id` as a 1-D torch.int64 tensor."""
+        return torch.from_numpy(self[cut_id].astype(np.int64))
+
+    def keys(self) -> Iterator[str]:
+        for cut_id in self.index["ids"]:
+            yield cut_id.decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def items(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for cut_id in self.keys():
+            yield cut_id, self[cut_id]
+
+
+def save_alignment_store(
+    alignments: Dict[str, List[int]],
+    subsampling_factor: int,
+    out_dir: Union[str, Path],
+    dtype: str = "int32",
+) -> None:
+    """Save a dict of alignments as an :class:`AlignmentStore` with
+    a single shard."""
+    with AlignmentWriter(out_dir, subsampling_factor, dtype=dtype) as writer:
+        for cut_id, ali in alignments.items():
+            writer.write(cut_id, ali)
+    finalize_alignment_store(out_dir)
+
+
+def convert_alignments(
+    filename: Union[str, Path],
+    out_dir: Union[str, Path],
+    dtype: Optional[str] = None,
+) -> None:
+    """Convert a file written by :func:`save_alignments` to an
+    :class:`AlignmentStore` in `out_dir`.
+
+    Args:
+      filename:
+        The file to convert.
+      out_dir:
+        The output directory.
+      dtype:
+        "int16" or "int32". If None, use "int16" if all labels fit into it.
+    """
+    subsampling_factor, alignments = load_alignments(filename)
+    if dtype is None:
+        info = np.iinfo(np.int16)
+        fits = all(
+            info.min <= min(a) and max(a) <= info.max
+            for a in alignments.values()
+            if len(a) > 0
+        )
+        dtype = "int16" if fits else "int32"
+    save_alignment_store(alignments, subsampling_factor, out_dir, dtype=dtype)
+    logging.info(f"Converted {len(alignments)} alignments from {filename}")
@@ -16,12 +16,14 @@
 
 
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 import k2
 import sentencepiece as spm
 import torch
 
+from icefall.graph_cache import TrainingGraphCache
+
 
 class BpeCtcTrainingGraphCompiler(object):
     def __init__(
@@ -30,6 +32,7 @@ class BpeCtcTrainingGraphCompiler(object):
         device: Union[str, torch.device] = "cpu",
         sos_token: str = "<sos/eos>",
         eos_token: str = "<sos/eos>",
+        cache: Optional[TrainingGraphCache] = None,
     ) -> None:
         """
         Args:
@@ -44,6 +47,9 @@ class BpeCtcTrainingGraphCompiler(object):
             The word piece that represents sos.
           eos_token:
             The word piece that represents eos.
+          cache:
+            If not None, the graph of each utterance is cached and reused
+            in :meth:`compile`. See :class:`TrainingGraphCache`.
         """
         lang_dir = Path(lang_dir)
         model_file = lang_dir / "bpe.model"
@@ -52,6 +58,7 @@ class BpeCtcTrainingGraphCompiler(object):
         self.sp = sp
         self.word_table = k2.SymbolTable.from_file(lang_dir / "words.txt")
         self.device = device
+        self.cache = cache
 
         self.sos_id = self.sp.piece_to_id(sos_token)
         self.eos_id = self.sp.piece_to_id(eos_token)
@@ -90,5 +97,15 @@ class BpeCtcTrainingGraphCompiler(object):
           CTC topology with linear FSAs constructed from the given
           piece IDs.
         """
+        if self.cache is not None:
+            # The first entry of a key distinguishes the two topologies
+            keys = [[int(modified)] + ids for ids in piece_ids]
+            return self.cache.compile(
+                keys,
+                lambda keys: k2.ctc_graph(
+                    [k[1:] for k in keys], modified=modified, device=self.device
+                ),
+                device=self.device,
+            )
         graph = k2.ctc_graph(piece_ids, modified=modified, device=self.device)
         return graph
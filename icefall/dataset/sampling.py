@@ -0,0 +1,268 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cost-aware bucketing for models whose cost grows super-linearly with the
+input length, e.g., models with self-attention.
+
+With --max-duration, a batch of 10 cuts of 20 seconds has the same budget
+as a batch of 100 cuts of 2 seconds, but the attention in the encoder and
+in the attention decoder is 10 times more expensive for the former.
+Here the budget of a batch is instead expressed as a cost
+
+    cost(cut) = a * T + b * T^2 + c * U
+
+where T is the duration of the cut in seconds and U is the number of
+tokens (words or characters) in its transcript. Since every cut in a batch
+is padded to the longest one, the cost of a batch with N cuts is
+N * max(cost(cut)).
+
+With a=1, b=0, c=0, it is identical to --max-duration. Setting b=1/30
+doubles the cost of a cut of 30 seconds, similar to `quadratic_duration`
+in lhotse.
+"""
+
+import math
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from lhotse import CutSet
+from lhotse.cut import Cut
+from lhotse.dataset import DynamicBucketingSampler
+from lhotse.dataset.sampling.base import SamplingConstraint
+
+
+@dataclass
+class CostConstraint(SamplingConstraint):
+    """A sampling constraint on the padded cost of a batch.
+
+    See the module docstring for the definition of the cost.
+
+    Args:
+      max_cost:
+        The maximum cost of a batch.
+      duration_scale:
+        `a` in the cost function.
+      quadratic_scale:
+        `b` in the cost function.
+      token_scale:
+        `c` in the cost function.
+      token_unit:
+        Either "word" or "char"; the unit in which U is counted.
+      max_cuts:
+        If not None, the maximum number of cuts in a batch.
+    """
+
+    max_cost: float
+    duration_scale: float = 1.0
+    quadratic_scale: float = 0.0
+    token_scale: float = 0.0
+    token_unit: str = "word"
+    max_cuts: Optional[int] = None
+    num_cuts: int = 0
+    longest_seen: float = 0.0
+
+    def __post_init__(self) -> None:
+        assert self.max_cost > 0, self.max_cost
+        assert self.duration_scale >= 0, self.duration_scale
+        assert self.quadratic_scale >= 0, self.quadratic_scale
+        assert self.token_scale >= 0, self.token_scale
+        assert self.token_unit in ("word", "char"), self.token_unit
+        assert self.max_cuts is None or self.max_cuts > 0, self.max_cuts
+
+    def num_tokens(self, cut: Cut) -> int:
+        if self.token_unit == "word":
+            return sum(len((s.text or "").split()) for s in cut.supervisions)
+        return sum(len((s.text or "").replace(" ", "")) for s in cut.supervisions)
+
+    def cost(self, duration: float, num_tokens: int) -> float:
+        return (
+            self.duration_scale * duration
+            + self.quadratic_scale * duration * duration
+            + self.token_scale * num_tokens
+        )
+
+    def measure_length(self, example: Cut) -> float:
+        """Return the cost of a single cut. It is also used to create
+        the buckets, so that each bucket holds a similar total cost."""
+        num_tokens = self.num_tokens(example) if self.token_scale > 0 else 0
+        return self.cost(example.duration, num_tokens)
+
+    def add(self, example: Cut) -> None:
+        self.longest_seen = max(self.longest_seen, self.measure_length(example))
+        self.num_cuts += 1
+
+    def exceeded(self) -> bool:
+        if self.max_cuts is not None and self.num_cuts > self.max_cuts:
+            return True
+        return self.num_cuts * self.longest_seen > self.max_cost
+
+    def close_to_exceeding(self) -> bool:
+        if self.max_cuts is not None and self.num_cuts >= self.max_cuts:
+            return True
+        return (self.num_cuts + 1) * self.longest_seen > self.max_cost
+
+    def reset(self) -> None:
+        self.num_cuts = 0
+        self.longest_seen = 0.0
+
+    def state_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        for key in list(asdict(self).keys()):
+            setattr(self, key, state_dict.pop(key))
+        assert len(state_dict) == 0, (
+            "Error in CostConstraint.load_state_dict(): Unexpected keys:\n- "
+            + "\n- ".join(state_dict.keys())
+        )
+        self.__post_init__()
+
+    def __add__(self, other: "CostConstraint") -> "CostConstraint":
+        assert self == other, (self, other)
+        ans = self.copy()
+        ans.num_cuts = self.num_cuts + other.num_cuts
+        ans.longest_seen = max(self.longest_seen, other.longest_seen)
+        return ans
+
+    def __eq__(self, other: "CostConstraint") -> bool:
+        return (
+            isinstance(other, CostConstraint)
+            and self.max_cost == other.max_cost
+            and self.duration_scale == other.duration_scale
+            and self.quadratic_scale == other.quadratic_scale
+            and self.token_scale == other.token_scale
+            and self.token_unit == other.token_unit
+            and self.max_cuts == other.max_cuts
+        )
+
+
+class BatchCostStats:
+    """Accumulates statistics about the padded cost, the number of cuts
+    and the total duration of the batches drawn from each bucket.
+
+    Ideally the mean cost is close to max_cost and similar for all buckets,
+    which means the step time does not depend on the bucket.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        # Map bucket index to a list [num_batches, sum_cost, sum_cost^2,
+        # max_cost, sum_num_cuts, sum_duration]
+        self.stats: Dict[int, List[float]] = defaultdict(
+            lambda: [0, 0.0, 0.0, 0.0, 0, 0.0]
+        )
+
+    def update(self, bucket: int, cost: float, num_cuts: int, duration: float):
+        s = self.stats[bucket]
+        s[0] += 1
+        s[1] += cost
+        s[2] += cost * cost
+        s[3] = max(s[3], cost)
+        s[4] += num_cuts
+        s[5] += duration
+
+    @property
+    def num_batches(self) -> int:
+        return sum(s[0] for s in self.stats.values())
+
+    def summary(self) -> Tuple[float, float, float]:
+        """Return the mean, the standard deviation and the maximum of the
+        batch cost over all buckets."""
+        n = self.num_batches
+        if n == 0:
+            return 0.0, 0.0, 0.0
+        total = sum(s[1] for s in self.stats.values())
+        total_sq = sum(s[2] for s in self.stats.values())
+        mean = total / n
+        std = math.sqrt(max(total_sq / n - mean * mean, 0.0))
+        return mean, std, max(s[3] for s in self.stats.values())
+
+    def state_dict(self) -> Dict[int, List[float]]:
+        return {k: list(v) for k, v in self.stats.items()}
+
+    def __str__(self) -> str:
+        mean, std, max_cost = self.summary()
+        s = (
+            f"{self.num_batches} batches, cost mean {mean:.2f}, "
+            f"std {std:.2f}, max {max_cost:.2f}\n"
+        )
+        for bucket in sorted(self.stats.keys()):
+            n, c, _, m, cuts, duration = self.stats[bucket]
+            s += (
+                f"  bucket {bucket}: {n} batches, mean cost {c / n:.2f}, "
+                f"max cost {m:.2f}, mean cuts {cuts / n:.1f}, "
+                f"mean duration {duration / n:.1f}s\n"
+            )
+        return s
+
+
+class CostBucketingSampler(DynamicBucketingSampler):
+    """A DynamicBucketingSampler whose batches are limited by a
+    :class:`CostConstraint` instead of max_duration.
+
+    Unlike DynamicBucketingSampler with a custom constraint, it supports
+    state_dict(), so it can be used with the checkpointing code in icefall.
+    The statistics of the batches drawn so far are in `self.cost_stats`.
+
+    Usage:
+
+        constraint = CostConstraint(max_cost=600, quadratic_scale=1/30)
+        sampler = CostBucketingSampler(cuts, constraint=constraint, shuffle=True)
+    """
+
+    def __init__(self, *cuts: CutSet, constraint: CostConstraint, **kwargs):
+        assert isinstance(constraint, CostConstraint), type(constraint)
+        super().__init__(*cuts, constraint=constraint, **kwargs)
+        self.cost_stats = BatchCostStats()
+
+    def _next_batch(self) -> Union[CutSet, Tuple[CutSet]]:
+        batch = super()._next_batch()
+        cuts = batch[0] if isinstance(batch, tuple) else batch
+        costs = [self.constraint.measure_length(c) for c in cuts]
+        longest = max(costs)
+        bucket = self.constraint.select_bucket(self.duration_bins, example_len=longest)
+        self.cost_stats.update(
+            bucket=bucket,
+            cost=len(costs) * longest,
+            num_cuts=len(costs),
+            duration=sum(c.duration for c in cuts),
+        )
+        return batch
+
+    def set_epoch(self, epoch: int) -> None:
+        if epoch != self.epoch:
+            self.cost_stats.reset()
+        super().set_epoch(epoch)
+
+    def state_dict(self) -> Dict[str, Any]:
+        # DynamicBucketingSampler.state_dict() refuses custom constraints
+        # since it does not know how to save them.
+        constraint = self.constraint
+        self.constraint = None
+        try:
+            sd = super().state_dict()
+        finally:
+            self.constraint = constraint
+        sd["constraint"] = constraint.state_dict()
+        return sd
+
+    def load_state_dict(self, sd: Dict[str, Any]) -> None:
+        self.constraint.load_state_dict(sd.pop("constraint"))
+        super().load_state_dict(sd)
@@ -0,0 +1,334 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sequential-read sharded feature storage for training, based on the
+Lhotse Shar format.
+
+With PrecomputedFeatures, every cut in a shuffled batch is read from a
+random offset of some .lca/.h5 archive. On network file systems, these
+small random reads starve the GPUs. Here we pack the features and the
+supervisions of a CutSet into large tar shards that are read sequentially:
+
+    data/shar/cuts.000000.jsonl.gz
+    data/shar/features.000000.tar
+    data/shar/cuts.000001.jsonl.gz
+    data/shar/features.000001.tar
+    ...
+    data/shar/index.json
+
+During training, the shards are shuffled, split over DDP ranks and
+dataloader workers, and each worker reads its shards from start to end.
+Cuts are shuffled locally in memory by an additional shuffle buffer and
+by the buffers of DynamicBucketingSampler.
+
+With DDP, the ranks read different shards and would get different numbers
+of batches, so the ranks that finish first would wait forever for the
+others in the gradient all-reduce. In that case the shards are repeated
+without end and every rank stops after the same number of batches, see
+`num_batches` of :class:`SharIterableDataset`.
+
+index.json lists the files of each shard together with its number of
+cuts and total duration.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import torch
+from lhotse import CutSet
+from lhotse.dataset import IterableDatasetWrapper
+from lhotse.shar import LazySharIterator
+from lhotse.utils import Pathlike
+
+
+def export_to_shar(
+    cuts: CutSet,
+    output_dir: Pathlike,
+    shard_size: int = 1000,
+    feature_format: str = "lilcom",
+    num_jobs: int = 1,
+    verbose: bool = False,
+) -> Dict[str, Any]:
+    """Write the features and supervisions of `cuts` into Lhotse Shar shards
+    and write an index to `output_dir/index.json`.
+
+    Args:
+      cuts:
+        The cuts to export. They must have precomputed features.
+        They should be shuffled beforehand, since each shard is read
+        sequentially during training.
+      output_dir:
+        The output directory.
+      shard_size:
+        Number of cuts per shard.
+      feature_format:
+        "lilcom" or "numpy".
+      num_jobs:
+        Number of processes used for the export.
+      verbose:
+        True to show a progress bar.
+    Returns:
+      Return the index, which is also saved to `output_dir/index.json`.
+    """
+    assert feature_format in ("lilcom", "numpy"), feature_format
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    shards = cuts.to_shar(
+        output_dir,
+        fields={"features": feature_format},
+        shard_size=shard_size,
+        num_jobs=num_jobs,
+        verbose=verbose,
+    )
+
+    index = build_shar_index(shards)
+    with open(output_dir / "index.json", "w") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def build_shar_index(shards: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Build the index of shards returned by CutSet.to_shar().
+
+    It reads only the (small) cut manifests of the shards.
+    """
+    entries = []
+    for i, cuts_path in enumerate(sorted(shards["cuts"])):
+        num_cuts = 0
+        duration = 0.0
+        for c in CutSet.from_file(cuts_path):
+            num_cuts += 1
+            duration += c.duration
+        entry = {"cuts": Path(cuts_path).name, "num_cuts": num_cuts}
+        entry["duration"] = round(duration, 3)
+        for field, paths in shards.items():
+            if field != "cuts":
+                entry[field] = Path(sorted(paths)[i]).name
+        entries.append(entry)
+
+    return {
+        "num_shards": len(entries),
+        "num_cuts": sum(e["num_cuts"] for e in entries),
+        "duration": round(sum(e["duration"] for e in entries), 3),
+        "fields": sorted(shards.keys()),
+        "shards": entries,
+    }
+
+
+def load_shar_index(shar_dir: Pathlike) -> Optional[Dict[str, Any]]:
+    """Return the index written by :func:`export_to_shar`, or None
+    if there is no index in `shar_dir`."""
+    filename = Path(shar_dir) / "index.json"
+    if not filename.is_file():
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def load_shar_cuts(
+    shar_dir: Pathlike,
+    seed: int = 42,
+    shuffle_buffer_size: int = 0,
+    repeat: bool = False,
+) -> CutSet:
+    """Return a lazy CutSet that reads the shards in `shar_dir` sequentially.
+
+    The shards are shuffled with the same seed on all DDP ranks and then
+    split so that each combination of rank and dataloader worker reads a
+    distinct subset of them. It has to be used with
+    :class:`SharIterableDataset` and a `worker_init_fn` from
+    `lhotse.dataset.dataloading.make_worker_init_fn` that knows the
+    rank and the world size.
+
+    Args:
+      shar_dir:
+        A directory created by :func:`export_to_shar`.
+      seed:
+        The seed for shuffling the shards. The epoch is added to it.
+      shuffle_buffer_size:
+        If positive, shuffle cuts within a buffer of this size in memory.
+      repeat:
+        If True, read the shards again and again, reshuffled after each
+        pass, so that the returned CutSet is infinite. Use it with the
+        `num_batches` argument of :class:`SharIterableDataset`.
+    """
+    index = load_shar_index(shar_dir)
+    if index is not None:
+        # Note: lhotse would treat index.json as a data field with in_dir=
+        fields = {
+            field: [str(Path(shar_dir) / s[field]) for s in index["shards"]]
+            for field in index["fields"]
+        }
+        in_dir = None
+    else:
+        fields = None
+        in_dir = shar_dir
+
+    cuts = CutSet.from_shar(
+        fields=fields,
+        in_dir=in_dir,
+        shuffle_shards=True,
+        stateful_shuffle=True,
+        split_for_dataloading=True,
+        seed=seed,
+    )
+    if repeat:
+        cuts = cuts.repeat(preserve_id=True)
+    if shuffle_buffer_size > 0:
+        cuts = cuts.shuffle(buffer_size=shuffle_buffer_size)
+    return cuts
+
+
+def set_shar_epoch(cuts: CutSet, epoch: int) -> bool:
+    """Set the epoch of the shar reader underlying a lazy CutSet, possibly
+    wrapped in filters, maps, shuffles, etc., so that its shards are
+    shuffled differently in each epoch.
+
+    Returns:
+      Return True if a shar reader was found.
+    """
+    found = False
+    stack = [cuts.data if isinstance(cuts, CutSet) else cuts]
+    while stack:
+        it = stack.pop()
+        if isinstance(it, LazySharIterator):
+            it.epoch = epoch
+            found = True
+            continue
+        if isinstance(it, CutSet):
+            stack.append(it.data)
+        for name in ("iterator", "source", "iterators"):
+            child = getattr(it, name, None)
+            if isinstance(child, (list, tuple)):
+                stack.extend(child)
+            elif child is not None:
+                stack.append(child)
+    return found
+
+
+class SharIterableDataset(IterableDatasetWrapper):
+    """An IterableDatasetWrapper whose set_epoch() also reshuffles the
+    shards of the shar reader used by the sampler.
+
+    Since the sampler lives in the dataloader workers, its state cannot
+    be saved in checkpoints.
+
+    Args:
+      dataset:
+        The map-style dataset that converts a CutSet into a batch.
+      sampler:
+        The sampler. It runs in the dataloader workers.
+      num_batches:
+        If not None, an epoch has exactly this number of batches, which are
+        split evenly over the dataloader workers. The cuts of the sampler
+        have to be infinite, see `repeat` of :func:`load_shar_cuts`. This is
+        required for DDP training, where all ranks need the same number of
+        batches.
+    """
+
+    def __init__(
+        self,
+        dataset: torch.utils.data.Dataset,
+        sampler: Any,
+        num_batches: Optional[int] = None,
+    ) -> None:
+        super().__init__(dataset=dataset, sampler=sampler)
+        assert num_batches is None or num_batches > 0, num_batches
+        self.num_batches = num_batches
+        # Number of batches left in this epoch for this dataloader worker
+        self._num_left = None
+
+    def __iter__(self):
+        if self.num_batches is not None:
+            worker_info = torch.utils.data.get_worker_info()
+            if worker_info is None:
+                self._num_left = self.num_batches
+            else:
+                q, r = divmod(self.num_batches, worker_info.num_workers)
+                self._num_left = q + int(worker_info.id < r)
+        return super().__iter__()
+
+    def __next__(self) -> dict:
+        if self._num_left is not None:
+            if self._num_left == 0:
+                # Start from new shards in the next epoch
+                self._sampler_iter = None
+                raise StopIteration
+            self._num_left -= 1
+        return super().__next__()
+
+    def set_epoch(self, epoch: int) -> None:
+        super().set_epoch(epoch)
+        for cuts in self.sampler.cuts:
+            if not set_shar_epoch(cuts, epoch):
+                logging.warning("No shar reader found in the sampler's cuts")
+
+
+def check_num_shards(
+    shar_dir: Pathlike,
+    world_size: int,
+    num_workers: int,
+) -> None:
+    """Raise an error if some dataloader workers would not get any shard.
+
+    Such a worker would produce no batch at all, so with DDP its rank would
+    run out of batches before the other ranks.
+    """
+    index = load_shar_index(shar_dir)
+    if index is None:
+        return
+    num_readers = world_size * max(num_workers, 1)
+    if index["num_shards"] < num_readers:
+        raise ValueError(
+            f"There are only {index['num_shards']} shards in {shar_dir} "
+            f"for {num_readers} readers (world_size * num_workers). "
+            f"Please export with a smaller shard size or use fewer "
+            f"dataloader workers."
+        )
+    if index["num_shards"] % num_readers != 0:
+        logging.info(
+            f"{index['num_shards']} shards are not evenly divisible over "
+            f"{num_readers} readers; some workers will read one more shard."
+        )
+
+
+def get_num_batches_per_epoch(
+    shar_dir: Pathlike,
+    world_size: int,
+    max_duration: float,
+) -> int:
+    """Return the number of batches per epoch and per rank such that one
+    epoch reads about the whole data once, for :class:`SharIterableDataset`.
+
+    Batches are rarely full, so this slightly underestimates the number of
+    batches of a single pass over the data.
+    """
+    index = load_shar_index(shar_dir)
+    assert index is not None, (
+        f"There is no index.json in {shar_dir}; "
+        "please specify the number of batches per epoch"
+    )
+    return max(1, int(index["duration"] / (world_size * max_duration)))
+
+
+def is_iterable_dataloader(dl: torch.utils.data.DataLoader) -> bool:
+    """Return True if `dl` uses an iterable-style dataset, in which case
+    the sampler lives in the dataloader workers."""
+    return isinstance(dl.dataset, torch.utils.data.IterableDataset)
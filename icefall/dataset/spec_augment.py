@@ -0,0 +1,290 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batched SpecAugment.
+
+The SpecAugment of lhotse, and `icefall.utils.time_warp`, process the
+sequences (or supervision segments) of a batch one by one, with two
+`interpolate()` calls per warped segment and one indexing operation per
+mask. Here the warping of all segments is done with a single gather of the
+four neighbouring frames used by bicubic interpolation, and the masks of
+all sequences are built at once.
+
+The random parameters are drawn from the same distributions as in lhotse,
+and the time warping gives the same result as `interpolate()` with
+`mode="bicubic"` and `align_corners=False`, up to rounding errors.
+"""
+
+import math
+import random
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from lhotse.dataset import SpecAugment
+
+# The coefficient of the cubic convolution used by torch for bicubic
+# interpolation
+_CUBIC_A = -0.75
+
+
+def _cubic_weights(t: torch.Tensor) -> torch.Tensor:
+    """Return the weights of the 4 neighbours at offsets -1, 0, 1, 2 for
+    fractional positions `t` in [0, 1). The result has shape (*t.shape, 4)."""
+    A = _CUBIC_A
+
+    def near(x):  # |x| <= 1
+        return ((A + 2) * x - (A + 3)) * x * x + 1
+
+    def far(x):  # 1 < |x| < 2
+        return ((A * x - 5 * A) * x + 8 * A) * x - 4 * A
+
+    return torch.stack([far(t + 1), near(t), near(1 - t), far(2 - t)], dim=-1)
+
+
+def sample_time_warp(num_frames: int, factor: int) -> Optional[Tuple[int, int]]:
+    """Draw the center and the warped center of a segment as in lhotse's
+    time_warp(). Return None if the segment is not changed."""
+    if num_frames - factor <= factor + 1:
+        return None
+    center = np.random.randint(factor + 1, num_frames - factor)
+    warped = np.random.randint(center - factor, center + factor + 1)
+    if warped == center:
+        return None
+    return center, warped
+
+
+def warp_segments(
+    features: torch.Tensor,
+    segments: Sequence[Tuple[int, int, int, int, int]],
+) -> torch.Tensor:
+    """Time-warp segments of `features` in place.
+
+    Each segment is a tuple (sequence_idx, start_frame, num_frames, center,
+    warped). Frames [0, center) of the segment are stretched to [0, warped)
+    and frames [center, num_frames) to [warped, num_frames).
+
+    The segments are warped one after another, as in
+    `icefall.utils.time_warp`: a segment that overlaps a previous one warps
+    the output of the previous one. Runs of consecutive segments that do
+    not overlap are warped at once.
+
+    Args:
+      features:
+        A tensor of shape (N, T, F).
+      segments:
+        The segments to warp.
+    Returns:
+      Return `features`.
+    """
+    group = []
+    for segment in segments:
+        sequence_idx, start_frame, num_frames = segment[:3]
+        if any(
+            s[0] == sequence_idx
+            and s[1] < start_frame + num_frames
+            and start_frame < s[1] + s[2]
+            for s in group
+        ):
+            # It has to see the output of the segments of `group`
+            _warp_disjoint_segments(features, group)
+            group = []
+        group.append(segment)
+    return _warp_disjoint_segments(features, group)
+
+
+def _warp_disjoint_segments(
+    features: torch.Tensor,
+    segments: Sequence[Tuple[int, int, int, int, int]],
+) -> torch.Tensor:
+    """Time-warp segments that do not overlap, with a single gather. See
+    :func:`warp_segments`."""
+    if len(segments) == 0:
+        return features
+    device = features.device
+    seg = torch.tensor(segments, dtype=torch.int64).to(device)
+    seq_idx, start, length, center, warped = seg.unbind(dim=1)
+
+    # The segment of each output frame and its position in the segment
+    seg_of_frame = torch.repeat_interleave(
+        torch.arange(len(segments), device=device), length
+    )
+    offsets = torch.cumsum(length, dim=0) - length
+    j = torch.arange(seg_of_frame.numel(), device=device) - offsets[seg_of_frame]
+
+    # Output frames [0, warped) come from input frames [0, center), and
+    # output frames [warped, length) from input frames [center, length).
+    s_center = center[seg_of_frame]
+    s_warped = warped[seg_of_frame]
+    s_length = length[seg_of_frame]
+    left = j < s_warped
+    in_start = torch.where(left, 0, s_center)
+    in_len = torch.where(left, s_center, s_length - s_center)
+    out_len = torch.where(left, s_warped, s_length - s_warped)
+    out_pos = torch.where(left, j, j - s_warped)
+
+    # As in torch's upsample_bicubic2d with align_corners=False
+    scale = in_len.float() / out_len.float()
+    src = scale * (out_pos.float() + 0.5) - 0.5
+    src_floor = src.floor()
+    weights = _cubic_weights(src - src_floor).to(features.dtype)
+
+    neighbours = src_floor.long().unsqueeze(-1) + torch.arange(-1, 3, device=device)
+    # Neighbours outside of the piece are clamped to its borders
+    neighbours = torch.minimum(neighbours.clamp(min=0), (in_len - 1).unsqueeze(-1))
+    frames = start[seg_of_frame].unsqueeze(-1) + in_start.unsqueeze(-1) + neighbours
+
+    # Rows of features.view(N * T, F)
+    s_row = seq_idx[seg_of_frame] * features.size(1)
+    src_rows = s_row.unsqueeze(-1) + frames
+    dst_rows = s_row + start[seg_of_frame] + j
+
+    flat = features.view(-1, features.size(2))
+    warped_frames = weights[:, :1] * flat.index_select(0, src_rows[:, 0])
+    for k in range(1, 4):
+        warped_frames += weights[:, k : k + 1] * flat.index_select(0, src_rows[:, k])
+    flat.index_copy_(0, dst_rows, warped_frames)
+    return features
+
+
+def batched_time_warp(
+    features: torch.Tensor,
+    p: float = 0.9,
+    time_warp_factor: Optional[int] = 80,
+    supervision_segments: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """A batched version of `icefall.utils.time_warp`. See there for the
+    arguments. Overlapping supervision segments are warped one after
+    another, as there."""
+    if time_warp_factor is None or time_warp_factor < 1:
+        return features
+    assert len(features.shape) == 3, (
+        "SpecAugment only supports batches of single-channel feature matrices. "
+        f"{features.shape}"
+    )
+
+    if supervision_segments is None:
+        candidates = [(i, 0, features.size(1)) for i in range(features.size(0))]
+    else:
+        candidates = supervision_segments.tolist()
+
+    segments = []
+    for sequence_idx, start_frame, num_frames in candidates:
+        # As with slicing, segments are truncated to the end of the sequence
+        num_frames = max(0, min(num_frames, features.size(1) - start_frame))
+        if random.random() > p:
+            # Randomly choose whether this transform is applied
+            continue
+        params = sample_time_warp(num_frames, time_warp_factor)
+        if params is not None:
+            segments.append((sequence_idx, start_frame, num_frames) + params)
+
+    return warp_segments(features.clone(), segments)
+
+
+def _sample_masks(
+    num_sequences: int,
+    size: int,
+    mask_size: int,
+    mask_times: int,
+    device: torch.device,
+) -> torch.Tensor:
+    """Return a boolean tensor of shape (num_sequences, size) with
+    `mask_times` random ranges per sequence, as in lhotse's
+    mask_along_axis_optimized()."""
+    mask_size = int(mask_size)
+    if mask_times <= 0 or mask_size <= 0:
+        return torch.zeros(num_sequences, size, dtype=torch.bool, device=device)
+    widths = torch.randint(0, mask_size, (num_sequences, mask_times))
+    starts = (torch.rand(num_sequences, mask_times) * (size - widths)).long()
+    ends = starts + widths
+    pos = torch.arange(size).view(1, 1, -1)
+    mask = (pos >= starts.unsqueeze(-1)) & (pos < ends.unsqueeze(-1))
+    return mask.any(dim=1).to(device)
+
+
+class BatchedSpecAugment(SpecAugment):
+    """A drop-in replacement for lhotse's SpecAugment, which processes all
+    sequences of a batch at once.
+
+    For each sequence, the transform is applied with probability `p`, and
+    the masks are drawn from the same distributions as in lhotse. With
+    supervision segments, they are warped separately and the masks are
+    applied to the whole sequences, with independent draws of `p`.
+    """
+
+    def forward(
+        self,
+        features: torch.Tensor,
+        supervision_segments: Optional[torch.IntTensor] = None,
+        *args,
+        **kwargs,
+    ) -> torch.Tensor:
+        assert len(features.shape) == 3, (
+            "SpecAugment only supports batches of " "single-channel feature matrices."
+        )
+        features = features.clone()
+        N, T, _ = features.shape
+        warp = self.time_warp_factor is not None and self.time_warp_factor >= 1
+
+        if supervision_segments is None:
+            apply = [random.random() <= self.p for _ in range(N)]
+            if warp:
+                segments = []
+                for i in range(N):
+                    params = apply[i] and sample_time_warp(T, self.time_warp_factor)
+                    if params:
+                        segments.append((i, 0, T) + params)
+                warp_segments(features, segments)
+        else:
+            if warp:
+                features = batched_time_warp(
+                    features,
+                    p=self.p,
+                    time_warp_factor=self.time_warp_factor,
+                    supervision_segments=supervision_segments,
+                )
+            apply = [random.random() <= self.p for _ in range(N)]
+
+        return self._mask(features, torch.tensor(apply, device=features.device))
+
+    def _mask(self, features: torch.Tensor, apply: torch.Tensor) -> torch.Tensor:
+        """Apply frequency and time masks to the sequences with `apply`
+        set to True."""
+        N, T, F = features.shape
+        device = features.device
+        mean = features.mean(dim=(1, 2), keepdim=True)
+
+        mask = _sample_masks(
+            N, F, self.features_mask_size, self.num_feature_masks, device
+        ).unsqueeze(1)
+
+        # The time masks depend only on the (padded) length, as in lhotse
+        max_tot_mask_frames = self.max_frames_mask_fraction * T
+        num_frame_masks = min(
+            self.num_frame_masks,
+            math.ceil(max_tot_mask_frames / self.frames_mask_size),
+        )
+        if num_frame_masks > 0:
+            max_mask_frames = min(
+                self.frames_mask_size, max_tot_mask_frames // num_frame_masks
+            )
+            time_mask = _sample_masks(N, T, max_mask_frames, num_frame_masks, device)
+            mask = mask | time_mask.unsqueeze(2)
+
+        mask = mask & apply.view(N, 1, 1)
+        return torch.where(mask, mean, features)
@@ -18,7 +18,7 @@
 import logging
 from dataclasses import dataclass, field
 from multiprocessing.pool import Pool
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import k2
 import torch
@@ -2167,3 +2167,199 @@ def ctc_prefix_beam_search_attention_decoder_rescoring(
         key = f"attention_scale_{a_scale}"
         ans[key] = best_path
     return ans
+
+
+@dataclass
+class SpeculativeDecodingStats:
+    """Statistics of :func:`speculative_greedy_search`, accumulated over
+    the utterances decoded with the same object."""
+
+    # Number of utterances
+    num_utterances: int = 0
+
+    # Number of tokens of the drafts
+    num_draft_tokens: int = 0
+
+    # Number of draft tokens accepted by the decoder
+    num_accepted_tokens: int = 0
+
+    # Number of decoder steps of each utterance, summed over utterances.
+    # The verification of the draft counts as one step.
+    num_steps: int = 0
+
+    # Number of decoder steps autoregressive greedy search would take,
+    # i.e., one per output token including the EOS, summed over utterances.
+    num_autoregressive_steps: int = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.num_accepted_tokens / max(self.num_draft_tokens, 1)
+
+    @property
+    def speedup(self) -> float:
+        """Reduction of the number of sequential decoder steps compared to
+        autoregressive greedy search."""
+        return self.num_autoregressive_steps / max(self.num_steps, 1)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.num_utterances} utterances, "
+            f"acceptance rate: {self.acceptance_rate:.4f} "
+            f"({self.num_accepted_tokens}/{self.num_draft_tokens}), "
+            f"decoder steps: {self.num_steps}, "
+            f"autoregressive decoder steps: {self.num_autoregressive_steps}, "
+            f"speedup: {self.speedup:.2f}"
+        )
+
+
+def speculative_greedy_search(
+    decoder_logits: Callable[[torch.Tensor, torch.Tensor, torch.Tensor], torch.Tensor],
+    draft_token_ids: List[List[int]],
+    max_lens: List[int],
+    sos_id: int,
+    eos_id: int,
+    device: torch.device = torch.device("cpu"),
+    stats: Optional[SpeculativeDecodingStats] = None,
+) -> List[List[int]]:
+    """Greedy search of an attention decoder, which uses a draft hypothesis of
+    each utterance, e.g., the result of CTC greedy search, to reduce the
+    number of sequential decoder steps.
+
+    The draft is verified with a single forward of the decoder on all its
+    tokens: the longest prefix of the draft that greedy search would produce
+    is accepted, together with the token predicted after it. Greedy search
+    then continues autoregressively from the first rejected token. The
+    result is the same as the one of autoregressive greedy search, which is
+    the special case of empty drafts.
+
+    Args:
+      decoder_logits:
+        A function that takes `indexes`, a 1-D tensor with the indexes of some
+        utterances in the batch, `ys_in_pad` of shape (len(indexes), S),
+        their token IDs starting with the SOS and padded with the EOS, and
+        `ys_in_lens` of shape (len(indexes),), and returns the logits of the
+        decoder of shape (len(indexes), S, vocab_size).
+      draft_token_ids:
+        The draft token IDs of each utterance, without SOS and EOS.
+      max_lens:
+        The maximum number of tokens of the result of each utterance, e.g.,
+        its number of encoder frames.
+      sos_id:
+        The token ID of the SOS.
+      eos_id:
+        The token ID of the EOS.
+      device:
+        The device of the tensors given to `decoder_logits`.
+      stats:
+        If not None, the statistics of the decoding are added to it.
+    Returns:
+      Return the token IDs of each utterance, without SOS and EOS.
+    """
+    hyps = []
+    for i, draft in enumerate(draft_token_ids):
+        if eos_id in draft:
+            draft = draft[: draft.index(eos_id)]
+        hyps.append(draft[: max_lens[i]])
+    active = [i for i in range(len(hyps)) if max_lens[i] > 0]
+    num_steps = [0] * len(hyps)
+    verifying = True
+
+    while active:
+        ys_in = [torch.tensor([sos_id] + hyps[i]) for i in active]
+        ys_in_lens = torch.tensor([len(y) for y in ys_in], device=device)
+        ys_in_pad = torch.nn.utils.rnn.pad_sequence(
+            ys_in, batch_first=True, padding_value=eos_id
+        ).to(device)
+        logits = decoder_logits(
+            torch.tensor(active, device=device), ys_in_pad, ys_in_lens
+        )
+
+        if verifying:
+            # The prediction after each prefix of the draft
+            predictions = logits.argmax(dim=-1).tolist()
+        else:
+            # Only the prediction after the whole hypothesis is needed
+            logits = logits[torch.arange(len(active), device=device), ys_in_lens - 1]
+            predictions = logits.argmax(dim=-1).unsqueeze(1).tolist()
+
+        next_active = []
+        for i, pred in zip(active, predictions):
+            num_steps[i] += 1
+            hyp = hyps[i]
+            if verifying:
+                k = 0
+                while k < len(hyp) and pred[k] == hyp[k]:
+                    k += 1
+                if stats is not None:
+                    stats.num_draft_tokens += len(hyp)
+                    stats.num_accepted_tokens += k
+                hyp = hyp[:k]
+                token = pred[k]
+            else:
+                token = pred[0]
+
+            if len(hyp) < max_lens[i] and token != eos_id:
+                hyp.append(token)
+                if len(hyp) < max_lens[i]:
+                    next_active.append(i)
+            hyps[i] = hyp
+        active = next_active
+        verifying = False
+
+    if stats is not None:
+        stats.num_utterances += len(hyps)
+        for i, hyp in enumerate(hyps):
+            stats.num_steps += num_steps[i]
+            stats.num_autoregressive_steps += min(len(hyp) + 1, max_lens[i])
+    return hyps
+
+
+def attention_decoder_speculative_greedy_search(
+    attention_decoder: torch.nn.Module,
+    encoder_out: torch.Tensor,
+    encoder_out_lens: torch.Tensor,
+    draft_token_ids: List[List[int]],
+    stats: Optional[SpeculativeDecodingStats] = None,
+) -> List[List[int]]:
+    """Greedy search of the attention decoder, with draft hypotheses, e.g.,
+    from CTC greedy search or transducer greedy search.
+    See :func:`speculative_greedy_search`.
+
+    Args:
+      attention_decoder:
+        The attention decoder, see zipformer/attention_decoder.py.
+      encoder_out:
+        The output of encoder, the shape is (B, T, D)
+      encoder_out_lens:
+        The lengths (frames) of sequences after subsampling, the shape is (B,)
+      draft_token_ids:
+        The draft token IDs of each utterance. Use empty lists for
+        autoregressive greedy search.
+      stats:
+        If not None, the statistics of the decoding are added to it.
+    Returns:
+      Return the token IDs of each utterance.
+    """
+
+    def decoder_logits(
+        indexes: torch.Tensor, ys_in_pad: torch.Tensor, ys_in_lens: torch.Tensor
+    ) -> torch.Tensor:
+        memory_lens = encoder_out_lens[indexes]
+        # The padding mask of the memory has max(memory_lens) frames
+        memory = encoder_out[indexes, : memory_lens.max()]
+        return attention_decoder.decoder(
+            x=ys_in_pad,
+            x_lens=ys_in_lens,
+            memory=memory,
+            memory_lens=memory_lens,
+        )
+
+    return speculative_greedy_search(
+        decoder_logits=decoder_logits,
+        draft_token_ids=draft_token_ids,
+        max_lens=encoder_out_lens.tolist(),
+        sos_id=attention_decoder.sos_id,
+        eos_id=attention_decoder.eos_id,
+        device=encoder_out.device,
+        stats=stats,
+    )
@@ -19,8 +19,10 @@
 
 import logging
 import random
+import re
+import zlib
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple, Union
 
 import torch
 from torch import Tensor, nn
@@ -686,6 +688,387 @@ def attach_diagnostics(
     return ans
 
 
+class ContinuousDiagnosticOptions(object):
+    """Options object for continuous diagnostics, which are intended to be
+    kept on during the whole training, see :class:`ContinuousDiagnostic`.
+
+    Args:
+      sample_prob:
+        The probability that a training batch is analyzed.
+      module_fraction:
+        The fraction of modules that are analyzed. The selection is
+        deterministic given the module names, so it is the same on all
+        DDP ranks and across restarts.
+      module_pattern:
+        If not None, only modules whose name matches this regular expression
+        (with re.search) are candidates for the selection.
+      include_params:
+        If True, also analyze the values and gradients of the parameters
+        owned directly by the selected modules.
+      histograms:
+        The per-channel stats that are written as histograms to TensorBoard
+        in flush(). Possible values are "mean", "rms", "abs_max", "positive".
+      max_eig_dim:
+        Passed to TensorDiagnosticOptions for the full diagnostics that are
+        computed on demand, see :meth:`ContinuousDiagnostic.request_full_diagnostics`.
+      seed:
+        The seed of the generator used to sample batches.
+    """
+
+    def __init__(
+        self,
+        sample_prob: float = 0.02,
+        module_fraction: float = 0.25,
+        module_pattern: Optional[str] = None,
+        include_params: bool = True,
+        histograms: Tuple[str, ...] = ("rms", "abs_max"),
+        max_eig_dim: int = 512,
+        seed: int = 0,
+    ):
+        assert 0.0 <= sample_prob <= 1.0, sample_prob
+        assert 0.0 <= module_fraction <= 1.0, module_fraction
+        for h in histograms:
+            assert h in ("mean", "rms", "abs_max", "positive"), h
+        self.sample_prob = sample_prob
+        self.module_fraction = module_fraction
+        self.module_pattern = module_pattern
+        self.include_params = include_params
+        self.histograms = histograms
+        self.max_eig_dim = max_eig_dim
+        self.seed = seed
+
+    def is_selected(self, name: str) -> bool:
+        if self.module_pattern is not None and not re.search(self.module_pattern, name):
+            return False
+        # Python's hash() of str is randomized per process, crc32 is not.
+        return zlib.crc32(name.encode()) % 10000 < self.module_fraction * 10000
+
+
+class StreamingTensorStats(object):
+    """Running per-channel statistics of a tensor, where the channel is the
+    last dim. All accumulators stay on the device of the tensors, so that
+    accumulate() never synchronizes with the GPU.
+
+    If the size of the last dim changes between calls (e.g. it is a time
+    dim), the stats are collapsed into a single channel.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        # number of elements per channel
+        self.count = 0
+        self.sum = None
+        self.sumsq = None
+        self.abs_max = None
+        self.num_positive = None
+
+    @property
+    def num_channels(self) -> int:
+        return 0 if self.sum is None else self.sum.numel()
+
+    def _collapse(self) -> None:
+        self.count *= self.num_channels
+        self.sum = self.sum.sum(dim=0, keepdim=True)
+        self.sumsq = self.sumsq.sum(dim=0, keepdim=True)
+        self.abs_max = self.abs_max.max(dim=0, keepdim=True)[0]
+        self.num_positive = self.num_positive.sum(dim=0, keepdim=True)
+
+    def accumulate(self, x: Tensor, scale: Optional[Union[float, Tensor]] = None):
+        """
+        Args:
+          x:
+            The tensor to analyze.
+          scale:
+            If not None, x is divided by it, e.g. the grad scale of
+            torch.cuda.amp.GradScaler for gradients.
+        """
+        x = x.detach()
+        if x.numel() == 0:
+            return
+        if x.ndim == 0:
+            x = x.unsqueeze(0)
+        x = x.reshape(-1, x.shape[-1]).to(torch.float32)
+        if scale is not None:
+            x = x / scale
+
+        if self.sum is not None and x.shape[1] != self.num_channels:
+            if self.num_channels != 1:
+                self._collapse()
+            x = x.reshape(-1, 1)
+
+        s = x.sum(dim=0).to(torch.float64)
+        sumsq = (x * x).sum(dim=0).to(torch.float64)
+        abs_max = x.abs().max(dim=0)[0]
+        num_positive = (x > 0).sum(dim=0).to(torch.float64)
+        if self.sum is None:
+            self.sum, self.sumsq = s, sumsq
+            self.abs_max, self.num_positive = abs_max, num_positive
+        else:
+            self.sum += s
+            self.sumsq += sumsq
+            self.abs_max = torch.maximum(self.abs_max, abs_max)
+            self.num_positive += num_positive
+        self.count += x.shape[0]
+
+    def get_stats(self) -> Dict[str, Tensor]:
+        """Return a dict mapping "mean", "rms", "abs_max" and "positive"
+        (the proportion of positive values) to per-channel stats on CPU."""
+        assert self.count > 0
+        s = torch.stack(
+            [self.sum, self.sumsq, self.abs_max.to(torch.float64), self.num_positive]
+        ).cpu()
+        return {
+            "mean": s[0] / self.count,
+            "rms": (s[1] / self.count).sqrt(),
+            "abs_max": s[2],
+            "positive": s[3] / self.count,
+        }
+
+
+class ContinuousDiagnostic(object):
+    """Low-overhead diagnostics that can stay on in production training,
+    unlike :class:`ModelDiagnostic`, which computes all stats, including
+    eigenvalues, on every forward and backward pass.
+
+    Only a random fraction of the batches and a fixed subset of the modules
+    are analyzed, and only cheap streaming stats are accumulated on the
+    device: mean, rms, abs-max and proportion of positive values, per
+    channel. flush() writes them as histograms to TensorBoard, logs a
+    short summary, warns about non-finite values and resets them.
+
+    The full diagnostics of :class:`ModelDiagnostic`, including eigenvalues,
+    are only computed on demand with request_full_diagnostics().
+
+    Usage:
+
+        diagnostic = attach_continuous_diagnostics(model)
+        for batch_idx, batch in enumerate(train_dl):
+            diagnostic.start_batch()
+            loss = compute_loss(model, batch)
+            loss.backward()
+            diagnostic.end_batch()
+            if batch_idx % 500 == 0:
+                diagnostic.flush(tb_writer, batch_idx)
+
+    Use it instead of :func:`attach_diagnostics`, not together with it.
+    """
+
+    def __init__(self, opts: Optional[ContinuousDiagnosticOptions] = None):
+        self.opts = ContinuousDiagnosticOptions() if opts is None else opts
+        self.stats: Dict[str, StreamingTensorStats] = dict()
+        self.class_names: Dict[str, str] = dict()
+        self.rng = random.Random(self.opts.seed)
+        self.handles = []
+
+        # True between start_batch() and end_batch() of a sampled batch
+        self.active = False
+        self.grad_scale = None
+        self.num_batches = 0
+        self.num_sampled_batches = 0
+
+        # Used only while full diagnostics are requested
+        self.full: Optional[ModelDiagnostic] = None
+        self.num_full_batches_left = 0
+
+    def __getitem__(self, name: str) -> StreamingTensorStats:
+        if name not in self.stats:
+            self.stats[name] = StreamingTensorStats()
+        return self.stats[name]
+
+    def start_batch(self, grad_scale: Optional[Union[float, Tensor]] = None) -> bool:
+        """Decide whether the next forward and backward passes are analyzed.
+        Call it before the forward pass of each training batch.
+
+        Args:
+          grad_scale:
+            The scale of the loss when using torch.cuda.amp.GradScaler, so
+            that the gradient stats do not depend on it. Can be a tensor,
+            e.g. `scaler._scale`, to avoid a synchronization.
+        Returns:
+          Return True if this batch is analyzed.
+        """
+        self.num_batches += 1
+        self.active = (
+            self.num_full_batches_left > 0 or self.rng.random() < self.opts.sample_prob
+        )
+        if self.active:
+            self.grad_scale = grad_scale
+            self.num_sampled_batches += 1
+        return self.active
+
+    def end_batch(self) -> None:
+        """Call it after the backward pass of each training batch."""
+        if self.active and self.num_full_batches_left > 0:
+            self.num_full_batches_left -= 1
+            if self.num_full_batches_left == 0:
+                self.full.print_diagnostics()
+                self.full = None
+        self.active = False
+        self.grad_scale = None
+
+    def request_full_diagnostics(self, num_batches: int = 5) -> None:
+        """Accumulate the full diagnostics of :class:`ModelDiagnostic`,
+        including eigenvalues, for the selected modules over the next
+        `num_batches` batches and print them afterwards."""
+        logging.info(f"Computing full diagnostics for {num_batches} batches")
+        self.full = ModelDiagnostic(TensorDiagnosticOptions(self.opts.max_eig_dim))
+        self.num_full_batches_left = num_batches
+
+    def accumulate(
+        self,
+        name: str,
+        x: Tensor,
+        class_name: Optional[str] = None,
+        is_grad: bool = False,
+    ) -> None:
+        scale = self.grad_scale if is_grad else None
+        self[name].accumulate(x, scale=scale)
+        if class_name is not None:
+            self.class_names[name] = class_name
+        if self.full is not None:
+            if scale is not None:
+                x = x / scale
+            self.full[name].accumulate(x, class_name=class_name)
+
+    def get_stats(self) -> Dict[str, Dict[str, Tensor]]:
+        """Return the per-channel stats of all tensors analyzed since the
+        last flush(), see :meth:`StreamingTensorStats.get_stats`."""
+        return {
+            name: s.get_stats() for name, s in sorted(self.stats.items()) if s.count
+        }
+
+    def flush(self, tb_writer=None, step: int = 0, num_to_log: int = 5) -> None:
+        """Write the stats accumulated since the last call to TensorBoard and
+        to the log, and reset them.
+
+        Args:
+          tb_writer:
+            If not None, a torch.utils.tensorboard.SummaryWriter.
+          step:
+            The global step for TensorBoard.
+          num_to_log:
+            Log the tensors with the largest absolute values.
+        """
+        stats = self.get_stats()
+        for s in self.stats.values():
+            s.reset()
+        if not stats:
+            return
+
+        non_finite = []
+        abs_max = []
+        for name, s in stats.items():
+            if not all(torch.isfinite(v).all() for v in s.values()):
+                non_finite.append(name)
+                continue
+            abs_max.append((s["abs_max"].max().item(), name))
+            if tb_writer is not None:
+                for h in self.opts.histograms:
+                    tb_writer.add_histogram(f"diagnostics/{name}/{h}", s[h], step)
+
+        if non_finite:
+            logging.warning(
+                f"Non-finite values in {len(non_finite)} tensors: "
+                + ", ".join(non_finite[:num_to_log])
+            )
+        msg = ", ".join(
+            f"{name}={value:.3g}"
+            for value, name in sorted(abs_max, reverse=True)[:num_to_log]
+        )
+        logging.info(
+            f"Diagnostics of {len(stats)} tensors over {self.num_sampled_batches}"
+            f"/{self.num_batches} batches, largest abs values: {msg}"
+        )
+        self.num_batches = 0
+        self.num_sampled_batches = 0
+
+    def remove(self) -> None:
+        """Remove the hooks from the model."""
+        for h in self.handles:
+            h.remove()
+        self.handles = []
+
+
+def attach_continuous_diagnostics(
+    model: nn.Module, opts: Optional[ContinuousDiagnosticOptions] = None
+) -> ContinuousDiagnostic:
+    """Attach a ContinuousDiagnostic object to the model, by registering a
+    forward hook on each selected module. In sampled batches, the hook
+    accumulates the output of the module and registers a hook on the output
+    to accumulate its gradient. In other batches, the hooks return
+    immediately.
+
+    Args:
+      model:
+        the model to be analyzed.
+      opts:
+        Options object.
+
+    Returns:
+      The ContinuousDiagnostic object attached to the model.
+    """
+    ans = ContinuousDiagnostic(opts)
+    num_selected = 0
+    for name, module in model.named_modules():
+        if name == "":
+            name = "<top-level>"
+        if not ans.opts.is_selected(name):
+            continue
+        num_selected += 1
+
+        def forward_hook(_module, _input, _output, _diagnostic=ans, _name=name):
+            if not _diagnostic.active:
+                return
+            if isinstance(_output, Tensor):
+                _output = (_output,)
+            if not isinstance(_output, tuple):
+                return
+            class_name = get_class_name(_module)
+            for i, o in enumerate(_output):
+                if not isinstance(o, Tensor) or o.dtype not in (
+                    torch.float32,
+                    torch.float16,
+                    torch.bfloat16,
+                    torch.float64,
+                ):
+                    continue
+                key = _name if len(_output) == 1 else f"{_name}[{i}]"
+                _diagnostic.accumulate(f"{key}.output", o, class_name=class_name)
+                if o.requires_grad:
+
+                    def grad_hook(grad, _key=key, _class_name=class_name):
+                        _diagnostic.accumulate(
+                            f"{_key}.grad", grad, class_name=_class_name, is_grad=True
+                        )
+
+                    o.register_hook(grad_hook)
+
+        ans.handles.append(module.register_forward_hook(forward_hook))
+
+        if not ans.opts.include_params:
+            continue
+
+        for pname, parameter in module.named_parameters(recurse=False):
+            if not parameter.requires_grad:
+                continue
+            pname = f"{name}.{pname}"
+
+            def param_backward_hook(
+                grad, _parameter=parameter, _diagnostic=ans, _name=pname
+            ):
+                if not _diagnostic.active:
+                    return
+                _diagnostic.accumulate(f"{_name}.param_value", _parameter)
+                _diagnostic.accumulate(f"{_name}.param_grad", grad, is_grad=True)
+
+            ans.handles.append(parameter.register_hook(param_backward_hook))
+
+    logging.info(f"Continuous diagnostics attached to {num_selected} modules")
+    return ans
+
+
 def _test_tensor_diagnostic():
     opts = TensorDiagnosticOptions(512)
 
@@ -708,5 +1091,40 @@ def _test_tensor_diagnostic():
     diagnostic.print_diagnostics()
 
 
+def _test_continuous_diagnostic():
+    model = nn.Sequential(nn.Linear(100, 50), nn.ReLU(), nn.Linear(50, 80))
+    opts = ContinuousDiagnosticOptions(sample_prob=0.5, module_fraction=1.0)
+    diagnostic = attach_continuous_diagnostics(model, opts)
+
+    for i in range(20):
+        if i == 10:
+            diagnostic.request_full_diagnostics(num_batches=2)
+        diagnostic.start_batch(grad_scale=4.0)
+        T = random.randint(200, 300)
+        x = torch.randn(T, 100)
+        y = model(x)
+        (4.0 * y.sum()).backward()
+        diagnostic.end_batch()
+
+    assert 0 < diagnostic.num_sampled_batches < 20
+    stats = diagnostic.get_stats()
+    assert stats["0.output"]["rms"].shape == (50,)
+    assert stats["2.weight.param_grad"]["rms"].shape == (50,)
+    # d(y.sum())/dy is 1; the grad scale of 4 is removed.
+    assert torch.allclose(stats["2.grad"]["mean"], torch.ones(80, dtype=torch.float64))
+    assert (
+        (stats["1.output"]["positive"] > 0.2) & (stats["1.output"]["positive"] < 0.8)
+    ).all()
+
+    diagnostic.flush()
+    assert diagnostic.get_stats() == {}
+
+    diagnostic.remove()
+    diagnostic.start_batch()
+    model(torch.randn(10, 100))
+    assert diagnostic.get_stats() == {}
+
+
 if __name__ == "__main__":
     _test_tensor_diagnostic()
+    _test_continuous_diagnostic()
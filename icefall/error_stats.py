@@ -0,0 +1,376 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Mergeable WER/CER statistics.
+
+:class:`ErrorStats` accumulates the error counts and per-word statistics
+written by `icefall.utils.write_error_stats`. Statistics of different
+parts of the results can be merged with `+=`, so that
+
+  - :func:`compute_error_stats` aligns the results in several processes,
+    each one computing the statistics of a contiguous chunk of them, and
+  - a decoding script can update the statistics after every batch and
+    log the running WER.
+
+Usage:
+
+    stats = ErrorStats(keep_details=False)
+    for batch in dl:
+        ...
+        stats.update(this_batch)
+        logging.info(f"Running {stats}")
+"""
+
+import logging
+import multiprocessing as mp
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, TextIO, Tuple, Union
+
+import kaldialign
+
+ERR = "*"
+
+Timestamp = Union[float, Tuple[float, float]]
+
+
+def _zero_counts() -> List[int]:
+    # corr, ref_sub, hyp_sub, ins, dels
+    return [0, 0, 0, 0, 0]
+
+
+def _format_utt_details(cut_id: str, ali: List[Tuple[str, str]]) -> str:
+    """Return the PER-UTT DETAILS line of an utterance. Successive errors
+    are combined into a single one."""
+    ali = [[[x], [y]] for x, y in ali]
+    for i in range(len(ali) - 1):
+        if ali[i][0] != ali[i][1] and ali[i + 1][0] != ali[i + 1][1]:
+            ali[i + 1][0] = ali[i][0] + ali[i + 1][0]
+            ali[i + 1][1] = ali[i][1] + ali[i + 1][1]
+            ali[i] = [[], []]
+    ali = [
+        [
+            list(filter(lambda a: a != ERR, x)),
+            list(filter(lambda a: a != ERR, y)),
+        ]
+        for x, y in ali
+    ]
+    ali = list(filter(lambda x: x != [[], []], ali))
+    ali = [
+        [
+            ERR if x == [] else " ".join(x),
+            ERR if y == [] else " ".join(y),
+        ]
+        for x, y in ali
+    ]
+
+    return f"{cut_id}:\t" + " ".join(
+        (
+            ref_word if ref_word == hyp_word else f"({ref_word}->{hyp_word})"
+            for ref_word, hyp_word in ali
+        )
+    )
+
+
+class ErrorStats(object):
+    def __init__(
+        self,
+        sclite_mode: bool = False,
+        keep_details: bool = True,
+        with_end_time: bool = False,
+    ):
+        """
+        Args:
+          sclite_mode:
+            Passed to `kaldialign.align()` when counting the errors.
+            The per-utterance details are always aligned without it,
+            as in `write_error_stats`.
+          keep_details:
+            If False, the PER-UTT DETAILS lines are not kept, which saves
+            one alignment per utterance when only the WER is needed.
+          with_end_time:
+            True if the timestamps are (start, end) pairs.
+        """
+        self.sclite_mode = sclite_mode
+        self.keep_details = keep_details
+        self.with_end_time = with_end_time
+
+        self.subs: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.ins: Dict[str, int] = defaultdict(int)
+        self.dels: Dict[str, int] = defaultdict(int)
+        # `words` stores counts per word, as follows:
+        #   corr, ref_sub, hyp_sub, ins, dels
+        self.words: Dict[str, List[int]] = defaultdict(_zero_counts)
+        self.num_corr = 0
+        self.ref_len = 0
+        self.num_utts = 0
+        self.details: List[str] = []
+        # Delays of the correct words, only for results with timestamps
+        self.delays: List[Timestamp] = []
+
+    @property
+    def sub_errs(self) -> int:
+        return sum(self.subs.values())
+
+    @property
+    def ins_errs(self) -> int:
+        return sum(self.ins.values())
+
+    @property
+    def del_errs(self) -> int:
+        return sum(self.dels.values())
+
+    @property
+    def tot_errs(self) -> int:
+        return self.sub_errs + self.ins_errs + self.del_errs
+
+    @property
+    def tot_err_rate(self) -> str:
+        """The error rate in percent, formatted with 2 decimals."""
+        return "%.2f" % (100.0 * self.tot_errs / self.ref_len)
+
+    def add(
+        self,
+        cut_id: str,
+        ref: Sequence[str],
+        hyp: Sequence[str],
+        time_ref: Optional[Sequence[Timestamp]] = None,
+        time_hyp: Optional[Sequence[Timestamp]] = None,
+    ) -> None:
+        """Add the result of one utterance. If both `time_ref` and `time_hyp`
+        are non-empty, the delays of the correct words are also computed.
+        """
+        ali = kaldialign.align(ref, hyp, ERR, sclite_mode=self.sclite_mode)
+        has_time = (
+            time_ref is not None
+            and time_hyp is not None
+            and len(time_ref) > 0
+            and len(time_hyp) > 0
+        )
+        # pointers to time_ref and time_hyp
+        p_ref = 0
+        p_hyp = 0
+        for ref_word, hyp_word in ali:
+            if ref_word == ERR:
+                self.ins[hyp_word] += 1
+                self.words[hyp_word][3] += 1
+                p_hyp += 1
+            elif hyp_word == ERR:
+                self.dels[ref_word] += 1
+                self.words[ref_word][4] += 1
+                p_ref += 1
+            elif hyp_word != ref_word:
+                self.subs[(ref_word, hyp_word)] += 1
+                self.words[ref_word][1] += 1
+                self.words[hyp_word][2] += 1
+                p_hyp += 1
+                p_ref += 1
+            else:
+                self.words[ref_word][0] += 1
+                self.num_corr += 1
+                if has_time:
+                    if self.with_end_time:
+                        self.delays.append(
+                            (
+                                time_hyp[p_hyp][0] - time_ref[p_ref][0],
+                                time_hyp[p_hyp][1] - time_ref[p_ref][1],
+                            )
+                        )
+                    else:
+                        self.delays.append(time_hyp[p_hyp] - time_ref[p_ref])
+                p_hyp += 1
+                p_ref += 1
+        if has_time:
+            assert p_hyp == len(hyp), (p_hyp, len(hyp))
+            assert p_ref == len(ref), (p_ref, len(ref))
+
+        self.ref_len += len(ref)
+        self.num_utts += 1
+
+        if self.keep_details:
+            if self.sclite_mode:
+                ali = kaldialign.align(ref, hyp, ERR)
+            self.details.append(_format_utt_details(cut_id, ali))
+
+    def update(self, results: Sequence[Tuple]) -> "ErrorStats":
+        """Add a list of (cut_id, ref, hyp) or (cut_id, ref, hyp, time_ref,
+        time_hyp) tuples. Return self."""
+        for res in results:
+            self.add(*res)
+        return self
+
+    def __iadd__(self, other: "ErrorStats") -> "ErrorStats":
+        """Merge the statistics of `other`, which must come from the results
+        following those of `self`, so that the details stay in order."""
+        for k, v in other.subs.items():
+            self.subs[k] += v
+        for k, v in other.ins.items():
+            self.ins[k] += v
+        for k, v in other.dels.items():
+            self.dels[k] += v
+        for k, v in other.words.items():
+            counts = self.words[k]
+            for i in range(len(counts)):
+                counts[i] += v[i]
+        self.num_corr += other.num_corr
+        self.ref_len += other.ref_len
+        self.num_utts += other.num_utts
+        self.details.extend(other.details)
+        self.delays.extend(other.delays)
+        return self
+
+    def __str__(self) -> str:
+        if self.ref_len == 0:
+            return "%WER n/a [0 utterances]"
+        return (
+            f"%WER {self.tot_errs / self.ref_len:.2%} "
+            f"[{self.tot_errs} / {self.ref_len}, {self.ins_errs} ins, "
+            f"{self.del_errs} del, {self.sub_errs} sub, "
+            f"{self.num_utts} utterances]"
+        )
+
+    def delay_stats(self) -> Tuple[Timestamp, Timestamp]:
+        """Return the mean and the variance of the delays of the correct
+        words, rounded to 3 decimals, or inf if there are none."""
+        num_delay = len(self.delays)
+        if num_delay == 0:
+            if self.with_end_time:
+                return (float("inf"), float("inf")), (float("inf"), float("inf"))
+            return float("inf"), float("inf")
+
+        def mean_var(delays: List[float]) -> Tuple[float, float]:
+            mean = sum(delays) / num_delay
+            var = sum([(i - mean) ** 2 for i in delays]) / num_delay
+            return float("%.3f" % mean), float("%.3f" % var)
+
+        if self.with_end_time:
+            mean_start, var_start = mean_var([i[0] for i in self.delays])
+            mean_end, var_end = mean_var([i[1] for i in self.delays])
+            return (mean_start, mean_end), (var_start, var_end)
+        return mean_var(self.delays)
+
+    def write(self, f: TextIO, test_set_name: str, enable_log: bool = True) -> float:
+        """Write the statistics in the format of `write_error_stats` and
+        return the error rate in percent."""
+        sub_errs = self.sub_errs
+        ins_errs = self.ins_errs
+        del_errs = self.del_errs
+        tot_errs = sub_errs + ins_errs + del_errs
+        tot_err_rate = self.tot_err_rate
+
+        if enable_log:
+            logging.info(
+                f"[{test_set_name}] %WER {tot_errs / self.ref_len:.2%} "
+                f"[{tot_errs} / {self.ref_len}, {ins_errs} ins, "
+                f"{del_errs} del, {sub_errs} sub ]"
+            )
+
+        print(f"%WER = {tot_err_rate}", file=f)
+        print(
+            f"Errors: {ins_errs} insertions, {del_errs} deletions, "
+            f"{sub_errs} substitutions, over {self.ref_len} reference "
+            f"words ({self.num_corr} correct)",
+            file=f,
+        )
+        print(
+            "Search below for sections starting with PER-UTT DETAILS:, "
+            "SUBSTITUTIONS:, DELETIONS:, INSERTIONS:, PER-WORD STATS:",
+            file=f,
+        )
+
+        print("", file=f)
+        print("PER-UTT DETAILS: corr or (ref->hyp)  ", file=f)
+        for line in self.details:
+            print(line, file=f)
+
+        print("", file=f)
+        print("SUBSTITUTIONS: count ref -> hyp", file=f)
+
+        for count, (ref, hyp) in sorted(
+            [(v, k) for k, v in self.subs.items()], reverse=True
+        ):
+            print(f"{count}   {ref} -> {hyp}", file=f)
+
+        print("", file=f)
+        print("DELETIONS: count ref", file=f)
+        for count, ref in sorted([(v, k) for k, v in self.dels.items()], reverse=True):
+            print(f"{count}   {ref}", file=f)
+
+        print("", file=f)
+        print("INSERTIONS: count hyp", file=f)
+        for count, hyp in sorted([(v, k) for k, v in self.ins.items()], reverse=True):
+            print(f"{count}   {hyp}", file=f)
+
+        print("", file=f)
+        print("PER-WORD STATS: word  corr tot_errs count_in_ref count_in_hyp", file=f)
+        for _, word, counts in sorted(
+            [(sum(v[1:]), k, v) for k, v in self.words.items()], reverse=True
+        ):
+            (corr, ref_sub, hyp_sub, ins, dels) = counts
+            tot_errs = ref_sub + hyp_sub + ins + dels
+            ref_count = corr + ref_sub + dels
+            hyp_count = corr + hyp_sub + ins
+
+            print(f"{word}   {corr} {tot_errs} {ref_count} {hyp_count}", file=f)
+        return float(tot_err_rate)
+
+
+def _compute_chunk_stats(args) -> ErrorStats:
+    results, kwargs = args
+    return ErrorStats(**kwargs).update(results)
+
+
+def compute_error_stats(
+    results: Sequence[Tuple],
+    sclite_mode: bool = False,
+    keep_details: bool = True,
+    with_end_time: bool = False,
+    num_jobs: int = 1,
+    chunk_size: int = 5000,
+) -> ErrorStats:
+    """Compute the :class:`ErrorStats` of `results`.
+
+    Args:
+      results:
+        A list of (cut_id, ref, hyp) or (cut_id, ref, hyp, time_ref,
+        time_hyp) tuples, where ref and hyp are lists of words.
+      sclite_mode, keep_details, with_end_time:
+        See :class:`ErrorStats`.
+      num_jobs:
+        If larger than 1, the results are split into chunks of
+        `chunk_size` utterances, which are aligned by a pool of
+        `num_jobs` processes. The result does not depend on it.
+      chunk_size:
+        Number of utterances per chunk.
+    """
+    kwargs = dict(
+        sclite_mode=sclite_mode,
+        keep_details=keep_details,
+        with_end_time=with_end_time,
+    )
+    if num_jobs <= 1 or len(results) <= chunk_size:
+        return ErrorStats(**kwargs).update(results)
+
+    chunks = (
+        (results[i : i + chunk_size], kwargs)
+        for i in range(0, len(results), chunk_size)
+    )
+    stats = ErrorStats(**kwargs)
+    with mp.get_context("spawn").Pool(num_jobs) as pool:
+        # imap keeps the order of the chunks
+        for chunk_stats in pool.imap(_compute_chunk_stats, chunks):
+            stats += chunk_stats
+    return stats
@@ -0,0 +1,256 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resumable feature extraction for the compute_fbank_*.py scripts.
+
+`CutSet.compute_and_store_features()` splits a CutSet into `num_jobs`
+parts and returns only when all of them are done, so a crash near the end
+of a large partition loses all the work. :func:`compute_features_resumable`
+instead splits the cuts into small work units of `unit_size` cuts, which
+are handed out one at a time to a process pool, so that a fast worker
+takes more units than a slow one. Each unit is stored in `storage_dir`:
+
+    storage_dir/feats.000000.lca
+    storage_dir/cuts.000000.jsonl.gz
+    storage_dir/feats.000001.lca
+    storage_dir/cuts.000001.jsonl.gz
+    ...
+    storage_dir/units.json
+
+The manifest of a unit is written (atomically) only after its features,
+so units with a manifest are skipped when the script is run again. At the
+end, the manifests of all units are merged, in order, into `output_cuts`.
+
+Usage:
+
+    cuts = compute_features_resumable(
+        cuts,
+        extractor=Fbank(FbankConfig(num_mel_bins=80)),
+        storage_dir="data/fbank/librispeech_feats_train-clean-100",
+        output_cuts="data/fbank/librispeech_cuts_train-clean-100.jsonl.gz",
+    )
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Type
+
+import torch
+from lhotse import CutSet, LilcomChunkyWriter
+from lhotse.cut import Cut
+from lhotse.features import FeatureExtractor
+from lhotse.features.io import FeaturesWriter
+from lhotse.utils import Pathlike
+
+
+def get_num_cpus() -> int:
+    """Return the number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _split_into_units(cuts: Iterable[Cut], unit_size: int) -> Iterator[List[Cut]]:
+    unit = []
+    for c in cuts:
+        unit.append(c)
+        if len(unit) == unit_size:
+            yield unit
+            unit = []
+    if unit:
+        yield unit
+
+
+def _unit_cuts_path(storage_dir: Path, index: int) -> Path:
+    return storage_dir / f"cuts.{index:06d}.jsonl.gz"
+
+
+def _set_num_threads() -> None:
+    # Each worker computes the features of a unit sequentially.
+    torch.set_num_threads(1)
+
+
+def _compute_unit(
+    cuts: List[Cut],
+    extractor: FeatureExtractor,
+    storage_dir: Path,
+    index: int,
+    storage_type: Type[FeaturesWriter],
+) -> Tuple[int, float]:
+    """Compute the features of a work unit and write its manifest.
+    Return the number of cuts and their total duration."""
+    cuts = CutSet.from_cuts(cuts).compute_and_store_features(
+        extractor=extractor,
+        storage_path=storage_dir / f"feats.{index:06d}",
+        num_jobs=1,
+        storage_type=storage_type,
+        progress_bar=False,
+    )
+
+    filename = _unit_cuts_path(storage_dir, index)
+    tmp = filename.with_name(f"tmp.{filename.name}")
+    cuts.to_file(tmp)
+    os.replace(tmp, filename)
+
+    return len(cuts), sum(c.duration for c in cuts)
+
+
+def _check_units_info(storage_dir: Path, unit_size: int) -> None:
+    """Make sure that the existing units in `storage_dir`, if any, were
+    created with the same unit size."""
+    filename = storage_dir / "units.json"
+    if filename.is_file():
+        with open(filename) as f:
+            info = json.load(f)
+        if info["unit_size"] != unit_size:
+            raise ValueError(
+                f"{storage_dir} contains units of {info['unit_size']} cuts, "
+                f"but unit_size is {unit_size}. Please use the same unit size "
+                f"or remove {storage_dir}"
+            )
+    else:
+        with open(filename, "w") as f:
+            json.dump({"unit_size": unit_size}, f)
+
+
+def compute_features_resumable(
+    cuts: CutSet,
+    extractor: FeatureExtractor,
+    storage_dir: Pathlike,
+    output_cuts: Pathlike,
+    unit_size: int = 1000,
+    num_workers: Optional[int] = None,
+    storage_type: Type[FeaturesWriter] = LilcomChunkyWriter,
+    executor: Optional[Executor] = None,
+) -> CutSet:
+    """Compute and store the features of `cuts`, resuming a previous run
+    with the same arguments if there is one. See the module docstring.
+
+    Args:
+      cuts:
+        The cuts to process. The order of the cuts must be the same in
+        each run, since it determines the cuts of each unit.
+      extractor:
+        The feature extractor.
+      storage_dir:
+        The directory for the features and the manifests of the units.
+      output_cuts:
+        The merged manifest with the cuts of all units, in the input
+        order. If it exists, nothing is computed.
+      unit_size:
+        Number of cuts in a work unit.
+      num_workers:
+        Size of the process pool. Defaults to the number of available CPUs.
+      storage_type:
+        The features writer of each unit.
+      executor:
+        If not None, it is used instead of a process pool, e.g., the
+        `get_executor()` of a `distributed.Client`.
+    Returns:
+      Return the merged cuts, read lazily from `output_cuts`.
+    """
+    assert unit_size > 0, unit_size
+    storage_dir = Path(storage_dir)
+    output_cuts = Path(output_cuts)
+    if output_cuts.is_file():
+        logging.info(f"{output_cuts} exists - skipping")
+        return CutSet.from_file(output_cuts)
+
+    storage_dir.mkdir(parents=True, exist_ok=True)
+    _check_units_info(storage_dir, unit_size)
+
+    if num_workers is None:
+        num_workers = get_num_cpus()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(num_workers, initializer=_set_num_threads)
+
+    # Keep only a few units per worker in flight, so that the cuts of a
+    # lazy CutSet are not all loaded into memory.
+    max_pending = 2 * num_workers
+    pending = set()
+    num_units = 0
+    num_skipped = 0
+    num_done = 0
+    num_cuts = 0
+    duration = 0.0
+    start_time = time.time()
+
+    def collect() -> None:
+        # Wait for at least one unit to finish
+        nonlocal pending, num_done, num_cuts, duration
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            n, d = future.result()
+            num_done += 1
+            num_cuts += n
+            duration += d
+            if num_done % 10 == 0:
+                elapsed = time.time() - start_time
+                logging.info(
+                    f"{num_done} units done ({num_cuts} cuts, "
+                    f"{duration / 3600:.1f} hours of audio, "
+                    f"{duration / elapsed:.0f}x real time)"
+                )
+
+    try:
+        for index, unit in enumerate(_split_into_units(cuts, unit_size)):
+            num_units += 1
+            if _unit_cuts_path(storage_dir, index).is_file():
+                num_skipped += 1
+                continue
+            while len(pending) >= max_pending:
+                collect()
+            pending.add(
+                executor.submit(
+                    _compute_unit, unit, extractor, storage_dir, index, storage_type
+                )
+            )
+        while pending:
+            collect()
+    finally:
+        # Units that have not started yet are not needed after an error.
+        # Note: shutdown(cancel_futures=True) requires Python >= 3.9
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
+
+    logging.info(
+        f"Computed {num_done} units; skipped {num_skipped} units "
+        f"done in a previous run"
+    )
+
+    # Write to a temporary file first so that an interrupted merge is redone
+    tmp = output_cuts.with_name(f"tmp.{output_cuts.name}")
+    if num_units > 0:
+        merged = CutSet.from_files(
+            [_unit_cuts_path(storage_dir, i) for i in range(num_units)],
+            shuffle_iters=False,
+        )
+    else:
+        merged = CutSet()
+    merged.to_file(tmp)
+    os.replace(tmp, output_cuts)
+    logging.info(f"Merged {num_units} units into {output_cuts}")
+
+    return CutSet.from_file(output_cuts)
@@ -0,0 +1,641 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batched forced alignment of CutSets with CTC or transducer models.
+
+:func:`align_cuts` sorts the cuts by duration within chunks, groups them
+into batches of at most `max_duration` seconds and aligns the batches in
+several worker processes. Each supervision gets two alignments, which can
+be accessed with `supervision.alignment["word"]` and
+`supervision.alignment["token"]`; their times are relative to the cut,
+like the start of the supervision.
+
+The aligned cuts are appended to a jsonl manifest as soon as a batch is
+done. If the run is interrupted, running it again skips the cuts that are
+already in the manifest.
+
+Usage:
+
+    def make_aligner():
+        model = torch.jit.load("exp/jit_script.pt")
+        sp = spm.SentencePieceProcessor(model_file="data/lang_bpe_500/bpe.model")
+        return CtcForcedAligner(
+            model, encode_words=lambda words: sp.encode(words), frame_shift=0.04
+        )
+
+    align_cuts(cuts, make_aligner, "data/ali/cuts.jsonl", num_workers=16)
+
+`make_aligner` is called in each worker, so it must be picklable, e.g.,
+a module-level function or a functools.partial of one.
+"""
+
+import json
+import logging
+import multiprocessing as mp
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import torch
+from lhotse import CutSet
+from lhotse.cut import Cut
+from lhotse.dataset.input_strategies import OnTheFlyFeatures, PrecomputedFeatures
+from lhotse.features import Fbank, FbankConfig
+from lhotse.serialization import SequentialJsonlWriter
+from lhotse.supervision import AlignmentItem
+from lhotse.utils import Pathlike, fastcopy
+from torch.nn.utils.rnn import pad_sequence
+
+from icefall.ctc.utils import TokenSpan, merge_tokens
+
+
+def ctc_viterbi_align(
+    log_probs: torch.Tensor,
+    log_prob_lens: torch.Tensor,
+    targets: List[List[int]],
+    blank_id: int = 0,
+) -> List[Optional[List[int]]]:
+    """Batched Viterbi alignment of CTC outputs with the given targets.
+
+    Args:
+      log_probs:
+        A 3-D tensor of shape (N, T, C) containing log-probs.
+      log_prob_lens:
+        A 1-D tensor of shape (N,) containing the number of valid frames.
+      targets:
+        The token IDs of each utterance. They must not contain blanks.
+      blank_id:
+        ID of the blank.
+    Returns:
+      Return a list with the framewise alignment of each utterance, i.e.,
+      a list of token IDs (including blanks) with one entry per frame.
+      An entry is None if the utterance has too few frames for its targets.
+    """
+    N, T, _ = log_probs.shape
+    device = log_probs.device
+    assert len(targets) == N, (len(targets), N)
+
+    # The extended target sequence with blanks: blank y1 blank y2 ... blank
+    U = max((len(t) for t in targets), default=0)
+    S = 2 * U + 1
+    ext = torch.full((N, S), blank_id, dtype=torch.int64, device=device)
+    for n, t in enumerate(targets):
+        if len(t) > 0:
+            ext[n, 1 : 2 * len(t) : 2] = torch.tensor(t, device=device)
+    num_states = torch.tensor([2 * len(t) + 1 for t in targets], device=device)
+
+    # A skip from s - 2 to s is allowed if s is not a blank and it
+    # differs from the token at s - 2
+    can_skip = torch.zeros((N, S), dtype=torch.bool, device=device)
+    can_skip[:, 2:] = (ext[:, 2:] != blank_id) & (ext[:, 2:] != ext[:, :-2])
+
+    neg_inf = float("-inf")
+    emit = log_probs.float().gather(2, ext.unsqueeze(1).expand(N, T, S))
+    alpha = torch.full((N, S), neg_inf, device=device)
+    alpha[:, 0] = emit[:, 0, 0]
+    if S > 1:
+        alpha[:, 1] = emit[:, 0, 1]
+    alpha[
+        torch.arange(S, device=device).unsqueeze(0) >= num_states.unsqueeze(1)
+    ] = neg_inf
+
+    # backptr[t, n, s] is 0, 1 or 2: the number of states we moved
+    # forward when entering s at frame t.
+    backptr = torch.zeros((T, N, S), dtype=torch.int8, device=device)
+    log_prob_lens = log_prob_lens.to(device)
+    for t in range(1, T):
+        stay = alpha
+        move = torch.full_like(alpha, neg_inf)
+        move[:, 1:] = alpha[:, :-1]
+        skip = torch.full_like(alpha, neg_inf)
+        skip[:, 2:] = alpha[:, :-2]
+        skip = skip.masked_fill(~can_skip, neg_inf)
+
+        best, ptr = torch.stack([stay, move, skip]).max(dim=0)
+        active = (t < log_prob_lens).unsqueeze(1)
+        alpha = torch.where(active, best + emit[:, t], alpha)
+        backptr[t] = torch.where(active, ptr, 0).to(torch.int8)
+
+    # The path ends in the last token or in the final blank
+    rows = torch.arange(N, device=device)
+    last = alpha[rows, num_states - 1]
+    second_last = alpha[rows, (num_states - 2).clamp(min=0)]
+    second_last = torch.where(num_states > 1, second_last, neg_inf)
+    s = torch.where(second_last > last, num_states - 2, num_states - 1)
+    ok = torch.maximum(last, second_last) > neg_inf
+
+    path = torch.empty((N, T), dtype=torch.int64, device=device)
+    for t in range(T - 1, -1, -1):
+        path[:, t] = ext[rows, s]
+        s = s - backptr[t, rows, s].to(torch.int64)
+
+    path = path.cpu()
+    ans = []
+    for n in range(N):
+        if not ok[n]:
+            ans.append(None)
+        else:
+            ans.append(path[n, : int(log_prob_lens[n])].tolist())
+    return ans
+
+
+def transducer_viterbi_align(
+    blank_log_probs: torch.Tensor,
+    emit_log_probs: torch.Tensor,
+    frame_lens: torch.Tensor,
+    target_lens: torch.Tensor,
+) -> List[List[int]]:
+    """Batched Viterbi alignment on the lattice of a transducer, where a
+    frame can emit any number of tokens before a blank moves to the next
+    frame.
+
+    Args:
+      blank_log_probs:
+        A 3-D tensor of shape (N, T, U + 1). blank_log_probs[n, t, u] is the
+        log-prob of a blank at frame t after emitting u tokens.
+      emit_log_probs:
+        A 3-D tensor of shape (N, T, U). emit_log_probs[n, t, u] is the
+        log-prob of emitting token u + 1 at frame t after u tokens.
+      frame_lens:
+        A 1-D tensor of shape (N,) containing the number of frames.
+      target_lens:
+        A 1-D tensor of shape (N,) containing the number of tokens.
+    Returns:
+      Return the frame at which each token is emitted, for each utterance.
+    """
+    N, T, U1 = blank_log_probs.shape
+    device = blank_log_probs.device
+    neg_inf = float("-inf")
+
+    # With C[t, u] = sum_{j < u} emit[t, j], the recursion
+    #   alpha[t, u] = max(alpha[t-1, u] + blank[t-1, u],
+    #                     alpha[t, u-1] + emit[t, u-1])
+    # becomes alpha[t] = C[t] + cummax(from_prev - C[t]), where
+    # from_prev[u] = alpha[t-1, u] + blank[t-1, u].
+    cum_emit = torch.zeros((N, T, U1), device=device)
+    cum_emit[:, :, 1:] = emit_log_probs.float().cumsum(dim=2)
+
+    # entry[t, n, u] is the number of tokens emitted before frame t on the
+    # best path to (t, u)
+    entry = torch.zeros((T, N, U1), dtype=torch.int64, device=device)
+    from_prev = torch.full((N, U1), neg_inf, device=device)
+    from_prev[:, 0] = 0
+    for t in range(T):
+        c = cum_emit[:, t]
+        best, entry[t] = torch.cummax(from_prev - c, dim=1)
+        alpha = best + c
+        from_prev = alpha + blank_log_probs[:, t].float()
+
+    frame_lens = frame_lens.to(device)
+    target_lens = target_lens.to(device)
+    positions = torch.arange(U1 - 1, device=device).unsqueeze(0)
+    frames = torch.zeros((N, max(U1 - 1, 0)), dtype=torch.int64, device=device)
+    rows = torch.arange(N, device=device)
+    u = target_lens.to(torch.int64)
+    for t in range(T - 1, -1, -1):
+        active = t < frame_lens
+        k = torch.where(active, entry[t, rows, u], u)
+        emitted = (positions >= k.unsqueeze(1)) & (positions < u.unsqueeze(1))
+        frames.masked_fill_(emitted, t)
+        u = k
+
+    frames = frames.cpu()
+    return [frames[n, : int(target_lens[n])].tolist() for n in range(N)]
+
+
+class ForcedAligner(object):
+    """Base class of the aligners used by :func:`align_cuts`.
+
+    Subclasses implement :meth:`compute_token_spans`.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        encode_words: Callable[[List[str]], List[List[int]]],
+        token_symbols: Optional[Callable[[int], str]] = None,
+        frame_shift: float = 0.04,
+        device: torch.device = torch.device("cpu"),
+    ):
+        """
+        Args:
+          model:
+            The model. It must have either `forward_encoder(x, x_lens)` or
+            `encoder(x, x_lens)` returning (encoder_out, encoder_out_lens),
+            like the models in icefall and their torchscript exports.
+          encode_words:
+            Convert a list of words to a list of token IDs for each word,
+            e.g., `lambda words: sp.encode(words)` for a BPE model.
+          token_symbols:
+            Map a token ID to its symbol. If None, str(token_id) is used.
+          frame_shift:
+            The duration of an output frame of the model in seconds, i.e.,
+            the feature frame shift times the subsampling factor.
+          device:
+            The device of the model.
+        """
+        self.model = model.to(device).eval()
+        self.encode_words = encode_words
+        self.token_symbols = token_symbols if token_symbols is not None else str
+        self.frame_shift = frame_shift
+        self.device = device
+
+    def encode(
+        self, features: torch.Tensor, feature_lens: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        features = features.to(self.device)
+        feature_lens = feature_lens.to(self.device)
+        if hasattr(self.model, "forward_encoder"):
+            return self.model.forward_encoder(features, feature_lens)
+        return self.model.encoder(features, feature_lens)
+
+    def compute_token_spans(
+        self,
+        features: torch.Tensor,
+        feature_lens: torch.Tensor,
+        targets: List[List[int]],
+    ) -> List[Optional[Tuple[List[TokenSpan], List[float]]]]:
+        """Return the token spans (in output frames) and the score of each
+        token for each utterance, or None if it could not be aligned."""
+        raise NotImplementedError
+
+    @torch.no_grad()
+    def align(self, cuts: Sequence[Cut]) -> Tuple[List[Cut], int]:
+        """Align all supervisions of the given cuts.
+
+        Returns:
+          Return a tuple (cuts, num_failed), where `cuts` are copies of
+          the input cuts with alignments attached to their supervisions,
+          and num_failed is the number of supervisions that could not be
+          aligned. They are kept without alignments.
+        """
+        # Each supervision is aligned on its own segment of the cut
+        segments, index = [], []
+        for i, cut in enumerate(cuts):
+            for j, sup in enumerate(cut.supervisions):
+                if len(cut.supervisions) == 1 and (
+                    sup.start <= 0 and sup.end >= cut.duration
+                ):
+                    segments.append(cut)
+                else:
+                    segments.append(
+                        cut.truncate(
+                            offset=max(sup.start, 0),
+                            duration=min(sup.end, cut.duration) - max(sup.start, 0),
+                            keep_excessive_supervisions=False,
+                        )
+                    )
+                index.append((i, j))
+        if len(segments) == 0:
+            return list(cuts), 0
+
+        segments = CutSet.from_cuts(segments)
+        if all(c.has_features for c in segments):
+            input_strategy = PrecomputedFeatures()
+        else:
+            input_strategy = OnTheFlyFeatures(Fbank(FbankConfig(num_mel_bins=80)))
+        features, feature_lens = input_strategy(segments)
+
+        words_list = [(cuts[i].supervisions[j].text or "").split() for (i, j) in index]
+        word_tokens_list = [
+            self.encode_words(words) if words else [] for words in words_list
+        ]
+        targets = [sum(word_tokens, []) for word_tokens in word_tokens_list]
+
+        results = self.compute_token_spans(features, feature_lens, targets)
+
+        supervisions = [list(c.supervisions) for c in cuts]
+        num_failed = 0
+        for (i, j), words, word_tokens, result in zip(
+            index, words_list, word_tokens_list, results
+        ):
+            if result is None:
+                num_failed += 1
+                continue
+            sup = supervisions[i][j]
+            spans, scores = result
+            offset = max(sup.start, 0)
+            token_ali = [
+                AlignmentItem(
+                    symbol=self.token_symbols(span.token),
+                    start=round(offset + span.start * self.frame_shift, 3),
+                    duration=round((span.end - span.start) * self.frame_shift, 3),
+                    score=round(score, 4),
+                )
+                for span, score in zip(spans, scores)
+            ]
+            word_ali = []
+            k = 0
+            for word, tokens in zip(words, word_tokens):
+                if len(tokens) == 0:
+                    continue
+                first, last = token_ali[k], token_ali[k + len(tokens) - 1]
+                word_ali.append(
+                    AlignmentItem(
+                        symbol=word,
+                        start=first.start,
+                        duration=round(last.start + last.duration - first.start, 3),
+                        score=round(
+                            sum(a.score for a in token_ali[k : k + len(tokens)])
+                            / len(tokens),
+                            4,
+                        ),
+                    )
+                )
+                k += len(tokens)
+            supervisions[i][j] = sup.with_alignment("token", token_ali).with_alignment(
+                "word", word_ali
+            )
+
+        ans = [fastcopy(c, supervisions=sups) for c, sups in zip(cuts, supervisions)]
+        return ans, num_failed
+
+
+class CtcForcedAligner(ForcedAligner):
+    """Forced alignment with the CTC output of a model.
+
+    The model must have a `ctc_output` module that returns log-probs,
+    like the zipformer models in icefall. See :class:`ForcedAligner` for
+    the arguments; `blank_id` is the ID of the blank.
+    """
+
+    def __init__(self, *args, blank_id: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blank_id = blank_id
+
+    def compute_token_spans(
+        self,
+        features: torch.Tensor,
+        feature_lens: torch.Tensor,
+        targets: List[List[int]],
+    ) -> List[Optional[Tuple[List[TokenSpan], List[float]]]]:
+        encoder_out, encoder_out_lens = self.encode(features, feature_lens)
+        log_probs = self.model.ctc_output(encoder_out)
+        alignments = ctc_viterbi_align(
+            log_probs, encoder_out_lens, targets, blank_id=self.blank_id
+        )
+        log_probs = log_probs.float().cpu()
+
+        ans = []
+        for n, ali in enumerate(alignments):
+            if ali is None:
+                ans.append(None)
+                continue
+            spans = merge_tokens(ali, blank=self.blank_id)
+            assert [s.token for s in spans] == targets[n], (spans, targets[n])
+            # The score of a token is its mean posterior over its frames
+            scores = [
+                log_probs[n, s.start : s.end, s.token].exp().mean().item()
+                for s in spans
+            ]
+            ans.append((spans, scores))
+        return ans
+
+
+class TransducerForcedAligner(ForcedAligner):
+    """Forced alignment with a transducer model.
+
+    The model must have `decoder` and `joiner` modules like the transducer
+    models in icefall. A token spans a single frame: the one in which it
+    is emitted. See :class:`ForcedAligner` for the arguments.
+
+    The joiner is evaluated on the full (T, U + 1) lattice in chunks of
+    frames; `max_lattice_size` limits the number of logits computed at a
+    time.
+    """
+
+    def __init__(self, *args, max_lattice_size: int = 2**25, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_lattice_size = max_lattice_size
+
+    def compute_token_spans(
+        self,
+        features: torch.Tensor,
+        feature_lens: torch.Tensor,
+        targets: List[List[int]],
+    ) -> List[Optional[Tuple[List[TokenSpan], List[float]]]]:
+        encoder_out, encoder_out_lens = self.encode(features, feature_lens)
+        N, T, _ = encoder_out.shape
+        blank_id = self.model.decoder.blank_id
+
+        y = [torch.tensor([blank_id] + t, dtype=torch.int64) for t in targets]
+        sos_y = pad_sequence(y, batch_first=True, padding_value=blank_id)
+        sos_y = sos_y.to(self.device)
+        U1 = sos_y.size(1)
+        decoder_out = self.model.decoder(sos_y)
+
+        # The targets, padded with blanks, of shape (N, 1, U, 1)
+        symbols = sos_y[:, 1:].reshape(N, 1, U1 - 1, 1)
+
+        def joint(begin: int, end: int) -> Tuple[torch.Tensor, torch.Tensor, int]:
+            logits = self.model.joiner(
+                encoder_out[:, begin:end].unsqueeze(2),
+                decoder_out.unsqueeze(1),
+            )
+            log_probs = logits.float().log_softmax(dim=-1)  # (N, t, U1, V)
+            emit = log_probs[:, :, :-1].gather(
+                3, symbols.expand(-1, end - begin, -1, -1)
+            )
+            return log_probs[..., blank_id], emit.squeeze(3), log_probs.size(-1)
+
+        # The first frame tells us the vocabulary size
+        blank, emit, vocab_size = joint(0, 1)
+        blank_log_probs, emit_log_probs = [blank], [emit]
+        chunk = max(1, self.max_lattice_size // (N * U1 * vocab_size))
+        for begin in range(1, T, chunk):
+            blank, emit, _ = joint(begin, min(begin + chunk, T))
+            blank_log_probs.append(blank)
+            emit_log_probs.append(emit)
+
+        blank_log_probs = torch.cat(blank_log_probs, dim=1)
+        emit_log_probs = torch.cat(emit_log_probs, dim=1)
+
+        target_lens = torch.tensor([len(t) for t in targets])
+        frames = transducer_viterbi_align(
+            blank_log_probs, emit_log_probs, encoder_out_lens, target_lens
+        )
+        emit_log_probs = emit_log_probs.cpu()
+
+        ans = []
+        for n, f in enumerate(frames):
+            spans = [
+                TokenSpan(token=token, start=t, end=t + 1)
+                for token, t in zip(targets[n], f)
+            ]
+            scores = [emit_log_probs[n, t, u].exp().item() for u, t in enumerate(f)]
+            ans.append((spans, scores))
+        return ans
+
+
+def get_aligned_cut_ids(output: Pathlike) -> set:
+    """Return the IDs of the cuts in the manifest written by
+    :func:`align_cuts` so far.
+
+    If the last line is incomplete because the previous run was killed,
+    it is removed from the file.
+    """
+    output = Path(output)
+    if not output.is_file():
+        return set()
+
+    ids = set()
+    valid_bytes = 0
+    with open(output, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            valid_bytes += len(line)
+
+    if valid_bytes < output.stat().st_size:
+        logging.warning(f"Removing an incomplete line at the end of {output}")
+        with open(output, "r+b") as f:
+            f.truncate(valid_bytes)
+    return ids
+
+
+def make_alignment_batches(
+    cuts: Iterable[Cut],
+    max_duration: float,
+    sort_chunk_size: int = 10000,
+) -> Iterator[List[Cut]]:
+    """Group cuts into batches of at most `max_duration` seconds.
+
+    The cuts are sorted by duration within chunks of `sort_chunk_size`
+    cuts to reduce padding, so the input can be a lazy CutSet of any size.
+    A cut longer than `max_duration` is put into a batch of its own.
+    """
+    assert max_duration > 0, max_duration
+
+    def split(chunk: List[Cut]) -> Iterator[List[Cut]]:
+        chunk.sort(key=lambda c: c.duration, reverse=True)
+        batch: List[Cut] = []
+        for c in chunk:
+            # Cuts are padded to the longest one, which is the first one
+            if batch and (len(batch) + 1) * batch[0].duration > max_duration:
+                yield batch
+                batch = []
+            batch.append(c)
+        if batch:
+            yield batch
+
+    chunk: List[Cut] = []
+    for c in cuts:
+        chunk.append(c)
+        if len(chunk) >= sort_chunk_size:
+            yield from split(chunk)
+            chunk = []
+    yield from split(chunk)
+
+
+# The aligner of a worker process
+_aligner: Optional[ForcedAligner] = None
+
+
+def _init_worker(make_aligner: Callable[[], ForcedAligner], num_threads: int):
+    global _aligner
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    _aligner = make_aligner()
+
+
+def _align_batch(cuts: List[Cut]) -> Tuple[List[Cut], int]:
+    return _aligner.align(cuts)
+
+
+def align_cuts(
+    cuts: CutSet,
+    make_aligner: Callable[[], ForcedAligner],
+    output: Pathlike,
+    max_duration: float = 600.0,
+    num_workers: int = 4,
+    num_threads: int = 1,
+    sort_chunk_size: int = 10000,
+) -> None:
+    """Align the supervisions of `cuts` and write the aligned cuts to
+    `output`. See the module docstring.
+
+    Args:
+      cuts:
+        The cuts to align. It can be lazy.
+      make_aligner:
+        A picklable function that returns a :class:`ForcedAligner`.
+        It is called once in each worker process.
+      output:
+        The output manifest. It must be a .jsonl file, since it is
+        appended to, and it can be compressed afterwards. Cuts that are
+        already in it are skipped.
+      max_duration:
+        Maximum duration in seconds of a batch, including padding.
+      num_workers:
+        Number of worker processes. If 0, the cuts are aligned in this
+        process, e.g., with a model on a GPU.
+      num_threads:
+        Number of torch threads of each worker process.
+      sort_chunk_size:
+        Number of cuts sorted by duration at a time.
+    """
+    output = Path(output)
+    assert output.suffix == ".jsonl", f"Expect a .jsonl file, given {output}"
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    done = get_aligned_cut_ids(output)
+    if done:
+        logging.info(f"Skipping {len(done)} cuts that are already in {output}")
+    pending = (c for c in cuts if c.id not in done)
+    batches = make_alignment_batches(pending, max_duration, sort_chunk_size)
+
+    if num_workers > 0:
+        # spawn instead of fork, since the parent may have initialized
+        # torch threads or CUDA
+        pool = mp.get_context("spawn").Pool(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(make_aligner, num_threads),
+        )
+        results = pool.imap_unordered(_align_batch, batches)
+    else:
+        pool = None
+        _init_worker(make_aligner, torch.get_num_threads())
+        results = map(_align_batch, batches)
+
+    num_cuts = num_failed = 0
+    duration = 0.0
+    try:
+        with SequentialJsonlWriter(output, overwrite=False) as writer:
+            for i, (aligned, failed) in enumerate(results):
+                for j, c in enumerate(aligned):
+                    writer.write(c, flush=j + 1 == len(aligned))
+                    duration += c.duration
+                num_cuts += len(aligned)
+                num_failed += failed
+                if i % 100 == 0:
+                    logging.info(
+                        f"Aligned {num_cuts} cuts, {duration / 3600:.2f} hours; "
+                        f"{num_failed} supervisions failed"
+                    )
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    logging.info(
+        f"Done. Aligned {num_cuts} cuts, {duration / 3600:.2f} hours, "
+        f"saved to {output}. {num_failed} supervisions could not be aligned "
+        f"and have no alignments."
+    )
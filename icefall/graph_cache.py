@@ -0,0 +1,204 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A cache of per-utterance training graphs.
+
+The training graph compilers in icefall compile the transcripts of every
+batch from scratch, although the same utterances come back in every epoch.
+:class:`TrainingGraphCache` keeps the compiled graph of each utterance,
+keyed by its word or token IDs, in an in-memory LRU cache and optionally
+in a directory on disk. A batch is assembled from the cached graphs with
+`k2.create_fsa_vec`, and only the missing utterances are compiled.
+
+Usage:
+
+    graph_compiler = BpeCtcTrainingGraphCompiler(lang_dir, device=device)
+    graph_compiler.cache = TrainingGraphCache(max_size=200000)
+    ...
+    logging.info(f"Graph cache: {graph_compiler.cache}")
+
+A directory passed as `cache_dir` must be used only with one lang dir and
+one type of graph compiler, since the keys contain only the IDs.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import k2
+import numpy as np
+import torch
+
+
+class TrainingGraphCache(object):
+    def __init__(
+        self,
+        max_size: int = 100000,
+        cache_dir: Optional[Union[str, Path]] = None,
+        storage_device: Union[str, torch.device] = "cpu",
+    ):
+        """
+        Args:
+          max_size:
+            Maximum number of graphs kept in memory. The least recently
+            used graph is evicted when it is exceeded.
+          cache_dir:
+            If not None, graphs are also saved to this directory and loaded
+            from it when they are not in memory, e.g., after a restart.
+          storage_device:
+            The device on which the graphs are kept in memory. Batches are
+            moved to the device of the graph compiler after assembly.
+        """
+        assert max_size > 0, max_size
+        self.max_size = max_size
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.storage_device = torch.device(storage_device)
+
+        self.graphs: "OrderedDict[Tuple[int, ...], k2.Fsa]" = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.num_hits = 0
+        self.num_disk_hits = 0
+        self.num_misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of utterances whose graph was not compiled, i.e.,
+        found in memory or on disk, since the last reset_stats()."""
+        total = self.num_hits + self.num_disk_hits + self.num_misses
+        if total == 0:
+            return 0.0
+        return (self.num_hits + self.num_disk_hits) / total
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "size": len(self.graphs),
+            "hits": self.num_hits,
+            "disk_hits": self.num_disk_hits,
+            "misses": self.num_misses,
+            "hit_rate": self.hit_rate,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"size {len(self.graphs)}/{self.max_size}, "
+            f"hits {self.num_hits}, disk hits {self.num_disk_hits}, "
+            f"misses {self.num_misses}, hit rate {self.hit_rate:.3f}"
+        )
+
+    def __len__(self) -> int:
+        return len(self.graphs)
+
+    def _filename(self, key: Tuple[int, ...]) -> Path:
+        digest = hashlib.sha1(np.array(key, dtype=np.int64).tobytes()).hexdigest()
+        # Use sub-directories to keep the number of files per directory small
+        return self.cache_dir / digest[:2] / f"{digest}.pt"
+
+    def get(self, key: Tuple[int, ...]) -> Optional[k2.Fsa]:
+        """Return the cached graph of `key`, or None if it is not cached.
+        It updates the statistics."""
+        fsa = self.graphs.get(key)
+        if fsa is not None:
+            self.graphs.move_to_end(key)
+            self.num_hits += 1
+            return fsa
+
+        if self.cache_dir is not None:
+            filename = self._filename(key)
+            if filename.is_file():
+                fsa = k2.Fsa.from_dict(torch.load(filename, map_location="cpu"))
+                fsa = fsa.to(self.storage_device)
+                self._put_in_memory(key, fsa)
+                self.num_disk_hits += 1
+                return fsa
+
+        self.num_misses += 1
+        return None
+
+    def _put_in_memory(self, key: Tuple[int, ...], fsa: k2.Fsa) -> None:
+        self.graphs[key] = fsa
+        self.graphs.move_to_end(key)
+        while len(self.graphs) > self.max_size:
+            self.graphs.popitem(last=False)
+
+    def put(self, key: Tuple[int, ...], fsa: k2.Fsa) -> k2.Fsa:
+        """Add a single graph (not an FsaVec) to the cache and return
+        the cached copy of it."""
+        fsa = fsa.to(self.storage_device)
+        self._put_in_memory(key, fsa)
+
+        if self.cache_dir is not None:
+            filename = self._filename(key)
+            if not filename.is_file():
+                filename.parent.mkdir(exist_ok=True)
+                # Write to a temporary file first, since other DDP ranks
+                # may read the same file.
+                tmp = filename.with_suffix(f".{os.getpid()}.tmp")
+                torch.save(fsa.to("cpu").as_dict(), tmp)
+                os.replace(tmp, filename)
+        return fsa
+
+    def compile(
+        self,
+        keys: Sequence[Sequence[int]],
+        compile_fn: Callable[[List[List[int]]], k2.Fsa],
+        device: Union[str, torch.device],
+    ) -> k2.Fsa:
+        """Return the graphs of `keys` as an FsaVec, compiling only those
+        that are not cached.
+
+        Args:
+          keys:
+            The word or token IDs of each utterance.
+          compile_fn:
+            It takes a list-of-list of IDs and returns an FsaVec with one
+            graph for each of them.
+          device:
+            The device of the returned FsaVec.
+        Returns:
+          Return an FsaVec with `len(keys)` graphs, which is equal to
+          `compile_fn(keys)`.
+        """
+        keys = [tuple(k) for k in keys]
+        graphs: List[Optional[k2.Fsa]] = [None] * len(keys)
+
+        # Map a missing key to the positions of the utterances with it
+        missing: Dict[Tuple[int, ...], List[int]] = OrderedDict()
+        for i, key in enumerate(keys):
+            if key in missing:
+                # compiled only once
+                missing[key].append(i)
+                self.num_hits += 1
+                continue
+            graphs[i] = self.get(key)
+            if graphs[i] is None:
+                missing[key] = [i]
+
+        if missing:
+            fsa_vec = compile_fn([list(k) for k in missing.keys()])
+            assert fsa_vec.shape[0] == len(missing), (fsa_vec.shape, len(missing))
+            for j, (key, indexes) in enumerate(missing.items()):
+                fsa = self.put(key, fsa_vec[j])
+                for i in indexes:
+                    graphs[i] = fsa
+
+        return k2.create_fsa_vec(graphs).to(device)
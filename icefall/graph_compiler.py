@@ -15,11 +15,12 @@
 # limitations under the License.
 
 
-from typing import List
+from typing import List, Optional
 
 import k2
 import torch
 
+from icefall.graph_cache import TrainingGraphCache
 from icefall.lexicon import Lexicon
 
 
@@ -30,6 +31,7 @@ class CtcTrainingGraphCompiler(object):
         device: torch.device,
         oov: str = "<UNK>",
         need_repeat_flag: bool = False,
+        cache: Optional[TrainingGraphCache] = None,
     ):
         """
         Args:
@@ -47,6 +49,9 @@ class CtcTrainingGraphCompiler(object):
             ctc loss. See https://github.com/k2-fsa/k2/pull/1086 for more
             details. Note: The above change MUST be included in k2 to open this
             flag.
+          cache:
+            If not None, the graph of each utterance is cached and reused
+            in :meth:`compile`. See :class:`TrainingGraphCache`.
         """
         L_inv = lexicon.L_inv.to(device)
         assert L_inv.requires_grad is False
@@ -68,6 +73,7 @@ class CtcTrainingGraphCompiler(object):
             )
 
         self.device = device
+        self.cache = cache
 
     def compile(self, texts: List[str]) -> k2.Fsa:
         """Build decoding graphs by composing ctc_topo with
@@ -85,7 +91,17 @@ class CtcTrainingGraphCompiler(object):
           An FsaVec, the composition result of `self.ctc_topo` and the
           transcript FSA.
         """
-        transcript_fsa = self.convert_transcript_to_fsa(texts)
+        word_ids_list = self.texts_to_ids(texts)
+        if self.cache is not None:
+            return self.cache.compile(
+                word_ids_list, self.compile_word_ids, device=self.device
+            )
+        return self.compile_word_ids(word_ids_list)
+
+    def compile_word_ids(self, word_ids_list: List[List[int]]) -> k2.Fsa:
+        """Like :meth:`compile`, but it takes a list-of-list of word IDs.
+        It does not use the cache."""
+        transcript_fsa = self.word_ids_to_fsa(word_ids_list)
 
         # NOTE: k2.compose runs on CUDA only when treat_epsilons_specially
         # is False, so we add epsilon self-loops here
@@ -138,16 +154,11 @@ class CtcTrainingGraphCompiler(object):
         Returns:
           Return an FsaVec, whose `shape[0]` equals to `len(texts)`.
         """
-        word_ids_list = []
-        for text in texts:
-            word_ids = []
-            for word in text.split():
-                if word in self.word_table:
-                    word_ids.append(self.word_table[word])
-                else:
-                    word_ids.append(self.oov_id)
-            word_ids_list.append(word_ids)
+        return self.word_ids_to_fsa(self.texts_to_ids(texts))
 
+    def word_ids_to_fsa(self, word_ids_list: List[List[int]]) -> k2.Fsa:
+        """Like :meth:`convert_transcript_to_fsa`, but it takes a
+        list-of-list of word IDs."""
         word_fsa = k2.linear_fsa(word_ids_list, self.device)
 
         word_fsa_with_self_loops = k2.add_epsilon_self_loops(word_fsa)
@@ -0,0 +1,474 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Random access by id to lazily loaded jsonl manifests.
+
+`load_manifest_lazy()` can only scan a manifest from start to end, so
+looking up a few cuts by id requires reading the whole manifest, usually
+into a dict. :func:`build_manifest_index` records the position of every
+item of a manifest in an index file next to it
+
+    data/fbank/librispeech_cuts_train-clean-100.jsonl.gz
+    data/fbank/librispeech_cuts_train-clean-100.jsonl.gz.idx.npz
+
+and :class:`IndexedManifest` reads single items at these positions.
+
+For plain .jsonl files the position is a byte offset. For .jsonl.gz files
+it is the offset of a gzip member (a "block") plus the offset within the
+decompressed block, so the file must consist of many small gzip members,
+like the files written by `bgzip` from htslib or by :func:`convert_to_bgzip`.
+Such files are still valid gzip files and can be read by lhotse as usual.
+The manifests written by lhotse are a single gzip member; they can be
+converted in place with `build_manifest_index(path, convert_gzip=True)`.
+
+Usage:
+
+    cuts = load_cuts_indexed("data/fbank/librispeech_cuts_dev-clean.jsonl.gz")
+    cut = cuts["1272-128104-0000-0"]  # no scan
+    for cut in cuts:  # lazy, as with load_manifest_lazy()
+        ...
+
+    # Attach external per-cut values, e.g., k-means labels, without
+    # loading the manifest
+    index = IndexedManifest(path)
+    for cut in index.join(labels.items(), field="kmeans"):
+        writer.write(cut)
+"""
+
+import gzip
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from lhotse import CutSet
+from lhotse.serialization import deserialize_item, load_manifest_lazy
+from lhotse.utils import Pathlike
+
+# Maximum size of a decompressed gzip member in an indexed file. Larger
+# members would make each lookup slow.
+MAX_BLOCK_SIZE = 1 << 22
+
+# Uncompressed size of a block written by convert_to_bgzip(),
+# the same as in bgzip
+BGZF_BLOCK_SIZE = 0xFF00
+
+# The empty block at the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def get_index_path(path: Pathlike) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + ".idx.npz")
+
+
+def _is_gzip(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def _item_id(line: bytes) -> str:
+    # lhotse writes the id first; avoid parsing the whole line if possible
+    prefix = b'{"id": "'
+    if line.startswith(prefix):
+        end = line.find(b'"', len(prefix))
+        if end > 0 and b"\\" not in line[len(prefix) : end]:
+            return line[len(prefix) : end].decode("utf-8")
+    return json.loads(line)["id"]
+
+
+def _iter_gzip_members(f, chunk_size: int = 1 << 20) -> Iterator[Tuple[int, bytes]]:
+    """Yield (compressed offset, decompressed data) of each gzip member."""
+    pos = 0
+    data = b""
+    while True:
+        if not data:
+            data = f.read(chunk_size)
+            if not data:
+                return
+        start = pos
+        d = zlib.decompressobj(31)
+        parts = []
+        size = 0
+        while True:
+            out = d.decompress(data)
+            parts.append(out)
+            size += len(out)
+            if size > MAX_BLOCK_SIZE:
+                raise ValueError(
+                    f"{f.name} has gzip members larger than {MAX_BLOCK_SIZE} "
+                    "bytes and cannot be indexed. Please compress it with "
+                    "bgzip or use convert_gzip=True"
+                )
+            if d.eof:
+                pos += len(data) - len(d.unused_data)
+                data = d.unused_data
+                break
+            pos += len(data)
+            data = f.read(chunk_size)
+            if not data:
+                raise ValueError(f"{f.name} is truncated")
+        yield start, b"".join(parts)
+
+
+def _iter_lines(path: Path, compressed: bool) -> Iterator[Tuple[int, int, bytes]]:
+    """Yield (block, offset, line) for each non-empty line of a manifest,
+    where (block, offset) is the position at which the line starts."""
+    with open(path, "rb") as f:
+        if not compressed:
+            pos = 0
+            for line in f:
+                if line.strip():
+                    yield pos, 0, line
+                pos += len(line)
+            return
+
+        # A line may continue in the following blocks
+        start = None
+        pending: List[bytes] = []
+        for block, data in _iter_gzip_members(f):
+            offset = 0
+            while offset < len(data):
+                if start is None:
+                    start = (block, offset)
+                end = data.find(b"\n", offset)
+                if end < 0:
+                    pending.append(data[offset:])
+                    break
+                pending.append(data[offset : end + 1])
+                line = b"".join(pending)
+                if line.strip():
+                    yield start[0], start[1], line
+                start = None
+                pending = []
+                offset = end + 1
+        if pending and b"".join(pending).strip():
+            yield start[0], start[1], b"".join(pending)
+
+
+def _write_bgzf_block(f, data: bytes) -> None:
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = c.compress(data) + c.flush()
+    # header (18 bytes) + data + crc32 and size (8 bytes)
+    block_size = len(deflated) + 26
+    if block_size > 0x10000:
+        # not compressible enough to fit into a block
+        half = len(data) // 2
+        _write_bgzf_block(f, data[:half])
+        _write_bgzf_block(f, data[half:])
+        return
+    header = struct.pack(
+        "<4BI2BH2BHH",
+        0x1F,
+        0x8B,
+        8,  # deflate
+        4,  # FEXTRA
+        0,  # mtime
+        0,  # extra flags
+        0xFF,  # OS unknown
+        6,  # XLEN
+        ord("B"),
+        ord("C"),
+        2,
+        block_size - 1,
+    )
+    f.write(header)
+    f.write(deflated)
+    f.write(struct.pack("<II", zlib.crc32(data) & 0xFFFFFFFF, len(data)))
+
+
+def convert_to_bgzip(src: Pathlike, dst: Pathlike) -> None:
+    """Write the decompressed content of the (possibly gzip-compressed)
+    file `src` to `dst` in the BGZF format of bgzip, i.e., as a sequence
+    of gzip members of at most 64 KB. `src` and `dst` may be the same."""
+    src, dst = Path(src), Path(dst)
+    tmp = dst.with_name(f"tmp.{dst.name}")
+    opener = gzip.open if _is_gzip(src) else open
+    with opener(src, "rb") as fin, open(tmp, "wb") as fout:
+        while True:
+            data = fin.read(BGZF_BLOCK_SIZE)
+            if not data:
+                break
+            _write_bgzf_block(fout, data)
+        fout.write(BGZF_EOF)
+    os.replace(tmp, dst)
+
+
+def build_manifest_index(path: Pathlike, convert_gzip: bool = False) -> Path:
+    """Build the index of a jsonl manifest and return the path to it.
+
+    Args:
+      path:
+        Path to a .jsonl or .jsonl.gz manifest.
+      convert_gzip:
+        If True and `path` is a gzip file with large members, e.g., a
+        manifest written by lhotse, convert it in place with
+        :func:`convert_to_bgzip` first. Its content is not changed.
+    """
+    path = Path(path)
+    compressed = _is_gzip(path)
+
+    def read_positions():
+        ids, blocks, offsets = [], [], []
+        for block, offset, line in _iter_lines(path, compressed):
+            ids.append(_item_id(line))
+            blocks.append(block)
+            offsets.append(offset)
+        return ids, blocks, offsets
+
+    try:
+        ids, blocks, offsets = read_positions()
+    except ValueError:
+        if not (compressed and convert_gzip):
+            raise
+        logging.info(f"Converting {path} to bgzip")
+        convert_to_bgzip(path, path)
+        ids, blocks, offsets = read_positions()
+
+    ids = np.array(ids, dtype=np.bytes_) if ids else np.zeros(0, dtype="S1")
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    if len(ids) > 1:
+        dup = np.nonzero(ids[1:] == ids[:-1])[0]
+        if len(dup) > 0:
+            raise ValueError(f"Duplicate id {ids[dup[0]].decode()} in {path}")
+
+    stat = path.stat()
+    index_path = get_index_path(path)
+    tmp = index_path.with_name(f"tmp.{index_path.name}")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            ids=ids,
+            blocks=np.array(blocks, dtype=np.int64)[order],
+            offsets=np.array(offsets, dtype=np.int64)[order],
+            file_positions=order.astype(np.int64),
+            info=np.array([stat.st_size, stat.st_mtime_ns, int(compressed)]),
+        )
+    os.replace(tmp, index_path)
+    return index_path
+
+
+class IndexedManifest(object):
+    """A lazily loaded jsonl manifest with random access by id.
+
+    It can be iterated like the manifests returned by
+    `load_manifest_lazy()`, and `index[item_id]` returns a single item
+    (a Cut, SupervisionSegment, Recording, etc.) read from the position
+    stored in the index, which is found by binary search.
+
+    Only the index is kept in memory. It is built if it does not exist
+    or if the manifest was modified after it was built. An instance must
+    not be used by several threads at the same time.
+    """
+
+    def __init__(
+        self,
+        path: Pathlike,
+        convert_gzip: bool = False,
+        cache_size: int = 16,
+    ):
+        """
+        Args:
+          path:
+            Path to a .jsonl or .jsonl.gz manifest.
+          convert_gzip:
+            See :func:`build_manifest_index`.
+          cache_size:
+            Number of decompressed blocks kept in memory.
+        """
+        self.path = Path(path)
+        self.cache_size = cache_size
+
+        index_path = get_index_path(self.path)
+        if not self._load_index(index_path):
+            logging.info(f"Building the index of {self.path}")
+            build_manifest_index(self.path, convert_gzip=convert_gzip)
+            assert self._load_index(index_path), index_path
+
+        self._file = None
+        self._blocks: "OrderedDict[int, Tuple[bytes, int]]" = OrderedDict()
+
+    def _load_index(self, index_path: Path) -> bool:
+        """Load the index. Return False if it is missing or outdated."""
+        if not index_path.is_file():
+            return False
+        with np.load(index_path) as index:
+            size, mtime_ns, compressed = index["info"].tolist()
+            stat = self.path.stat()
+            if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                return False
+            self.ids = index["ids"]
+            self.block_offsets = index["blocks"]
+            self.offsets = index["offsets"]
+            # the position in the manifest of each (sorted) id
+            self.file_positions = index["file_positions"]
+        self.compressed = bool(compressed)
+        return True
+
+    def __getstate__(self):
+        # The file is opened again in each dataloader worker
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_blocks"] = OrderedDict()
+        return state
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(load_manifest_lazy(self.path))
+
+    def item_ids(self) -> List[str]:
+        """Return the ids of all items in the order of the manifest."""
+        ids = np.empty_like(self.ids)
+        ids[self.file_positions] = self.ids
+        return [i.decode("utf-8") for i in ids]
+
+    def _find(self, item_id: str) -> int:
+        key = item_id.encode("utf-8")
+        i = int(np.searchsorted(self.ids, key))
+        if i < len(self.ids) and self.ids[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, item_id: str) -> bool:
+        return self._find(item_id) >= 0
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        return self._file
+
+    def _read_block(self, block: int) -> Tuple[bytes, int]:
+        """Return the decompressed data of the gzip member at `block` and
+        the offset of the next member."""
+        if block in self._blocks:
+            self._blocks.move_to_end(block)
+            return self._blocks[block]
+
+        f = self._open()
+        f.seek(block)
+        d = zlib.decompressobj(31)
+        parts = []
+        consumed = 0
+        while not d.eof:
+            data = f.read(1 << 16)
+            if not data:
+                break
+            parts.append(d.decompress(data))
+            consumed += len(data) - len(d.unused_data)
+        ans = (b"".join(parts), block + consumed)
+
+        self._blocks[block] = ans
+        while len(self._blocks) > self.cache_size:
+            self._blocks.popitem(last=False)
+        return ans
+
+    def _read_line(self, block: int, offset: int) -> bytes:
+        if not self.compressed:
+            f = self._open()
+            f.seek(block)
+            return f.readline()
+
+        parts = []
+        while True:
+            data, next_block = self._read_block(block)
+            end = data.find(b"\n", offset)
+            if end >= 0:
+                parts.append(data[offset:end])
+                break
+            parts.append(data[offset:])
+            if not data:
+                # end of file
+                break
+            block, offset = next_block, 0
+        return b"".join(parts)
+
+    def get(self, item_id: str, default: Any = None) -> Any:
+        i = self._find(item_id)
+        if i < 0:
+            return default
+        line = self._read_line(int(self.block_offsets[i]), int(self.offsets[i]))
+        return deserialize_item(json.loads(line))
+
+    def __getitem__(self, item_id: str) -> Any:
+        if not isinstance(item_id, str):
+            # CutSet.__getitem__ falls back to a scan for integer indexes
+            raise TypeError(f"Expected an id, got {type(item_id)}")
+        item = self.get(item_id)
+        if item is None:
+            raise KeyError(item_id)
+        return item
+
+    def get_many(self, item_ids: Iterable[str]) -> List[Any]:
+        """Return the items with the given ids. They are read in the order
+        of the manifest to make use of the cached blocks."""
+        item_ids = list(item_ids)
+        pos = [self._find(i) for i in item_ids]
+        for item_id, p in zip(item_ids, pos):
+            if p < 0:
+                raise KeyError(item_id)
+        ans = [None] * len(item_ids)
+        for k in sorted(range(len(pos)), key=lambda k: self.file_positions[pos[k]]):
+            i = pos[k]
+            line = self._read_line(int(self.block_offsets[i]), int(self.offsets[i]))
+            ans[k] = deserialize_item(json.loads(line))
+        return ans
+
+    def join(
+        self,
+        items: Iterable[Tuple[str, Any]],
+        field: str,
+        skip_missing: bool = False,
+    ) -> Iterator[Any]:
+        """Yield the manifest items with the given ids, in the order of
+        `items`, with `value` attached as the custom field `field`.
+
+        Args:
+          items:
+            (item_id, value) pairs, e.g., k-means labels, alignments or
+            hypotheses read from another file.
+          field:
+            Name of the custom field.
+          skip_missing:
+            If True, ids that are not in the manifest are skipped.
+            Otherwise, a KeyError is raised.
+        """
+        num_missing = 0
+        for item_id, value in items:
+            item = self.get(item_id)
+            if item is None:
+                if not skip_missing:
+                    raise KeyError(item_id)
+                num_missing += 1
+                continue
+            yield item.with_custom(field, value)
+        if num_missing > 0:
+            logging.warning(f"{num_missing} ids are not in {self.path}")
+
+
+def load_cuts_indexed(path: Pathlike, convert_gzip: bool = False) -> CutSet:
+    """Return a lazy CutSet backed by an :class:`IndexedManifest`, so that
+    `cuts[cut_id]` does not scan the manifest. The IndexedManifest is
+    available as `cuts.data`."""
+    return CutSet(IndexedManifest(path, convert_gzip=convert_gzip))
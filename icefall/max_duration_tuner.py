@@ -0,0 +1,603 @@
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Automatic selection of --max-duration.
+
+Instead of guessing --max-duration and waiting for an OOM, we run a few
+forward/backward probes on synthetic batches that are shaped like the
+buckets of a DynamicBucketingSampler, at increasing batch durations.
+Several buckets are probed, each with several batch sizes. From the
+measured peak memory we fit a small analytic model
+
+    peak = c0 + c1 * N + c2 * N * F + c3 * N * F^2
+
+where N is the number of cuts in a batch and F the number of frames per
+cut (all coefficients are non-negative; the F^2 term accounts for
+self-attention). The synthetic batches have a number of tokens per cut
+that is proportional to F, so the memory used per token cannot be told
+apart from the memory used per frame and is part of c2. The model is then
+used to pick the largest max_duration whose predicted peak memory fits
+into the budget, either globally or per bucket.
+
+On CUDA we use the peak of the caching allocator; on CPU we use the peak
+resident set size of the process, so that the tuner can be tested without
+accelerators.
+
+Usage:
+
+    result = tune_max_duration(
+        step_fn=step_fn,
+        make_batch=make_batch,
+        bucket_durations=get_bucket_durations(train_dl.sampler, 20.0),
+        device=device,
+    )
+    logging.info(result)
+    max_duration = result.max_duration
+"""
+
+import itertools
+import logging
+import math
+import resource
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+
+@dataclass
+class MemoryProbe:
+    # Total duration (in seconds) of the probed batch
+    max_duration: float
+    # Duration (in seconds) of each cut in the batch
+    cut_duration: float
+    batch_size: int
+    # Number of frames per cut
+    num_frames: int
+    # Number of tokens per cut
+    num_tokens: int
+    # Measured peak memory in bytes. None if the probe ran out of memory.
+    peak_bytes: Optional[int]
+
+    @property
+    def oom(self) -> bool:
+        return self.peak_bytes is None
+
+
+def _features(batch_size: int, num_frames: int) -> List[float]:
+    n = float(batch_size)
+    f = float(num_frames)
+    return [1.0, n, n * f, n * f * f]
+
+
+def nnls(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    """Solve min ||x @ c - y|| subject to c >= 0.
+
+    The solution of a non-negative least squares problem is the
+    unconstrained least squares solution restricted to its non-zero
+    coefficients, so we try every subset of the columns and keep the best
+    feasible one. This is exact and deterministic, and cheap for the few
+    columns of :class:`PeakMemoryModel`. When several subsets fit equally
+    well, e.g., because the columns are collinear, the smallest one is
+    chosen, so that the solution is unique.
+
+    Args:
+      x:
+        A 2-D tensor of shape (num_rows, num_cols), of dtype torch.float64.
+      y:
+        A 1-D tensor of shape (num_rows,), of dtype torch.float64.
+    Returns:
+      Return a 1-D tensor of shape (num_cols,) with the coefficients.
+    """
+    num_cols = x.shape[1]
+    best = torch.zeros(num_cols, dtype=torch.float64)
+    best_err = float(y.square().sum())
+    tol = 1e-9 * max(best_err, 1.0)
+    for k in range(1, num_cols + 1):
+        for cols in itertools.combinations(range(num_cols), k):
+            sub = x[:, cols]
+            if int(torch.linalg.matrix_rank(sub)) < k:
+                continue
+            # The subset has full rank, so the solution is unique
+            c = torch.linalg.lstsq(sub, y.unsqueeze(1), driver="gelsd")
+            c = c.solution.squeeze(1)
+            if (c < 0).any():
+                continue
+            err = float((sub @ c - y).square().sum())
+            # Only a significantly better fit may use more columns
+            if err < best_err - tol:
+                best_err = err
+                best = torch.zeros(num_cols, dtype=torch.float64)
+                best[list(cols)] = c
+    return best
+
+
+class PeakMemoryModel:
+    """A linear model of the peak memory of one training step.
+
+    peak = c0 + c1 * N + c2 * N * F + c3 * N * F^2
+
+    See the module docstring for the meaning of N and F.
+    The coefficients are constrained to be non-negative, which makes the
+    predicted peak monotonically increasing in the batch duration.
+    To determine all of them, the probes need at least 3 different values
+    of F and at least 2 different values of N for some F.
+    """
+
+    feature_names = ("const", "cuts", "frames", "frames^2")
+
+    def __init__(self):
+        self.coef: Optional[torch.Tensor] = None
+
+    def fit(self, probes: Sequence[MemoryProbe]) -> "PeakMemoryModel":
+        """Fit the coefficients with non-negative least squares on the
+        probes that did not run out of memory.
+        """
+        probes = [p for p in probes if not p.oom]
+        assert len(probes) > 0, "No successful probe to fit the memory model"
+
+        x = torch.tensor(
+            [_features(p.batch_size, p.num_frames) for p in probes],
+            dtype=torch.float64,
+        )
+        y = torch.tensor([float(p.peak_bytes) for p in probes], dtype=torch.float64)
+
+        if int(torch.linalg.matrix_rank(x)) < x.shape[1]:
+            logging.warning(
+                "The probes cannot determine all the terms of the memory model; "
+                "the predictions for other batch shapes may be inaccurate"
+            )
+
+        # Normalize the columns so that the problem is well conditioned
+        scale = x.abs().max(dim=0).values.clamp(min=1.0)
+        y_scale = y.abs().max().clamp(min=1.0)
+        coef = nnls(x / scale, y / y_scale)
+        self.coef = coef * y_scale / scale
+        return self
+
+    def predict(self, batch_size: int, num_frames: int) -> float:
+        """Return the predicted peak memory in bytes."""
+        assert self.coef is not None, "Please call fit() first"
+        x = torch.tensor(_features(batch_size, num_frames), dtype=torch.float64)
+        return float((x * self.coef).sum())
+
+    def __str__(self) -> str:
+        if self.coef is None:
+            return "PeakMemoryModel(<not fitted>)"
+        terms = ", ".join(
+            f"{n}={c:.4g}" for n, c in zip(self.feature_names, self.coef.tolist())
+        )
+        return f"PeakMemoryModel({terms})"
+
+
+@dataclass
+class TunedMaxDuration:
+    # The largest max_duration that is safe for every bucket
+    max_duration: float
+    # Upper duration bound of each bucket, in seconds
+    bucket_durations: List[float]
+    # The largest safe max_duration for each bucket
+    bucket_max_durations: List[float]
+    # If not None, use it as `quadratic_duration` of DynamicBucketingSampler
+    # together with `max_duration`; it lets shorter buckets use larger
+    # batches than the longest bucket.
+    quadratic_duration: Optional[float]
+    memory_budget: int
+    model: PeakMemoryModel
+    probes: List[MemoryProbe] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        s = f"max_duration: {self.max_duration:.1f}"
+        if self.quadratic_duration is not None:
+            s += f", quadratic_duration: {self.quadratic_duration:.1f}"
+        s += f", memory budget: {self.memory_budget // 1000000}MB\n"
+        s += f"{self.model}\n"
+        for d, m in zip(self.bucket_durations, self.bucket_max_durations):
+            s += f"  bucket with cuts up to {d:.2f}s: max_duration {m:.1f}\n"
+        return s
+
+
+def is_oom_error(e: BaseException) -> bool:
+    """Return True if `e` is an out-of-memory error from PyTorch or
+    the Python runtime."""
+    if isinstance(e, MemoryError):
+        return True
+    if hasattr(torch.cuda, "OutOfMemoryError") and isinstance(
+        e, torch.cuda.OutOfMemoryError
+    ):
+        return True
+    return isinstance(e, RuntimeError) and "out of memory" in str(e)
+
+
+def _read_proc_status_kb(key: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak resident set size (VmHWM) of this process.
+    Return False if it is not supported on this system.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes."""
+    hwm = _read_proc_status_kb("VmHWM")
+    if hwm is not None:
+        return hwm * 1024
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_available_memory(device: torch.device) -> int:
+    """Return the amount of memory in bytes that can be used on `device`."""
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(device).total_memory
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    assert available is not None, (
+        "Cannot determine the available memory on this system. "
+        "Please specify the memory budget explicitly."
+    )
+    # The resident memory of this process is also usable
+    return available + _read_proc_status_kb("VmRSS") * 1024
+
+
+def measure_peak_memory(fn: Callable[[], Any], device: torch.device) -> int:
+    """Run `fn()` and return the peak memory in bytes used during the call.
+
+    For CUDA devices, it is the peak memory allocated by PyTorch's caching
+    allocator. For CPU, it is the peak resident set size of the process.
+    Out-of-memory errors are propagated to the caller.
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        fn()
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device)
+
+    if not _reset_peak_rss():
+        # The peak can only grow; since we probe increasing durations
+        # this is still a reasonable (pessimistic) estimate.
+        logging.debug("Cannot reset the peak RSS; using the process-wide peak")
+    fn()
+    return get_peak_rss()
+
+
+def get_bucket_durations(sampler: Any, max_cut_duration: float) -> List[float]:
+    """Return the upper duration bound of each bucket of a sampler.
+
+    Args:
+      sampler:
+        Usually an instance of DynamicBucketingSampler. If it has no
+        `duration_bins`, a single bucket is assumed.
+      max_cut_duration:
+        Duration of the longest cut in the training data, in seconds.
+        It is used as the upper bound of the last bucket.
+    Returns:
+      A sorted list of durations, one per bucket.
+    """
+    bins = [b for b in getattr(sampler, "duration_bins", []) if b < max_cut_duration]
+    return [float(b) for b in bins] + [float(max_cut_duration)]
+
+
+def _select_probe_buckets(
+    bucket_durations: Sequence[float], num_buckets: int = 4
+) -> List[float]:
+    # Buckets evenly spread from the shortest to the longest one. At least
+    # 3 different cut durations are needed to tell the per-frame term from
+    # the quadratic one; one more makes the fit robust to noise.
+    n = len(bucket_durations)
+    indexes = sorted(
+        {round(i * (n - 1) / (num_buckets - 1)) for i in range(num_buckets)}
+    )
+    return [bucket_durations[i] for i in indexes]
+
+
+def _fit_quadratic_duration(
+    bucket_durations: Sequence[float],
+    bucket_max_durations: Sequence[float],
+) -> Tuple[float, Optional[float]]:
+    """Choose (max_duration, quadratic_duration) for lhotse's TimeConstraint
+    so that every bucket stays below its safe duration while maximizing
+    the average batch duration over buckets.
+
+    With quadratic_duration q, a bucket with cuts of duration d gets
+    batches of total duration max_duration / (1 + d / q).
+    """
+    best = min(bucket_max_durations)
+    best_q = None
+    for q in [2.0 ** (i / 4) for i in range(8, 40)]:
+        m = min(s * (1 + d / q) for d, s in zip(bucket_durations, bucket_max_durations))
+        avg = sum(m / (1 + d / q) for d in bucket_durations) / len(bucket_durations)
+        if avg > best * 1.02:
+            best = avg
+            best_q = q
+    if best_q is None:
+        return min(bucket_max_durations), None
+    m = min(
+        s * (1 + d / best_q) for d, s in zip(bucket_durations, bucket_max_durations)
+    )
+    return m, best_q
+
+
+def select_max_duration(
+    bucket_durations: Sequence[float],
+    bucket_max_durations: Sequence[float],
+    per_bucket: bool = False,
+) -> Tuple[float, Optional[float]]:
+    """Return (max_duration, quadratic_duration) for the largest safe
+    max_duration of each bucket. quadratic_duration is None unless
+    `per_bucket` is True. See :func:`tune_max_duration`.
+
+    With DDP, the ranks may have different memory budgets. Call it on every
+    rank with the minimum over the ranks of each bucket's safe max_duration,
+    so that all ranks use the same pair of values, which fits into the
+    memory of every rank.
+    """
+    if per_bucket:
+        max_duration, quadratic_duration = _fit_quadratic_duration(
+            bucket_durations, bucket_max_durations
+        )
+    else:
+        max_duration, quadratic_duration = min(bucket_max_durations), None
+    return float(math.floor(max_duration)), quadratic_duration
+
+
+def tune_max_duration(
+    step_fn: Callable[[Any], None],
+    make_batch: Callable[[int, int, int], Any],
+    bucket_durations: Sequence[float],
+    device: torch.device,
+    memory_budget: Optional[int] = None,
+    safety_margin: float = 0.1,
+    frame_rate: float = 100.0,
+    tokens_per_second: float = 3.5,
+    start_duration: float = 100.0,
+    max_duration_limit: float = 2000.0,
+    growth: float = 1.5,
+    per_bucket: bool = False,
+) -> TunedMaxDuration:
+    """Find the largest safe max_duration by probing the model.
+
+    Args:
+      step_fn:
+        A function that takes a batch and runs one forward and backward
+        pass of the model (without updating the parameters).
+      make_batch:
+        A function make_batch(batch_size, num_frames, num_tokens) that returns
+        a synthetic batch with `batch_size` cuts, each with `num_frames`
+        frames and about `num_tokens` tokens.
+      bucket_durations:
+        Upper duration bound of each bucket, in seconds.
+        See :func:`get_bucket_durations`.
+      device:
+        The device the model is on.
+      memory_budget:
+        Memory in bytes that the training may use. If None, it is the
+        total memory of the GPU, or the available RAM on CPU.
+      safety_margin:
+        Fraction of the budget that is kept free, e.g., for fragmentation
+        and for batches that are a bit different from the synthetic ones.
+      frame_rate:
+        Number of feature frames per second.
+      tokens_per_second:
+        Average number of tokens per second of speech in the training data.
+      start_duration:
+        The max_duration of the first probe.
+      max_duration_limit:
+        Never probe or return a max_duration larger than this.
+      growth:
+        Ratio between the max_duration of two successive probes.
+      per_bucket:
+        If True, also fit `quadratic_duration` so that the batch duration
+        of each bucket is close to its own safe value.
+    Returns:
+      Return a :class:`TunedMaxDuration`.
+    """
+    assert len(bucket_durations) > 0
+    assert growth > 1.0, growth
+    assert 0 <= safety_margin < 1, safety_margin
+    bucket_durations = sorted(bucket_durations)
+
+    if memory_budget is None:
+        memory_budget = get_available_memory(device)
+    limit = memory_budget * (1 - safety_margin)
+
+    def shape(max_duration: float, cut_duration: float) -> Tuple[int, int, int]:
+        batch_size = max(1, int(max_duration // cut_duration))
+        num_frames = max(1, int(cut_duration * frame_rate))
+        num_tokens = max(1, int(round(cut_duration * tokens_per_second)))
+        return batch_size, num_frames, num_tokens
+
+    probes: List[MemoryProbe] = []
+    # The smallest max_duration that failed for each probed bucket
+    failed: Dict[float, float] = {}
+
+    def run_probe(max_duration: float, cut_duration: float, batch_size: int):
+        _, num_frames, num_tokens = shape(max_duration, cut_duration)
+        batch = make_batch(batch_size, num_frames, num_tokens)
+        try:
+            peak = measure_peak_memory(lambda: step_fn(batch), device)
+        except Exception as e:
+            if not is_oom_error(e):
+                raise
+            peak = None
+        finally:
+            # Release the batch before emptying the cache
+            batch = None
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+
+        probes.append(
+            MemoryProbe(
+                max_duration=max_duration,
+                cut_duration=cut_duration,
+                batch_size=batch_size,
+                num_frames=num_frames,
+                num_tokens=num_tokens,
+                peak_bytes=peak,
+            )
+        )
+        msg = (
+            f"Probe max_duration={max_duration:.1f}: "
+            f"{batch_size} cuts of {cut_duration:.2f}s, "
+        )
+        if peak is None:
+            logging.info(msg + "out of memory")
+        else:
+            logging.info(msg + f"peak memory {peak // 1000000}MB")
+
+        if peak is None or peak > limit:
+            # Larger batches would exceed the budget anyway
+            failed[cut_duration] = min(
+                failed.get(cut_duration, max_duration), max_duration
+            )
+
+    probe_buckets = _select_probe_buckets(bucket_durations)
+    max_duration = start_duration
+    while max_duration <= max_duration_limit:
+        for cut_duration in probe_buckets:
+            if cut_duration in failed:
+                continue
+            batch_size = shape(max_duration, cut_duration)[0]
+            if any(
+                p.cut_duration == cut_duration and p.batch_size == batch_size
+                for p in probes
+            ):
+                # The same shape as a previous probe tells nothing new
+                continue
+            run_probe(max_duration, cut_duration, batch_size)
+
+        if len(failed) == len(probe_buckets):
+            break
+        max_duration *= growth
+
+    # The slope in N of each bucket needs at least two batch sizes, so if a
+    # bucket fitted only once, also probe it with smaller batches.
+    for cut_duration in probe_buckets:
+        ok = [
+            p.batch_size
+            for p in probes
+            if p.cut_duration == cut_duration and not p.oom and p.peak_bytes <= limit
+        ]
+        tried = [p.batch_size for p in probes if p.cut_duration == cut_duration]
+        batch_size = min(tried, default=1)
+        while len(ok) < 2 and batch_size > 1:
+            batch_size //= 2
+            run_probe(batch_size * cut_duration, cut_duration, batch_size)
+            if not probes[-1].oom and probes[-1].peak_bytes <= limit:
+                ok.append(batch_size)
+
+    model = PeakMemoryModel().fit(probes)
+
+    bucket_max_durations = []
+    for cut_duration in bucket_durations:
+        # An upper bound from the failed probes of nearby buckets.
+        # Longer cuts never need less memory for the same max_duration.
+        hi = max_duration_limit
+        for d, m in failed.items():
+            if d <= cut_duration:
+                hi = min(hi, m)
+
+        def fits(m: float) -> bool:
+            return model.predict(*shape(m, cut_duration)[:2]) <= limit
+
+        lo = cut_duration
+        if not fits(lo):
+            logging.warning(
+                f"Even a single cut of {cut_duration:.2f}s is predicted to "
+                f"exceed the memory budget of {memory_budget // 1000000}MB"
+            )
+            bucket_max_durations.append(lo)
+            continue
+        if fits(hi) and hi == max_duration_limit:
+            bucket_max_durations.append(hi)
+            continue
+        # Binary search for the largest max_duration that fits
+        while hi - lo > 1.0:
+            mid = (lo + hi) / 2
+            if fits(mid):
+                lo = mid
+            else:
+                hi = mid
+        bucket_max_durations.append(math.floor(lo))
+
+    max_duration, quadratic_duration = select_max_duration(
+        bucket_durations, bucket_max_durations, per_bucket
+    )
+
+    return TunedMaxDuration(
+        max_duration=max_duration,
+        bucket_durations=list(bucket_durations),
+        bucket_max_durations=bucket_max_durations,
+        quadratic_duration=quadratic_duration,
+        memory_budget=memory_budget,
+        model=model,
+        probes=probes,
+    )
+
+
+def make_synthetic_asr_batch(
+    batch_size: int,
+    num_frames: int,
+    texts: List[str],
+    feature_dim: int = 80,
+) -> Dict[str, Any]:
+    """Return a batch in the format of K2SpeechRecognitionDataset
+    with random features.
+
+    Args:
+      batch_size:
+        Number of cuts in the batch.
+      num_frames:
+        Number of frames of each cut.
+      texts:
+        The transcript of each cut; len(texts) == batch_size.
+      feature_dim:
+        Feature dimension.
+    """
+    assert len(texts) == batch_size, (len(texts), batch_size)
+    return {
+        "inputs": torch.randn(batch_size, num_frames, feature_dim),
+        "supervisions": {
+            "sequence_idx": torch.arange(batch_size, dtype=torch.int32),
+            "start_frame": torch.zeros(batch_size, dtype=torch.int32),
+            "num_frames": torch.full((batch_size,), num_frames, dtype=torch.int32),
+            "text": texts,
+        },
+    }
@@ -1,10 +1,11 @@
 import logging
 from pathlib import Path
-from typing import Iterable, List, Tuple, Union
+from typing import Iterable, List, Optional, Tuple, Union
 
 import k2
 import torch
 
+from icefall.graph_cache import TrainingGraphCache
 from icefall.lexicon import UniqLexicon
 
 
@@ -17,6 +18,7 @@ class MmiTrainingGraphCompiler(object):
         oov: str = "<UNK>",
         sos_id: int = 1,
         eos_id: int = 1,
+        cache: Optional[TrainingGraphCache] = None,
     ):
         """
         Args:
@@ -39,6 +41,9 @@ class MmiTrainingGraphCompiler(object):
           oov:
             Out of vocabulary word. When a word in the transcript
             does not exist in the lexicon, it is replaced with `oov`.
+          cache:
+            If not None, the numerator graph of each utterance is cached
+            and reused in :meth:`compile`. See :class:`TrainingGraphCache`.
         """
         self.lang_dir = Path(lang_dir)
         self.lexicon = UniqLexicon(lang_dir, uniq_filename=uniq_filename)
@@ -49,6 +54,7 @@ class MmiTrainingGraphCompiler(object):
         self.oov_id = self.lexicon.word_table[oov]
         self.sos_id = sos_id
         self.eos_id = eos_id
+        self.cache = cache
 
         self.build_ctc_topo_P()
 
@@ -128,7 +134,28 @@ class MmiTrainingGraphCompiler(object):
               with the same shape of the `num_graph` if replicate_den is
               True; otherwise, it is an FsaVec containing only a single FSA.
         """
-        transcript_fsa = self.build_transcript_fsa(texts)
+        if self.cache is not None:
+            num = self.cache.compile(
+                self.texts_to_word_ids(texts),
+                self.compile_num_graphs,
+                device=self.device,
+            )
+        else:
+            num = self.compile_num_graphs(self.texts_to_word_ids(texts))
+
+        ctc_topo_P_vec = k2.create_fsa_vec([self.ctc_topo_P])
+        if replicate_den:
+            indexes = torch.zeros(len(texts), dtype=torch.int32, device=self.device)
+            den = k2.index_fsa(ctc_topo_P_vec, indexes)
+        else:
+            den = ctc_topo_P_vec
+
+        return num, den
+
+    def compile_num_graphs(self, word_ids_list: List[List[int]]) -> k2.Fsa:
+        """Return the numerator graphs of a list-of-list of word IDs.
+        See :meth:`compile`. It does not use the cache."""
+        transcript_fsa = self.word_ids_to_fsa(word_ids_list)
 
         # remove word IDs from transcript_fsa since it is not needed
         del transcript_fsa.aux_labels
@@ -152,15 +179,7 @@ class MmiTrainingGraphCompiler(object):
         num = k2.connect(num)
 
         num = k2.arc_sort(num)
-
-        ctc_topo_P_vec = k2.create_fsa_vec([self.ctc_topo_P])
-        if replicate_den:
-            indexes = torch.zeros(len(texts), dtype=torch.int32, device=self.device)
-            den = k2.index_fsa(ctc_topo_P_vec, indexes)
-        else:
-            den = ctc_topo_P_vec
-
-        return num, den
+        return num
 
     def build_transcript_fsa(self, texts: List[str]) -> k2.Fsa:
         """Convert transcripts to an FsaVec with the help of a lexicon
@@ -176,6 +195,11 @@ class MmiTrainingGraphCompiler(object):
           Return an FST (FsaVec) corresponding to the transcript.
           Its `labels` is token IDs and `aux_labels` is word IDs.
         """
+        return self.word_ids_to_fsa(self.texts_to_word_ids(texts))
+
+    def texts_to_word_ids(self, texts: Iterable[str]) -> List[List[int]]:
+        """Convert a list of texts to a list-of-list of word IDs.
+        OOVs are replaced with `self.oov_id`."""
         word_ids_list = []
         for text in texts:
             word_ids = []
@@ -185,7 +209,11 @@ class MmiTrainingGraphCompiler(object):
                 else:
                     word_ids.append(self.oov_id)
             word_ids_list.append(word_ids)
+        return word_ids_list
 
+    def word_ids_to_fsa(self, word_ids_list: List[List[int]]) -> k2.Fsa:
+        """Like :meth:`build_transcript_fsa`, but it takes a list-of-list
+        of word IDs."""
         fsa = k2.linear_fsa(word_ids_list, self.device)
         fsa = k2.add_epsilon_self_loops(fsa)
 
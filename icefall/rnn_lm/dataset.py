@@ -14,9 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Tuple
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
 
 import k2
+import numpy as np
 import torch
 from torch.utils.data import DataLoader
 from torch.utils.data.distributed import DistributedSampler
@@ -162,6 +165,432 @@ class LmDatasetCollate:
         return x.to(torch.int64), y.to(torch.int64), sentence_token_lengths
 
 
+def pack_lm_data(
+    sentence_row_splits: np.ndarray,
+    sentence_words: np.ndarray,
+    word_row_splits: np.ndarray,
+    word_tokens: np.ndarray,
+    out_dir: Union[str, Path],
+    chunk_size: int = 10000000,
+) -> None:
+    """Write LM data as a flat array of tokens and an array of sentence
+    offsets, which can be memory-mapped by :class:`PackedLmDataset`.
+
+    Two files are written:
+
+        - out_dir/tokens.npy, a 1-D array with the tokens of all sentences.
+          Its dtype is np.uint16 if all token IDs are less than 65536 and
+          np.int32 otherwise.
+
+        - out_dir/offsets.npy, a 1-D array of dtype np.int64 with
+          num_sentences + 1 entries. The tokens of the i-th sentence are
+          tokens[offsets[i]:offsets[i+1]].
+
+    Args:
+      sentence_row_splits:
+        Row splits of the ragged tensor `sentences` with axes [sentence][word].
+      sentence_words:
+        Values of `sentences`, i.e., the word IDs of all sentences.
+      word_row_splits:
+        Row splits of the ragged tensor `words` with axes [word][token].
+      word_tokens:
+        Values of `words`, i.e., the token IDs of all words.
+      out_dir:
+        The output directory.
+      chunk_size:
+        Number of words to process at a time. It limits the memory usage.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    word_row_splits = np.asarray(word_row_splits, dtype=np.int64)
+    sentence_words = np.asarray(sentence_words, dtype=np.int64)
+    word_tokens = np.asarray(word_tokens)
+
+    # Number of tokens of each word in sentence_words
+    num_tokens = np.diff(word_row_splits)[sentence_words]
+    token_splits = np.zeros(num_tokens.size + 1, dtype=np.int64)
+    np.cumsum(num_tokens, out=token_splits[1:])
+
+    offsets = token_splits[np.asarray(sentence_row_splits, dtype=np.int64)]
+    np.save(out_dir / "offsets.npy", offsets)
+
+    if word_tokens.size == 0 or word_tokens.max() < np.iinfo(np.uint16).max:
+        dtype = np.uint16
+    else:
+        dtype = np.int32
+    tokens = np.lib.format.open_memmap(
+        out_dir / "tokens.npy", mode="w+", dtype=dtype, shape=(token_splits[-1],)
+    )
+    for begin in range(0, sentence_words.size, chunk_size):
+        end = min(begin + chunk_size, sentence_words.size)
+        n = num_tokens[begin:end]
+        start = token_splits[begin]
+        # index into word_tokens of each token in this chunk
+        index = np.repeat(
+            word_row_splits[sentence_words[begin:end]]
+            - (token_splits[begin:end] - start),
+            n,
+        ) + np.arange(token_splits[end] - start)
+        tokens[start : token_splits[end]] = word_tokens[index]
+    tokens.flush()
+    del tokens
+
+    logging.info(
+        f"Wrote {offsets.size - 1} sentences with {token_splits[-1]} tokens "
+        f"to {out_dir}"
+    )
+
+
+def convert_lm_data(filename: Union[str, Path], out_dir: Union[str, Path]) -> None:
+    """Convert LM data generated by `../local/prepare_lm_training_data.py`
+    or `../local/sort_lm_training_data.py` to the format of
+    :func:`pack_lm_data`. The order of sentences is kept.
+    """
+    lm_data = torch.load(filename)
+    sentences = lm_data["sentences"]
+    words = lm_data["words"]
+
+    pack_lm_data(
+        sentence_row_splits=sentences.shape.row_splits(1).numpy(),
+        sentence_words=sentences.values.numpy(),
+        word_row_splits=words.shape.row_splits(1).numpy(),
+        word_tokens=words.values.numpy(),
+        out_dir=out_dir,
+    )
+
+    offsets = np.load(Path(out_dir) / "offsets.npy")
+    sentence_lengths = lm_data["sentence_lengths"].numpy()
+    assert np.array_equal(np.diff(offsets), sentence_lengths), filename
+
+
+def is_packed_lm_data(filename: Union[str, Path]) -> bool:
+    """Return True if `filename` is a directory written by
+    :func:`pack_lm_data`."""
+    filename = Path(filename)
+    return (filename / "tokens.npy").is_file() and (filename / "offsets.npy").is_file()
+
+
+class PackedLmDataset(torch.utils.data.Dataset):
+    def __init__(self, dirname: Union[str, Path]):
+        """
+        Args:
+          dirname:
+            A directory written by :func:`pack_lm_data`.
+
+        The tokens are memory-mapped, so the page cache is shared by all
+        dataloader workers and all DDP ranks on a machine, and only the
+        sentences of the current batches are read from disk.
+
+        `dataset[i]` returns the tokens of the i-th sentence as a 1-D
+        numpy array. It is meant to be used with :class:`TokenBudgetSampler`
+        as batch_sampler and with :class:`PackedLmDatasetCollate`.
+        """
+        super().__init__()
+        self.dirname = Path(dirname)
+        assert is_packed_lm_data(self.dirname), self.dirname
+        self._tokens = None
+        self._offsets = None
+
+    @property
+    def tokens(self) -> np.ndarray:
+        if self._tokens is None:
+            self._tokens = np.load(self.dirname / "tokens.npy", mmap_mode="r")
+        return self._tokens
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._offsets = np.load(self.dirname / "offsets.npy", mmap_mode="r")
+        return self._offsets
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.offsets[-1])
+
+    def sentence_lengths(self) -> np.ndarray:
+        """Return the number of tokens of each sentence."""
+        return np.diff(self.offsets).astype(np.int32)
+
+    def __getstate__(self):
+        # Don't pickle the memory maps; workers re-open them.
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        state["_offsets"] = None
+        return state
+
+    def __len__(self) -> int:
+        """Return number of sentences in this dataset"""
+        return self.offsets.size - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        assert 0 <= i < len(self), i
+        return np.asarray(self.tokens[self.offsets[i] : self.offsets[i + 1]])
+
+
+class TokenBudgetSampler(torch.utils.data.Sampler):
+    def __init__(
+        self,
+        sentence_lengths: np.ndarray,
+        max_tokens: int,
+        concat_sentences: bool = False,
+        shuffle: bool = True,
+        sort_buffer_size: int = 100000,
+        seed: int = 0,
+        world_size: Optional[int] = None,
+        rank: Optional[int] = None,
+    ):
+        """A batch sampler that limits the number of tokens in a batch,
+        including padding.
+
+        Without `concat_sentences`, sentences are sorted by length within
+        buffers of `sort_buffer_size` sentences, so that each batch contains
+        sentences of similar lengths. The padded size of a batch, i.e.,
+        num_sentences * (max_sentence_length + 1), does not exceed
+        `max_tokens`, unless it has only one sentence.
+
+        With `concat_sentences`, sentences are concatenated with EOS
+        between them and cut into rows of a fixed length by
+        :class:`PackedLmDatasetCollate`, so there is no padding except in
+        the last row. The total number of tokens plus the number of
+        sentences in a batch does not exceed `max_tokens`.
+
+        Args:
+          sentence_lengths:
+            Number of tokens of each sentence. See
+            :meth:`PackedLmDataset.sentence_lengths`.
+          max_tokens:
+            Maximum number of tokens in a batch.
+          concat_sentences:
+            True to concatenate sentences. See above.
+          shuffle:
+            True to shuffle sentences and batches in each epoch.
+          sort_buffer_size:
+            Number of sentences sorted together. Used only if
+            `concat_sentences` is False. Larger values reduce padding but
+            increase the similarity of consecutive batches.
+          seed:
+            The seed for shuffling. Must be the same on all DDP ranks.
+          world_size:
+            Number of DDP ranks. If None, use the default process group
+            if it is initialized, or 1 otherwise.
+          rank:
+            The DDP rank. If None, it is determined like `world_size`.
+        """
+        assert max_tokens > 0, max_tokens
+        assert sort_buffer_size > 0, sort_buffer_size
+        if world_size is None or rank is None:
+            if torch.distributed.is_available() and torch.distributed.is_initialized():
+                world_size = torch.distributed.get_world_size()
+                rank = torch.distributed.get_rank()
+            else:
+                world_size, rank = 1, 0
+        assert 0 <= rank < world_size, (rank, world_size)
+
+        self.sentence_lengths = np.asarray(sentence_lengths, dtype=np.int64)
+        self.max_tokens = max_tokens
+        self.concat_sentences = concat_sentences
+        self.shuffle = shuffle
+        self.sort_buffer_size = sort_buffer_size
+        self.seed = seed
+        self.world_size = world_size
+        self.rank = rank
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self.batches = self._make_batches()
+
+    def _make_batches(self) -> List[np.ndarray]:
+        num_sentences = self.sentence_lengths.size
+        rng = np.random.default_rng(self.seed + self.epoch)
+        if self.shuffle:
+            order = rng.permutation(num_sentences)
+        else:
+            order = np.arange(num_sentences)
+
+        batches = []
+        if self.concat_sentences:
+            # +1 for the EOS after each sentence
+            cost = np.cumsum(self.sentence_lengths[order] + 1)
+            begin = 0
+            while begin < num_sentences:
+                done = cost[begin - 1] if begin > 0 else 0
+                end = np.searchsorted(cost, done + self.max_tokens, side="right")
+                end = max(end, begin + 1)
+                batches.append(order[begin:end])
+                begin = end
+        else:
+            for b in range(0, num_sentences, self.sort_buffer_size):
+                buf = order[b : b + self.sort_buffer_size]
+                # Sort by length in descending order, so the first sentence
+                # of a batch is the longest one
+                buf = buf[np.argsort(-self.sentence_lengths[buf], kind="stable")]
+                lengths = self.sentence_lengths[buf]
+                begin = 0
+                while begin < buf.size:
+                    n = max(1, self.max_tokens // (int(lengths[begin]) + 1))
+                    batches.append(buf[begin : begin + n])
+                    begin += n
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        # Every rank gets the same number of batches
+        num_batches = len(batches) // self.world_size * self.world_size
+        if num_batches == 0:
+            logging.warning(f"Only {len(batches)} batches for {self.world_size} ranks")
+        return batches[self.rank : num_batches : self.world_size]
+
+    def __len__(self) -> int:
+        """Return number of batches in the current epoch for this rank"""
+        return len(self.batches)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        for batch in self.batches:
+            yield batch.tolist()
+
+
+class PackedLmDatasetCollate:
+    def __init__(
+        self,
+        sos_id: int,
+        eos_id: int,
+        blank_id: int,
+        concat_sentences: bool = False,
+        seq_len: Optional[int] = None,
+    ):
+        """
+        Args:
+          sos_id:
+            Token ID of the SOS symbol.
+          eos_id:
+            Token ID of the EOS symbol.
+          blank_id:
+            Token ID of the blank symbol.
+          concat_sentences:
+            If False, return the same as :class:`LmDatasetCollate`.
+            If True, the sentences are concatenated with `eos_id` between
+            them and cut into rows of `seq_len` tokens. Note that the
+            EOS token of a sentence is the SOS token of the next one.
+          seq_len:
+            Number of tokens in a row. Used only if `concat_sentences`
+            is True.
+        """
+        assert not concat_sentences or (seq_len is not None and seq_len > 0), (
+            concat_sentences,
+            seq_len,
+        )
+        self.sos_id = sos_id
+        self.eos_id = eos_id
+        self.blank_id = blank_id
+        self.concat_sentences = concat_sentences
+        self.seq_len = seq_len
+
+    def __call__(
+        self, batch: List[np.ndarray]
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Return a tuple (x, y, lengths). See :class:`LmDatasetCollate`."""
+        if self.concat_sentences:
+            return self._concat(batch)
+
+        lengths = np.array([s.size for s in batch], dtype=np.int64) + 1
+        x = np.full((len(batch), lengths.max()), self.blank_id, dtype=np.int64)
+        y = np.full_like(x, self.blank_id)
+        x[:, 0] = self.sos_id
+        for i, s in enumerate(batch):
+            x[i, 1 : s.size + 1] = s
+            y[i, : s.size] = s
+            y[i, s.size] = self.eos_id
+
+        return (
+            torch.from_numpy(x),
+            torch.from_numpy(y),
+            torch.from_numpy(lengths.astype(np.int32)),
+        )
+
+    def _concat(
+        self, batch: List[np.ndarray]
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        eos = np.array([self.eos_id], dtype=np.int64)
+        stream = [np.array([self.sos_id], dtype=np.int64)]
+        for s in batch:
+            stream.append(s)
+            stream.append(eos)
+        stream = np.concatenate(stream).astype(np.int64)
+
+        num_tokens = stream.size - 1
+        num_rows = (num_tokens + self.seq_len - 1) // self.seq_len
+        x = np.full(num_rows * self.seq_len, self.blank_id, dtype=np.int64)
+        y = np.full_like(x, self.blank_id)
+        x[:num_tokens] = stream[:-1]
+        y[:num_tokens] = stream[1:]
+
+        lengths = np.full(num_rows, self.seq_len, dtype=np.int32)
+        lengths[-1] = num_tokens - (num_rows - 1) * self.seq_len
+
+        return (
+            torch.from_numpy(x.reshape(num_rows, self.seq_len)),
+            torch.from_numpy(y.reshape(num_rows, self.seq_len)),
+            torch.from_numpy(lengths),
+        )
+
+
+def get_packed_dataloader(
+    dirname: str,
+    is_distributed: bool,
+    params: AttributeDict,
+    shuffle: bool = True,
+) -> torch.utils.data.DataLoader:
+    """Get dataloader for LM data written by :func:`pack_lm_data`.
+
+    It uses `params.max_tokens`, `params.concat_sentences`,
+    `params.max_sent_len` (the row length if sentences are concatenated),
+    `params.seed` and `params.num_workers` if present.
+    Call `dataloader.batch_sampler.set_epoch(epoch)` at the start of each
+    epoch.
+    """
+    dataset = PackedLmDataset(dirname)
+    concat_sentences = params.get("concat_sentences", False)
+
+    if is_distributed:
+        world_size = torch.distributed.get_world_size()
+        rank = torch.distributed.get_rank()
+    else:
+        world_size, rank = 1, 0
+
+    sampler = TokenBudgetSampler(
+        sentence_lengths=dataset.sentence_lengths(),
+        max_tokens=params.max_tokens,
+        concat_sentences=concat_sentences,
+        shuffle=shuffle,
+        seed=params.get("seed", 0),
+        world_size=world_size,
+        rank=rank,
+    )
+    logging.info(
+        f"{len(dataset)} sentences, {dataset.num_tokens} tokens, "
+        f"{len(sampler)} batches per rank"
+    )
+
+    collate_fn = PackedLmDatasetCollate(
+        sos_id=params.sos_id,
+        eos_id=params.eos_id,
+        blank_id=params.blank_id,
+        concat_sentences=concat_sentences,
+        seq_len=params.max_sent_len,
+    )
+
+    num_workers = params.get("num_workers", 2)
+    return DataLoader(
+        dataset,
+        batch_sampler=sampler,
+        collate_fn=collate_fn,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+    )
+
+
 def get_dataloader(
     filename: str,
     is_distributed: bool,
@@ -173,6 +602,9 @@ def get_dataloader(
       filename:
         Path to the file containing LM data. The file is assumed to
         be generated by `../local/sort_lm_training_data.py`.
+        It can also be a directory generated by
+        `../local/pack_lm_training_data.py`; see
+        :func:`get_packed_dataloader`.
       is_distributed:
         True if using DDP training. False otherwise.
       params:
@@ -180,6 +612,11 @@ def get_dataloader(
     Returns:
       Return a dataloader containing the LM data.
     """
+    if is_packed_lm_data(filename):
+        return get_packed_dataloader(
+            dirname=filename, is_distributed=is_distributed, params=params
+        )
+
     lm_data = torch.load(filename)
 
     words = lm_data["words"]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+import tempfile
+
+import numpy as np
+import torch
+from rnn_lm.dataset import (
+    PackedLmDataset,
+    PackedLmDatasetCollate,
+    TokenBudgetSampler,
+    pack_lm_data,
+)
+
+sentences = [[0, 1, 2], [1, 0, 1], [0, 1], [1, 3, 0, 2, 0], [3], [0, 2, 1]]
+words = [[3, 6], [2, 8, 9, 3], [5], [5, 6, 7, 8, 9]]
+
+
+def row_splits(ragged):
+    return np.cumsum([0] + [len(r) for r in ragged])
+
+
+def expected_tokens():
+    return [sum((words[w] for w in s), []) for s in sentences]
+
+
+def write_packed_data(out_dir, chunk_size):
+    pack_lm_data(
+        sentence_row_splits=row_splits(sentences),
+        sentence_words=np.concatenate(sentences),
+        word_row_splits=row_splits(words),
+        word_tokens=np.concatenate(words),
+        out_dir=out_dir,
+        chunk_size=chunk_size,
+    )
+
+
+def test_pack_lm_data():
+    for chunk_size in [1, 4, 100]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_packed_data(tmp_dir, chunk_size)
+            dataset = PackedLmDataset(tmp_dir)
+            assert len(dataset) == len(sentences)
+            assert dataset.tokens.dtype == np.uint16
+            for i, expected in enumerate(expected_tokens()):
+                assert dataset[i].tolist() == expected, (i, dataset[i])
+
+            # The memory map is not pickled
+            dataset2 = pickle.loads(pickle.dumps(dataset))
+            assert dataset2._tokens is None
+            assert dataset2[3].tolist() == dataset[3].tolist()
+
+
+def test_token_budget_sampler():
+    lengths = np.random.default_rng(0).integers(1, 50, size=1000)
+    for concat in [False, True]:
+        all_batches = []
+        for rank in range(3):
+            sampler = TokenBudgetSampler(
+                lengths,
+                max_tokens=200,
+                concat_sentences=concat,
+                sort_buffer_size=100,
+                seed=1,
+                world_size=3,
+                rank=rank,
+            )
+            sampler.set_epoch(2)
+            batches = list(sampler)
+            assert len(batches) == len(sampler)
+            all_batches.append(batches)
+            for b in batches:
+                if concat:
+                    assert len(b) == 1 or (lengths[b] + 1).sum() <= 200
+                else:
+                    assert len(b) * (lengths[b].max() + 1) <= 200
+
+        # All ranks have the same number of batches, and no sentence
+        # is used twice
+        assert len(set(len(b) for b in all_batches)) == 1
+        indexes = [i for batches in all_batches for b in batches for i in b]
+        assert len(indexes) == len(set(indexes))
+        assert len(indexes) > 900
+
+    sampler = TokenBudgetSampler(lengths, max_tokens=200, seed=1)
+    epoch0 = list(sampler)
+    sampler.set_epoch(1)
+    assert list(sampler) != epoch0
+    sampler.set_epoch(0)
+    assert list(sampler) == epoch0
+
+
+def test_collate():
+    batch = [np.array([3, 6, 2], dtype=np.uint16), np.array([5], dtype=np.uint16)]
+
+    collate = PackedLmDatasetCollate(sos_id=1, eos_id=-1, blank_id=0)
+    x, y, lengths = collate(batch)
+    assert x.tolist() == [[1, 3, 6, 2], [1, 5, 0, 0]]
+    assert y.tolist() == [[3, 6, 2, -1], [5, -1, 0, 0]]
+    assert lengths.tolist() == [4, 2]
+    assert x.dtype == y.dtype == torch.int64
+    assert lengths.dtype == torch.int32
+
+    collate = PackedLmDatasetCollate(
+        sos_id=1, eos_id=-1, blank_id=0, concat_sentences=True, seq_len=3
+    )
+    x, y, lengths = collate(batch)
+    # stream: 1 3 6 2 -1 5 -1
+    assert x.tolist() == [[1, 3, 6], [2, -1, 5]]
+    assert y.tolist() == [[3, 6, 2], [-1, 5, -1]]
+    assert lengths.tolist() == [3, 3]
+
+    x, y, lengths = collate(batch[:1])
+    assert x.tolist() == [[1, 3, 6], [2, 0, 0]]
+    assert y.tolist() == [[3, 6, 2], [-1, 0, 0]]
+    assert lengths.tolist() == [3, 1]
+
+
+def main():
+    test_pack_lm_data()
+    test_token_budget_sampler()
+    test_collate()
+
+
+if __name__ == "__main__":
+    main()
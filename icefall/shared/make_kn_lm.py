@@ -14,15 +14,27 @@
 #
 # The data structure is based on: kaldi/egs/wsj/s5/utils/lang/make_phone_lm.py
 # The smoothing algorithm is based on: http://www.speech.sri.com/projects/srilm/manpages/ngram-discount.7.html
+#
+# There are two implementations of the same algorithm, selected with -engine:
+#  - "python": class NgramCounts, which stores the counts in dicts keyed by
+#    history tuples. It is simple but slow and needs a lot of memory.
+#  - "numpy" (default): class ArrayNgramCounts, which stores the n-grams of each
+#    order as sorted arrays of packed integer keys. The corpus is split into
+#    shards that are counted in parallel with -num-jobs processes, and all
+#    estimation steps are vectorized. Its ARPA output is byte-identical to
+#    that of NgramCounts.
 
 import argparse
 import io
 import math
+import multiprocessing
 import os
 import re
 import sys
 from collections import Counter, defaultdict
 
+import numpy as np
+
 parser = argparse.ArgumentParser(
     description="""
     Generate kneser-ney language model as arpa format. By default,
@@ -43,6 +55,21 @@ parser.add_argument(
 parser.add_argument(
     "-verbose", type=int, default=0, choices=[0, 1, 2, 3, 4, 5], help="Verbose level"
 )
+parser.add_argument(
+    "-engine",
+    type=str,
+    default="numpy",
+    choices=["numpy", "python"],
+    help="numpy: vectorized implementation that supports -num-jobs; "
+    "python: the original dict-based implementation. "
+    "Both produce identical arpa files.",
+)
+parser.add_argument(
+    "-num-jobs",
+    type=int,
+    default=1,
+    help="Number of processes for counting n-grams. Used only with -engine numpy",
+)
 args = parser.parse_args()
 
 # For encoding-agnostic scripts, we assume byte stream as input.
@@ -425,14 +452,378 @@ class NgramCounts:
         print("\\end\\", file=fout)
 
 
+# Maximum size of a shard of the corpus counted by one process of
+# ArrayNgramCounts, in bytes.
+max_shard_bytes = 128 * 1024 * 1024
+
+
+def _count_ngrams_in_lines(lines, ngram_order, first_word_only):
+    """Count the n-grams of all orders in a list of lines; it is run in worker
+    processes by ArrayNgramCounts.
+
+    Returns a dict with:
+      - "vocab": the words of this shard, where the index is the word id;
+        0 and 1 are <s> and </s>
+      - "num_lines", "num_tokens": the number of lines and of tokens,
+        including <s> and </s>
+      - "tables": for each order, a tuple (parent, word, count, first), sorted
+        by (parent, word), where parent is the index of the n-gram without
+        its last word in the table of the previous order and first is the
+        position of the first occurrence of the n-gram in this shard.
+    """
+    vocab = {"<s>": 0, "</s>": 1}
+    ids = []
+    lengths = []
+    num_ids = 0
+    for line in lines:
+        line = line.strip(strip_chars)
+        if first_word_only:
+            line = line.split()[0]
+        ids.append(0)
+        if line != "":
+            for w in whitespace.split(line):
+                i = vocab.get(w)
+                if i is None:
+                    i = vocab[w] = len(vocab)
+                ids.append(i)
+        ids.append(1)
+        lengths.append(len(ids) - num_ids)
+        num_ids = len(ids)
+
+    tok = np.array(ids, dtype=np.int64)
+    num_tokens = tok.size
+    lengths = np.array(lengths, dtype=np.int64)
+    # end[p] is the end (exclusive) of the sentence containing position p
+    end = np.repeat(np.cumsum(lengths), lengths)
+    positions = np.arange(num_tokens, dtype=np.int64)
+    V = len(vocab)
+
+    tables = []
+    # prev_ids[p] is the index in the previous table of the n-gram starting
+    # at position p
+    prev_ids = np.zeros(num_tokens, dtype=np.int64)
+    for n in range(1, ngram_order + 1):
+        valid = positions[positions + n <= end]
+        keys = prev_ids[valid] * V + tok[valid + n - 1]
+        keys, index, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+        tables.append((keys // V, keys % V, counts, valid[index]))
+        prev_ids = np.full(num_tokens, -1, dtype=np.int64)
+        prev_ids[valid] = inverse
+
+    return {
+        "vocab": list(vocab.keys()),
+        "num_lines": len(lengths),
+        "num_tokens": num_tokens,
+        "tables": tables,
+    }
+
+
+def _count_ngrams_in_file_range(filename, start, end, ngram_order, first_word_only):
+    # The range starts and ends at line boundaries. Lines are split in the
+    # same way as open(filename, encoding=default_encoding) does.
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding=default_encoding)
+    return _count_ngrams_in_lines(lines, ngram_order, first_word_only)
+
+
+def _count_ngrams_in_file_range_star(a):
+    return _count_ngrams_in_file_range(*a)
+
+
+def _count_ngrams_in_lines_star(a):
+    return _count_ngrams_in_lines(*a)
+
+
+def _segment_sums(values, starts, lengths):
+    # Return the sums of values[starts[i]:starts[i] + lengths[i]]. The values
+    # of each segment are added one by one from left to right, like the
+    # built-in sum(), so that the results are bit-identical to NgramCounts.
+    # The loop runs over the position within the segments, not the segments.
+    ans = np.zeros(starts.size)
+    if starts.size == 0:
+        return ans
+    order = np.argsort(-lengths, kind="stable")
+    neg_lengths = -lengths[order]
+    starts = starts[order]
+    acc = np.zeros(starts.size)
+    for j in range(int(-neg_lengths[0])):
+        # number of segments longer than j
+        m = np.searchsorted(neg_lengths, -j, side="left")
+        acc[:m] += values[starts[:m] + j]
+    ans[order] = acc
+    return ans
+
+
+class ArrayNgramCounts:
+    # A vectorized version of NgramCounts. For each history length n, the
+    # (n+1)-grams are stored in arrays sorted by their packed integer key
+    #
+    #   self.keys[n] = self.parent[n] * V + self.word[n]
+    #
+    # where V is the vocabulary size, self.word[n] is the id of the predicted
+    # word and self.parent[n] is the index of the history (itself an n-gram)
+    # in the arrays for history length n-1. Thus all n-grams with the same
+    # history are contiguous. self.first[n] is the position in the corpus of
+    # the first occurrence of each n-gram, which gives the order in which
+    # NgramCounts would have inserted it into its dicts; it is used to print
+    # the arpa file in the same order and to sum floats in the same order.
+    def __init__(self, ngram_order, bos_symbol="<s>", eos_symbol="</s>"):
+        assert ngram_order >= 1
+        assert (bos_symbol, eos_symbol) == ("<s>", "</s>")
+
+        self.ngram_order = ngram_order
+        self.bos_symbol = bos_symbol
+        self.eos_symbol = eos_symbol
+
+        self.vocab = []
+        self.keys = []
+        self.parent = []
+        self.word = []
+        self.count = []
+        self.first = []
+        self.suffix = []  # index of the n-gram without its first word
+        self.modified_count = []  # number of distinct left contexts
+
+        self.d = []  # list of discounting factor for each order of ngram
+        self.f = []
+        self.bow = []  # nan if there is no back-off weight
+
+    def add_raw_counts_from_standard_input(self, num_jobs=1):
+        # byte stream as input
+        infile = io.TextIOWrapper(sys.stdin.buffer, encoding=default_encoding)
+
+        def chunks():
+            lines = []
+            for line in infile:
+                lines.append(line)
+                if len(lines) == 1000000:
+                    yield (lines, self.ngram_order, False)
+                    lines = []
+            yield (lines, self.ngram_order, False)
+
+        with multiprocessing.Pool(num_jobs) as pool:
+            results = list(pool.imap(_count_ngrams_in_lines_star, chunks()))
+        self._merge(results)
+
+    def add_raw_counts_from_file(self, filename, num_jobs=1):
+        size = os.path.getsize(filename)
+        num_shards = max(num_jobs, (size + max_shard_bytes - 1) // max_shard_bytes)
+        boundaries = [0]
+        with open(filename, "rb") as f:
+            for i in range(1, num_shards):
+                f.seek(max(size * i // num_shards - 1, boundaries[-1]))
+                f.readline()
+                if f.tell() > boundaries[-1]:
+                    boundaries.append(f.tell())
+        if size > boundaries[-1] or len(boundaries) == 1:
+            boundaries.append(size)
+
+        shards = [
+            (filename, start, end, self.ngram_order, self.ngram_order == 1)
+            for start, end in zip(boundaries[:-1], boundaries[1:])
+        ]
+        with multiprocessing.Pool(num_jobs) as pool:
+            results = pool.map(_count_ngrams_in_file_range_star, shards)
+        self._merge(results)
+
+    def _merge(self, results):
+        # Merge the tables counted on each shard by sorting their keys.
+        lines_processed = sum(r["num_lines"] for r in results)
+        if lines_processed == 0 or args.verbose > 0:
+            print(
+                "make_phone_lm.py: processed {0} lines of input".format(
+                    lines_processed
+                ),
+                file=sys.stderr,
+            )
+
+        word_to_id = dict()
+        word_maps = []
+        for r in results:
+            word_maps.append(
+                np.array(
+                    [word_to_id.setdefault(w, len(word_to_id)) for w in r["vocab"]],
+                    dtype=np.int64,
+                )
+            )
+        self.vocab = list(word_to_id.keys())
+        V = len(self.vocab)
+
+        offsets = np.cumsum([0] + [r["num_tokens"] for r in results])
+        parent_maps = [np.zeros(1, dtype=np.int64) for _ in results]
+        for n in range(self.ngram_order):
+            keys, counts, firsts = [], [], []
+            for s, r in enumerate(results):
+                parent, word, count, first = r["tables"][n]
+                keys.append(parent_maps[s][parent] * V + word_maps[s][word])
+                counts.append(count)
+                firsts.append(first + offsets[s])
+            keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            starts = np.flatnonzero(np.diff(inverse[order], prepend=-1))
+            self.keys.append(keys)
+            self.parent.append(keys // V)
+            self.word.append(keys % V)
+            self.count.append(np.add.reduceat(np.concatenate(counts)[order], starts))
+            self.first.append(
+                np.minimum.reduceat(np.concatenate(firsts)[order], starts)
+            )
+            parent_maps = np.split(
+                inverse, np.cumsum([r["tables"][n][0].size for r in results])[:-1]
+            )
+
+        # The suffix of an (n+1)-gram (w_1, ..., w_{n+1}) is (w_2, ..., w_{n+1}),
+        # whose history is the suffix of the history of the (n+1)-gram.
+        self.suffix = [None]
+        for n in range(1, self.ngram_order):
+            if n == 1:
+                suffix_keys = self.word[n]
+            else:
+                suffix_keys = self.suffix[n - 1][self.parent[n]] * V + self.word[n]
+            suffix = np.searchsorted(self.keys[n - 1], suffix_keys)
+            assert (self.keys[n - 1][suffix] == suffix_keys).all()
+            self.suffix.append(suffix)
+
+        # The modified count of an n-gram is the number of distinct words that
+        # precede it, i.e., the number of (n+1)-grams of which it is the suffix.
+        self.modified_count = [
+            np.bincount(self.suffix[n + 1], minlength=self.keys[n].size)
+            for n in range(self.ngram_order - 1)
+        ] + [None]
+
+    def cal_discounting_constants(self):
+        # See NgramCounts.cal_discounting_constants()
+        self.d = [0]
+        for n in range(1, self.ngram_order):
+            n1 = int((self.count[n] == 1).sum())
+            n2 = int((self.count[n] == 2).sum())
+            assert n1 + 2 * n2 > 0
+            self.d.append(max(0.1, n1 * 1.0) / (n1 + 2 * n2))
+
+    def _sum_over_history(self, n, values):
+        # Return the sum of values over the n-grams with the same history,
+        # for each n-gram. The values are integers, so the order does not matter.
+        total = np.bincount(self.parent[n], weights=values)
+        return total[self.parent[n]]
+
+    def cal_f(self):
+        # See NgramCounts.cal_f()
+        self.f = []
+        for n in range(self.ngram_order):
+            count = self.count[n]
+            total_count = self._sum_over_history(n, count)
+            f = np.maximum(count - self.d[n], 0) / total_count
+            if n < self.ngram_order - 1:
+                n_star_z = self.modified_count[n]
+                n_star_star = self._sum_over_history(n, n_star_z)
+                # patterns begin with <s>, they do not have "modified count",
+                # so use raw count instead
+                has_context = n_star_star != 0
+                f[has_context] = (
+                    np.maximum(n_star_z[has_context] - self.d[n], 0)
+                    / n_star_star[has_context]
+                )
+            self.f.append(f)
+
+    def cal_bow(self):
+        # See NgramCounts.cal_bow()
+        eos = self.vocab.index(self.eos_symbol)
+        self.bow = []
+        for n in range(self.ngram_order - 1):
+            # The n-grams a_z that follow each a_, in the order in which
+            # NgramCounts would iterate them.
+            order = np.lexsort((self.first[n + 1], self.parent[n + 1]))
+            num_z = np.bincount(self.parent[n + 1], minlength=self.keys[n].size)
+            starts = np.cumsum(num_z) - num_z
+
+            has_bow = self.word[n] != eos
+            assert (num_z[has_bow] > 0).all()
+
+            sum_z1_f_a_z = _segment_sums(self.f[n + 1][order], starts, num_z)
+            f_z = self.f[n][self.suffix[n + 1]]
+            sum_z1_f_z = _segment_sums(f_z[order], starts, num_z)
+
+            has_bow &= sum_z1_f_z < 1
+            bow = np.full(self.keys[n].size, np.nan)
+            bow[has_bow] = (1.0 - sum_z1_f_a_z[has_bow]) / (1.0 - sum_z1_f_z[has_bow])
+            self.bow.append(bow)
+        self.bow.append(np.full(self.keys[-1].size, np.nan))
+
+    def print_as_arpa(
+        self, fout=io.TextIOWrapper(sys.stdout.buffer, encoding="latin-1")
+    ):
+        # print as ARPA format, in the same order as NgramCounts.print_as_arpa()
+
+        print("\\data\\", file=fout)
+        for hist_len in range(self.ngram_order):
+            # print the number of n-grams.
+            print(
+                "ngram {0}={1}".format(hist_len + 1, self.keys[hist_len].size),
+                file=fout,
+            )
+
+        print("", file=fout)
+
+        texts = None
+        for hist_len in range(self.ngram_order):
+            print("\\{0}-grams:".format(hist_len + 1), file=fout)
+
+            words = [self.vocab[w] for w in self.word[hist_len].tolist()]
+            if hist_len == 0:
+                texts = words
+            else:
+                texts = [
+                    texts[p] + " " + w
+                    for p, w in zip(self.parent[hist_len].tolist(), words)
+                ]
+
+            # histories in the order of their first occurrence, then words
+            # in the order of their first occurrence
+            parent = self.parent[hist_len]
+            first = self.first[hist_len]
+            starts = np.flatnonzero(np.diff(parent, prepend=-1))
+            hist_first = np.minimum.reduceat(first, starts)
+            hist_first = np.repeat(hist_first, np.diff(np.append(starts, parent.size)))
+            order = np.lexsort((first, hist_first))
+
+            probs = self.f[hist_len][order]
+            probs[probs == 0] = 1e-99  # f(<s>) is always 0
+            bows = self.bow[hist_len][order].tolist()
+            log10 = math.log10
+            for start in range(0, order.size, 100000):
+                end = start + 100000
+                lines = [
+                    "%.7f\t%s" % (log10(prob), texts[i])
+                    if bow != bow  # nan, no back-off weight
+                    else "%.7f\t%s\t%.7f" % (log10(prob), texts[i], log10(bow))
+                    for prob, i, bow in zip(
+                        probs[start:end].tolist(),
+                        order[start:end].tolist(),
+                        bows[start:end],
+                    )
+                ]
+                print("\n".join(lines), file=fout)
+            print("", file=fout)
+        print("\\end\\", file=fout)
+
+
 if __name__ == "__main__":
-    ngram_counts = NgramCounts(args.ngram_order)
+    if args.engine == "numpy":
+        ngram_counts = ArrayNgramCounts(args.ngram_order)
+        kwargs = {"num_jobs": args.num_jobs}
+    else:
+        ngram_counts = NgramCounts(args.ngram_order)
+        kwargs = {}
 
     if args.text is None:
-        ngram_counts.add_raw_counts_from_standard_input()
+        ngram_counts.add_raw_counts_from_standard_input(**kwargs)
     else:
         assert os.path.isfile(args.text)
-        ngram_counts.add_raw_counts_from_file(args.text)
+        ngram_counts.add_raw_counts_from_file(args.text, **kwargs)
 
     ngram_counts.cal_discounting_constants()
     ngram_counts.cal_f()
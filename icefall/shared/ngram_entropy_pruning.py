@@ -25,18 +25,42 @@ Usage:
 This file is from Kaldi `egs/wsj/s5/utils/lang/ngram_entropy_pruning.py`.
 This is an implementation of ``Entropy-based Pruning of Backoff Language Models''
 in the same way as SRILM.
+
+By default (-engine numpy), the LM is stored in arrays (class ArrayArpa) and
+each order is pruned with vectorized operations, optionally split over
+-num-jobs processes. The pruning criterion is the same as the original
+dict-based implementation, which can still be used with -engine python.
+
+Parsing a large arpa file takes time. To prune the same LM with several
+thresholds, save its arrays once and load them with memory mapping:
+
+./ngram_entropy_pruning.py \
+    -threshold 1e-8 \
+    -lm download/lm/4gram.arpa \
+    -save-lm-arrays download/lm/4gram_arrays \
+    -write-lm download/lm/4gram_pruned_1e8.arpa
+
+./ngram_entropy_pruning.py \
+    -threshold 1e-7 \
+    -lm download/lm/4gram_arrays \
+    -write-lm download/lm/4gram_pruned_1e7.arpa
 """
 
 
 import argparse
 import gzip
+import json
 import logging
 import math
+import multiprocessing
+import os
 import re
 from collections import OrderedDict, defaultdict
 from enum import Enum, unique
 from io import StringIO
 
+import numpy as np
+
 parser = argparse.ArgumentParser(
     description="""
     Prune an n-gram language model based on the relative entropy 
@@ -69,6 +93,28 @@ parser.add_argument(
     choices=[0, 1, 2, 3, 4, 5],
     help="Verbose level, where 0 is most noisy; 5 is most silent",
 )
+parser.add_argument(
+    "-engine",
+    type=str,
+    default="numpy",
+    choices=["numpy", "python"],
+    help="numpy: vectorized implementation that supports -num-jobs and "
+    "-save-lm-arrays; python: the original dict-based implementation",
+)
+parser.add_argument(
+    "-num-jobs",
+    type=int,
+    default=1,
+    help="Number of processes for pruning. Used only with -engine numpy",
+)
+parser.add_argument(
+    "-save-lm-arrays",
+    type=str,
+    default=None,
+    help="If given, save the arrays of the input LM to this directory. "
+    "It can be passed to -lm instead of the arpa file later. "
+    "Used only with -engine numpy",
+)
 args = parser.parse_args()
 
 default_encoding = args.encoding
@@ -605,19 +651,448 @@ def compare_two_apras(path1, path2):
     pass
 
 
+class ArrayArpa:
+    """
+    An ARPA LM stored in arrays, one set of arrays per order. For the n-grams
+    of order n, which have index n - 1 in the lists below:
+
+      - word[n - 1] is the id of the last word, see self.vocab
+      - ctx[n - 1] is the index of the history (the first n - 1 words) in
+        the arrays of order n - 1; it is 0 for unigrams
+      - keys[n - 1] = ctx[n - 1] * len(self.vocab) + word[n - 1], which is
+        sorted, so n-grams with the same history are contiguous
+      - log_p[n - 1] and log_bo[n - 1] are the log10 probability and back-off
+        weight; log_bo is nan if there is no back-off weight
+      - p_is_int[n - 1] and bo_is_int[n - 1] tell if the number was written
+        as an integer in the arpa file, so that it is written back the same
+        way as class Arpa does
+      - pos[n - 1] is the position of the n-gram in the arpa file and
+        ctx_rank[n - 1] the position at which class Arpa would have created
+        the context of the n-gram; they are used to write the n-grams in the
+        same order as class Arpa.
+
+    The history of each n-gram must be in the LM, which is the case for LMs
+    produced by make_kn_lm.py, SRILM or kaldi.
+    """
+
+    SOS = Arpa.SOS
+    EOS = Arpa.EOS
+    FLOAT_NDIGITS = Arpa.FLOAT_NDIGITS
+    ARRAYS = ["word", "ctx", "keys", "log_p", "log_bo", "p_is_int", "bo_is_int"]
+    ARRAYS += ["pos", "ctx_rank"]
+
+    def __init__(self):
+        self.vocab = []
+        self._counts = OrderedDict()
+        for name in self.ARRAYS:
+            setattr(self, name, [])
+
+    def order(self):
+        return len(self.keys)
+
+    def counts(self):
+        return sorted(self._counts.items())
+
+    def update_counts(self):
+        for order in range(1, self.order() + 1):
+            count = self.keys[order - 1].size
+            if count > 0:
+                self._counts[order] = count
+
+    @staticmethod
+    def _is_int(s):
+        # The same as ArpaParser._float_or_int()
+        return "." not in s and "e" not in s and str(int(float(s))) == s
+
+    @classmethod
+    def loadf(cls, path, encoding=None):
+        """Load the first LM in an arpa file (.arpa, .gz)."""
+        path = str(path)
+        if path.endswith(".gz"):
+            with gzip.open(path, mode="rt", encoding=encoding) as f:
+                return cls.load(f)
+        else:
+            with open(path, mode="rt", encoding=encoding) as f:
+                return cls.load(f)
+
+    @classmethod
+    def load(cls, fp):
+        lm = cls()
+        word_to_id = dict()
+        entries = []  # for each order: words, log_p strings, log_bo strings
+        order = None
+        for line in fp:
+            line = line.strip()
+            if order is None:
+                if line == "\\data\\":
+                    order = 0
+                continue
+            match = ArpaParser.re_count.match(line)
+            if match:
+                lm._counts[int(match.group(1))] = int(match.group(2))
+                continue
+            match = ArpaParser.re_header.match(line)
+            if match:
+                order = int(match.group(1))
+                assert order == len(entries) + 1, line
+                entries.append(([], [], []))
+                continue
+            if line == "\\end\\":
+                break
+            if not line:
+                continue
+            fields = line.split("\t")
+            words = fields[1].split(" ")
+            if len(words) != order or len(fields) > 3:
+                raise Exception(line)
+            ids, log_p, log_bo = entries[-1]
+            for w in words:
+                i = word_to_id.get(w)
+                if i is None:
+                    i = word_to_id[w] = len(word_to_id)
+                ids.append(i)
+            log_p.append(fields[0])
+            log_bo.append(fields[2] if len(fields) == 3 else "nan")
+
+        lm.vocab = list(word_to_id.keys())
+        V = len(lm.vocab)
+        for n, (ids, log_p, log_bo) in enumerate(entries, 1):
+            ids = np.array(ids, dtype=np.int64).reshape(-1, n)
+            if n == 1:
+                ctx = np.zeros(ids.shape[0], dtype=np.int64)
+            else:
+                ctx = lm.lookup(ids[:, :-1])
+                if (ctx < 0).any():
+                    i = int(np.flatnonzero(ctx < 0)[0])
+                    ngram = " ".join(lm.vocab[w] for w in ids[i])
+                    raise ValueError(f"The history of {ngram} is not in the LM")
+            keys = ctx * V + ids[:, -1]
+            perm = np.argsort(keys, kind="stable")
+            keys = keys[perm]
+            if (np.diff(keys) == 0).any():
+                raise ValueError(f"Duplicate {n}-grams in the LM")
+            lm.keys.append(keys)
+            lm.ctx.append(ctx[perm])
+            lm.word.append(ids[perm, -1])
+            lm.log_p.append(np.array(log_p, dtype=np.float64)[perm])
+            lm.log_bo.append(np.array(log_bo, dtype=np.float64)[perm])
+            lm.p_is_int.append(np.array([cls._is_int(s) for s in log_p])[perm])
+            lm.bo_is_int.append(
+                np.array([s != "nan" and cls._is_int(s) for s in log_bo])[perm]
+            )
+            lm.pos.append(perm)
+
+        # Class Arpa creates the context of an n-gram when it reads the n-gram
+        # if it has a back-off weight, else when it reads its first successor.
+        for n in range(1, lm.order() + 1):
+            size = lm.keys[n - 1].size
+            rank = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+            if n < lm.order():
+                np.minimum.at(rank, lm.ctx[n], size + lm.pos[n])
+            has_bo = ~np.isnan(lm.log_bo[n - 1])
+            rank[has_bo] = lm.pos[n - 1][has_bo]
+            lm.ctx_rank.append(rank)
+        return lm
+
+    def save(self, path):
+        """Save the arrays to the directory `path`, see load_arrays()."""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "lm.json"), "w") as f:
+            json.dump({"vocab": self.vocab, "counts": self.counts()}, f)
+        for n in range(1, self.order() + 1):
+            for name in self.ARRAYS:
+                np.save(
+                    os.path.join(path, f"{name}.{n}.npy"), getattr(self, name)[n - 1]
+                )
+
+    @classmethod
+    def load_arrays(cls, path, mmap=True):
+        """Load the arrays saved by save(). If mmap is True, the arrays are
+        memory-mapped, so loading takes no time and processes created by
+        multiprocessing share them."""
+        lm = cls()
+        with open(os.path.join(path, "lm.json")) as f:
+            info = json.load(f)
+        lm.vocab = info["vocab"]
+        lm._counts = OrderedDict((n, c) for n, c in info["counts"])
+        for n in range(1, len(lm._counts) + 1):
+            for name in cls.ARRAYS:
+                getattr(lm, name).append(
+                    np.load(
+                        os.path.join(path, f"{name}.{n}.npy"),
+                        mmap_mode="r" if mmap else None,
+                    )
+                )
+        return lm
+
+    def ngram_words(self, n, rows=None):
+        """Return the word ids of the n-grams of order n as an array of shape
+        (num_rows, n)."""
+        rows = np.arange(self.keys[n - 1].size) if rows is None else rows
+        words = [self.word[n - 1][rows]]
+        for m in range(n - 1, 0, -1):
+            rows = self.ctx[m][rows]
+            words.append(self.word[m - 1][rows])
+        return np.stack(words[::-1], axis=1)
+
+    def _find(self, n, ctx, word):
+        # Return the index of the n-grams (ctx, word), -1 if not found.
+        keys = self.keys[n - 1]
+        if keys.size == 0:
+            return np.full(word.shape, -1, dtype=np.int64)
+        query = ctx * len(self.vocab) + word
+        i = np.minimum(np.searchsorted(keys, query), keys.size - 1)
+        return np.where((ctx >= 0) & (keys[i] == query), i, -1)
+
+    def lookup(self, words):
+        """Return the index of each n-gram in words, of shape (num, n), in the
+        arrays of order n, or -1 if it is not in the LM."""
+        i = np.zeros(words.shape[0], dtype=np.int64)
+        for n in range(1, words.shape[1] + 1):
+            i = self._find(n, i, words[:, n - 1])
+        return i
+
+    def _log_bo(self, words):
+        # The back-off weight of each n-gram in words; 0 if there is none.
+        if words.shape[1] == 0 or words.shape[1] > self.order():
+            return np.zeros(words.shape[0])
+        i = self.lookup(words)
+        log_bo = np.zeros(words.shape[0])
+        found = i >= 0
+        log_bo[found] = np.nan_to_num(self.log_bo[words.shape[1] - 1][i[found]])
+        return log_bo
+
+    def log_p_raw(self, words):
+        """Vectorized Arpa.log_p_raw() for n-grams of the same order given as
+        an array of word ids of shape (num, n)."""
+        ans = np.zeros(words.shape[0])
+        active = np.arange(words.shape[0])
+        for k in range(words.shape[1]):
+            this_words = words[active, k:]
+            n = this_words.shape[1]
+            i = self.lookup(this_words) if n <= self.order() else -np.ones_like(active)
+            found = i >= 0
+            ans[active[found]] += self.log_p[n - 1][i[found]]
+            active = active[~found]
+            this_words = this_words[~found]
+            if active.size == 0:
+                break
+            if n == 1:
+                raise KeyError(self.vocab[this_words[0, 0]])
+            ans[active] += self._log_bo(this_words[:, :-1])
+        return ans
+
+    def log_joint_prob(self, words):
+        """Vectorized Arpa.log_joint_prob()."""
+        ans = np.zeros(words.shape[0])
+        sos = self.vocab.index(self.SOS) if self.SOS in self.vocab else -1
+        eos = self.vocab.index(self.EOS) if self.EOS in self.vocab else -1
+        for k in range(words.shape[1], 0, -1):
+            seq = words[:, :k]
+            if k == 1 and words.shape[1] > 1:
+                # If we're computing the marginal probability of the unigram
+                # <s> context we have to look up </s> instead since the former
+                # has prob = 0.
+                seq = np.where(seq == sos, eos, seq)
+            ans += self.log_p_raw(seq)
+        return ans
+
+    def perp_change(self, n, start, end):
+        """Return the relative change in perplexity if each n-gram of order
+        n in [start, end) is pruned, as computed by prune(). All n-grams of a
+        context must be in the range."""
+        rows = np.arange(start, end)
+        words = self.ngram_words(n, rows)
+        log_p = self.log_p[n - 1][rows]
+        ctx, inverse = np.unique(self.ctx[n - 1][rows], return_inverse=True)
+
+        # old backoff weight, BOW(h)
+        log_bow = np.nan_to_num(self.log_bo[n - 2][ctx])[inverse]
+
+        # lower-order estimate for ngramProb, P(w|h')
+        backoff_prob = self.log_p_raw(words[:, 1:])
+
+        # numerator and denominator of the backoff weight
+        numerator = 1.0 - np.bincount(inverse, weights=10.0**log_p)
+        denominator = 1.0 - np.bincount(inverse, weights=10.0**backoff_prob)
+        numerator = numerator[inverse]
+        denominator = denominator[inverse]
+
+        # the marginal probability of the context, P(h)
+        h_log_p = self.log_joint_prob(self.ngram_words(n - 1, ctx))[inverse]
+
+        # BOW after removing ngram, BOW'(h)
+        new_log_bow = np.log10(numerator + 10.0**log_p) - np.log10(
+            denominator + 10.0**backoff_prob
+        )
+
+        # change in entropy due to removal of ngram
+        delta_prob = backoff_prob + new_log_bow - log_p
+        delta_entropy = -(10.0**h_log_p) * (
+            (10.0**log_p) * delta_prob + numerator * (new_log_bow - log_bow)
+        )
+
+        # relative change in model (training set) perplexity
+        return 10.0**delta_entropy - 1.0
+
+    def remove(self, n, keep):
+        """Remove the n-grams of order n for which keep is False. They must not
+        be the history of any n-gram of order n + 1."""
+        for name in self.ARRAYS:
+            getattr(self, name)[n - 1] = getattr(self, name)[n - 1][keep]
+        if n < self.order():
+            new_index = np.cumsum(keep) - 1
+            self.ctx[n] = new_index[self.ctx[n]]
+            self.keys[n] = self.ctx[n] * len(self.vocab) + self.word[n]
+
+    def recompute_log_bo(self, n):
+        """Recompute the back-off weights of the n-grams of order n from their
+        successors. N-grams without successors get no back-off weight."""
+        size = self.keys[n - 1].size
+        ctx = self.ctx[n]
+        backoff_prob = self.log_p_raw(self.ngram_words(n + 1)[:, 1:])
+        numerator = 1.0 - np.bincount(
+            ctx, weights=10.0 ** self.log_p[n], minlength=size
+        )
+        denominator = 1.0 - np.bincount(
+            ctx, weights=10.0**backoff_prob, minlength=size
+        )
+        has_successors = np.bincount(ctx, minlength=size) > 0
+        log_bo = np.full(size, np.nan)
+        log_bo[has_successors] = np.log10(numerator[has_successors]) - np.log10(
+            denominator[has_successors]
+        )
+        self.log_bo[n - 1] = log_bo
+        self.bo_is_int[n - 1] = np.zeros(size, dtype=bool)
+
+    @classmethod
+    def _format(cls, values, is_int):
+        return [
+            str(int(v)) if i else str(round(v, cls.FLOAT_NDIGITS))
+            for v, i in zip(values.tolist(), is_int.tolist())
+        ]
+
+    def write(self, fp):
+        # The same format and order as Arpa.write()
+        fp.write("\n\\data\\\n")
+        for order, count in self.counts():
+            fp.write("ngram {}={}\n".format(order, count))
+        fp.write("\n")
+        for order, _ in self.counts():
+            fp.write("\\{}-grams:\n".format(order))
+            if order == 1:
+                rows = np.argsort(self.pos[0])
+            else:
+                ctx_rank = self.ctx_rank[order - 2][self.ctx[order - 1]]
+                rows = np.lexsort((self.pos[order - 1], ctx_rank))
+            ngrams = [
+                " ".join(self.vocab[w] for w in ngram)
+                for ngram in self.ngram_words(order, rows).tolist()
+            ]
+            log_p = self._format(
+                self.log_p[order - 1][rows], self.p_is_int[order - 1][rows]
+            )
+            log_bo = self.log_bo[order - 1][rows]
+            has_bo = ~np.isnan(log_bo)
+            log_bo = self._format(
+                np.nan_to_num(log_bo), self.bo_is_int[order - 1][rows]
+            )
+            for p, ngram, b, h in zip(log_p, ngrams, log_bo, has_bo.tolist()):
+                if h:
+                    fp.write("{}\t{}\t{}\n".format(p, ngram, b))
+                else:
+                    fp.write("{}\t{}\n".format(p, ngram))
+            fp.write("\n")
+        fp.write("\\end\\\n")
+
+    def dumpf(self, path, encoding=None):
+        """Write it to path in ARPA format (.arpa, .gz)."""
+        path = str(path)
+        if path.endswith(".gz"):
+            with gzip.open(path, mode="wt", encoding=encoding) as f:
+                self.write(f)
+        else:
+            with open(path, mode="wt", encoding=encoding) as f:
+                self.write(f)
+
+
+# The LM pruned by prune_arrays(), shared with the worker processes
+_array_lm = None
+
+
+def _perp_change_worker(a):
+    return _array_lm.perp_change(*a)
+
+
+def prune_arrays(lm, threshold, minorder, num_jobs=1):
+    """The same as prune(), for an ArrayArpa. All n-grams of an order are
+    processed at once; with num_jobs > 1, the contexts are split over
+    processes."""
+    global _array_lm
+
+    for i in range(lm.order(), max(minorder - 1, 1), -1):
+        logging.info("processing %d-grams ..." % i)
+        size = lm.keys[i - 1].size
+
+        # split at context boundaries
+        boundaries = [0]
+        for j in range(1, num_jobs):
+            b = int(np.searchsorted(lm.ctx[i - 1], lm.ctx[i - 1][size * j // num_jobs]))
+            if boundaries[-1] < b < size:
+                boundaries.append(b)
+        boundaries.append(size)
+        chunks = [(i, s, e) for s, e in zip(boundaries[:-1], boundaries[1:]) if e > s]
+
+        if num_jobs > 1 and len(chunks) > 1:
+            _array_lm = lm
+            with multiprocessing.get_context("fork").Pool(num_jobs) as pool:
+                perp_change = np.concatenate(pool.map(_perp_change_worker, chunks))
+            _array_lm = None
+        else:
+            perp_change = np.concatenate(
+                [lm.perp_change(*c) for c in chunks] + [np.zeros(0)]
+            )
+
+        pruned = (threshold > 0) & (perp_change < threshold)
+        # Make sure we don't prune ngrams whose backoff nodes are needed
+        if i < lm.order():
+            pruned &= np.bincount(lm.ctx[i], minlength=size) == 0
+
+        logging.info("pruned %d %d-grams" % (pruned.sum(), i))
+        lm.remove(i, ~pruned)
+
+    # recompute backoff weights, from low- to high-order
+    for i in range(max(minorder - 1, 1) + 1, lm.order() + 1):
+        lm.recompute_log_bo(i - 1)
+
+    # update counts
+    lm.update_counts()
+
+
 if __name__ == "__main__":
     # load an arpa file
     logging.info("Loading the arpa file from %s" % args.lm)
     parser = ArpaParser()
-    models = parser.loadf(args.lm, encoding=default_encoding)
-    lm = models[0]  # ARPA files may contain several models.
+    if args.engine == "python":
+        models = parser.loadf(args.lm, encoding=default_encoding)
+        lm = models[0]  # ARPA files may contain several models.
+    elif os.path.isdir(args.lm):
+        lm = ArrayArpa.load_arrays(args.lm)
+    else:
+        lm = ArrayArpa.loadf(args.lm, encoding=default_encoding)
+    if args.engine == "numpy" and args.save_lm_arrays is not None:
+        logging.info("Saving the arrays of the LM to %s" % args.save_lm_arrays)
+        lm.save(args.save_lm_arrays)
     logging.info("Stats before pruning:")
     for i, cnt in lm.counts():
         logging.info("ngram %d=%d" % (i, cnt))
 
     # prune it, the language model will be modified in-place
     logging.info("Start pruning the model with threshold=%.3E..." % args.threshold)
-    prune(lm, args.threshold, args.minorder)
+    if args.engine == "python":
+        prune(lm, args.threshold, args.minorder)
+    else:
+        prune_arrays(lm, args.threshold, args.minorder, num_jobs=args.num_jobs)
 
     # validate_lm(lm)
 
@@ -626,5 +1101,8 @@ if __name__ == "__main__":
     for i, cnt in lm.counts():
         logging.info("ngram %d=%d" % (i, cnt))
     logging.info("Saving the pruned arpa file to %s" % args.write_lm)
-    parser.dumpf(lm, args.write_lm, encoding=default_encoding)
+    if args.engine == "python":
+        parser.dumpf(lm, args.write_lm, encoding=default_encoding)
+    else:
+        lm.dumpf(args.write_lm, encoding=default_encoding)
     logging.info("Done.")
@@ -123,7 +123,9 @@ def get_parser():
         "--lm-data",
         type=str,
         default="data/lm_training_bpe_500/sorted_lm_data.pt",
-        help="LM training data",
+        help="""LM training data. It can also be a directory generated
+        by ./local/pack_lm_training_data.py, which is memory-mapped
+        and batched by --max-tokens""",
     )
 
     parser.add_argument(
@@ -133,6 +135,24 @@ def get_parser():
         help="LM validation data",
     )
 
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=50000,
+        help="""Maximum number of tokens in a batch, including padding.
+        Used only if --lm-data is a directory of packed LM data""",
+    )
+
+    parser.add_argument(
+        "--concat-sentences",
+        type=str2bool,
+        default=False,
+        help="""Used only if --lm-data is a directory of packed LM data.
+        If True, concatenate sentences with EOS between them and cut
+        them into rows of params.max_sent_len tokens, so that there is
+        (almost) no padding""",
+    )
+
     parser.add_argument(
         "--vocab-size",
         type=int,
@@ -560,7 +580,10 @@ def run(rank, world_size, args):
 
     # Note: No learning rate scheduler is used here
     for epoch in range(params.start_epoch, params.num_epochs):
-        if is_distributed:
+        if hasattr(train_dl.batch_sampler, "set_epoch"):
+            # packed LM data
+            train_dl.batch_sampler.set_epoch(epoch)
+        elif is_distributed:
             train_dl.sampler.set_epoch(epoch)
 
         params.cur_epoch = epoch
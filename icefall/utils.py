@@ -23,7 +23,6 @@ import json
 import logging
 import os
 import pathlib
-import random
 import re
 import subprocess
 from collections import defaultdict
@@ -41,12 +40,14 @@ import sentencepiece as spm
 import torch
 import torch.distributed as dist
 import torch.nn as nn
-from lhotse.dataset.signal_transforms import time_warp as time_warp_impl
 from pypinyin import lazy_pinyin, pinyin
 from pypinyin.contrib.tone_convert import to_finals, to_finals_tone, to_initials
 from torch.utils.tensorboard import SummaryWriter
 
+from icefall.ali import AlignmentStore, is_alignment_store
 from icefall.checkpoint import average_checkpoints
+from icefall.dataset.spec_augment import batched_time_warp
+from icefall.error_stats import compute_error_stats
 
 Pathlike = Union[str, Path]
 
@@ -498,13 +499,20 @@ def load_alignments(filename: str) -> Tuple[int, Dict[str, List[int]]]:
       filename:
         Path to the file containing alignment information.
         The file should be saved by :func:`save_alignments`.
+        It can also be a directory written by
+        :class:`icefall.ali.AlignmentWriter`.
     Returns:
       Return a tuple containing:
         - subsampling_factor: The subsampling_factor used to compute
           the alignments.
         - alignments: A dict containing utterances and their corresponding
-          framewise alignment, after subsampling.
+          framewise alignment, after subsampling. If `filename` is a
+          directory, it is a read-only :class:`icefall.ali.AlignmentStore`.
     """
+    if is_alignment_store(filename):
+        store = AlignmentStore(filename)
+        return store.subsampling_factor, store
+
     ali_dict = torch.load(filename)
     subsampling_factor = ali_dict["subsampling_factor"]
     alignments = ali_dict["alignments"]
@@ -591,6 +599,7 @@ def write_error_stats(
     enable_log: bool = True,
     compute_CER: bool = False,
     sclite_mode: bool = False,
+    num_jobs: int = 1,
 ) -> float:
     """Write statistics based on predicted results and reference transcripts.
 
@@ -623,19 +632,12 @@ def write_error_stats(
       enable_log:
         If True, also print detailed WER to the console.
         Otherwise, it is written only to the given file.
+      num_jobs:
+        Number of processes used to align the results. The output does
+        not depend on it. See :func:`icefall.error_stats.compute_error_stats`.
     Returns:
-      Return None.
+      Return the WER in percent.
     """
-    subs: Dict[Tuple[str, str], int] = defaultdict(int)
-    ins: Dict[str, int] = defaultdict(int)
-    dels: Dict[str, int] = defaultdict(int)
-
-    # `words` stores counts per word, as follows:
-    #   corr, ref_sub, hyp_sub, ins, dels
-    words: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0, 0, 0])
-    num_corr = 0
-    ERR = "*"
-
     if compute_CER:
         for i, res in enumerate(results):
             cut_id, ref, hyp = res
@@ -643,116 +645,8 @@ def write_error_stats(
             hyp = list("".join(hyp))
             results[i] = (cut_id, ref, hyp)
 
-    for cut_id, ref, hyp in results:
-        ali = kaldialign.align(ref, hyp, ERR, sclite_mode=sclite_mode)
-        for ref_word, hyp_word in ali:
-            if ref_word == ERR:
-                ins[hyp_word] += 1
-                words[hyp_word][3] += 1
-            elif hyp_word == ERR:
-                dels[ref_word] += 1
-                words[ref_word][4] += 1
-            elif hyp_word != ref_word:
-                subs[(ref_word, hyp_word)] += 1
-                words[ref_word][1] += 1
-                words[hyp_word][2] += 1
-            else:
-                words[ref_word][0] += 1
-                num_corr += 1
-    ref_len = sum([len(r) for _, r, _ in results])
-    sub_errs = sum(subs.values())
-    ins_errs = sum(ins.values())
-    del_errs = sum(dels.values())
-    tot_errs = sub_errs + ins_errs + del_errs
-    tot_err_rate = "%.2f" % (100.0 * tot_errs / ref_len)
-
-    if enable_log:
-        logging.info(
-            f"[{test_set_name}] %WER {tot_errs / ref_len:.2%} "
-            f"[{tot_errs} / {ref_len}, {ins_errs} ins, "
-            f"{del_errs} del, {sub_errs} sub ]"
-        )
-
-    print(f"%WER = {tot_err_rate}", file=f)
-    print(
-        f"Errors: {ins_errs} insertions, {del_errs} deletions, "
-        f"{sub_errs} substitutions, over {ref_len} reference "
-        f"words ({num_corr} correct)",
-        file=f,
-    )
-    print(
-        "Search below for sections starting with PER-UTT DETAILS:, "
-        "SUBSTITUTIONS:, DELETIONS:, INSERTIONS:, PER-WORD STATS:",
-        file=f,
-    )
-
-    print("", file=f)
-    print("PER-UTT DETAILS: corr or (ref->hyp)  ", file=f)
-    for cut_id, ref, hyp in results:
-        ali = kaldialign.align(ref, hyp, ERR)
-        combine_successive_errors = True
-        if combine_successive_errors:
-            ali = [[[x], [y]] for x, y in ali]
-            for i in range(len(ali) - 1):
-                if ali[i][0] != ali[i][1] and ali[i + 1][0] != ali[i + 1][1]:
-                    ali[i + 1][0] = ali[i][0] + ali[i + 1][0]
-                    ali[i + 1][1] = ali[i][1] + ali[i + 1][1]
-                    ali[i] = [[], []]
-            ali = [
-                [
-                    list(filter(lambda a: a != ERR, x)),
-                    list(filter(lambda a: a != ERR, y)),
-                ]
-                for x, y in ali
-            ]
-            ali = list(filter(lambda x: x != [[], []], ali))
-            ali = [
-                [
-                    ERR if x == [] else " ".join(x),
-                    ERR if y == [] else " ".join(y),
-                ]
-                for x, y in ali
-            ]
-
-        print(
-            f"{cut_id}:\t"
-            + " ".join(
-                (
-                    ref_word if ref_word == hyp_word else f"({ref_word}->{hyp_word})"
-                    for ref_word, hyp_word in ali
-                )
-            ),
-            file=f,
-        )
-
-    print("", file=f)
-    print("SUBSTITUTIONS: count ref -> hyp", file=f)
-
-    for count, (ref, hyp) in sorted([(v, k) for k, v in subs.items()], reverse=True):
-        print(f"{count}   {ref} -> {hyp}", file=f)
-
-    print("", file=f)
-    print("DELETIONS: count ref", file=f)
-    for count, ref in sorted([(v, k) for k, v in dels.items()], reverse=True):
-        print(f"{count}   {ref}", file=f)
-
-    print("", file=f)
-    print("INSERTIONS: count hyp", file=f)
-    for count, hyp in sorted([(v, k) for k, v in ins.items()], reverse=True):
-        print(f"{count}   {hyp}", file=f)
-
-    print("", file=f)
-    print("PER-WORD STATS: word  corr tot_errs count_in_ref count_in_hyp", file=f)
-    for _, word, counts in sorted(
-        [(sum(v[1:]), k, v) for k, v in words.items()], reverse=True
-    ):
-        (corr, ref_sub, hyp_sub, ins, dels) = counts
-        tot_errs = ref_sub + hyp_sub + ins + dels
-        ref_count = corr + ref_sub + dels
-        hyp_count = corr + hyp_sub + ins
-
-        print(f"{word}   {corr} {tot_errs} {ref_count} {hyp_count}", file=f)
-    return float(tot_err_rate)
+    stats = compute_error_stats(results, sclite_mode=sclite_mode, num_jobs=num_jobs)
+    return stats.write(f, test_set_name, enable_log=enable_log)
 
 
 def write_error_stats_with_timestamps(
@@ -769,6 +663,7 @@ def write_error_stats_with_timestamps(
     ],
     enable_log: bool = True,
     with_end_time: bool = False,
+    num_jobs: int = 1,
 ) -> Tuple[float, Union[float, Tuple[float, float]], Union[float, Tuple[float, float]]]:
     """Write statistics based on predicted results and reference transcripts
     as well as their timestamps.
@@ -804,196 +699,28 @@ def write_error_stats_with_timestamps(
         Otherwise, it is written only to the given file.
       with_end_time:
         Whether use end timestamps.
+      num_jobs:
+        Number of processes used to align the results.
 
     Returns:
       Return total word error rate and mean delay.
     """
-    subs: Dict[Tuple[str, str], int] = defaultdict(int)
-    ins: Dict[str, int] = defaultdict(int)
-    dels: Dict[str, int] = defaultdict(int)
-
-    # `words` stores counts per word, as follows:
-    #   corr, ref_sub, hyp_sub, ins, dels
-    words: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0, 0, 0])
-    num_corr = 0
-    ERR = "*"
-    # Compute mean alignment delay on the correct words
-    all_delay = []
-    for cut_id, ref, hyp, time_ref, time_hyp in results:
-        ali = kaldialign.align(ref, hyp, ERR)
-        has_time = len(time_ref) > 0 and len(time_hyp) > 0
-        if has_time:
-            # pointer to timestamp_hyp
-            p_hyp = 0
-            # pointer to timestamp_ref
-            p_ref = 0
-        for ref_word, hyp_word in ali:
-            if ref_word == ERR:
-                ins[hyp_word] += 1
-                words[hyp_word][3] += 1
-                if has_time:
-                    p_hyp += 1
-            elif hyp_word == ERR:
-                dels[ref_word] += 1
-                words[ref_word][4] += 1
-                if has_time:
-                    p_ref += 1
-            elif hyp_word != ref_word:
-                subs[(ref_word, hyp_word)] += 1
-                words[ref_word][1] += 1
-                words[hyp_word][2] += 1
-                if has_time:
-                    p_hyp += 1
-                    p_ref += 1
-            else:
-                words[ref_word][0] += 1
-                num_corr += 1
-                if has_time:
-                    if with_end_time:
-                        all_delay.append(
-                            (
-                                time_hyp[p_hyp][0] - time_ref[p_ref][0],
-                                time_hyp[p_hyp][1] - time_ref[p_ref][1],
-                            )
-                        )
-                    else:
-                        all_delay.append(time_hyp[p_hyp] - time_ref[p_ref])
-                    p_hyp += 1
-                    p_ref += 1
-        if has_time:
-            assert p_hyp == len(hyp), (p_hyp, len(hyp))
-            assert p_ref == len(ref), (p_ref, len(ref))
-
-    ref_len = sum([len(r) for _, r, _, _, _ in results])
-    sub_errs = sum(subs.values())
-    ins_errs = sum(ins.values())
-    del_errs = sum(dels.values())
-    tot_errs = sub_errs + ins_errs + del_errs
-    tot_err_rate = float("%.2f" % (100.0 * tot_errs / ref_len))
-
-    if with_end_time:
-        mean_delay = (float("inf"), float("inf"))
-        var_delay = (float("inf"), float("inf"))
-    else:
-        mean_delay = float("inf")
-        var_delay = float("inf")
-    num_delay = len(all_delay)
-    if num_delay > 0:
-        if with_end_time:
-            all_delay_start = [i[0] for i in all_delay]
-            mean_delay_start = sum(all_delay_start) / num_delay
-            var_delay_start = (
-                sum([(i - mean_delay_start) ** 2 for i in all_delay_start]) / num_delay
-            )
-
-            all_delay_end = [i[1] for i in all_delay]
-            mean_delay_end = sum(all_delay_end) / num_delay
-            var_delay_end = (
-                sum([(i - mean_delay_end) ** 2 for i in all_delay_end]) / num_delay
-            )
-
-            mean_delay = (
-                float("%.3f" % mean_delay_start),
-                float("%.3f" % mean_delay_end),
-            )
-            var_delay = (float("%.3f" % var_delay_start), float("%.3f" % var_delay_end))
-        else:
-            mean_delay = sum(all_delay) / num_delay
-            var_delay = sum([(i - mean_delay) ** 2 for i in all_delay]) / num_delay
-            mean_delay = float("%.3f" % mean_delay)
-            var_delay = float("%.3f" % var_delay)
+    stats = compute_error_stats(results, with_end_time=with_end_time, num_jobs=num_jobs)
+    mean_delay, var_delay = stats.delay_stats()
 
     if enable_log:
         logging.info(
-            f"[{test_set_name}] %WER {tot_errs / ref_len:.2%} "
-            f"[{tot_errs} / {ref_len}, {ins_errs} ins, "
-            f"{del_errs} del, {sub_errs} sub ]"
+            f"[{test_set_name}] %WER {stats.tot_errs / stats.ref_len:.2%} "
+            f"[{stats.tot_errs} / {stats.ref_len}, {stats.ins_errs} ins, "
+            f"{stats.del_errs} del, {stats.sub_errs} sub ]"
         )
         logging.info(
             f"[{test_set_name}] %symbol-delay mean (s): "
             f"{mean_delay}, variance: {var_delay} "  # noqa
-            f"computed on {num_delay} correct words"
+            f"computed on {len(stats.delays)} correct words"
         )
 
-    print(f"%WER = {tot_err_rate}", file=f)
-    print(
-        f"Errors: {ins_errs} insertions, {del_errs} deletions, "
-        f"{sub_errs} substitutions, over {ref_len} reference "
-        f"words ({num_corr} correct)",
-        file=f,
-    )
-    print(
-        "Search below for sections starting with PER-UTT DETAILS:, "
-        "SUBSTITUTIONS:, DELETIONS:, INSERTIONS:, PER-WORD STATS:",
-        file=f,
-    )
-
-    print("", file=f)
-    print("PER-UTT DETAILS: corr or (ref->hyp)  ", file=f)
-    for cut_id, ref, hyp, _, _ in results:
-        ali = kaldialign.align(ref, hyp, ERR)
-        combine_successive_errors = True
-        if combine_successive_errors:
-            ali = [[[x], [y]] for x, y in ali]
-            for i in range(len(ali) - 1):
-                if ali[i][0] != ali[i][1] and ali[i + 1][0] != ali[i + 1][1]:
-                    ali[i + 1][0] = ali[i][0] + ali[i + 1][0]
-                    ali[i + 1][1] = ali[i][1] + ali[i + 1][1]
-                    ali[i] = [[], []]
-            ali = [
-                [
-                    list(filter(lambda a: a != ERR, x)),
-                    list(filter(lambda a: a != ERR, y)),
-                ]
-                for x, y in ali
-            ]
-            ali = list(filter(lambda x: x != [[], []], ali))
-            ali = [
-                [
-                    ERR if x == [] else " ".join(x),
-                    ERR if y == [] else " ".join(y),
-                ]
-                for x, y in ali
-            ]
-
-        print(
-            f"{cut_id}:\t"
-            + " ".join(
-                (
-                    ref_word if ref_word == hyp_word else f"({ref_word}->{hyp_word})"
-                    for ref_word, hyp_word in ali
-                )
-            ),
-            file=f,
-        )
-
-    print("", file=f)
-    print("SUBSTITUTIONS: count ref -> hyp", file=f)
-
-    for count, (ref, hyp) in sorted([(v, k) for k, v in subs.items()], reverse=True):
-        print(f"{count}   {ref} -> {hyp}", file=f)
-
-    print("", file=f)
-    print("DELETIONS: count ref", file=f)
-    for count, ref in sorted([(v, k) for k, v in dels.items()], reverse=True):
-        print(f"{count}   {ref}", file=f)
-
-    print("", file=f)
-    print("INSERTIONS: count hyp", file=f)
-    for count, hyp in sorted([(v, k) for k, v in ins.items()], reverse=True):
-        print(f"{count}   {hyp}", file=f)
-
-    print("", file=f)
-    print("PER-WORD STATS: word  corr tot_errs count_in_ref count_in_hyp", file=f)
-    for _, word, counts in sorted(
-        [(sum(v[1:]), k, v) for k, v in words.items()], reverse=True
-    ):
-        (corr, ref_sub, hyp_sub, ins, dels) = counts
-        tot_errs = ref_sub + hyp_sub + ins + dels
-        ref_count = corr + ref_sub + dels
-        hyp_count = corr + hyp_sub + ins
-
-        print(f"{word}   {corr} {tot_errs} {ref_count} {hyp_count}", file=f)
+    tot_err_rate = stats.write(f, test_set_name, enable_log=False)
     return float(tot_err_rate), float(mean_delay), float(var_delay)
 
 
@@ -2310,38 +2037,22 @@ def num_tokens(
     return num_tokens
 
 
-# Based on https://github.com/lhotse-speech/lhotse/blob/master/lhotse/dataset/signal_transforms.py
 def time_warp(
     features: torch.Tensor,
     p: float = 0.9,
     time_warp_factor: Optional[int] = 80,
     supervision_segments: Optional[torch.Tensor] = None,
 ):
-    """Apply time warping on a batch of features"""
-    if time_warp_factor is None or time_warp_factor < 1:
-        return features
-    assert (
-        len(features.shape) == 3
-    ), f"SpecAugment only supports batches of single-channel feature matrices. {features.shape}"
-    features = features.clone()
-    if supervision_segments is None:
-        # No supervisions - apply spec augment to full feature matrices.
-        for sequence_idx in range(features.size(0)):
-            if random.random() > p:
-                # Randomly choose whether this transform is applied
-                continue
-            features[sequence_idx] = time_warp_impl(
-                features[sequence_idx], factor=time_warp_factor
-            )
-    else:
-        # Supervisions provided - we will apply time warping only on the supervised areas.
-        for sequence_idx, start_frame, num_frames in supervision_segments:
-            if random.random() > p:
-                # Randomly choose whether this transform is applied
-                continue
-            end_frame = start_frame + num_frames
-            features[sequence_idx, start_frame:end_frame] = time_warp_impl(
-                features[sequence_idx, start_frame:end_frame], factor=time_warp_factor
-            )
+    """Apply time warping on a batch of features.
 
-    return features
+    If supervision_segments is given, only the supervised areas are warped.
+    Overlapping segments are warped one after another; the others are
+    warped at once, see
+    :func:`icefall.dataset.spec_augment.batched_time_warp`.
+    """
+    return batched_time_warp(
+        features,
+        p=p,
+        time_warp_factor=time_warp_factor,
+        supervision_segments=supervision_segments,
+    )
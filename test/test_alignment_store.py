@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from icefall.ali import (
+    AlignmentStore,
+    AlignmentWriter,
+    convert_alignments,
+    convert_alignments_to_tensor,
+    finalize_alignment_store,
+    load_alignments,
+    lookup_alignments,
+    save_alignments,
+)
+
+
+def get_alignments():
+    rng = np.random.default_rng(0)
+    return {
+        f"cut-{i}": rng.integers(0, 500, size=rng.integers(0, 50)).tolist()
+        for i in range(100)
+    }
+
+
+def test_convert_alignments():
+    alignments = get_alignments()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "ali.pt"
+        save_alignments(alignments, subsampling_factor=4, filename=filename)
+        convert_alignments(filename, Path(tmp_dir) / "ali")
+
+        subsampling_factor, store = load_alignments(Path(tmp_dir) / "ali")
+        assert isinstance(store, AlignmentStore)
+        assert subsampling_factor == 4
+        assert store.dtype == np.int16
+        assert len(store) == len(alignments)
+        assert sorted(store.keys()) == sorted(alignments.keys())
+        for cut_id, ali in alignments.items():
+            assert store[cut_id].tolist() == ali, cut_id
+        assert "cut-100" not in store
+        assert store.get("cut-100") is None
+
+        # The memory maps are re-opened after unpickling
+        store = pickle.loads(pickle.dumps(store))
+        assert store._index is None
+        assert store["cut-3"].tolist() == alignments["cut-3"]
+
+        cut_ids = ["cut-5", "cut-1", "cut-7"]
+        expected = lookup_alignments(
+            cut_ids,
+            convert_alignments_to_tensor(alignments, torch.device("cpu")),
+            num_classes=500,
+        )
+        mask = lookup_alignments(
+            cut_ids,
+            convert_alignments_to_tensor(store, torch.device("cpu")),
+            num_classes=500,
+        )
+        assert torch.equal(mask, expected)
+
+
+def test_sharded_writing():
+    alignments = get_alignments()
+    items = list(alignments.items())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for shard in range(3):
+            with AlignmentWriter(tmp_dir, subsampling_factor=4, shard=shard) as w:
+                for cut_id, ali in items[shard::3]:
+                    w.write(cut_id, torch.tensor(ali))
+
+        # An incomplete shard is ignored
+        w = AlignmentWriter(tmp_dir, subsampling_factor=4, shard=3)
+        w.write("cut-1000", [1, 2, 3])
+
+        finalize_alignment_store(tmp_dir)
+        store = AlignmentStore(tmp_dir)
+        assert store.dtype == np.int32
+        assert len(store) == len(alignments)
+        for cut_id, ali in alignments.items():
+            assert store[cut_id].tolist() == ali, cut_id
+        assert "cut-1000" not in store
+
+
+def main():
+    test_convert_alignments()
+    test_sharded_writing()
+
+
+if __name__ == "__main__":
+    main()
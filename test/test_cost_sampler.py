@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from lhotse import CutSet
+from lhotse.testing.dummies import dummy_cut, dummy_supervision
+
+from icefall.dataset.sampling import CostBucketingSampler, CostConstraint
+
+
+def get_cuts(n: int = 500) -> CutSet:
+    rng = random.Random(0)
+    cuts = []
+    for i in range(n):
+        duration = rng.uniform(1.0, 20.0)
+        c = dummy_cut(i, duration=duration)
+        c.supervisions = [
+            dummy_supervision(
+                i, duration=duration, text=" ".join(["a"] * int(duration))
+            )
+        ]
+        cuts.append(c)
+    return CutSet.from_cuts(cuts)
+
+
+def test_cost_constraint():
+    constraint = CostConstraint(
+        max_cost=100, duration_scale=1.0, quadratic_scale=0.1, token_scale=0.5
+    )
+    c = dummy_cut(0, duration=10.0)
+    c.supervisions = [dummy_supervision(0, duration=10.0, text="a b c d")]
+    assert abs(constraint.measure_length(c) - (10 + 10 + 2)) < 1e-6
+
+    for _ in range(4):
+        constraint.add(c)
+    # 4 * 22 <= 100 < 5 * 22
+    assert not constraint.exceeded()
+    assert constraint.close_to_exceeding()
+    constraint.add(c)
+    assert constraint.exceeded()
+
+    constraint.reset()
+    assert not constraint.exceeded()
+
+
+def test_cost_bucketing_sampler():
+    cuts = get_cuts()
+    max_cost = 200.0
+    constraint = CostConstraint(max_cost=max_cost, quadratic_scale=1 / 10)
+    sampler = CostBucketingSampler(
+        cuts, constraint=constraint, num_buckets=5, shuffle=True
+    )
+
+    num_cuts = 0
+    for batch in sampler:
+        costs = [constraint.measure_length(c) for c in batch]
+        # Like max_duration, the last cut of a batch may exceed the budget
+        assert (len(costs) - 1) * max(costs) <= max_cost
+        num_cuts += len(batch)
+    assert num_cuts == len(cuts)
+
+    stats = sampler.cost_stats
+    print(stats)
+    assert stats.num_batches > 0
+    mean, std, max_batch_cost = stats.summary()
+    assert max_cost / 2 < mean <= max_cost * 1.2, mean
+
+
+def test_cost_bucketing_sampler_state_dict():
+    cuts = get_cuts()
+    constraint = CostConstraint(max_cost=200.0, quadratic_scale=1 / 10)
+    sampler = CostBucketingSampler(
+        cuts, constraint=constraint, num_buckets=5, shuffle=True
+    )
+    batches = []
+    for i, batch in enumerate(sampler):
+        batches.append(batch)
+        if i == 4:
+            sd = sampler.state_dict()
+        if i == 9:
+            break
+
+    restored = CostBucketingSampler(
+        cuts,
+        constraint=CostConstraint(max_cost=200.0, quadratic_scale=1 / 10),
+        num_buckets=5,
+        shuffle=True,
+    )
+    restored.load_state_dict(sd)
+    assert restored.constraint == constraint
+    for i, batch in enumerate(restored):
+        assert [c.id for c in batch] == [c.id for c in batches[5 + i]]
+        if 5 + i == 9:
+            break
+
+
+def main():
+    test_cost_constraint()
+    test_cost_bucketing_sampler()
+    test_cost_bucketing_sampler_state_dict()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import random
+
+from icefall.error_stats import ErrorStats, compute_error_stats
+
+
+def get_results(num_utts: int, seed: int = 0):
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(30)]
+    results = []
+    for i in range(num_utts):
+        ref = [rng.choice(vocab) for _ in range(rng.randint(1, 10))]
+        hyp = [w for w in ref if rng.random() > 0.1]
+        hyp = [rng.choice(vocab) if rng.random() < 0.1 else w for w in hyp]
+        if rng.random() < 0.2:
+            hyp.insert(rng.randint(0, len(hyp)), rng.choice(vocab))
+        results.append((f"utt-{i}", ref, hyp))
+    return results
+
+
+def test_write():
+    results = [
+        (
+            "a",
+            "THE ASSOCIATION OF EDISON".split(),
+            "THE ASSOCIATION OF ADDISON".split(),
+        ),
+        ("b", "FOR THE FIRST DAY SIR".split(), "FOR THE FIRST DAY".split()),
+    ]
+    f = io.StringIO()
+    wer = ErrorStats().update(results).write(f, "test", enable_log=False)
+    assert wer == 22.22, wer
+
+    lines = f.getvalue().split("\n")
+    assert lines[0] == "%WER = 22.22"
+    assert lines[1] == (
+        "Errors: 0 insertions, 1 deletions, 1 substitutions, "
+        "over 9 reference words (7 correct)"
+    )
+    assert "a:\tTHE ASSOCIATION OF (EDISON->ADDISON)" in lines
+    assert "b:\tFOR THE FIRST DAY (SIR->*)" in lines
+    assert "1   EDISON -> ADDISON" in lines
+    assert "THE   2 0 2 2" in lines
+
+
+def test_merge():
+    results = get_results(1000)
+    expected = io.StringIO()
+    ErrorStats().update(results).write(expected, "test", enable_log=False)
+
+    stats = ErrorStats()
+    for i in range(0, len(results), 64):
+        stats += ErrorStats().update(results[i : i + 64])
+    f = io.StringIO()
+    stats.write(f, "test", enable_log=False)
+    assert f.getvalue() == expected.getvalue()
+
+
+def test_compute_error_stats_parallel():
+    results = get_results(500, seed=1)
+    expected = io.StringIO()
+    ErrorStats().update(results).write(expected, "test", enable_log=False)
+
+    stats = compute_error_stats(results, num_jobs=2, chunk_size=100)
+    f = io.StringIO()
+    stats.write(f, "test", enable_log=False)
+    assert f.getvalue() == expected.getvalue()
+    assert stats.num_utts == len(results)
+
+
+def test_running_wer():
+    results = get_results(100, seed=2)
+    stats = ErrorStats(keep_details=False)
+    assert str(stats) == "%WER n/a [0 utterances]"
+    stats.update(results)
+    assert stats.details == []
+    assert stats.tot_err_rate == ErrorStats().update(results).tot_err_rate
+    assert "100 utterances" in str(stats)
+
+
+def test_delays():
+    results = [
+        ("a", ["x", "y", "z"], ["x", "z"], [0.0, 1.0, 2.0], [0.5, 2.25]),
+        ("b", ["x"], ["x"], [], []),
+    ]
+    stats = ErrorStats().update(results)
+    assert stats.delays == [0.5, 0.25]
+    assert stats.delay_stats() == (0.375, 0.016)
+
+    results = [("a", ["x"], ["x"], [(0.0, 1.0)], [(0.5, 1.5)])]
+    stats = ErrorStats(with_end_time=True).update(results)
+    assert stats.delay_stats() == ((0.5, 0.5), (0.0, 0.0))
+
+
+def main():
+    test_write()
+    test_merge()
+    test_compute_error_stats_parallel()
+    test_running_wer()
+    test_delays()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+import soundfile as sf
+from lhotse import CutSet, Fbank, FbankConfig, Recording
+
+from icefall.feature_extraction import compute_features_resumable
+
+
+def make_cuts(num_cuts: int, audio_dir: Path) -> CutSet:
+    rng = np.random.default_rng(0)
+    recordings = []
+    for i in range(num_cuts):
+        audio = rng.standard_normal(1600 * (i + 1)).astype(np.float32) * 0.1
+        filename = audio_dir / f"rec-{i}.wav"
+        sf.write(filename, audio, 16000)
+        recordings.append(Recording.from_file(filename))
+    return CutSet.from_manifests(recordings=recordings)
+
+
+def test_compute_features_resumable():
+    extractor = Fbank(FbankConfig(num_mel_bins=80))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        cuts = make_cuts(7, tmp_dir)
+        storage_dir = tmp_dir / "feats"
+        output = tmp_dir / "cuts.jsonl.gz"
+
+        out = compute_features_resumable(
+            cuts,
+            extractor=extractor,
+            storage_dir=storage_dir,
+            output_cuts=output,
+            unit_size=3,
+            num_workers=2,
+        )
+        assert list(out.ids) == list(cuts.ids)
+        for c, expected in zip(out, cuts):
+            # lilcom compression is lossy
+            np.testing.assert_allclose(
+                c.load_features(), expected.compute_features(extractor), atol=0.1
+            )
+        assert len(list(storage_dir.glob("cuts.*.jsonl.gz"))) == 3
+
+        # Simulate a crash before the last unit was finished
+        output.unlink()
+        (storage_dir / "cuts.000002.jsonl.gz").unlink()
+        mtime = (storage_dir / "feats.000000.lca").stat().st_mtime_ns
+
+        out = compute_features_resumable(
+            cuts,
+            extractor=extractor,
+            storage_dir=storage_dir,
+            output_cuts=output,
+            unit_size=3,
+            num_workers=2,
+        )
+        assert list(out.ids) == list(cuts.ids)
+        assert (storage_dir / "feats.000000.lca").stat().st_mtime_ns == mtime
+        assert all(c.has_features for c in out)
+
+        output.unlink()
+        with pytest.raises(ValueError):
+            compute_features_resumable(
+                cuts,
+                extractor=extractor,
+                storage_dir=storage_dir,
+                output_cuts=output,
+                unit_size=4,
+            )
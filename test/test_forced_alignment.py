@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import tempfile
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+from lhotse import CutSet, MonoCut, Recording, SupervisionSegment
+from lhotse.audio import AudioSource
+
+from icefall.forced_alignment import (
+    CtcForcedAligner,
+    align_cuts,
+    ctc_viterbi_align,
+    get_aligned_cut_ids,
+    make_alignment_batches,
+    transducer_viterbi_align,
+)
+
+
+def ctc_path_score(log_probs, path):
+    return sum(log_probs[t, p].item() for t, p in enumerate(path))
+
+
+def collapse(path, blank=0):
+    ans = []
+    prev = None
+    for p in path:
+        if p != prev and p != blank:
+            ans.append(p)
+        prev = p
+    return ans
+
+
+def test_ctc_viterbi_align():
+    torch.manual_seed(0)
+    C = 4
+    targets = [[1, 1], [2, 3, 1], [3], []]
+    T = [5, 6, 4, 3]
+    log_probs = torch.randn(len(T), max(T), C).log_softmax(-1)
+    alignments = ctc_viterbi_align(log_probs, torch.tensor(T), targets)
+
+    for n in range(len(T)):
+        # brute force over all paths
+        best, best_path = float("-inf"), None
+        for path in itertools.product(range(C), repeat=T[n]):
+            if collapse(path) == targets[n]:
+                score = ctc_path_score(log_probs[n], path)
+                if score > best:
+                    best, best_path = score, list(path)
+        assert alignments[n] == best_path, (n, alignments[n], best_path)
+
+    # Too few frames: [1, 1] needs at least 3 frames
+    ali = ctc_viterbi_align(log_probs[:1, :2], torch.tensor([2]), [[1, 1]])
+    assert ali == [None]
+
+
+def test_transducer_viterbi_align():
+    torch.manual_seed(0)
+    N, T, U = 2, 4, 3
+    frame_lens = torch.tensor([4, 3])
+    target_lens = torch.tensor([3, 2])
+    blank = torch.randn(N, T, U + 1)
+    emit = torch.randn(N, T, U)
+    frames = transducer_viterbi_align(blank, emit, frame_lens, target_lens)
+
+    for n in range(N):
+        t_n, u_n = int(frame_lens[n]), int(target_lens[n])
+        best, best_frames = float("-inf"), None
+        # The frames at which the tokens are emitted are non-decreasing
+        for f in itertools.combinations_with_replacement(range(t_n), u_n):
+            score = 0.0
+            u = 0
+            for t in range(t_n):
+                while u < u_n and f[u] == t:
+                    score += emit[n, t, u].item()
+                    u += 1
+                score += blank[n, t, u].item()
+            if score > best:
+                best, best_frames = score, list(f)
+        assert frames[n] == best_frames, (n, frames[n], best_frames)
+
+
+class ToyCtcModel(nn.Module):
+    """Output frame t predicts the token of input frame 4 * t, which is
+    encoded in the sign of the first feature."""
+
+    def __init__(self):
+        super().__init__()
+        self.ctc_output = nn.LogSoftmax(dim=-1)
+
+    def forward_encoder(self, x, x_lens):
+        x = x[:, ::4, :3] * 10
+        return x, (x_lens + 3) // 4
+
+
+def make_aligner():
+    words = {"a": [1], "b": [2], "ab": [1, 2]}
+    return CtcForcedAligner(
+        ToyCtcModel(),
+        encode_words=lambda ws: [words[w] for w in ws],
+        frame_shift=0.04,
+    )
+
+
+def test_make_alignment_batches():
+    cuts = [
+        MonoCut(id=str(i), start=0, duration=d, channel=0)
+        for i, d in enumerate([1.0, 5.0, 2.0, 3.0, 8.0])
+    ]
+    batches = make_alignment_batches(cuts, max_duration=6, sort_chunk_size=3)
+    # Sorted within the chunks [1, 5, 2] and [3, 8]
+    ids = [[c.id for c in b] for b in batches]
+    assert ids == [["1"], ["2", "0"], ["4"], ["3"]], ids
+
+
+def test_align_cuts():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        cuts = []
+        for i in range(5):
+            recording = Recording(
+                id=f"rec-{i}",
+                sources=[AudioSource(type="file", channels=[0], source="none")],
+                sampling_rate=16000,
+                num_samples=16000 * 2,
+                duration=2.0,
+            )
+            cut = MonoCut(
+                id=f"cut-{i}",
+                start=0,
+                duration=2.0,
+                channel=0,
+                recording=recording,
+                supervisions=[
+                    SupervisionSegment(
+                        id=f"sup-{i}",
+                        recording_id=f"rec-{i}",
+                        start=0,
+                        duration=2.0,
+                        text="ab a",
+                    )
+                ],
+            )
+            cuts.append(cut)
+        cuts = CutSet.from_cuts(cuts)
+
+        # 200 feature frames -> 50 output frames
+        features = torch.full((200, 80), -1.0)
+        features[:, 0] = 1  # blank
+        features[40:60, 0], features[40:60, 1] = -1, 1  # a: 0.4 - 0.6s
+        features[80:100, 0], features[80:100, 2] = -1, 1  # b: 0.8 - 1.0s
+        features[120:160, 0], features[120:160, 1] = -1, 1  # a: 1.2 - 1.6s
+
+        from icefall import forced_alignment
+
+        aligner = make_aligner()
+        orig = forced_alignment.OnTheFlyFeatures
+
+        class FakeFeatures:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __call__(self, cuts):
+                n = len(cuts)
+                return features.expand(n, -1, -1), torch.full((n,), 200)
+
+        forced_alignment.OnTheFlyFeatures = FakeFeatures
+        try:
+            output = tmp_dir / "cuts.jsonl"
+            # Pretend an interrupted run wrote a cut and half of another one
+            aligned, _ = aligner.align(list(cuts.subset(first=1)))
+            CutSet.from_cuts(aligned).to_file(output)
+            with open(output, "a") as f:
+                f.write('{"id": "cut-1", ')
+            assert get_aligned_cut_ids(output) == {"cut-0"}
+
+            align_cuts(cuts, make_aligner, output, max_duration=4, num_workers=0)
+        finally:
+            forced_alignment.OnTheFlyFeatures = orig
+
+        aligned = CutSet.from_file(output)
+        assert sorted(aligned.ids) == sorted(cuts.ids)
+        for c in aligned:
+            sup = c.supervisions[0]
+            words = [(a.symbol, a.start, a.end) for a in sup.alignment["word"]]
+            assert words == [("ab", 0.4, 1.0), ("a", 1.2, 1.6)], words
+            tokens = [(a.symbol, a.start, a.end) for a in sup.alignment["token"]]
+            assert tokens == [("1", 0.4, 0.6), ("2", 0.8, 1.0), ("1", 1.2, 1.6)]
+
+
+def main():
+    test_ctc_viterbi_align()
+    test_transducer_viterbi_align()
+    test_make_alignment_batches()
+    test_align_cuts()
+
+
+if __name__ == "__main__":
+    main()
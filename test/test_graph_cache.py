@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+
+import k2
+import torch
+
+from icefall.graph_cache import TrainingGraphCache
+
+
+class CountingCompiler:
+    def __init__(self):
+        self.num_compiled = 0
+
+    def __call__(self, keys):
+        self.num_compiled += len(keys)
+        return k2.ctc_graph(keys, modified=False, device="cpu")
+
+
+def check_equal(a: k2.Fsa, b: k2.Fsa):
+    assert a.shape[0] == b.shape[0], (a.shape, b.shape)
+    for i in range(a.shape[0]):
+        assert str(a[i]) == str(b[i]), i
+        assert torch.equal(a[i].aux_labels, b[i].aux_labels), i
+
+
+def test_graph_cache():
+    compile_fn = CountingCompiler()
+    cache = TrainingGraphCache(max_size=3)
+
+    batch = [[1, 2, 3], [2, 2], [1, 2, 3]]
+    graphs = cache.compile(batch, compile_fn, device="cpu")
+    check_equal(graphs, k2.ctc_graph(batch))
+    # The duplicated utterance is compiled only once
+    assert compile_fn.num_compiled == 2
+    assert cache.num_misses == 2 and cache.num_hits == 1
+
+    batch = [[2, 2], [4], [1, 2, 3]]
+    graphs = cache.compile(batch, compile_fn, device="cpu")
+    check_equal(graphs, k2.ctc_graph(batch))
+    assert compile_fn.num_compiled == 3
+    assert len(cache) == 3
+
+    # [2, 2] is the least recently used one
+    cache.compile([[5]], compile_fn, device="cpu")
+    assert (2, 2) not in cache.graphs
+    assert len(cache) == 3
+    print(cache)
+
+
+def test_graph_cache_on_disk():
+    batch = [[1, 2, 3], [2, 2], [4, 4, 5, 1]]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        compile_fn = CountingCompiler()
+        cache = TrainingGraphCache(max_size=10, cache_dir=cache_dir)
+        cache.compile(batch, compile_fn, device="cpu")
+        assert compile_fn.num_compiled == 3
+
+        # A new cache, e.g., after restarting the training
+        cache = TrainingGraphCache(max_size=10, cache_dir=cache_dir)
+        graphs = cache.compile(batch, compile_fn, device="cpu")
+        check_equal(graphs, k2.ctc_graph(batch))
+        assert compile_fn.num_compiled == 3
+        assert cache.num_disk_hits == 3
+        assert cache.hit_rate == 1.0
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import pickle
+import tempfile
+from pathlib import Path
+
+import pytest
+from lhotse import CutSet, SupervisionSegment
+from lhotse.testing.dummies import dummy_cut
+
+from icefall.manifest_index import (
+    IndexedManifest,
+    convert_to_bgzip,
+    get_index_path,
+    load_cuts_indexed,
+)
+
+
+def make_cuts(num_cuts: int) -> CutSet:
+    return CutSet.from_cuts(
+        dummy_cut(
+            i,
+            supervisions=[
+                SupervisionSegment(
+                    id=f"sup-{i}",
+                    recording_id=f"rec-{i}",
+                    start=0,
+                    duration=1,
+                    text="x" * (i % 300),
+                )
+            ],
+        )
+        for i in range(num_cuts)
+    )
+
+
+def check(index: IndexedManifest, cuts: CutSet):
+    assert len(index) == len(cuts)
+    for i in [0, 1, len(cuts) // 2, len(cuts) - 1]:
+        c = index[cuts[i].id]
+        assert c.to_dict() == cuts[i].to_dict()
+    assert "missing" not in index
+    assert index.get("missing") is None
+    with pytest.raises(KeyError):
+        index["missing"]
+    assert index.item_ids() == list(cuts.ids)
+    assert [c.id for c in index] == list(cuts.ids)
+
+    ids = [cuts[5].id, cuts[2].id]
+    assert [c.id for c in index.get_many(ids)] == ids
+
+    # A copy in a dataloader worker opens the file again
+    index = pickle.loads(pickle.dumps(index))
+    assert index[cuts[7].id].id == cuts[7].id
+
+
+def test_plain_jsonl():
+    cuts = make_cuts(1000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "cuts.jsonl"
+        cuts.to_file(path)
+        check(IndexedManifest(path), cuts)
+        assert get_index_path(path).is_file()
+
+
+def test_gzip():
+    cuts = make_cuts(10000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "cuts.jsonl.gz"
+        cuts.to_file(path)
+        with open(path, "rb") as f:
+            original = gzip.decompress(f.read())
+
+        # A single gzip member
+        with pytest.raises(ValueError):
+            IndexedManifest(path)
+
+        index = IndexedManifest(path, convert_gzip=True)
+        check(index, cuts)
+        # The content is unchanged and is still readable by lhotse
+        with open(path, "rb") as f:
+            assert gzip.decompress(f.read()) == original
+        assert list(CutSet.from_file(path).ids) == list(cuts.ids)
+
+
+def test_outdated_index():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "cuts.jsonl.gz"
+        make_cuts(10).to_file(path)
+        convert_to_bgzip(path, path)
+        assert len(IndexedManifest(path)) == 10
+
+        cuts = make_cuts(20)
+        cuts.to_file(path)
+        convert_to_bgzip(path, path)
+        check(IndexedManifest(path), cuts)
+
+
+def test_load_cuts_indexed_and_join():
+    cuts = make_cuts(100)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "cuts.jsonl"
+        cuts.to_file(path)
+
+        indexed = load_cuts_indexed(path)
+        assert indexed.is_lazy
+        assert indexed[cuts[42].id].id == cuts[42].id
+
+        labels = [(cuts[3].id, "1 2 3"), ("missing", "4"), (cuts[1].id, "5")]
+        joined = list(indexed.data.join(labels, "kmeans", skip_missing=True))
+        assert [c.id for c in joined] == [cuts[3].id, cuts[1].id]
+        assert joined[0].custom["kmeans"] == "1 2 3"
+
+        with pytest.raises(KeyError):
+            list(indexed.data.join(labels, "kmeans"))
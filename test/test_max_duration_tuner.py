@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+import torch.nn as nn
+
+from icefall.max_duration_tuner import (
+    MemoryProbe,
+    PeakMemoryModel,
+    get_peak_rss,
+    make_synthetic_asr_batch,
+    measure_peak_memory,
+    nnls,
+    select_max_duration,
+    tune_max_duration,
+)
+
+
+def test_nnls():
+    x = torch.tensor(
+        [[1.0, 0.0, 1.0], [1.0, 1.0, 2.0], [1.0, 2.0, 3.0], [1.0, 3.0, 4.0]],
+        dtype=torch.float64,
+    )
+    # The last column is the sum of the first two, so the least squares
+    # problem has infinitely many solutions; the sparsest one is chosen.
+    y = 2 * x[:, 2]
+    c = nnls(x, y)
+    assert torch.allclose(c, torch.tensor([0.0, 0.0, 2.0], dtype=torch.float64)), c
+
+    # The unconstrained solution is [3, -1]
+    x = torch.tensor([[1.0, 1.0], [1.0, 2.0], [1.0, 3.0]], dtype=torch.float64)
+    y = torch.tensor([2.0, 1.0, 0.0], dtype=torch.float64)
+    c = nnls(x, y)
+    assert (c >= 0).all(), c
+    assert torch.allclose(c, torch.tensor([1.0, 0.0], dtype=torch.float64)), c
+
+
+def test_peak_memory_model():
+    # peak = 1000 + 50 * N + 2 * N * F + 0.01 * N * F^2
+    def peak(n, f):
+        return 1000 + 50 * n + 2 * n * f + 0.01 * n * f * f
+
+    probes = []
+    for d in [10, 20, 40, 80]:
+        for cut in [2, 5, 10, 20]:
+            n = max(1, d // cut)
+            f = cut * 100
+            probes.append(
+                MemoryProbe(
+                    max_duration=d,
+                    cut_duration=cut,
+                    batch_size=n,
+                    num_frames=f,
+                    num_tokens=round(cut * 3.5),
+                    peak_bytes=int(peak(n, f)),
+                )
+            )
+    # The model does not depend on the order of the probes
+    for i in range(3):
+        model = PeakMemoryModel().fit(probes[i:] + probes[:i])
+        expected = torch.tensor([1000, 50, 2, 0.01], dtype=torch.float64)
+        assert torch.allclose(model.coef, expected, rtol=1e-3), model
+        for n, f in [(3, 500), (100, 100), (1, 3000)]:
+            predicted = model.predict(n, f)
+            assert abs(predicted - peak(n, f)) / peak(n, f) < 1e-4, (n, f, predicted)
+
+
+def test_select_max_duration():
+    bucket_durations = [2.0, 5.0, 10.0, 20.0]
+    # The safe max_duration of each bucket on two DDP ranks
+    ranks = [[900.0, 600.0, 400.0, 250.0], [1000.0, 500.0, 450.0, 200.0]]
+    m = [min(v) for v in zip(*ranks)]
+    max_duration, q = select_max_duration(bucket_durations, m, per_bucket=True)
+    assert q is not None
+    # The pair is safe for every bucket of every rank
+    for safe in ranks:
+        for d, s in zip(bucket_durations, safe):
+            assert max_duration / (1 + d / q) <= s + 1.0, (d, s)
+
+    assert select_max_duration(bucket_durations, m) == (200.0, None)
+
+
+def test_measure_peak_memory_cpu():
+    before = get_peak_rss()
+    assert before > 0
+
+    def fn():
+        x = torch.ones(64 * 1024 * 1024, dtype=torch.int8)
+        return x.sum()
+
+    peak = measure_peak_memory(fn, torch.device("cpu"))
+    assert peak >= 64 * 1024 * 1024, peak
+
+
+def test_tune_max_duration_cpu():
+    torch.manual_seed(20250101)
+    model = nn.Sequential(nn.Linear(80, 128), nn.ReLU(), nn.Linear(128, 128))
+
+    def make_batch(batch_size, num_frames, num_tokens):
+        return make_synthetic_asr_batch(
+            batch_size, num_frames, texts=["a b c"] * batch_size
+        )
+
+    def step_fn(batch):
+        x = model(batch["inputs"])
+        # quadratic in the number of frames, like self-attention
+        (x @ x.transpose(1, 2)).sum().backward()
+        model.zero_grad()
+
+    budget = get_peak_rss() + 1024 * 1024 * 1024
+    result = tune_max_duration(
+        step_fn=step_fn,
+        make_batch=make_batch,
+        bucket_durations=[2.0, 5.0, 10.0],
+        device=torch.device("cpu"),
+        memory_budget=budget,
+        start_duration=20.0,
+        max_duration_limit=500.0,
+        per_bucket=True,
+    )
+    print(result)
+    assert 10.0 <= result.max_duration <= 500.0 * (1 + 10.0 / 2), result
+    assert len(result.bucket_max_durations) == 3
+    # Buckets with shorter cuts can use larger batches
+    assert result.bucket_max_durations[0] >= result.bucket_max_durations[-1]
+    if result.quadratic_duration is not None:
+        q = result.quadratic_duration
+        for d, m in zip(result.bucket_durations, result.bucket_max_durations):
+            assert result.max_duration / (1 + d / q) <= m + 1.0
+
+
+def main():
+    test_nnls()
+    test_peak_memory_model()
+    test_select_max_duration()
+    test_measure_peak_memory_cpu()
+    test_tune_max_duration_cpu()
+
+
+if __name__ == "__main__":
+    main()
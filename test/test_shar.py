@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from lhotse import CutSet, Features, NumpyFilesWriter
+from lhotse.cut import MonoCut
+from lhotse.dataset import DynamicBucketingSampler, K2SpeechRecognitionDataset
+from lhotse.dataset.dataloading import make_worker_init_fn
+from lhotse.testing.dummies import dummy_supervision
+
+from icefall.dataset.shar import (
+    SharIterableDataset,
+    check_num_shards,
+    export_to_shar,
+    load_shar_cuts,
+    set_shar_epoch,
+)
+
+
+def generate_cuts(d: Path, num_cuts: int) -> CutSet:
+    cuts = []
+    with NumpyFilesWriter(d / "feats") as writer:
+        for i in range(num_cuts):
+            num_frames = 50 + i
+            feats = np.random.randn(num_frames, 80).astype(np.float32)
+            cut_id = f"cut-{i}"
+            features = Features(
+                type="fbank",
+                num_frames=num_frames,
+                num_features=80,
+                frame_shift=0.01,
+                sampling_rate=16000,
+                start=0,
+                duration=num_frames / 100,
+                storage_type=writer.name,
+                storage_path=str(writer.storage_path),
+                storage_key=writer.write(cut_id, feats),
+                recording_id=cut_id,
+                channels=0,
+            )
+            c = MonoCut(
+                id=cut_id,
+                start=0,
+                duration=num_frames / 100,
+                channel=0,
+                features=features,
+            )
+            c.supervisions = [
+                dummy_supervision(i, duration=c.duration, text=f"text {i}")
+            ]
+            c.supervisions[0].recording_id = cut_id
+            cuts.append(c)
+    return CutSet.from_cuts(cuts)
+
+
+def test_export_and_load():
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        cuts = generate_cuts(d, num_cuts=40)
+        index = export_to_shar(cuts, d / "shar", shard_size=10, feature_format="numpy")
+        assert index["num_shards"] == 4
+        assert index["num_cuts"] == 40
+
+        shar_cuts = load_shar_cuts(d / "shar")
+        ids = []
+        for c in shar_cuts:
+            expected = cuts[c.id]
+            np.testing.assert_allclose(c.load_features(), expected.load_features())
+            assert c.supervisions[0].text == expected.supervisions[0].text
+            ids.append(c.id)
+        assert sorted(ids) == sorted(cuts.ids)
+
+        # Shards are read in a different order in another epoch
+        order0 = [c.id for c in shar_cuts]
+        orders = []
+        for epoch in range(1, 5):
+            assert set_shar_epoch(shar_cuts, epoch)
+            orders.append([c.id for c in shar_cuts])
+        assert any(o != order0 for o in orders)
+
+
+def test_dataloader_workers():
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        cuts = generate_cuts(d, num_cuts=40)
+        export_to_shar(cuts, d / "shar", shard_size=5, feature_format="numpy")
+
+        sampler = DynamicBucketingSampler(
+            load_shar_cuts(d / "shar", shuffle_buffer_size=10),
+            max_duration=5.0,
+            num_buckets=2,
+            shuffle=True,
+            world_size=1,
+            rank=0,
+        )
+        dataset = SharIterableDataset(
+            dataset=K2SpeechRecognitionDataset(return_cuts=True), sampler=sampler
+        )
+        dl = torch.utils.data.DataLoader(
+            dataset,
+            batch_size=None,
+            num_workers=2,
+            worker_init_fn=make_worker_init_fn(rank=0, world_size=1),
+        )
+        for epoch in range(2):
+            dataset.set_epoch(epoch)
+            ids = []
+            for batch in dl:
+                ids.extend(c.id for c in batch["supervisions"]["cut"])
+            # Each worker reads different shards: no duplicates
+            assert sorted(ids) == sorted(cuts.ids), epoch
+
+
+def test_fixed_num_batches():
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        cuts = generate_cuts(d, num_cuts=37)
+        # 5 shards of different sizes for 2 workers
+        export_to_shar(cuts, d / "shar", shard_size=8, feature_format="numpy")
+        check_num_shards(d / "shar", world_size=1, num_workers=2)
+        try:
+            check_num_shards(d / "shar", world_size=2, num_workers=3)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+        sampler = DynamicBucketingSampler(
+            load_shar_cuts(d / "shar", shuffle_buffer_size=10, repeat=True),
+            max_duration=5.0,
+            num_buckets=2,
+            # The cuts are infinite, so keep the buffers small
+            buffer_size=20,
+            shuffle=True,
+            world_size=1,
+            rank=0,
+        )
+        dataset = SharIterableDataset(
+            dataset=K2SpeechRecognitionDataset(return_cuts=True),
+            sampler=sampler,
+            num_batches=7,
+        )
+        dl = torch.utils.data.DataLoader(
+            dataset,
+            batch_size=None,
+            num_workers=2,
+            worker_init_fn=make_worker_init_fn(rank=0, world_size=1),
+        )
+        for epoch in range(2):
+            dataset.set_epoch(epoch)
+            # The number of batches does not depend on how the shards are
+            # split over the workers.
+            assert len(list(dl)) == 7, epoch
+
+
+def main():
+    test_export_and_load()
+    test_dataloader_workers()
+    test_fixed_num_batches()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Copyright      2025  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import numpy as np
+import torch
+from lhotse.dataset import SpecAugment
+from lhotse.dataset.signal_transforms import time_warp
+
+from icefall.dataset.spec_augment import BatchedSpecAugment, batched_time_warp
+
+
+def time_warp_loop(features, p, time_warp_factor, supervision_segments=None):
+    # The per-sequence implementation that batched_time_warp replaces
+    features = features.clone()
+    if supervision_segments is None:
+        supervision_segments = [(i, 0, features.size(1)) for i in range(len(features))]
+    for i, start, num_frames in supervision_segments:
+        if random.random() > p:
+            continue
+        features[i, start : start + num_frames] = time_warp(
+            features[i, start : start + num_frames], factor=time_warp_factor
+        )
+    return features
+
+
+def test_time_warp():
+    features = torch.randn(8, 300, 20)
+    segments = torch.tensor(
+        [[0, 0, 300], [1, 10, 150], [1, 160, 140], [3, 50, 30], [5, 100, 250]],
+        dtype=torch.int32,
+    )
+    for supervision_segments in [None, segments]:
+        for seed in range(3):
+            random.seed(seed)
+            np.random.seed(seed)
+            expected = time_warp_loop(features, 0.9, 20, supervision_segments)
+
+            random.seed(seed)
+            np.random.seed(seed)
+            warped = batched_time_warp(
+                features,
+                p=0.9,
+                time_warp_factor=20,
+                supervision_segments=supervision_segments,
+            )
+            assert torch.allclose(warped, expected, atol=1e-4)
+            assert not torch.equal(warped, features)
+
+    # Frames outside of the supervisions are not changed
+    warped = batched_time_warp(
+        features, p=1.0, time_warp_factor=20, supervision_segments=segments
+    )
+    assert torch.equal(warped[2], features[2])
+    assert torch.equal(warped[1, :10], features[1, :10])
+    assert torch.equal(warped[5, :100], features[5, :100])
+
+    # Overlapping segments are warped one after another, e.g., with
+    # multi-speaker supervisions
+    overlapping = torch.tensor(
+        [[1, 10, 150], [1, 100, 150], [2, 0, 200], [1, 200, 100], [2, 150, 150]],
+        dtype=torch.int32,
+    )
+    for seed in range(3):
+        random.seed(seed)
+        np.random.seed(seed)
+        expected = time_warp_loop(features, 1.0, 20, overlapping)
+
+        random.seed(seed)
+        np.random.seed(seed)
+        warped = batched_time_warp(
+            features, p=1.0, time_warp_factor=20, supervision_segments=overlapping
+        )
+        assert torch.allclose(warped, expected, atol=1e-4), seed
+
+
+def test_spec_augment():
+    features = torch.randn(32, 400, 80) + 3
+    for time_warp_factor in [0, 80]:
+        kwargs = dict(
+            time_warp_factor=time_warp_factor,
+            num_frame_masks=10,
+            features_mask_size=27,
+            num_feature_masks=2,
+            frames_mask_size=100,
+        )
+        ref = SpecAugment(**kwargs)
+        new = BatchedSpecAugment(**kwargs)
+        y = new(features)
+        assert y.shape == features.shape
+
+        if time_warp_factor == 0:
+            # Masked values are set to the mean of their sequence
+            changed = y != features
+            mean = features.mean(dim=(1, 2), keepdim=True).expand_as(features)
+            assert torch.equal(y[changed], mean[changed])
+
+            def masked_fraction(transform):
+                torch.manual_seed(0)
+                random.seed(0)
+                fractions = [
+                    (transform(features) != features).float().mean() for _ in range(20)
+                ]
+                return sum(fractions) / len(fractions)
+
+            # The masks have the same distribution as in lhotse
+            assert abs(masked_fraction(new) - masked_fraction(ref)) < 0.02
+
+    new = BatchedSpecAugment(p=0.0)
+    assert torch.equal(new(features), features)
+
+    new = BatchedSpecAugment(time_warp_factor=80)
+    segments = torch.tensor([[0, 0, 200], [1, 50, 300]], dtype=torch.int32)
+    assert new(features, supervision_segments=segments).shape == features.shape
+
+
+def main():
+    test_time_warp()
+    test_spec_augment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import torch
+
+from icefall.decode import SpeculativeDecodingStats, speculative_greedy_search
+
+SOS_EOS_ID = 1
+
+
+def get_decoder_logits(batch_size: int, vocab_size: int = 6, dim: int = 8):
+    """Return a random causal decoder, in which the EOS becomes more likely
+    with the position."""
+    embed = torch.randn(vocab_size, dim)
+    memory = torch.randn(batch_size, dim)
+    weight = torch.randn(dim, vocab_size)
+
+    def decoder_logits(indexes, ys_in_pad, ys_in_lens):
+        x = embed[ys_in_pad] + memory[indexes].unsqueeze(1)
+        logits = x.cumsum(dim=1) @ weight
+        logits[:, :, SOS_EOS_ID] += torch.arange(ys_in_pad.shape[1])
+        return logits
+
+    return decoder_logits
+
+
+def test_speculative_greedy_search():
+    torch.manual_seed(20250101)
+    batch_size = 10
+    decoder_logits = get_decoder_logits(batch_size)
+    max_lens = [0, 1, 2, 50, 50, 50, 50, 50, 50, 50]
+
+    def decode(drafts, stats=None):
+        return speculative_greedy_search(
+            decoder_logits,
+            drafts,
+            max_lens=max_lens,
+            sos_id=SOS_EOS_ID,
+            eos_id=SOS_EOS_ID,
+            stats=stats,
+        )
+
+    # Autoregressive greedy search
+    stats = SpeculativeDecodingStats()
+    expected = decode([[] for _ in range(batch_size)], stats)
+    assert any(len(hyp) > 3 for hyp in expected), expected
+    assert stats.num_steps == stats.num_autoregressive_steps, stats
+    assert stats.num_draft_tokens == 0, stats
+
+    # Perfect drafts are decoded in a single step
+    stats = SpeculativeDecodingStats()
+    assert decode(expected, stats) == expected
+    assert stats.num_steps == batch_size - 1, stats
+    assert stats.acceptance_rate == 1, stats
+
+    # Drafts with errors, which may be longer than max_lens
+    for _ in range(20):
+        drafts = []
+        for hyp in expected:
+            draft = hyp + torch.randint(2, 6, (3,)).tolist()
+            draft = [t if torch.rand(1) > 0.2 else 5 for t in draft]
+            drafts.append(draft[: torch.randint(0, len(draft) + 1, (1,))])
+        stats = SpeculativeDecodingStats()
+        assert decode(drafts, stats) == expected
+        assert stats.num_steps <= stats.num_autoregressive_steps, stats
+
+
+def main():
+    test_speculative_greedy_search()
+
+
+if __name__ == "__main__":
+    main()